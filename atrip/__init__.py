@@ -2,6 +2,7 @@ import os
 import sys
 import zlib
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 import logging
 log = logging.getLogger(__name__)
@@ -14,9 +15,11 @@ except ImportError:
     raise RuntimeError("atrip %s requires numpy" % __version__)
 
 from . import errors
-from .container import Container, ContainerHeader, guess_container
+from .container import Container, ContainerHeader, guess_container, guess_container_memmap
 from .collection import Collection
 from .segment import Segment
+from .byte_pattern import BytePattern, search_files
+from .search_index import SearchIndex, iter_pathnames
 from . import style_bits
 # from .ataridos import AtrHeader, AtariDosDiskImage, BootDiskImage, AtariDosFile, XexContainerSegment, get_xex, add_atr_header
 # from .dos33 import Dos33DiskImage
@@ -95,7 +98,13 @@ def find_container_from_data(name, data, verbose=False):
     return container
 
 
-def find_container(filename, verbose=False):
+def find_container(filename, verbose=False, use_memmap=False):
+    if use_memmap:
+        container = guess_container_memmap(filename)
+        container.name = os.path.basename(filename)
+        container.guess_media_type()
+        container.guess_filesystem()
+        return container
     sample_data = np.fromfile(filename, dtype=np.uint8)
     return find_container_from_data(os.path.basename(filename), sample_data, verbose)
 
@@ -109,27 +118,49 @@ def find_collection(filename, verbose=False):
     return Collection(filename, sample_data)
 
 
+def write_host_files(outputs, jobs=None):
+    """Write the list of (path, bytes) to the local filesystem, using a pool
+    of `jobs` threads so many files can be written concurrently.
+    """
+    def write(item):
+        path, data = item
+        with open(path, "wb") as fh:
+            fh.write(data)
+
+    if jobs == 1 or len(outputs) < 2:
+        for item in outputs:
+            write(item)
+    else:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            list(pool.map(write, outputs))
+
+
 def extract_files(collection, files):
     files = set(files)
+    outputs = []
     for dirent in collection.iter_dirents():
         if not files or dirent.filename in files:
             output = dirent.filename
             if options.lower:
                 output = output.lower()
             if not options.dry_run:
-                segment = dirent.get_file()
                 if os.path.exists(output) and not options.force:
                     print("skipping %s, file exists. Use -f to overwrite" % output)
                 else:
-                    print("extracting %s -> %s" % (dirent.filename, output))
-                    with open(output, "wb") as fh:
-                        fh.write(segment[:])
+                    try:
+                        segment = dirent.get_file_segment()
+                    except errors.FileError as e:
+                        print("skipping %s: %s" % (dirent.filename, e))
+                    else:
+                        print("extracting %s -> %s" % (dirent.filename, output))
+                        outputs.append((output, segment.tobytes() if segment is not None else b''))
             else:
                 print("extracting %s -> %s" % (dirent.filename, output))
             if dirent.filename in files:
                 files.remove(dirent.filename)
                 if not files:
                     break
+    write_host_files(outputs, options.jobs)
     if files:
         for filename in sorted(files):
             print(f"not found: {filename}")
@@ -152,33 +183,35 @@ def save_file(image, name, filetype, data):
     return False
 
 
-def add_files(image, files):
-    filetype = options.filetype
-    if not filetype:
-        filetype = image.default_filetype
-    changed = False
+def add_files(collection, files):
+    container = collection.containers[0]
+    filetype = options.filetype or None
+    transaction = container.filesystem.transaction()
     for name in files:
+        filename = os.path.basename(name)
+        if container.find_dirent(filename) is not None and not options.force:
+            print("skipping %s, use -f to overwrite" % (filename))
+            continue
+        print("copying %s to %s" % (name, container))
         with open(name, "rb") as fh:
-            data = fh.read()
-        changed = save_file(image, name, filetype, data)
-    if changed:
-        image.save()
+            transaction.add(filename, fh.read(), filetype)
+    if len(transaction) > 0 and not options.dry_run:
+        transaction.commit()
+        collection.save()
 
 
-def remove_files(image, files):
-    changed = False
+def remove_files(collection, files):
+    container = collection.containers[0]
+    transaction = container.filesystem.transaction()
     for name in files:
-        try:
-            dirent = image.find_dirent(name)
-        except errors.FileNotFound:
-            print("%s not in %s" % (name, image))
+        if container.find_dirent(name) is None:
+            print("%s not in %s" % (name, container))
             continue
-        print("removing %s from %s" % (name, image))
-        if not options.dry_run:
-            image.delete_file(name)
-            changed = True
-    if changed:
-        image.save()
+        print("removing %s from %s" % (name, container))
+        transaction.remove(name)
+    if len(transaction) > 0 and not options.dry_run:
+        transaction.commit()
+        collection.save()
 
 
 def list_files(collection, files, show_crc=False, show_metadata=False):
@@ -186,7 +219,8 @@ def list_files(collection, files, show_crc=False, show_metadata=False):
     for dirent in collection.iter_dirents():
         if not files or dirent.filename in files:
             if show_crc:
-                data = image.get_file(dirent)
+                segment = dirent.get_file_segment()
+                data = segment.tobytes() if segment is not None else b''
                 crc = zlib.crc32(data) & 0xffffffff  # correct for some platforms that return signed int
                 extra = "  %08x" % crc
             else:
@@ -196,6 +230,36 @@ def list_files(collection, files, show_crc=False, show_metadata=False):
                 print(dirent.extra_metadata(image))
 
 
+def check_files(collection):
+    for container in collection.containers:
+        fs = container.filesystem
+        problems = fs.check_integrity() if fs is not None else []
+        if problems:
+            print(f"{container.name}: {len(problems)} problem{'s' if len(problems) != 1 else ''} found")
+            for problem in problems:
+                print(f"  {problem}")
+        else:
+            print(f"{container.name}: no problems found")
+
+
+def search_images(pattern, paths, index_path=None, jobs=None):
+    """Print the location of every match of the `BytePattern` in the disk
+    images found in the paths. If an index directory is specified, it is
+    updated with the paths and then used to find the images to scan.
+    """
+    if index_path:
+        index = SearchIndex(index_path)
+        if paths:
+            index.update(paths, jobs)
+        found = index.search(pattern, jobs)
+    else:
+        found = search_files(pattern, iter_pathnames(paths), jobs)
+    for pathname, container, ranges in found:
+        offsets = " ".join("$%04x" % start for start, end in ranges)
+        print(f"{pathname}: {container.name}: {offsets}")
+    return found
+
+
 def crc_files(image, files):
     files = set(files)
     for dirent in image.files:
@@ -483,8 +547,11 @@ def run():
         "assemble": ["s", "asm"],
         "delete": ["rm", "del"],
         "vtoc": ["v"],
+        "check": ["fsck"],
+        "search": ["find", "grep"],
         "segments": [],
         "menu": [],
+        "batch": [],
     }
     # reverse aliases does the inverse mapping of command aliases, including
     # the identity mapping of "command" to "command"
@@ -524,6 +591,7 @@ def run():
     #p.add_argument("-n", "--no-sys", action="store_true", default=False, help="only extract things that look like games (no DOS or .SYS files)")
     p.add_argument("-e", "--ext", action="store", nargs=1, default=False, help="add the specified extension")
     p.add_argument("-f", "--force", action="store_true", default=False, help="allow file overwrites on local filesystem")
+    p.add_argument("-j", "--jobs", action="store", type=int, default=None, help="number of files to write at the same time (default: based on the number of CPUs)")
     p.add_argument("disk_image", metavar="DISK_IMAGE", nargs=1, help="disk image")
     p.add_argument("files", metavar="FILENAME", nargs="*", help="if not using the -a/--all option, a file (or list of files) to extract from the disk image.")
 
@@ -570,6 +638,10 @@ def run():
     p.add_argument("-e", "--clear-empty", action="store_true", default=False, help="fill empty sectors with 0")
     p.add_argument("disk_image", metavar="DISK_IMAGE", nargs=1, help="disk image")
 
+    command = "check"
+    p = subparsers.add_parser(command, help="Check the disk image for broken files, cross-linked sectors and VTOC errors", aliases=command_aliases[command])
+    p.add_argument("disk_image", metavar="DISK_IMAGE", nargs=1, help="disk image")
+
     command = "segments"
     p = subparsers.add_parser(command, help="Show the list of parsed segments in the disk image", aliases=command_aliases[command])
     p.add_argument("disk_image", metavar="DISK_IMAGE", nargs=1, help="disk image")
@@ -578,6 +650,21 @@ def run():
     p = subparsers.add_parser(command, help="Show the segment hierarchy in the disk image", aliases=command_aliases[command])
     p.add_argument("disk_image", metavar="DISK_IMAGE", nargs=1, help="disk image")
 
+    command = "batch"
+    p = subparsers.add_parser(command, help="Catalog all disk images in directories, zip files or tar files as newline-delimited JSON", aliases=command_aliases[command])
+    p.add_argument("-o", "--output", action="store", default=None, help="write records to this file instead of stdout")
+    p.add_argument("-r", "--resume", action="store_true", default=False, help="skip disk images already recorded in the output file and append new records")
+    p.add_argument("-j", "--jobs", action="store", type=int, default=None, help="number of worker processes (default: number of CPUs)")
+    p.add_argument("paths", metavar="PATH", nargs="+", help="disk image, directory, zip file or tar file")
+
+    command = "search"
+    p = subparsers.add_parser(command, help="Find a hex pattern (?? or ? for wildcard bytes or nibbles, value/mask for bit masks) in disk images", aliases=command_aliases[command])
+    p.add_argument("-i", "--index", action="store", default=None, help="n-gram index directory used to find candidate disk images; it is created or updated with the disk images in PATH")
+    p.add_argument("-t", "--text", action="store_true", default=False, help="search for the text rather than a hex pattern")
+    p.add_argument("-j", "--jobs", action="store", type=int, default=None, help="number of files to search at the same time (default: based on the number of CPUs)")
+    p.add_argument("pattern", metavar="PATTERN", help="hex pattern, e.g. 'a9 ?? 8d 0? d4'")
+    p.add_argument("paths", metavar="PATH", nargs="*", help="disk image or directory; optional when searching an existing index")
+
 
     # argparse doesn't seem to allow a default command, so if the first
     # argument isn't recognized, use the "list" command
@@ -611,6 +698,26 @@ def run():
     if options.trace:
         sys.settrace(trace_calls)
 
+    if command == "batch":
+        from .batch import run_batch
+        if options.resume and not options.output:
+            parser.error("--resume requires --output")
+        run_batch(options.paths, options.output, options.jobs, options.resume)
+        return
+
+    if command == "search":
+        if not options.index and not options.paths:
+            parser.error("search requires a PATH or --index")
+        try:
+            if options.text:
+                pattern = BytePattern.from_bytes(options.pattern.encode("utf-8"))
+            else:
+                pattern = BytePattern(options.pattern)
+        except ValueError as e:
+            parser.error(f"invalid pattern: {e}")
+        search_images(pattern, options.paths, options.index, options.jobs)
+        return
+
     disk_image_name = options.disk_image[0]
 
     if command == "create":
@@ -633,14 +740,16 @@ def run():
                 print(vtoc)
                 if options.clear_empty:
                     shred_image(container)
+            elif command == "check":
+                check_files(collection)
             elif command == "list":
                 list_files(collection, options.files, options.crc, options.metadata)
             elif command == "crc":
                 crc_files(container, options.files)
             elif command == "add":
-                add_files(container, options.files)
+                add_files(collection, options.files)
             elif command == "delete":
-                remove_files(container, options.files)
+                remove_files(collection, options.files)
             elif command == "extract":
                 extract_files(collection, options.files)
             elif command == "assemble":
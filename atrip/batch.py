@@ -0,0 +1,266 @@
+"""Batch cataloguing of collections of disk images
+
+Each disk image (or each item inside a zip or tar archive) is identified and
+its directory listed in a separate worker process, and the results are
+streamed as newline-delimited JSON: one record per container, written in the
+same order as the input. Only a bounded number of items are queued at any
+time, so memory use doesn't depend on the size of the collection.
+
+Output written to a file can be resumed: items that already have records in
+the file are skipped and new records are appended.
+"""
+import os
+import sys
+import json
+import zlib
+import hashlib
+import tarfile
+import zipfile
+import contextlib
+import collections
+import multiprocessing
+
+import numpy as np
+
+from . import errors
+from .collection import Collection
+
+import logging
+log = logging.getLogger(__name__)
+
+
+#### work items
+
+def iter_batch_items(paths):
+    """Generate work items for all files in the list of paths.
+
+    Directories are searched recursively in sorted order. Each item is a tuple
+    of (pathname, member, data), where member is the name of the item inside
+    a zip or tar archive (or None for a plain file) and data is the item's
+    bytes if they have already been read (tar members are read here because
+    compressed tar files can't be accessed randomly), otherwise None.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    yield from iter_file_items(os.path.join(root, name))
+        else:
+            yield from iter_file_items(path)
+
+
+def iter_file_items(pathname):
+    if not os.path.isfile(pathname):
+        # let the worker report the error
+        yield pathname, None, None
+    elif zipfile.is_zipfile(pathname):
+        with zipfile.ZipFile(pathname) as zf:
+            for info in zf.infolist():
+                if not info.is_dir():
+                    yield pathname, info.filename, None
+    elif tarfile.is_tarfile(pathname):
+        with tarfile.open(pathname, "r:*") as tf:
+            for info in tf:
+                if info.isfile():
+                    yield pathname, info.name, tf.extractfile(info).read()
+    else:
+        yield pathname, None, None
+
+
+def item_key(pathname, member):
+    if member is None:
+        return pathname
+    return f"{pathname}/{member}"
+
+
+# Workers keep the most recently used zip file open, because parsing the
+# central directory of a large zip for every member would dominate the time.
+# The process id is part of the key: a worker forked after the parent has
+# read from a zip inherits the parent's handle, and processes sharing one
+# file offset corrupt each other's reads.
+_open_zip = (None, None, None)
+
+def read_zip_member(pathname, member):
+    global _open_zip
+
+    pid, name, zf = _open_zip
+    if pid != os.getpid() or name != pathname:
+        if zf is not None:
+            zf.close()
+        zf = zipfile.ZipFile(pathname)
+        _open_zip = (os.getpid(), pathname, zf)
+    return zf.read(member)
+
+
+#### cataloguing
+
+def calc_hashes(data):
+    return {
+        "crc32": "%08x" % (zlib.crc32(data) & 0xffffffff),
+        "sha1": hashlib.sha1(data).hexdigest(),
+    }
+
+
+def catalog_dirent(dirent):
+    record = {
+        "filename": dirent.filename,
+        "file_num": dirent.file_num,
+    }
+    if dirent.in_use:
+        try:
+            data = np.asarray(dirent.get_file_segment()[:], dtype=np.uint8).tobytes()
+        except errors.FileError as e:
+            record["error"] = str(e)
+        else:
+            record["size"] = len(data)
+            record.update(calc_hashes(data))
+    return record
+
+
+def catalog_container(container):
+    media = container.media
+    fs = container.filesystem
+    record = {
+        "container": container.name,
+        "item": container.pathname,
+        "size": len(container),
+        "compression": [c.compression_algorithm for c in container.decompression_order],
+        "mime": container.mime,
+        "media": media.ui_name if media is not None else None,
+        "filesystem": fs.ui_name if fs is not None else None,
+    }
+    record.update(calc_hashes(container.data.tobytes()))
+    if fs is not None:
+        record["dirents"] = [catalog_dirent(d) for d in container.iter_dirents()]
+    return record
+
+
+def catalog_item(item):
+    """Identify and list the contents of a single work item, returning a list
+    of JSON-serializable records.
+
+    Errors are reported as a record containing an "error" key rather than
+    raised, so one bad image doesn't stop the batch. Anything the parsers
+    print goes to stderr so it can't be mixed into the records when they are
+    written to stdout.
+    """
+    with contextlib.redirect_stdout(sys.stderr):
+        return _catalog_item(item)
+
+
+def _catalog_item(item):
+    pathname, member, data = item
+    key = item_key(pathname, member)
+    base = {"path": pathname, "member": member}
+    try:
+        if data is None:
+            if member is None:
+                with open(pathname, "rb") as fh:
+                    data = fh.read()
+            else:
+                data = read_zip_member(pathname, member)
+        if len(data) == 0:
+            raise errors.UnsupportedDiskImage("No data")
+        collection = Collection(key, np.frombuffer(data, dtype=np.uint8))
+        records = []
+        for container in collection.containers:
+            record = dict(base)
+            record.update(catalog_container(container))
+            records.append(record)
+    except Exception as e:
+        log.debug(f"{key}: {e}")
+        record = dict(base)
+        record["error"] = f"{e.__class__.__name__}: {e}"
+        records = [record]
+    return records
+
+
+#### output
+
+def load_completed(output_pathname):
+    """Find the items that have already been recorded in a previous run.
+
+    Returns the set of item keys. If the previous run was interrupted in the
+    middle of writing a record, the partial line is removed from the file so
+    the output can be appended.
+    """
+    completed = set()
+    if not os.path.exists(output_pathname):
+        return completed
+    valid_length = 0
+    with open(output_pathname, "rb") as fh:
+        for line in fh:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if not line.endswith(b"\n"):
+                break
+            completed.add(item_key(record["path"], record["member"]))
+            valid_length += len(line)
+    if valid_length < os.path.getsize(output_pathname):
+        log.warning(f"{output_pathname}: removing partial record at byte {valid_length}")
+        with open(output_pathname, "r+b") as fh:
+            fh.truncate(valid_length)
+    return completed
+
+
+def iter_catalog(items, processes=None, max_pending=None):
+    """Generate lists of records for each item, in order, using a pool of
+    worker processes.
+
+    At most `max_pending` items are in flight at once (default four per
+    process), which bounds the memory used regardless of the number of
+    items.
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if max_pending is None:
+        max_pending = 4 * processes
+    if processes < 2:
+        for item in items:
+            yield catalog_item(item)
+        return
+    with multiprocessing.Pool(processes) as pool:
+        pending = collections.deque()
+        for item in items:
+            pending.append(pool.apply_async(catalog_item, (item,)))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def catalog(paths, fh, processes=None, completed=None):
+    """Write NDJSON records for every disk image found in the paths to the
+    file handle, skipping items whose keys are in `completed`.
+
+    Returns the number of items processed.
+    """
+    if completed is None:
+        completed = set()
+    items = (item for item in iter_batch_items(paths) if item_key(item[0], item[1]) not in completed)
+    count = 0
+    for records in iter_catalog(items, processes):
+        for record in records:
+            fh.write(json.dumps(record) + "\n")
+        fh.flush()
+        count += 1
+        if count % 1000 == 0:
+            log.info(f"catalogued {count} items")
+    return count
+
+
+def run_batch(paths, output_pathname=None, processes=None, resume=False):
+    if output_pathname is None:
+        return catalog(paths, sys.stdout, processes)
+    if resume:
+        completed = load_completed(output_pathname)
+        log.info(f"{output_pathname}: skipping {len(completed)} previously catalogued items")
+        mode = "a"
+    else:
+        completed = None
+        mode = "w"
+    with open(output_pathname, mode) as fh:
+        return catalog(paths, fh, processes, completed)
@@ -0,0 +1,234 @@
+"""Byte patterns with wildcards and bit masks
+
+Patterns are written as hex digits (see `parse_hex_pattern`) and compiled
+into arrays of byte values and masks that can be scanned for in any numpy
+array of bytes without copying it. Many containers or files can be
+scanned in parallel.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from . import errors
+from .collection import Collection
+
+import logging
+log = logging.getLogger(__name__)
+
+
+# number of bits set in each byte value, used to pick the most selective
+# byte of a pattern to scan for first
+bit_counts = np.unpackbits(np.arange(256, dtype=np.uint8)[:, np.newaxis], axis=1).sum(axis=1)
+
+
+def parse_hex_byte(text):
+    """Return the (value, mask) of two hex digits, either of which may be the
+    wildcard ``?``
+    """
+    value = 0
+    mask = 0
+    for c in text:
+        value <<= 4
+        mask <<= 4
+        if c != "?":
+            value |= int(c, 16)
+            mask |= 0xf
+    return value, mask
+
+
+def parse_hex_pattern(text):
+    """Return the arrays of byte values and bit masks of a hex pattern.
+
+    The pattern is pairs of hex digits with optional whitespace between
+    bytes, like the text accepted by `bytes.fromhex`, with these additions:
+
+    * ``?`` in place of a hex digit matches any value of that nibble, so
+      ``??`` matches any byte
+    * ``value/mask`` compares only the bits set in the mask, e.g. ``80/80``
+      matches any byte with the high bit set. The value and mask are the same
+      number of bytes, e.g. ``2000/ff0f``
+
+    Raises ValueError if the pattern can't be parsed.
+    """
+    values = []
+    masks = []
+    for token in text.split():
+        if "/" in token:
+            token, mask_text = token.split("/", 1)
+            if len(mask_text) != len(token) or "?" in mask_text:
+                raise ValueError(f"mask '{mask_text}' must be hex digits the same length as '{token}'")
+        else:
+            mask_text = None
+        if len(token) % 2 != 0:
+            raise ValueError(f"'{token}' is not a whole number of bytes")
+        for i in range(0, len(token), 2):
+            value, mask = parse_hex_byte(token[i:i + 2])
+            if mask_text is not None:
+                mask &= int(mask_text[i:i + 2], 16)
+            values.append(value & mask)
+            masks.append(mask)
+    return np.asarray(values, dtype=np.uint8), np.asarray(masks, dtype=np.uint8)
+
+
+class BytePattern:
+    """Hex search pattern with wildcards and bit masks (see
+    `parse_hex_pattern`), compiled for vectorized scanning.
+
+    The scan is done on the array in place: the most selective byte of the
+    pattern is compared over the whole array to find the candidate
+    positions, then each remaining byte is only checked at the surviving
+    candidates. Matches may overlap.
+    """
+    def __init__(self, text, values=None, masks=None):
+        self.text = text
+        if values is None:
+            values, masks = parse_hex_pattern(text)
+        self.values = values
+        self.masks = masks
+
+        # check bytes in order of decreasing selectivity; fully wildcarded
+        # bytes match anything and are skipped
+        active = np.nonzero(self.masks)[0]
+        order = np.argsort(-bit_counts[self.masks[active]], kind="stable")
+        self.check_order = active[order]
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Create a pattern that matches the bytes exactly"""
+        values = np.frombuffer(bytes(data), dtype=np.uint8).copy()
+        return cls(values.tobytes().hex(), values, np.full(len(values), 0xff, dtype=np.uint8))
+
+    def __str__(self):
+        return self.text
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def is_exact(self):
+        """True if the pattern has no wildcards or masks"""
+        return bool(np.all(self.masks == 0xff))
+
+    def iter_exact_runs(self):
+        """Yield (start, bytes) of each run of bytes in the pattern that has
+        no wildcards or masks
+        """
+        exact = np.concatenate([[False], self.masks == 0xff, [False]])
+        edges = np.nonzero(np.diff(exact.astype(np.int8)))[0]
+        for start, end in zip(edges[0::2], edges[1::2]):
+            yield int(start), self.values[start:end].tobytes()
+
+    def find(self, data):
+        """Return the array of start indexes of the pattern in `data`, which
+        may be any object supporting the buffer protocol or a numpy array
+        """
+        data = np.frombuffer(data, dtype=np.uint8) if not isinstance(data, np.ndarray) else data
+        size = len(self.values)
+        count = len(data) - size + 1
+        if size == 0 or count <= 0:
+            return np.zeros(0, dtype=np.int64)
+        if len(self.check_order) == 0:
+            return np.arange(count, dtype=np.int64)
+        first = self.check_order[0]
+        window = data[first:first + count]
+        value = self.values[first]
+        mask = self.masks[first]
+        if mask == 0xff:
+            candidates = np.nonzero(window == value)[0]
+        else:
+            candidates = np.nonzero((window & mask) == value)[0]
+        for i in self.check_order[1:]:
+            if len(candidates) == 0:
+                break
+            found = data[candidates + i]
+            mask = self.masks[i]
+            if mask != 0xff:
+                found &= mask
+            candidates = candidates[found == self.values[i]]
+        return candidates.astype(np.int64)
+
+    def find_ranges(self, data):
+        """Return the list of (start, end) tuples of the matches in `data`,
+        suitable for `set_style_ranges`
+        """
+        size = len(self.values)
+        return [(start, start + size) for start in self.find(data).tolist()]
+
+
+def compile_pattern(pattern):
+    """Return the BytePattern of the hex text, or the pattern itself if it's
+    already compiled
+    """
+    if isinstance(pattern, BytePattern):
+        return pattern
+    return BytePattern(pattern)
+
+
+def search_containers(pattern, containers, max_workers=None):
+    """Search the raw data of each container for the pattern, using a pool of
+    threads (numpy releases the GIL while scanning).
+
+    Returns the list of (container, ranges) for each container with at
+    least one match, in the order the containers were given.
+    """
+    pattern = compile_pattern(pattern)
+    containers = list(containers)
+
+    def search(container):
+        return pattern.find_ranges(container._data)
+
+    if max_workers == 1 or len(containers) < 2:
+        results = [search(c) for c in containers]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(search, containers))
+    return [(c, r) for c, r in zip(containers, results) if r]
+
+
+def search_collection(pattern, collection, max_workers=None):
+    """Search every container in the collection; see `search_containers`"""
+    return search_containers(pattern, collection.containers, max_workers)
+
+
+def load_collection(pathname):
+    data = np.fromfile(pathname, dtype=np.uint8)
+    if len(data) == 0:
+        raise errors.UnsupportedDiskImage("No data")
+    return Collection(pathname, data)
+
+
+def search_files(pattern, pathnames, max_workers=None, container_names=None):
+    """Load each file as a collection and scan its containers for the
+    pattern, using a pool of threads.
+
+    If `container_names` is specified, it maps each pathname to the set of
+    names of the containers to scan in that file (or None to scan all of
+    them). Files that can't be loaded are skipped.
+
+    Returns the list of (pathname, container, ranges) for each container
+    with at least one match.
+    """
+    pattern = compile_pattern(pattern)
+    pathnames = list(pathnames)
+
+    def scan(pathname):
+        names = None if container_names is None else container_names[pathname]
+        try:
+            collection = load_collection(pathname)
+        except (IOError, errors.AtrError) as e:
+            log.warning(f"{pathname}: skipped: {e}")
+            return []
+        found = []
+        for container in collection.containers:
+            if names is None or container.name in names:
+                ranges = pattern.find_ranges(container._data)
+                if ranges:
+                    found.append((pathname, container, ranges))
+        return found
+
+    if max_workers == 1 or len(pathnames) < 2:
+        results = [scan(p) for p in pathnames]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(scan, pathnames))
+    return [match for found in results for match in found]
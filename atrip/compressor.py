@@ -1,7 +1,12 @@
+import io
 import os
+import zlib
+import lzma
 import inspect
 import pkg_resources
 
+import numpy as np
+
 from . import errors
 
 import logging
@@ -22,6 +27,12 @@ class Compressor:
     """
     compression_algorithm = None
 
+    # Byte strings that can appear at the start of data compressed with this
+    # algorithm, used to select candidate compressors without attempting to
+    # decompress. Compressors that don't define any are only tried if no
+    # compressor recognizes the data by its magic.
+    magic = ()
+
     def __init__(self, byte_data=None):
         if byte_data is not None:
             self.unpacked = self.calc_unpacked_data(byte_data)
@@ -35,6 +46,28 @@ class Compressor:
 
     #### decompression
 
+    @classmethod
+    def sniff(cls, header):
+        """Cheap check of the first few bytes of the data (at least
+        `max_magic_length` bytes if the data is that long) to see if this
+        compressor might be able to unpack it.
+
+        Subclasses whose magic is only a prefix of the valid headers should
+        override this to perform further checks.
+        """
+        return any(header.startswith(m) for m in cls.magic)
+
+    def open_unpacked_stream(self, fh):
+        """Return a readable file-like object that produces the unpacked data
+        from the compressed data read from the file-like object `fh`.
+
+        Subclasses should override this if the algorithm supports streaming
+        decompression; the default reads all of the compressed data and
+        unpacks it using `calc_unpacked_data`.
+        """
+        byte_data = np.frombuffer(fh.read(), dtype=np.uint8)
+        return io.BytesIO(self.calc_unpacked_data(byte_data))
+
     def calc_unpacked_data(self, byte_data):
         """Attempt to unpack `byte_data` using this unpacking algorithm.
 
@@ -105,13 +138,55 @@ def find_compressor_by_name(name):
             return c()
     raise KeyError(f"Unknown compressor {name}")
 
+# number of bytes from the start of the data passed to the sniff methods
+max_magic_length = 8
+
+# exceptions that indicate a compressor can't unpack the data
+decompression_errors = (errors.InvalidAlgorithm, IOError, EOFError, ValueError, RuntimeError, OverflowError, IndexError, lzma.LZMAError, zlib.error)
+
+_compressors_by_magic = None
+
+def find_compressors_by_magic():
+    """Return a dict mapping the first byte of the magic of each compressor to
+    the list of compressors that use it, and the list of compressors that
+    don't declare any magic.
+    """
+    global _compressors_by_magic
+
+    if _compressors_by_magic is None:
+        by_first_byte = {}
+        no_magic = []
+        for c in find_compressors():
+            if c.magic:
+                for first in sorted(set(m[0:1] for m in c.magic)):
+                    by_first_byte.setdefault(first, []).append(c)
+            else:
+                no_magic.append(c)
+        _compressors_by_magic = by_first_byte, no_magic
+    return _compressors_by_magic
+
+def sniff_compressors(header):
+    """Return the list of compressors whose magic matches the header bytes
+    """
+    header = bytes(header[0:max_magic_length])
+    by_first_byte, _ = find_compressors_by_magic()
+    return [c for c in by_first_byte.get(header[0:1], []) if c.sniff(header)]
+
 def guess_compressor(raw_data):
+    """Return a compressor instance (containing the unpacked data) for the
+    first compressor that can unpack the data.
+
+    Only the compressors that recognize the header bytes are attempted, unless
+    none do, in which case any compressors that don't declare magic are
+    tried.
+    """
     compressor = None
-    for c in find_compressors():
+    _, no_magic = find_compressors_by_magic()
+    for c in sniff_compressors(raw_data) + no_magic:
         log.debug(f"trying compressor {c.compression_algorithm}")
         try:
             compressor = c(raw_data)
-        except (errors.InvalidAlgorithm, IOError, EOFError) as e:
+        except decompression_errors as e:
             continue
         else:
             log.info(f"found compressor {c.compression_algorithm}")
@@ -121,7 +196,10 @@ def guess_compressor(raw_data):
         compressor = Uncompressed(raw_data)
     return compressor
 
-def guess_compressor_list(data):
+def guess_compressor_list_by_trial(data):
+    """Unpack each layer of compression in turn, keeping the entire unpacked
+    data of each layer in memory.
+    """
     compressors = []
     while True:  # loop until reach an uncompressed state
         c = guess_compressor(data)
@@ -135,6 +213,88 @@ def guess_compressor_list(data):
         compressors.append(c.__class__)
     return data, compressors
 
+
+class MemoryReader(io.RawIOBase):
+    """Raw stream that reads from any object supporting the buffer protocol
+    (bytes, numpy arrays, memmaps) without copying it.
+    """
+    def __init__(self, data):
+        self.view = memoryview(data).cast("B")
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        count = min(len(b), len(self.view) - self.pos)
+        b[0:count] = self.view[self.pos:self.pos + count]
+        self.pos += count
+        return count
+
+
+def open_unpacked_stream(data, compressors):
+    """Return a buffered stream of the data unpacked through each of the
+    compressors in order.
+    """
+    stream = io.BufferedReader(MemoryReader(data))
+    for c in compressors:
+        stream = io.BufferedReader(c().open_unpacked_stream(stream))
+    return stream
+
+def guess_compressor_list_by_magic(data):
+    """Identify each layer of compression by its magic and unpack all layers
+    as a single stream, so the only copy made is the final unpacked data.
+
+    Each layer is identified by peeking at the start of the unpacked stream of
+    the layer before. Raises one of the `decompression_errors` if the data
+    can't be completely unpacked.
+    """
+    compressors = []
+    stream = open_unpacked_stream(data, compressors)
+    while True:
+        header = stream.peek(max_magic_length)[0:max_magic_length]
+        for c in sniff_compressors(header):
+            try:
+                next_stream = io.BufferedReader(c().open_unpacked_stream(stream))
+                next_stream.peek(1)
+            except decompression_errors as e:
+                log.debug(f"magic matched {c.compression_algorithm} but can't unpack: {e}")
+                # the failed attempt may have consumed some of the stream
+                stream = open_unpacked_stream(data, compressors)
+                continue
+            else:
+                log.info(f"found compressor {c.compression_algorithm}")
+                compressors.append(c)
+                stream = next_stream
+                break
+        else:
+            break
+    if not compressors:
+        log.info(f"image does not appear to be compressed.")
+        return data, [Uncompressed]
+    # read in chunks into a single growing buffer; read() with no size would
+    # hold the list of chunks and the joined result at the same time
+    unpacked = bytearray()
+    while True:
+        chunk = stream.read(1024 * 1024)
+        if not chunk:
+            break
+        unpacked += chunk
+    unpacked = np.frombuffer(unpacked, dtype=np.uint8)
+    if len(unpacked) == 0:
+        raise errors.InvalidAlgorithm("Unpacked to zero size")
+    return unpacked, compressors
+
+def guess_compressor_list(data):
+    """Unpack all layers of compression, returning the unpacked data and the
+    list of compressor classes in the order they were unpacked.
+    """
+    try:
+        return guess_compressor_list_by_magic(data)
+    except decompression_errors as e:
+        log.info(f"streaming decompression failed: {e}; unpacking each layer")
+        return guess_compressor_list_by_trial(data)
+
 def compress_in_reverse_order(byte_data, decompression_order, media=None, skip_missing_compressors=False):
     order = reversed(decompression_order)
     log.debug(f"compression_order: {order}")
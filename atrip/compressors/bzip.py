@@ -9,6 +9,10 @@ from ..compressor import Compressor
 
 class BZipCompressor(Compressor):
     compression_algorithm = "bzip2"
+    magic = (b"BZh",)
+
+    def open_unpacked_stream(self, fh):
+        return bz2.BZ2File(fh, mode='rb')
 
     def calc_unpacked_data(self, byte_data):
         try:
@@ -11,6 +11,7 @@ log = logging.getLogger(__name__)
 
 class DCMCompressor(Compressor):
     compression_algorithm = "dcm"
+    magic = (b"\xf9", b"\xfa")
 
     valid_densities = {
         0: (720, 128),
@@ -18,6 +19,14 @@ class DCMCompressor(Compressor):
         2: (1040, 128),
     }
 
+    @classmethod
+    def sniff(cls, header):
+        # archive type, then flags for pass 1 with a known density
+        if not super().sniff(header) or len(header) < 2:
+            return False
+        flags = header[1]
+        return flags & 0x1f == 1 and ((flags >> 5) & 3) in cls.valid_densities
+
     def get_next(self):
         try:
             data = self.raw[self.index]
@@ -25,6 +34,19 @@ class DCMCompressor(Compressor):
             raise errors.InvalidAlgorithm("Incomplete DCM file")
         else:
             self.index += 1
+        # python int, so sector and index arithmetic can't overflow uint8
+        return int(data)
+
+    def get_bytes(self, count):
+        """Return the next `count` bytes as an array, so a run of literal
+        bytes is copied in one operation instead of one `get_next` at a
+        time
+        """
+        end = self.index + count
+        if end > len(self.raw):
+            raise errors.InvalidAlgorithm("Incomplete DCM file")
+        data = self.raw[self.index:end]
+        self.index = end
         return data
 
     def calc_unpacked_data(self, data):
@@ -33,7 +55,7 @@ class DCMCompressor(Compressor):
         self.current_sector = 0
         self.index = 0
         self.count = len(data)
-        self.raw = data
+        self.raw = np.frombuffer(data, dtype=np.uint8)
         self.output = np.zeros(200000, dtype=np.uint8)  # max is 1 DD image
         self.current = np.zeros(256, dtype=np.uint8)
         expected_pass = 1
@@ -99,18 +121,14 @@ class DCMCompressor(Compressor):
 
     def decode_41(self):
         """Change beginning of sector"""
-        index = self.get_next()
-        while index >= 0:
-            self.current[index] = self.get_next()
-            index -= 1
+        # bytes are stored from the last changed byte back to the first
+        end = self.get_next() + 1
+        self.current[0:end] = self.get_bytes(end)[::-1]
 
     def decode_42(self):
         """DOS sector?"""
         self.current[0:124] = self.get_next()
-        self.current[124] = self.get_next()
-        self.current[125] = self.get_next()
-        self.current[126] = self.get_next()
-        self.current[127] = self.get_next()
+        self.current[124:128] = self.get_bytes(4)
 
     def decode_43(self):
         """Run-length encoded block"""
@@ -124,9 +142,9 @@ class DCMCompressor(Compressor):
 
             # 2: copy bytes verbatim until end offset
             log.debug(f"0x43: copying verbatim {index}-{end}")
-            while index < end:
-                self.current[index] = self.get_next()
-                index += 1
+            if index < end:
+                self.current[index:end] = self.get_bytes(end - index)
+                index = end
 
             if index < self.sector_size:
                 # 3: run-length encoding
@@ -135,16 +153,15 @@ class DCMCompressor(Compressor):
                     end = 256
                 fill_byte = self.get_next()
                 log.debug(f"0x43: rle: ${fill_byte:02x} {index}-{end}")
-                while index < end:
-                    self.current[index] = fill_byte
-                    index += 1
+                if index < end:
+                    self.current[index:end] = fill_byte
+                    index = end
 
     def decode_44(self):
         """Change the end of the sector"""
         index = self.get_next()
-        while index < self.sector_size:
-            self.current[index] = self.get_next()
-            index += 1
+        if index < self.sector_size:
+            self.current[index:self.sector_size] = self.get_bytes(self.sector_size - index)
 
     def decode_46(self):
         """Same as last sector"""
@@ -153,10 +170,7 @@ class DCMCompressor(Compressor):
     def decode_47(self):
         """Uncompressed"""
         log.debug(f"index {self.index}-{self.index+self.sector_size}: uncompressed sector")
-        index = 0
-        while index < self.sector_size:
-            self.current[index] = self.get_next()
-            index += 1
+        self.current[0:self.sector_size] = self.get_bytes(self.sector_size)
 
 
     decode_block_type_func = {
@@ -193,10 +207,204 @@ class DCMCompressor(Compressor):
         self.pass_number = 1
 
     def put_byte(self, value):
-        self.pass_buffer[self.pass_buffer_index] = value
+        # run ends of 256 are stored as 0
+        self.pass_buffer[self.pass_buffer_index] = value & 0xff
         self.pass_buffer_index += 1
 
     def calc_packed_data(self, byte_data, media, block_restrictions=None):
+        """Compress the media into DCM format.
+
+        The block type for every sector is chosen up front using array
+        operations over the whole disk (see `calc_block_choices`), so the only
+        per-sector work is writing out the chosen block. The output is
+        identical to `calc_packed_data_by_sector`.
+        """
+        self.init_packing(media)
+        sectors, empty, previous = self.calc_sector_arrays(media)
+        if block_restrictions is None:
+            allowed_blocks = set([0x41, 0x42, 0x43, 0x44])
+        else:
+            allowed_blocks = block_restrictions
+        choices = self.calc_block_choices(sectors, previous, False, allowed_blocks)
+        first_choices = self.calc_block_choices(sectors, previous, True, allowed_blocks)
+
+        output = bytearray()
+        current_sector = 1
+        previous_sector = 0
+        while current_sector <= self.num_sectors:
+            log.debug(f"dcm: starting pass {self.pass_number} at sector {current_sector}")
+            buf = bytearray(4)  # space for the FA block
+            record_start_index = 0
+            first_sector_in_pass = 0
+
+            while len(buf) < 0x5e00:
+                if current_sector > self.num_sectors:
+                    break
+                i = current_sector - 1
+                if empty[i]:
+                    current_sector += 1
+                    continue
+                if first_sector_in_pass == 0:
+                    first_sector_in_pass = current_sector
+                    previous_sector = current_sector
+                    block, arg = first_choices[0][i], first_choices[1][i]
+                else:
+                    block, arg = choices[0][i], choices[1][i]
+                if current_sector - previous_sector > 1:
+                    buf.append(current_sector & 0xff)
+                    buf.append(current_sector >> 8)
+                else:
+                    buf[record_start_index] |= 0x80
+                record_start_index = len(buf)
+                buf.extend(self.calc_block_bytes(block, arg, sectors[i]))
+                previous_sector = current_sector
+                current_sector += 1
+
+            buf[record_start_index] |= 0x80
+            buf.append(0x45)
+            last_pass = current_sector > self.num_sectors
+            flag = self.density_flag << 5 | self.pass_number & 0x1f
+            if last_pass:
+                flag |= 0x80
+            buf[0:4] = bytes([0xfa, flag, first_sector_in_pass & 0xff, first_sector_in_pass >> 8])
+            output.extend(buf)
+            self.pass_number += 1
+
+        return bytes(output)
+
+    def calc_sector_arrays(self, media):
+        """Return the 2D array of sector data (one sector per row, every row
+        padded to the full sector size), a boolean array marking empty
+        sectors, and the array of the previous non-empty sector that each
+        sector is compared against.
+
+        Short sectors (e.g. the boot sectors on some double density images)
+        keep the trailing bytes from the sector before them, the same as
+        in the sector-by-sector encoder.
+        """
+        size = self.sector_size
+        count = self.num_sectors
+        positions, sizes = media.calc_sector_positions()
+        data = media.data
+        sectors = np.zeros((count, size), dtype=np.uint8)
+        previous = np.zeros((count, size), dtype=np.uint8)
+        empty = np.zeros(count, dtype=bool)
+
+        # short sectors can only be at the start of the disk, and depend on
+        # the bytes left over from the sectors before them, so they are
+        # handled one at a time
+        short = np.nonzero(sizes < size)[0]
+        num_short = int(short[-1]) + 1 if len(short) > 0 else 0
+        current = np.zeros(size, dtype=np.uint8)
+        prev = np.zeros(size, dtype=np.uint8)
+        for i in range(num_short):
+            pos, length = positions[i], sizes[i]
+            current[:length] = data[pos:pos + length]
+            sectors[i] = current
+            previous[i] = prev
+            empty[i] = np.count_nonzero(current[:length]) == 0
+            if not empty[i]:
+                prev[:length] = current[:length]
+
+        # the rest are full sectors: each is compared to the last non-empty
+        # sector before it
+        sectors[num_short:] = data[positions[num_short:, np.newaxis] + np.arange(size)]
+        empty[num_short:] = ~sectors[num_short:].any(axis=1)
+        index = np.where(empty[num_short:], -1, np.arange(num_short, count))
+        index = np.maximum.accumulate(np.concatenate(([-1], index[:-1])))
+        previous[num_short:] = prev
+        valid = index >= 0
+        previous[num_short:][valid] = sectors[index[valid]]
+        return sectors, empty, previous
+
+    def calc_block_choices(self, sectors, previous, first, allowed_blocks):
+        """Choose the block type for every sector using the same rules as
+        `encode_best`, returning the array of block types and the array of
+        the argument for each block (the changed byte index for 0x41 and
+        0x44).
+        """
+        count, size = sectors.shape
+        best_size = np.full(count, size, dtype=np.int64)
+        best_block = np.full(count, 0x47, dtype=np.uint8)
+        encoder_arg = np.zeros(count, dtype=np.int64)
+
+        if not first:
+            changed = sectors != previous
+            any_changed = changed.any(axis=1)
+            first_diff = np.argmax(changed, axis=1)
+            last_diff = size - 1 - np.argmax(changed[:, ::-1], axis=1)
+            best_block[~any_changed] = 0x46
+            best_size[~any_changed] = 0
+
+            len_41 = last_diff + 1
+            use = any_changed & (len_41 < best_size) & (0x41 in allowed_blocks)
+            best_size[use] = len_41[use]
+            best_block[use] = 0x41
+            encoder_arg[use] = last_diff[use]
+
+            len_44 = size - first_diff + 1
+            use = any_changed & (len_44 < best_size) & (0x44 in allowed_blocks)
+            best_size[use] = len_44[use]
+            best_block[use] = 0x44
+            encoder_arg[use] = first_diff[use]
+
+        # runs of identical bytes: same[i, j] is True if byte j == byte j + 1
+        same = sectors[:, 1:] == sectors[:, :-1]
+
+        # length of the identical bytes at the start of the sector
+        leading = np.where(same.all(axis=1), size, np.argmin(same, axis=1) + 1)
+        use = (leading > 123) & (best_size > 6) & (0x42 in allowed_blocks)
+        best_size[use] = 6
+        best_block[use] = 0x42
+
+        if 0x43 in allowed_blocks:
+            # encoded length for RLE is 3 bytes per run plus the bytes not
+            # in a run; see calc_rle_groups
+            run_starts = same & ~np.concatenate((np.zeros((count, 1), dtype=bool), same[:, :-1]), axis=1)
+            num_runs = run_starts.sum(axis=1)
+            bytes_in_runs = same.sum(axis=1) + num_runs
+            last_run_end = size - np.argmax(same[:, ::-1], axis=1)
+            len_43 = 3 * num_runs + last_run_end - bytes_in_runs
+            len_43 += np.where(last_run_end < size, 1 + size - last_run_end, 0)
+            len_43[num_runs == 0] = 100000
+            use = len_43 < best_size
+            best_size[use] = len_43[use]
+            best_block[use] = 0x43
+
+        return best_block, encoder_arg
+
+    def calc_block_bytes(self, block, arg, data):
+        """Return the encoded bytes for the block type, the same as the
+        `encode_*` methods would write to the pass buffer.
+        """
+        if block == 0x41:
+            return bytes([0x41, arg]) + data[arg::-1].tobytes()
+        elif block == 0x42:
+            return bytes([0x42]) + data[123:128].tobytes()
+        elif block == 0x43:
+            _, groups = calc_rle_groups(data)
+            encoded = bytearray([0x43])
+            index = 0
+            size = len(data)
+            for rle_start, rle_end in groups:
+                encoded.append(rle_start & 0xff)
+                encoded.extend(data[index:rle_start].tobytes())
+                index = rle_start
+                if index < size:
+                    encoded.append(rle_end & 0xff)
+                    encoded.append(data[index])
+                    index = rle_end
+            return bytes(encoded)
+        elif block == 0x44:
+            return bytes([0x44, arg]) + data[arg:].tobytes()
+        elif block == 0x46:
+            return bytes([0x46])
+        return bytes([0x47]) + data.tobytes()
+
+    def calc_packed_data_by_sector(self, byte_data, media, block_restrictions=None):
+        """Reference implementation of `calc_packed_data` that determines the
+        block type one sector at a time.
+        """
         self.init_packing(media)
         output_index = 0
         current_sector = 1
@@ -358,71 +566,7 @@ class DCMCompressor(Compressor):
         self.put_byte(self.current[127])
 
     def prepare_43(self):
-        size = self.sector_size
-
-        # find where the values are the same
-        d = np.diff(self.current[:size])
-        # [  1,   1,   1,   1,   1,   1,   1,   1,   1,   1,   1,   1,   1,
-        #    1,   1,   1,   1,   1,   1,  -9,   0,   0,   0,   0,   0,   0,
-        #    0,   0,   0,   0,   0,   0,   0,   0,   0,   0,   0,   0,   0,
-        #   30,   1,   1,   1,   1,   1,   1,   1,   1,   1,  50,   0,   0,
-        #    0,   0,   0,   0,   0,   0,   0, -95,   0,   0,   0,   0,   0,
-        #    0,   0,   0,   0,   0,   0,   0,   0,   0,   0,   0,   0,   0,
-        #    0,  76,   1,   1,   1,   1,   1,   1,   1,   1,   1,   1,   1,
-        #    1,   1,   1,   1,   1,   1,   1,   1,   1,   1,   1,   1,   1,
-        #    1,   1,   1,   1,   1,   1,   1,   1,   1,   1,   1,   1,   1,
-        #    1,   1,   1,   1,   1,   1,   1,   1,   1,   1]
-
-        # The index before the first zero in a group of zeros is the start of a
-        # group of the same values. This gives a list of indexes of the groups
-        same = np.where(d == 0)[0]
-        # [20, 21, 22, 23, 24, 25, 26, 27, 28, 29, 30, 31, 32, 33, 34, 35, 36,
-        #  37, 38, 50, 51, 52, 53, 54, 55, 56, 57, 58, 60, 61, 62, 63, 64, 65,
-        #  66, 67, 68, 69, 70, 71, 72, 73, 74, 75, 76, 77, 78]
-
-        # If no consecutive bytes have the same value, abort!
-        if len(same) == 0:
-            return 100000, None
-
-        # The changes in same are the breaks in groups:
-        changes=np.diff(same)
-        # [ 1,  1,  1,  1,  1,  1,  1,  1,  1,  1,  1,  1,  1,  1,  1,  1,  1,
-        #   1, 12,  1,  1,  1,  1,  1,  1,  1,  1,  2,  1,  1,  1,  1,  1,  1,
-        #   1,  1,  1,  1,  1,  1,  1,  1,  1,  1,  1,  1]
-
-        # each 1 represents the same value as the next item in the array, so
-        # values > 1 are where there are gaps, i.e. the start of a new group
-        starts = np.where(changes > 1)[0] + 1
-        # [19, 28]
-        ends = starts - 1
-        # [18, 27]
-
-        # but it doesn't include the start of the first group or the end of the
-        # last group
-        starts = list(starts)
-        starts[0:0] = [0]
-        ends = list(ends)
-        ends.append(-1)
-
-        rle_starts = same[starts]
-        # [20, 50, 60]
-        rle_ends = same[ends] + 1 + 1  # inclusive, so need extra to form slice
-        # [40, 60, 80]
-        rle_groups = list(zip(rle_starts, rle_ends))
-
-        # start with verbatim copy, then alternate with rle
-        length = 0
-        index = 0
-        for start, end in rle_groups:
-            length += 1 + start - index  # verbatim
-            index = start
-            if index < size:
-                length += 2  # rle blocks always encoded in 2 bytes
-            index = end
-        if index < size:
-            length += 1 + size - index
-            rle_groups.append((size, size))
-        return length, rle_groups
+        return calc_rle_groups(self.current[:self.sector_size])
 
     def encode_43(self, groups):
         """Run-length encoded block"""
@@ -473,6 +617,80 @@ class DCMCompressor(Compressor):
         0x47: encode_47,
     }
 
+def calc_rle_groups(data):
+    """Find the runs of identical bytes for the RLE block type (0x43).
+
+    Returns the length of the encoded block (not including the block type
+    byte) and the list of (start, end) pairs of each run, or a length of
+    100000 if there are no runs.
+    """
+    size = len(data)
+
+    # find where the values are the same
+    d = np.diff(data)
+    # [  1,   1,   1,   1,   1,   1,   1,   1,   1,   1,   1,   1,   1,
+    #    1,   1,   1,   1,   1,   1,  -9,   0,   0,   0,   0,   0,   0,
+    #    0,   0,   0,   0,   0,   0,   0,   0,   0,   0,   0,   0,   0,
+    #   30,   1,   1,   1,   1,   1,   1,   1,   1,   1,  50,   0,   0,
+    #    0,   0,   0,   0,   0,   0,   0, -95,   0,   0,   0,   0,   0,
+    #    0,   0,   0,   0,   0,   0,   0,   0,   0,   0,   0,   0,   0,
+    #    0,  76,   1,   1,   1,   1,   1,   1,   1,   1,   1,   1,   1,
+    #    1,   1,   1,   1,   1,   1,   1,   1,   1,   1,   1,   1,   1,
+    #    1,   1,   1,   1,   1,   1,   1,   1,   1,   1,   1,   1,   1,
+    #    1,   1,   1,   1,   1,   1,   1,   1,   1,   1]
+
+    # The index before the first zero in a group of zeros is the start of a
+    # group of the same values. This gives a list of indexes of the groups
+    same = np.where(d == 0)[0]
+    # [20, 21, 22, 23, 24, 25, 26, 27, 28, 29, 30, 31, 32, 33, 34, 35, 36,
+    #  37, 38, 50, 51, 52, 53, 54, 55, 56, 57, 58, 60, 61, 62, 63, 64, 65,
+    #  66, 67, 68, 69, 70, 71, 72, 73, 74, 75, 76, 77, 78]
+
+    # If no consecutive bytes have the same value, abort!
+    if len(same) == 0:
+        return 100000, None
+
+    # The changes in same are the breaks in groups:
+    changes=np.diff(same)
+    # [ 1,  1,  1,  1,  1,  1,  1,  1,  1,  1,  1,  1,  1,  1,  1,  1,  1,
+    #   1, 12,  1,  1,  1,  1,  1,  1,  1,  1,  2,  1,  1,  1,  1,  1,  1,
+    #   1,  1,  1,  1,  1,  1,  1,  1,  1,  1,  1,  1]
+
+    # each 1 represents the same value as the next item in the array, so
+    # values > 1 are where there are gaps, i.e. the start of a new group
+    starts = np.where(changes > 1)[0] + 1
+    # [19, 28]
+    ends = starts - 1
+    # [18, 27]
+
+    # but it doesn't include the start of the first group or the end of the
+    # last group
+    starts = list(starts)
+    starts[0:0] = [0]
+    ends = list(ends)
+    ends.append(-1)
+
+    rle_starts = same[starts]
+    # [20, 50, 60]
+    rle_ends = same[ends] + 1 + 1  # inclusive, so need extra to form slice
+    # [40, 60, 80]
+    rle_groups = list(zip(rle_starts, rle_ends))
+
+    # start with verbatim copy, then alternate with rle
+    length = 0
+    index = 0
+    for start, end in rle_groups:
+        length += 1 + start - index  # verbatim
+        index = start
+        if index < size:
+            length += 2  # rle blocks always encoded in 2 bytes
+        index = end
+    if index < size:
+        length += 1 + size - index
+        rle_groups.append((size, size))
+    return length, rle_groups
+
+
 # Notes:
 #
 # 
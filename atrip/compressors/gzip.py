@@ -9,6 +9,10 @@ from ..compressor import Compressor
 
 class GZipCompressor(Compressor):
     compression_algorithm = "gzip"
+    magic = (b"\x1f\x8b",)
+
+    def open_unpacked_stream(self, fh):
+        return gzip.GzipFile(mode='rb', fileobj=fh)
 
     def calc_unpacked_data(self, byte_data):
         try:
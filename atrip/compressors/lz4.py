@@ -10,6 +10,12 @@ from ..compressor import Compressor
 
 class LZ4Compressor(Compressor):
     compression_algorithm = "lz4"
+    magic = (b"\x04\x22\x4d\x18",)  # lz4 frame format
+
+    def open_unpacked_stream(self, fh):
+        if lz4 is None:
+            raise errors.InvalidAlgorithm("lz4 module needed for .lz4 support")
+        return lz4.LZ4FrameFile(fh, mode='rb')
 
     def calc_unpacked_data(self, byte_data):
         if lz4 is None:
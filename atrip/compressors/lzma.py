@@ -9,6 +9,13 @@ from ..compressor import Compressor
 
 class LZMACompressor(Compressor):
     compression_algorithm = "lzma"
+    magic = (
+        b"\xfd7zXZ\x00",  # xz container
+        b"\x5d\x00\x00",  # legacy .lzma with the default lc/lp/pb properties
+    )
+
+    def open_unpacked_stream(self, fh):
+        return lzma.LZMAFile(fh, mode='rb')
 
     def calc_unpacked_data(self, byte_data):
         try:
@@ -6,6 +6,7 @@ from ..compressor import Compressor
 
 class UnixCompressor(Compressor):
     compression_algorithm = "unix compress"
+    magic = (b"\x1f\x9d",)
 
     def calc_unpacked_data(self, byte_data):
         try:
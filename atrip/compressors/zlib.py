@@ -11,6 +11,14 @@ class ZLibCompressor(Compressor):
     """NOTE: this is the GNU zip compression, not unix compress"""
     compression_algorithm = "zlib"
 
+    # zlib has no fixed magic; the first byte is the compression method (8)
+    # and window size, the second makes the first 16 bits a multiple of 31
+    magic = tuple(bytes([(window << 4) | 8]) for window in range(8))
+
+    @classmethod
+    def sniff(cls, header):
+        return super().sniff(header) and len(header) >= 2 and (header[0] * 256 + header[1]) % 31 == 0
+
     def calc_unpacked_data(self, byte_data):
         try:
             unpacked = zlib.decompress(bytes(byte_data))
@@ -9,10 +9,12 @@ from . import errors
 from . import style_bits
 from . import utils
 from .segment import Segment
+from .run_length import RunLengthArray
 from . import media_type
 from . import filesystem
 from .compressor import guess_compressor_list, compress_in_reverse_order, Uncompressed
 from .filesystem import Dirent
+from .detection import DetectionCache
 
 import logging
 log = logging.getLogger(__name__)
@@ -71,6 +73,16 @@ class Container:
     point to the container's data, a change to one segment can affect many
     other segments.
 
+    The data may also be a `numpy.memmap` of the image file (see
+    `guess_container_memmap`), in which case only the parts of the image
+    that are accessed are read from disk.
+
+    The style and disassembly type metadata are stored as `RunLengthArray`s,
+    so range operations on them are proportional to the number of runs
+    rather than the number of bytes. Dense numpy arrays of the metadata are
+    only allocated when something asks for them through the `style` or
+    `disasm_type` properties.
+
     In their native data format, disk images may be stored as raw data or can
     be compressed by any number of techniques. Subclasses of `Compressor`
     are used to transform compressed data into uncompressed bytes.
@@ -113,6 +125,7 @@ class Container:
         self.header = None
         self._filesystem = None
         self._media = None
+        self._detection = None
         self.mime = "application/octet-stream"
         self.pathname = ""
         self.default_disasm_type = 128  # libudis flag to use default CPU
@@ -142,28 +155,62 @@ class Container:
 
     @property
     def style(self):
-        return self._style
+        return self._style.dense
 
     @style.setter
     def style(self, value):
         if value is None:
-            value = np.zeros(len(self._data), dtype=np.uint8)
-        self._style = utils.to_numpy(value)
+            self._style = RunLengthArray(len(self._data))
+        else:
+            self._style = RunLengthArray.from_array(utils.to_numpy(value))
+
+    @property
+    def style_runs(self):
+        return self._style
+
+    @property
+    def writable_style(self):
+        """Style array for code that changes it directly rather than through
+        the style range methods
+        """
+        return self._style.writable()
 
     @property
     def disasm_type(self):
-        return self._disasm_type
+        return self._disasm_type.dense
 
     @disasm_type.setter
     def disasm_type(self, value):
         if value is None:
-            value = np.zeros(len(self._data), dtype=np.uint8) + self.default_disasm_type
-        self._disasm_type = utils.to_numpy(value)
+            self._disasm_type = RunLengthArray(len(self._data), self.default_disasm_type)
+        else:
+            self._disasm_type = RunLengthArray.from_array(utils.to_numpy(value))
+
+    @property
+    def disasm_type_runs(self):
+        return self._disasm_type
+
+    @property
+    def writable_disasm_type(self):
+        return self._disasm_type.writable()
+
+    @property
+    def is_memory_mapped(self):
+        return isinstance(self._data, np.memmap)
 
     @property
     def sha1(self):
         return hashlib.sha1(self.data).digest()
 
+    @property
+    def detection(self):
+        """Cache of values (hashes, header bytes) shared by the media type and
+        filesystem detectors
+        """
+        if self._detection is None:
+            self._detection = DetectionCache(self)
+        return self._detection
+
     @property
     def header_length(self):
         return len(self.header) if self.header is not None else 0
@@ -283,6 +330,7 @@ class Container:
     #### media
 
     def guess_media_type(self):
+        self._detection = None
         media = media_type.guess_media_type(self)
         self.media = media
 
@@ -318,7 +366,7 @@ class Container:
         # pairs
         state['comments'] = self.get_sorted_comments()
 
-        state['disasm_type'] = utils.collapse_values(self._disasm_type)
+        state['disasm_type'] = self._disasm_type.collapsed()
 
         state['header'] = self.header
         state['media'] = self.media
@@ -339,7 +387,6 @@ class Container:
         self._data = raw
         self.style = None
         self.default_disasm_type = state.pop('default_disasm_type')
-        self.disasm_type = None
         self.origin = state.pop('origin', 0)
         self.name = state.pop('name', "")
         self.verbose_name = state.pop('verbose_name', "")
@@ -348,7 +395,7 @@ class Container:
         self.decompression_order = state.pop('decompression_order', [])
         self.memory_map = dict(state.pop('memory_map', []))
         self.restore_comments(state.pop('comments', []))
-        utils.restore_values(self._disasm_type, state.pop('disasm_type', []))
+        self._disasm_type = RunLengthArray.from_collapsed(size, state.pop('disasm_type', []), self.default_disasm_type)
 
         self.header = state.pop('header')
         if self.header is not None:
@@ -378,19 +425,20 @@ class Container:
 
     def restore_backward_compatible_state(self, state):
         # convert old atrcopy stuff
+        runs = self._disasm_type
         d = state.get('data ranges', None)
         if d is not None:
-            utils.restore_value_to_ranges(self._disasm_type, d, 0)
+            runs.set_ranges(d, 0)
         d = state.get('display list ranges', None)
         if d is not None:
-            utils.restore_value_to_ranges(self._disasm_type, d, 30)
+            runs.set_ranges(d, 30)
 
         d2 = state.get('user style 2', None)  # display list
         if d2 is not None:
-            utils.restore_value_to_ranges(self._disasm_type, d2, 30)
+            runs.set_ranges(d2, 30)
         d3 = state.get('user style 3', None)  # jumpman level
         if d3 is not None:
-            utils.restore_value_to_ranges(self._disasm_type, d3, 31)
+            runs.set_ranges(d3, 31)
 
         if d2 is not None and d2 == d3:
             # it seems that user styles 2 and 3 can point to the same ranges,
@@ -399,15 +447,15 @@ class Container:
             # usually start out with 0x70, 0x70.
             for start, end in d2:
                 if self._data[start] == 0x70 and self._data[start + 1] == 0x70:
-                    self._disasm_type[start:end] = 30
+                    runs.set_ranges([(start, end)], 30)
                 elif self._data[start] in [0xfc, 0xfd, 0xfe]:
-                    self._disasm_type[start:end] = 32
+                    runs.set_ranges([(start, end)], 32)
                 else:
-                    self._disasm_type[start:end] = 30
+                    runs.set_ranges([(start, end)], 30)
 
         d = state.get('user style 4', None)  # jumpman harvest
         if d is not None:
-            utils.restore_value_to_ranges(self._disasm_type, d, 31)
+            runs.set_ranges(d, 31)
 
         d = state.get('comments', None)  # jumpman harvest
         if d is not None:
@@ -437,32 +485,45 @@ class Container:
 
     def set_style_at_indexes(self, indexes, **kwargs):
         bits = style_bits.get_style_bits(**kwargs)
-        self._style[indexes] |= bits
+        self._style.or_ranges(utils.indexes_to_ranges(indexes, len(self)), bits)
 
     def clear_style_at_indexes(self, indexes, **kwargs):
         style_mask = style_bits.get_style_mask(**kwargs)
-        self.style[indexes] &= style_mask
+        self._style.and_ranges(utils.indexes_to_ranges(indexes, len(self)), style_mask)
+
+    def set_style_at_ranges(self, ranges, **kwargs):
+        bits = style_bits.get_style_bits(**kwargs)
+        self._style.or_ranges(ranges, bits)
+
+    def clear_style_at_ranges(self, ranges, **kwargs):
+        style_mask = style_bits.get_style_mask(**kwargs)
+        self._style.and_ranges(ranges, style_mask)
 
-    def get_style_ranges(self, **kwargs):
+    def get_style_ranges(self, start=0, end=None, **kwargs):
         """Return a list of start, end pairs that match the specified style
         """
         bits = style_bits.get_style_bits(**kwargs)
-        matches = (self.style & bits) == bits
-        return utils.bool_to_ranges(matches)
+        return self._style.find_ranges(bits, start, end)
+
+    def set_disasm_type_at_ranges(self, ranges, value):
+        self._disasm_type.set_ranges(ranges, value)
 
     def update_data_style_from_disasm_type(self):
         mask = style_bits.get_style_mask(data=True)
-        self._style &= mask
         bits = style_bits.get_style_bits(data=True)
-        indexes = np.where((self._disasm_type == 0) | ((self._disasm_type >= 30) & (self._disasm_type < 128)))[0]
-        self._style[indexes] |= bits
+        self._style.and_ranges([(0, len(self))], mask)
+        data_types = np.zeros(256, dtype=bool)
+        data_types[0] = True
+        data_types[30:128] = True
+        ranges = self._disasm_type.find_value_ranges(data_types)
+        self._style.or_ranges(ranges, bits)
 
 
     #### comments
 
     def clear_comments(self, indexes):
         mask = style_bits.get_style_mask(comment=True)
-        style = self.style
+        style = self.writable_style
         subset = style[indexes]
         comment_subset_indexes = np.where(subset & style_bits.comment_bit_mask)[0]
         print(f"clear_comments: deleting comments at {indexes}")
@@ -477,7 +538,7 @@ class Container:
         if overwrite:
             self.comments = {}
         bits = style_bits.get_style_bits(comment=True)
-        style = self.style
+        style = self.writable_style
         for k, v in comments_list:
             self.comments[k] = v
             style[k] |= bits
@@ -490,7 +551,7 @@ class Container:
         This happens on the base data, so only need to do this on one segment
         that uses this base data.
         """
-        style_base = self._style
+        style_base = self.writable_style
         comment_text_indexes = np.asarray(list(self.comments.keys()), dtype=np.uint32)
         comment_mask = style_bits.get_style_mask(comment=True)
         has_comments = np.where(style_base & style_bits.comment_bit_mask > 0)[0]
@@ -528,9 +589,31 @@ def guess_container(data):
     return container
 
 
-def load(pathname):
-    sample_data = np.fromfile(pathname, dtype=np.uint8)
-    container = guess_container(sample_data)
+def guess_container_memmap(pathname):
+    """Create a container whose data is memory mapped rather than read into
+    memory.
+
+    Uncompressed images are mapped copy-on-write directly from the source
+    file, so changes are never written back until the container is saved.
+    Compressed images are decompressed into an unnamed temporary file which
+    is then mapped.
+    """
+    if os.path.getsize(pathname) == 0:
+        raise IOError("No data")
+    raw = np.memmap(pathname, dtype=np.uint8, mode='c')
+    data, compressors = guess_compressor_list(raw)
+    if data is not raw:
+        data = utils.to_memmap(data)
+    container = Container(data, compressors, force_numpy_data=True)
+    return container
+
+
+def load(pathname, use_memmap=False):
+    if use_memmap:
+        container = guess_container_memmap(pathname)
+    else:
+        sample_data = np.fromfile(pathname, dtype=np.uint8)
+        container = guess_container(sample_data)
     container.pathname = pathname
     container.guess_media_type()
     return container
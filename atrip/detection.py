@@ -0,0 +1,134 @@
+"""Shared state and ranking for media type and filesystem detection
+
+Identifying a container used to mean instantiating every media type (and then
+every filesystem) in turn until one didn't raise an exception. Instead, each
+media type and filesystem class provides a `calc_confidence` classmethod that
+uses only cheap tests -- exact sizes, header magic bytes, the sha1 signature
+-- to score how likely it is to match. Classes that score zero are never
+instantiated, and the rest are tried in order of decreasing confidence. Ties
+are broken by registration order so the result is deterministic.
+
+The values used by the tests are computed once per container and stored in a
+`DetectionCache`.
+"""
+import hashlib
+
+from .signature import guess_signature_from_sha1
+
+import logging
+log = logging.getLogger(__name__)
+
+
+# confidence levels used by the calc_confidence methods
+
+impossible = 0
+
+possible = 10
+
+likely = 50
+
+certain = 90
+
+exact = 100
+
+
+class DetectionCache:
+    """Values computed from the container data that are needed by more than
+    one detector: the sha1 hash, the signature found from that hash, and
+    slices of the data (usually header bytes).
+
+    The values reflect the data at the time they were first computed. The
+    container creates a new cache each time media type detection starts.
+    """
+    def __init__(self, container):
+        self.container = container
+        self.size = len(container)
+        self._sha1 = None
+        self._signature = None
+        self._signature_checked = False
+        self._slices = {}
+
+    def __str__(self):
+        return f"DetectionCache size={self.size} slices={len(self._slices)}"
+
+    @property
+    def sha1(self):
+        if self._sha1 is None:
+            self._sha1 = hashlib.sha1(self.container.data).digest()
+        return self._sha1
+
+    @property
+    def signature(self):
+        if not self._signature_checked:
+            self._signature = guess_signature_from_sha1(self.sha1)
+            self._signature_checked = True
+        return self._signature
+
+    def get_bytes(self, start, end):
+        """Return the container bytes from start to end (clipped at the end of
+        the container) as a bytes object
+        """
+        key = (start, end)
+        try:
+            return self._slices[key]
+        except KeyError:
+            value = self.container.data[start:end].tobytes()
+            self._slices[key] = value
+            return value
+
+    def has_magic(self, offset, magic):
+        """Check if the bytes object `magic` appears at `offset`
+        """
+        return self.get_bytes(offset, offset + len(magic)) == magic
+
+    def check_signature(self, sig):
+        """Equivalent to `magic.check_signature`, using cached slices of the
+        container data
+        """
+        for index, expected in sig:
+            if isinstance(index, slice):
+                actual = list(self.get_bytes(index.start, index.stop))
+            else:
+                actual = self.get_bytes(index, index + 1)
+                actual = actual[0] if actual else None
+            if actual != expected:
+                return False
+        return True
+
+
+class Candidate:
+    """A media type or filesystem class with the confidence that it will
+    match
+    """
+    def __init__(self, cls, confidence, order):
+        self.cls = cls
+        self.confidence = confidence
+        self.order = order
+
+    def __str__(self):
+        return f"{self.cls.ui_name}: confidence={self.confidence}"
+
+    def __repr__(self):
+        return f"<Candidate {self.cls.__name__} {self.confidence}>"
+
+
+def rank_candidates(classes, *args):
+    """Return a list of `Candidate`s for each class with nonzero confidence,
+    sorted by decreasing confidence and then by their order in `classes`.
+
+    Each class's `calc_confidence` classmethod is called with `args`.
+    Duplicate classes (which happen when a module providing entry point
+    classes imports another's) are only scored once.
+    """
+    candidates = []
+    seen = set()
+    for order, cls in enumerate(classes):
+        if cls in seen:
+            continue
+        seen.add(cls)
+        confidence = cls.calc_confidence(*args)
+        log.debug(f"rank_candidates: {cls.__name__}: {confidence}")
+        if confidence > impossible:
+            candidates.append(Candidate(cls, confidence, order))
+    candidates.sort(key=lambda c: (-c.confidence, c.order))
+    return candidates
@@ -125,6 +125,10 @@ class FileNotFound(FilesystemError):
     pass
 
 
+class ReadOnlyFilesystem(FilesystemError):
+    pass
+
+
 # Errors in files or structure of a file. These are separate from
 # FilesystemError subclasses to indicate they aren't fatal when detecting
 # filesystems
@@ -45,7 +45,7 @@ def get_xex(segments, run_addr=None):
     rawdata = SegmentData(bytes)
     main_segment = DefaultSegment(rawdata)
     main_segment.data[0:2] = 0xff  # FFFF header
-    main_segment.style[0:2] = data_style
+    main_segment.writable_style[0:2] = data_style
     i = 2
     for s in segments_copy:
         # create new sub-segment inside new main segment that duplicates the
@@ -54,9 +54,9 @@ def get_xex(segments, run_addr=None):
         words = new_s.data[0:4].view(dtype='<u2')
         words[0] = s.origin
         words[1] = s.origin + len(s) - 1
-        new_s.style[0:4] = data_style
+        new_s.writable_style[0:4] = data_style
         new_s.data[4:4+len(s)] = s[:]
-        new_s.style[4:4+len(s)] = s.style[:]
+        new_s.writable_style[4:4+len(s)] = s.style[:]
         i += 4 + len(s)
         new_s.copy_user_data(s, 4)
         sub_segments.append(new_s)
@@ -6,7 +6,9 @@ import numpy as np
 
 from . import errors
 from . import style_bits
+from . import detection
 from .segment import Segment
+from . import utils
 from .utils import to_numpy, to_numpy_list, uuid
 from .file_type import guess_file_type
 
@@ -42,6 +44,17 @@ class Filesystem:
     def __str__(self):
         return self.ui_name
 
+    #### detection
+
+    @classmethod
+    def calc_confidence(cls, media, cache):
+        """Return an estimate (using the constants in `detection`) of how
+        likely the media is to contain this filesystem, using only cheap
+        tests. Subclasses should return `detection.impossible` if
+        `check_media` would fail.
+        """
+        return detection.possible
+
     #### initialization
 
     def check_media(self, media):
@@ -118,8 +131,31 @@ class Filesystem:
                 yield segment
             yield from segment.iter_segments(Dirent)
 
+    #### changing files
+
+    def transaction(self):
+        """Return a `FilesystemTransaction` to stage changes to the files,
+        which are applied all at once when it's committed.
+        """
+        return FilesystemTransaction(self)
+
+    def commit_transaction(self, transaction):
+        """Subclasses that can write files should override this method to
+        apply all the changes in the transaction, updating the VTOC and
+        directory only once. If any change can't be made (e.g. the disk is
+        full), an exception should be raised before the media is modified.
+        """
+        raise errors.ReadOnlyFilesystem(f"{self.ui_name} doesn't support changing files")
+
     #### utilities
 
+    def check_integrity(self):
+        """Subclasses should override this to check the consistency of the
+        files, directory and VTOC, returning a list of text descriptions of
+        any problems found.
+        """
+        return []
+
     def find_interesting_segment(self):
         """If the filesystem has some interesting segment that might be better
         to display than the first segment in the container, identify that here
@@ -129,6 +165,48 @@ class Filesystem:
         return None
 
 
+class FilesystemTransaction:
+    """A set of files to add to and remove from a filesystem, which are
+    applied together by `commit`.
+
+    Can also be used as a context manager, which commits the changes if the
+    block completes without an exception:
+
+        with container.filesystem.transaction() as t:
+            t.remove("OLD.DAT")
+            t.add("NEW.DAT", data)
+    """
+    def __init__(self, filesystem):
+        self.filesystem = filesystem
+        self.adds = []
+        self.removes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+
+    def __len__(self):
+        return len(self.adds) + len(self.removes)
+
+    def add(self, filename, data, filetype=None):
+        """Stage a new file. An existing file with the same name is
+        replaced.
+        """
+        self.adds.append((filename, to_numpy(data), filetype))
+
+    def remove(self, filename):
+        self.removes.append(filename)
+
+    def commit(self):
+        if len(self) > 0:
+            self.filesystem.commit_transaction(self)
+        self.adds = []
+        self.removes = []
+
+
 class NoFilesystem(Filesystem):
     ui_name = "No Filesystem"
     
@@ -158,6 +236,14 @@ class Dirent(Segment):
         Segment.__init__(self, parent, start, name=f"{self.ui_name} {file_num}", length=length)
         self.init_dirent()
 
+    def init_empty(self):
+        super().init_empty()
+        self._segments = None
+        self.file_segment = None
+        self.file_error = None
+        self.file_structure_offsets = None
+        self.file_structure_bytes = None
+
     def init_dirent(self):
         self.parse_raw_dirent()
         if self.sanity_check():
@@ -165,13 +251,85 @@ class Dirent(Segment):
         else:
             self.is_sane = False
             self.in_use = False
+
+    def calc_segments(self):
+        # the file is only located when the segments are first needed; see
+        # the segments property
+        return None
+
+    @property
+    def segments(self):
+        """The segments of the file, built by `get_file` on first access and
+        cached until the bytes describing the file's structure change.
+        """
+        if self._segments is None or self.is_file_structure_changed():
+            self.resolve_file()
+        return self._segments
+
+    @segments.setter
+    def segments(self, segments):
+        self._segments = segments
+
+    def iter_segments(self, segment_type=None):
+        # file segments never contain dirents, so don't build them when only
+        # looking for dirents
+        if segment_type is not None and issubclass(segment_type, Dirent):
+            return
+        yield from Segment.iter_segments(self, segment_type)
+
+    def resolve_file(self, *args):
+        """Build the file segments, passing any arguments on to `get_file`"""
+        self._segments = []
+        self.file_segment = None
+        self.file_error = None
+        self.file_structure_offsets = []
         if self.in_use:
             try:
-                self.get_file()
+                self.file_segment = self.get_file(*args)
             except errors.FileError as e:
-                self.in_use = False
                 self.is_sane = False
-                self.error = e
+                self.file_error = e
+                self.error = str(e)
+        if self.file_structure_offsets:
+            offsets = np.concatenate(self.file_structure_offsets)
+        else:
+            offsets = np.zeros(0, dtype=np.uint32)
+        self.file_structure_offsets = offsets
+        self.file_structure_bytes = self.container._data[offsets].copy()
+
+    def watch_file_structure(self, segment, indexes):
+        """Called by `get_file` to record the bytes (as indexes into
+        `segment`) that were used to find the file, e.g. sector links, so the
+        file segments can be rebuilt when any of them change.
+        """
+        offsets = segment.calc_container_offsets(indexes)
+        if isinstance(offsets, range):
+            offsets = utils.range_to_array(offsets)
+        self.file_structure_offsets.append(np.atleast_1d(offsets).astype(np.uint32))
+
+    def is_file_structure_changed(self):
+        offsets = self.file_structure_offsets
+        if offsets is None or self.container is None:
+            return False
+        return not np.array_equal(self.container._data[offsets], self.file_structure_bytes)
+
+    def invalidate_file(self):
+        """Discard the file segments so they are rebuilt on next use"""
+        self._segments = None
+        self.file_segment = None
+        self.file_error = None
+        self.file_structure_offsets = None
+        self.file_structure_bytes = None
+
+    def get_file_segment(self):
+        """Return the segment containing the file data, or None if the file
+        is empty. Raises the `FileError` found when following the file
+        structure, if any.
+        """
+        self.segments
+        if self.file_error is not None:
+            raise self.file_error
+        return self.file_segment
 
     def __eq__(self, other):
         raise NotImplementedError
@@ -208,6 +366,7 @@ class Dirent(Segment):
     def mark_deleted(self):
         self.deleted = True
         self.in_use = False
+        self.invalidate_file()
 
     def parse_raw_dirent(self):
         raise NotImplementedError
@@ -465,9 +624,16 @@ def find_filesystems():
         _filesystems = _find_filesystems()
     return _filesystems
 
+def rank_filesystems(segment):
+    """Return the list of `detection.Candidate`s for the filesystems that
+    might be on the media, best first.
+    """
+    return detection.rank_candidates(find_filesystems(), segment, segment.container.detection)
+
 def guess_filesystem(segment):
-    for f in find_filesystems():
-        log.debug(f"trying filesystem {f.ui_name}")
+    for candidate in rank_filesystems(segment):
+        f = candidate.cls
+        log.debug(f"trying filesystem {candidate}")
         try:
             found = f(segment)
         except errors.FilesystemError as e:
@@ -1,6 +1,7 @@
 import numpy as np
 
 from .. import errors
+from .. import detection
 from ..segment import Segment
 from ..filesystem import VTOC, Dirent, Directory, Filesystem
 from ..file_type import guess_file_type
@@ -139,7 +140,6 @@ class Dos33Dirent(Dirent):
 
     def __init__(self, directory, filenum):
         start = self.format.itemsize * filenum
-        Dirent.__init__(self, directory, filenum, start, self.format.itemsize)
         self._file_type = 0
         self.locked = False
         self.deleted = False
@@ -147,6 +147,7 @@ class Dos33Dirent(Dirent):
         self.sector = 0
         self.filename = ""
         self.num_sectors = 0
+        Dirent.__init__(self, directory, filenum, start, self.format.itemsize)
         self.current_sector_index = 0
         self.current_read = 0
         self.sectors_seen = None
@@ -236,6 +237,7 @@ class Dos33Dirent(Dirent):
     def get_file(self):
         media = self.filesystem.media
         tslist = self.get_track_sector_list()
+        self.watch_file_structure(tslist, range(len(tslist)))
         offsets = media.follow_track_sector_list(tslist)
         if len(offsets) > 0:
             file_segment = guess_file_type(media, self.filename, offsets)
@@ -302,6 +304,12 @@ class AppleDos33(Filesystem):
     ui_name = "Apple DOS 3.3"
     default_executable_extension = "BIN"
 
+    @classmethod
+    def calc_confidence(cls, media, cache):
+        if not hasattr(media, "sector_from_track"):
+            return detection.impossible
+        return detection.likely
+
     def check_media(self, media):
         try:
             media.sector_from_track
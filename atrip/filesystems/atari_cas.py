@@ -1,6 +1,7 @@
 import numpy as np
 
 from .. import errors
+from .. import detection
 from ..segment import Segment
 from ..filesystem import VTOC, Dirent, Directory, Filesystem
 from ..file_type import guess_file_type
@@ -126,6 +127,12 @@ class AtariCassetteFilesystem(Filesystem):
     ui_name = "Atari Cassette (.cas)"
     default_executable_extension = "XEX"
 
+    @classmethod
+    def calc_confidence(cls, media, cache):
+        if not hasattr(media, "get_chunk"):
+            return detection.impossible
+        return detection.certain
+
     def check_media(self, media):
         try:
             media.get_chunk
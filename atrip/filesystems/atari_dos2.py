@@ -1,9 +1,11 @@
 import numpy as np
 
 from .. import errors
+from .. import detection
 from ..segment import Segment
 from ..filesystem import VTOC, Dirent, Directory, Filesystem
 from ..file_type import guess_file_type
+from ..utils import bool_to_ranges
 
 try:  # Expensive debugging
     _xd = _expensive_debugging
@@ -68,6 +70,9 @@ class AtariDos1SectorVTOC(VTOC):
 
     max_sector = 720
 
+    # number of sectors (starting from sector 0) described by the bitmap
+    num_mapped_sectors = 720
+
     extra_serializable_attributes = ['total_sectors:int', 'unused_sectors:int']
 
     def find_segment_location(self):
@@ -99,12 +104,25 @@ class AtariDos1SectorVTOC(VTOC):
         packed = np.packbits(self.sector_map[0:720])
         self[0x0a:0x64] = packed
 
+    def calc_free_change(self, old_sector_map, start, end):
+        return int(np.count_nonzero(self.sector_map[start:end])) - int(np.count_nonzero(old_sector_map[start:end]))
+
+    def pack_free_count(self, old_sector_map):
+        """Update the count of free sectors after the sector map has been
+        changed from `old_sector_map`. The count is adjusted rather than
+        recalculated so sectors that DOS leaves out of its count stay out.
+        """
+        self.unused_sectors = int(self.unused_sectors) + self.calc_free_change(old_sector_map, 0, 720)
+        self[3:5] = np.array([self.unused_sectors], dtype='<u2').view(np.uint8)
+
 
 class AtariDos2SectorVTOC(AtariDos1SectorVTOC):
     ui_name = "DOS2 ED VTOC"
 
     max_sector = 1040
 
+    num_mapped_sectors = 1024
+
     def find_segment_location(self):
         if self.media.num_sectors != 1040:
             raise errors.FilesystemError(f"Not enhanced density disk")
@@ -124,6 +142,126 @@ class AtariDos2SectorVTOC(AtariDos1SectorVTOC):
         packed = np.packbits(self.sector_map[720:1024])
         self[0xd4:0xfa] = packed
 
+    def pack_free_count(self, old_sector_map):
+        # the 2nd VTOC sector holds the count of free sectors above 719
+        AtariDos1SectorVTOC.pack_free_count(self, old_sector_map)
+        count = int(self[0xfa:0xfc].view('<u2')[0]) + self.calc_free_change(old_sector_map, 720, 1024)
+        self[0xfa:0xfc] = np.array([count], dtype='<u2').view(np.uint8)
+
+
+class AtariDosSectorLinks:
+    """Table of the sector link bytes of every sector on the disk.
+
+    Atari DOS 2 (and MyDOS) stores the file number, the next sector in the
+    file and the number of bytes used in the last 3 bytes of each data
+    sector. All of these are unpacked at once into arrays indexed by sector
+    number, so sector chains can be followed without touching the media
+    again and all the files on the disk can be checked together.
+
+    If `file_numbers` is False, the top 6 bits of the link are used as part
+    of the next sector number instead of the file number, as MyDOS does on
+    disks with more than 1024 sectors.
+
+    The link bytes are kept, so `is_current` can check whether a chain of
+    sectors has been changed on the media since the table was built.
+    """
+    def __init__(self, media, file_numbers=True):
+        self.media = media
+        first = media.starting_sector_label
+        size = first + media.num_sectors
+        positions, sizes = media.calc_sector_positions()
+        tails = media.get_sector_tails(3).astype(np.int32)
+
+        # element 0 (and any others before the first sector) is unused
+        self.index = np.zeros(size, dtype=np.int64)
+        self.index[first:] = positions
+        self.size = np.zeros(size, dtype=np.int64)
+        self.size[first:] = sizes
+        self.file_num = np.full(size, -1, dtype=np.int32)
+        self.next_sector = np.zeros(size, dtype=np.int32)
+        self.num_bytes = np.zeros(size, dtype=np.int32)
+        self.tails = np.zeros((size, 3), dtype=np.uint8)
+        self.tails[first:] = tails
+        if file_numbers:
+            self.file_num[first:] = tails[:,0] >> 2
+            self.next_sector[first:] = ((tails[:,0] & 0x3) << 8) | tails[:,1]
+        else:
+            self.next_sector[first:] = (tails[:,0] << 8) | tails[:,1]
+        self.num_bytes[first:] = np.minimum(tails[:,2], sizes - 3)
+        self.first_sector = first
+        self.has_file_numbers = file_numbers
+
+    def __len__(self):
+        return len(self.next_sector)
+
+    def is_sector_valid(self, sector):
+        return self.first_sector <= sector < len(self.next_sector)
+
+    def follow(self, start, count, file_num=None):
+        """Follow the chain of sectors starting at `start`, stopping at a
+        zero link or after `count` sectors.
+
+        Returns the array of sector numbers and None, or if the chain is bad,
+        the sectors up to the problem and the error: InvalidSectorNumber if a
+        link points off the disk, FileNumberMismatchError164 if a sector
+        belongs to a different file (only checked if `file_num` is
+        specified), or FileStructureError if the chain loops back on itself.
+        """
+        sectors = np.zeros(min(count, len(self)), dtype=np.int32)
+        seen = np.zeros(len(self), dtype=bool)
+        error = None
+        n = 0
+        sector = start
+        while sector > 0 and n < count:
+            if not self.is_sector_valid(sector):
+                error = errors.InvalidSectorNumber(f"Sector {sector} out of range")
+                break
+            if seen[sector]:
+                error = errors.FileStructureError(f"Bad sector pointer data: attempting to reread sector {sector}")
+                break
+            if file_num is not None and self.has_file_numbers and self.file_num[sector] != file_num:
+                error = errors.FileNumberMismatchError164(f"Expecting file {file_num}, found {self.file_num[sector]}")
+                break
+            seen[sector] = True
+            sectors[n] = sector
+            n += 1
+            sector = int(self.next_sector[sector])
+        return sectors[:n], error
+
+    def is_current(self, sectors):
+        """Return True if the link bytes of the sectors on the media are
+        the same as when the table was built
+        """
+        return np.array_equal(self.media[self.calc_link_indexes(sectors)], self.tails[sectors].ravel())
+
+    def calc_data_indexes(self, sectors, counts=None):
+        """Return the indexes into the media of the data bytes in the list of
+        sectors, in order. The number of bytes in each sector is taken from
+        the link bytes unless `counts` is specified.
+        """
+        if counts is None:
+            counts = self.num_bytes[sectors]
+        counts = np.asarray(counts, dtype=np.int64)
+        total = int(counts.sum())
+        if total == 0:
+            return np.zeros(0, dtype=np.uint32)
+        # each byte's index is the start of its sector plus its position in
+        # the file less the number of file bytes in the preceding sectors
+        starts = self.index[sectors] - (np.cumsum(counts) - counts)
+        return (np.repeat(starts, counts) + np.arange(total)).astype(np.uint32)
+
+    def calc_link_indexes(self, sectors):
+        """Return the indexes into the media of the link bytes in the list
+        of sectors
+        """
+        ends = self.index[sectors] + self.size[sectors]
+        return ((ends - 3)[:, np.newaxis] + np.arange(3)).ravel()
+
+    def calc_sectors_of_indexes(self, indexes):
+        """Return the sector numbers containing the indexes into the media"""
+        first = self.first_sector
+        return np.searchsorted(self.index[first:], indexes, side='right') - 1 + first
+
 
 class AtariDosDirent(Dirent):
     ui_name = "DOS2 Dirent"
@@ -247,37 +385,38 @@ class AtariDosDirent(Dirent):
         values[4] = self.ext
         return data
 
-    def get_file(self):
+    def follow_sector_links(self, links):
+        """Return the sectors of the file, the error found following them
+        (or None) and the sectors whose links determine the file structure
+        """
+        sectors, error = links.follow(self.starting_sector, self.num_sectors, self.file_num)
+        watched = sectors
+        if error is not None:
+            # include the sector that caused the error, so fixing it will
+            # cause the file to be rebuilt
+            bad = links.next_sector[sectors[-1]] if len(sectors) > 0 else self.starting_sector
+            if links.is_sector_valid(bad):
+                watched = np.append(sectors, bad)
+        return sectors, error, watched
+
+    def get_file(self, links=None):
         media = self.filesystem.media
-        offsets = np.empty(self.filesystem.max_file_size, dtype=np.uint32)
-        length = 0
-        next_sector = self.starting_sector
-        sectors_remaining = self.num_sectors
-        sectors_seen = set()
-
-        while next_sector > 0 and sectors_remaining > 0:
-            try:
-                index, size = media.get_index_of_sector(next_sector)
-            except errors.MediaError:
-                length = 0
-                self.is_sane = False
-                break
-            num_bytes = media[index + size - 1]
-            file_num = media[index + size - 3] >> 2
-            if file_num != self.file_num:
-                raise errors.FileNumberMismatchError164(f"Expecting file {self.file_num}, found {file_num}")
-            sectors_seen.add(next_sector)
-
-            offsets[length:length + num_bytes] = np.arange(index, index+num_bytes)
-            length += num_bytes
-
-            next_sector = ((media[index + size - 3] & 0x3) << 8) + media[index + size - 2]
-            if next_sector in sectors_seen:
-                raise errors.FileStructureError(f"Bad sector pointer data: attempting to reread sector {next_sector}")
-            sectors_remaining -= 1
-
-        if length > 0:
-            offsets = np.copy(offsets[0:length])
+        if links is None:
+            links = self.filesystem.sector_links
+        sectors, error, watched = self.follow_sector_links(links)
+        if not links.is_current(watched):
+            # the file's sectors have been changed since the table was built
+            links = self.filesystem.update_sector_links()
+            sectors, error, watched = self.follow_sector_links(links)
+        self.watch_file_structure(media, links.calc_link_indexes(watched))
+        if isinstance(error, errors.FileError):
+            raise error
+        elif error is not None:
+            self.is_sane = False
+            return None
+
+        offsets = links.calc_data_indexes(sectors)
+        if len(offsets) > 0:
             file_segment = guess_file_type(media, self.filename, offsets)
             self.segments = [file_segment]
             return file_segment
@@ -285,6 +424,7 @@ class AtariDosDirent(Dirent):
     def update_sector_info(self, sector_list):
         self.num_sectors = sector_list.num_sectors
         self.starting_sector = sector_list.first_sector
+        self.invalidate_file()
 
     def add_metadata_sectors(self, vtoc, sector_list, header):
         # no extra sectors are needed for an Atari DOS file; the links to the
@@ -301,6 +441,20 @@ class AtariDosDirent(Dirent):
             return False
         return True
 
+    @classmethod
+    def calc_dos_filename(cls, filename):
+        """Return the basename and extension, as bytes padded with spaces,
+        of the DOS filename for `filename`
+        """
+        if type(filename) is not bytes:
+            filename = filename.encode("latin1")
+        filename = filename.upper()
+        if b'.' in filename:
+            basename, ext = filename.split(b'.', 1)
+        else:
+            basename, ext = filename, b''
+        return b'%-8s' % basename[0:8], b'%-3s' % ext[0:3]
+
     def set_values(self, filename, filetype, index):
         if type(filename) is not bytes:
             filename = filename.encode("latin1")
@@ -348,6 +502,12 @@ class AtariDos2(Filesystem):
     ui_name = "Atari DOS 2"
     default_executable_extension = "XEX"
 
+    @classmethod
+    def calc_confidence(cls, media, cache):
+        if not hasattr(media, "get_contiguous_sectors"):
+            return detection.impossible
+        return detection.likely
+
     def check_media(self, media):
         try:
             media.get_contiguous_sectors
@@ -366,3 +526,176 @@ class AtariDos2(Filesystem):
 
     def calc_directory_segment(self):
         return AtariDos2Directory(self)
+
+    #### changing files
+
+    def find_dirent_slot(self, raw, filename):
+        """Return the index of the in-use entry for `filename` in the array
+        of raw directory entries, or None if not found
+        """
+        basename, ext = AtariDosDirent.calc_dos_filename(filename)
+        in_use = (raw['FLAG'] & AtariDosDirent.FLAG_IN_USE) != 0
+        found = np.nonzero(in_use & (raw['NAME'] == basename) & (raw['EXT'] == ext))[0]
+        return int(found[0]) if len(found) > 0 else None
+
+    def commit_transaction(self, transaction):
+        media = self.media
+        if self.vtoc is None:
+            raise errors.ReadOnlyFilesystem(f"{self.ui_name} has no VTOC")
+        links = self.calc_sector_links()
+        raw = self.directory[:].view(dtype=AtariDosDirent.format).copy()
+        sector_map = self.vtoc.sector_map.copy()
+
+        # removing files (including those about to be replaced) only frees
+        # their sectors and directory entries in the working copies
+        def remove(slot):
+            sectors, _ = links.follow(int(raw['START'][slot]), int(raw['COUNT'][slot]), slot)
+            sector_map[sectors] = 1
+            raw['FLAG'][slot] = AtariDosDirent.FLAG_DELETED
+
+        for filename in transaction.removes:
+            slot = self.find_dirent_slot(raw, filename)
+            if slot is None:
+                raise errors.FileNotFound(f"{filename} not found on disk")
+            remove(slot)
+        adds = []
+        for filename, data, filetype in transaction.adds:
+            slot = self.find_dirent_slot(raw, filename)
+            if slot is not None:
+                remove(slot)
+            basename, ext = AtariDosDirent.calc_dos_filename(filename)
+            adds.append((basename, ext, data))
+
+        # allocate sectors for all new files from one scan of the bitmap,
+        # and find their directory entries
+        payload = media.sector_size - 3
+        num_sectors = [max(1, (len(data) + payload - 1) // payload) for _, _, data in adds]
+        free = np.nonzero(sector_map[links.first_sector:self.vtoc.num_mapped_sectors])[0] + links.first_sector
+        if sum(num_sectors) > len(free):
+            raise errors.NotEnoughSpaceOnDisk(f"Need {sum(num_sectors)} sectors, VTOC has only {len(free)} available")
+        slots = np.nonzero((raw['FLAG'] & AtariDosDirent.FLAG_IN_USE) == 0)[0]
+        if len(adds) > len(slots):
+            raise errors.NoSpaceInDirectory(f"Need {len(adds)} directory entries, only {len(slots)} available")
+
+        all_sectors = free[:sum(num_sectors)]
+        sector_map[all_sectors] = 0
+        counts = []
+        tails = np.zeros((len(all_sectors), 3), dtype=np.uint8)
+        first = 0
+        for (basename, ext, data), count, slot in zip(adds, num_sectors, slots):
+            sectors = all_sectors[first:first + count]
+            used = np.full(count, payload, dtype=np.int64)
+            used[-1] = len(data) - payload * (count - 1)
+            next_sectors = np.append(sectors[1:], 0)
+            if links.has_file_numbers:
+                tails[first:first + count, 0] = (slot << 2) | (next_sectors >> 8)
+            else:
+                tails[first:first + count, 0] = next_sectors >> 8
+            tails[first:first + count, 1] = next_sectors & 0xff
+            tails[first:first + count, 2] = used
+            counts.append(used)
+            raw[slot] = (AtariDosDirent.FLAG_DOS_2 | AtariDosDirent.FLAG_IN_USE, count, sectors[0], basename, ext)
+            first += count
+
+        # everything fits, so write it all
+        if len(all_sectors) > 0:
+            media[links.calc_data_indexes(all_sectors, links.size[all_sectors] - 3)] = 0
+            data = np.concatenate([data for _, _, data in adds])
+            media[links.calc_data_indexes(all_sectors, np.concatenate(counts))] = data
+            media[links.calc_link_indexes(all_sectors)] = tails.ravel()
+        self.directory[:] = raw.view(np.uint8)
+        old_sector_map = self.vtoc.sector_map.copy()
+        self.vtoc.sector_map[:] = sector_map
+        self.vtoc.pack_vtoc()
+        self.vtoc.pack_free_count(old_sector_map)
+        self.invalidate_sector_links()
+        self.directory.segments = self.directory.calc_dirents()
+
+    #### sector links
+
+    def calc_sector_links(self):
+        # disks larger than enhanced density are only possible with MyDOS,
+        # which needs all the link bits for the sector number
+        return AtariDosSectorLinks(self.media, self.media.num_sectors <= 1040)
+
+    @property
+    def sector_links(self):
+        """The sector link table, built on first use and shared by all the
+        files until it is invalidated. It is cached on the media rather than
+        here so it isn't serialized with the filesystem.
+
+        Changes to the media don't invalidate it automatically; users check
+        the sectors they follow with `AtariDosSectorLinks.is_current` and
+        call `update_sector_links` if they have changed.
+        """
+        media = self.media
+        if media.sector_links is None:
+            media.sector_links = self.calc_sector_links()
+        return media.sector_links
+
+    def invalidate_sector_links(self):
+        self.media.sector_links = None
+
+    def update_sector_links(self):
+        """Rebuild the sector link table from the media and return it"""
+        self.invalidate_sector_links()
+        return self.sector_links
+
+    def resolve_files(self):
+        """Build the segments of all files not already built, using a single
+        sector link table
+        """
+        for dirent in self.iter_dirents():
+            if dirent._segments is None:
+                dirent.resolve_file()
+
+    def calc_system_sectors(self, links):
+        """Return the sector numbers used by the boot sectors, VTOC and
+        directory
+        """
+        indexes = [self.media.calc_reverse_index(s.container_offset) for s in self.filesystem_metadata_segments()]
+        if not indexes:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(links.calc_sectors_of_indexes(np.concatenate(indexes)))
+
+    def check_integrity(self):
+        links = self.calc_sector_links()
+        problems = []
+        claims = np.zeros(len(links), dtype=np.int32)
+        for dirent in self.iter_dirents():
+            if not isinstance(dirent, AtariDosDirent):
+                continue
+            # DOS follows the links to the end rather than using the count
+            sectors, error = links.follow(dirent.starting_sector, len(links), dirent.file_num)
+            if error is not None:
+                problems.append(f"{dirent.filename}: {error}")
+            elif len(sectors) != dirent.num_sectors:
+                problems.append(f"{dirent.filename}: directory lists {dirent.num_sectors} sectors, found {len(sectors)}")
+            claims[sectors] += 1
+        if np.any(claims > 1):
+            problems.append(f"Sectors in more than one file: {sector_ranges_text(claims > 1)}")
+
+        used = claims > 0
+        used[self.calc_system_sectors(links)] = True
+        if self.vtoc is not None:
+            n = min(self.vtoc.num_mapped_sectors, len(links))
+            free = np.zeros(len(links), dtype=bool)
+            free[:n] = self.vtoc.sector_map[:n] == 1
+            if np.any(free & used):
+                problems.append(f"Sectors in use but marked free in VTOC: {sector_ranges_text(free & used)}")
+            orphans = ~free & ~used
+            orphans[:links.first_sector] = False
+            orphans[n:] = False
+            if np.any(orphans):
+                problems.append(f"Sectors marked in use in VTOC but not in any file: {sector_ranges_text(orphans)}")
+        return problems
+
+
+def sector_ranges_text(mask):
+    ranges = []
+    for start, end in bool_to_ranges(mask):
+        if end - start == 1:
+            ranges.append(str(start))
+        else:
+            ranges.append(f"{start}-{end - 1}")
+    return ", ".join(ranges)
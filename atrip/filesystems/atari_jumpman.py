@@ -1,6 +1,8 @@
 import numpy as np
 
 from .. import errors
+from .. import detection
+from ..magic import find_magic_signature
 from ..segment import Segment
 from ..filesystem import VTOC, Dirent, Directory, Filesystem
 from ..file_type import guess_file_type
@@ -140,6 +142,15 @@ class AtariJumpmanDirectory(Directory):
 
 class AtariJumpman(AtariDos2):
     ui_name = "Atari Jumpman"
+    magic_mime = "application/x.atari8bit.atr;jumpman"
+
+    @classmethod
+    def calc_confidence(cls, media, cache):
+        if not hasattr(media, "get_contiguous_sectors") or media.sector_size != 128:
+            return detection.impossible
+        if cache.check_signature(find_magic_signature(cls.magic_mime)):
+            return detection.certain
+        return detection.possible
 
     def check_media(self, media):
         AtariDos2.check_media(self, media)
@@ -204,7 +215,7 @@ class AtariJumpmanLevelTesterDirectory(AtariJumpmanDirectory):
                 # Need index relative to media; container_offset is absolute
                 # position in source file and media is at some offset from the
                 # beginning of the container.
-                index = s.container_offset[0] - media.container_offset[0]
+                index = s.calc_container_offsets(0) - media.calc_container_offsets(0)
         if index is None:
             raise errors.FilesystemError("Not recognized as a Jumpman Level Tester image")
         return index, 0x800
@@ -212,6 +223,7 @@ class AtariJumpmanLevelTesterDirectory(AtariJumpmanDirectory):
 
 class AtariJumpmanLevelTester(AtariJumpman):
     ui_name = "Atari Jumpman Level Tester"
+    magic_mime = "application/x.atari8bit.atr;jumpman_level_tester"
 
     def calc_boot_segment(self):
         return AtariJumpmanLevelTesterBootSegment(self)
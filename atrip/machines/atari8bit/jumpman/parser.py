@@ -712,7 +712,7 @@ class ScreenState(LevelDef):
         self.screen = screen
         if screen is not None:
             self.screen_2d = screen.container.data.reshape((88, 160))
-            self.screen_style_2d = screen.container.style.reshape((88, 160))
+            self.screen_style_2d = screen.container.writable_style.reshape((88, 160))
         self.pick_buffer = pick_buffer
         if pick_buffer is not None:
             self.pick_buffer_2d = pick_buffer.reshape((88, 160))
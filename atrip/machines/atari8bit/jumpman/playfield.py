@@ -89,7 +89,7 @@ class JumpmanPlayfieldModel:
         if playfield is None:
             playfield = self.playfield
         playfield[:] = 8  # background is the 9th ANTIC color register (counting from zero)
-        playfield.style[:] = 0
+        playfield.writable_style[:] = 0
 
     def calc_level_colors(self):
         if self.valid_level:
@@ -157,8 +157,9 @@ class JumpmanPlayfieldModel:
             # change highlight to comment color for selected trigger coin so
             # you don't get confused with any objects actually selected
             old_highlight = np.where(screen.style == style_bits.selected_bit_mask)
-            screen.style[old_highlight] |= style_bits.comment_bit_mask
-            screen.style[:] &= (0xff ^ (style_bits.match_bit_mask|style_bits.selected_bit_mask))
+            style = screen.writable_style
+            style[old_highlight] |= style_bits.comment_bit_mask
+            style[:] &= (0xff ^ (style_bits.match_bit_mask|style_bits.selected_bit_mask))
 
             # replace screen state so that the only pickable objects are
             # those in the triggered layer
@@ -187,9 +188,9 @@ class JumpmanPlayfieldModel:
     def bad_image(self):
         self.set_current_screen()
         self.playfield[:] = 0
-        self.playfield.style[:] = 0
+        self.playfield.writable_style[:] = 0
         self.force_refresh = True
-        s = self.playfield.container.style.reshape((self.antic_lines, -1))
+        s = self.playfield.container.writable_style.reshape((self.antic_lines, -1))
         s[::2,::2] = style_bits.comment_bit_mask
         s[1::2,1::2] = style_bits.comment_bit_mask
         self.set_current_screen()
@@ -62,6 +62,16 @@ def check_signature(raw, sig):
     return True
 
 
+def find_magic_signature(mime):
+    """Return the signature of the magic entry with exactly the given mime
+    type
+    """
+    for entry in magic:
+        if entry['mime'] == mime:
+            return entry['signature']
+    raise KeyError(f"no magic entry for {mime}")
+
+
 def guess_detail_for_mime(mime, raw, parser):
     for entry in magic:
         if entry['mime'].startswith(mime):
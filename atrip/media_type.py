@@ -10,7 +10,7 @@ from .segment import Segment
 from .utils import to_numpy, to_numpy_list, uuid
 from . import filesystem
 from .file_type import guess_file_type
-from .signature import guess_signature_from_container
+from . import detection
 
 import logging
 log = logging.getLogger(__name__)
@@ -53,6 +53,29 @@ class Media(Segment):
     def filesystem(self):
         return self.container.filesystem
 
+    #### detection
+
+    @classmethod
+    def calc_confidence(cls, cache):
+        """Return an estimate (using the constants in `detection`) of how
+        likely the container is to hold this media type, using only the cheap
+        tests available from the `DetectionCache`. Subclasses should return
+        `detection.impossible` if the media can be ruled out; the full checks
+        in the constructor are still performed for all other candidates.
+        """
+        return detection.possible
+
+    @classmethod
+    def calc_header_length(cls, cache):
+        """Return the length of the header that `calc_header` will find, or
+        zero if there is no header.
+        """
+        return 0
+
+    @classmethod
+    def calc_payload_size(cls, cache):
+        return cache.size - cls.calc_header_length(cache)
+
     #### initialization
 
     def calc_header(self, container):
@@ -110,6 +133,24 @@ class DiskImage(Media):
         super().init_empty()
         self.num_sectors = 0
 
+        # table of the links between sectors, cached by filesystems that use
+        # one
+        self.sector_links = None
+
+    @classmethod
+    def calc_confidence(cls, cache):
+        if not cls.is_disk_size_possible(cls.calc_payload_size(cache)):
+            return detection.impossible
+        if cls.calc_header_length(cache) > 0:
+            return detection.certain
+        return detection.likely
+
+    @classmethod
+    def is_disk_size_possible(cls, size):
+        """Cheap equivalent of `check_disk_size` for use in detection
+        """
+        return size == cls.expected_size
+
     # def __str__(self):
     #     return f"{self.ui_name}, size={len(self)} ({self.num_sectors}x{self.sector_size}B)"
 
@@ -147,6 +188,23 @@ class DiskImage(Media):
         pos = (sector - self.starting_sector_label) * self.sector_size
         return pos, self.sector_size
 
+    def calc_sector_positions(self):
+        """Return arrays of the index into the media and the size of every
+        sector, in order of sector number starting from
+        `starting_sector_label`
+        """
+        sizes = np.full(self.num_sectors, self.sector_size, dtype=np.int64)
+        positions = np.arange(self.num_sectors, dtype=np.int64) * self.sector_size
+        return positions, sizes
+
+    def get_sector_tails(self, count):
+        """Return a 2D array containing a copy of the last `count` bytes of
+        every sector, in the same order as `calc_sector_positions`
+        """
+        positions, sizes = self.calc_sector_positions()
+        indexes = (positions + sizes - count)[:, np.newaxis] + np.arange(count)
+        return self[indexes]
+
     def get_contiguous_sectors_offsets(self, start, count=1):
         index, _ = self.get_index_of_sector(start)
         last, size = self.get_index_of_sector(start + count - 1)
@@ -194,6 +252,17 @@ class CartImage(Media):
 
     extra_serializable_attributes = ['cart_type']
 
+    @classmethod
+    def calc_confidence(cls, cache):
+        size = cls.calc_payload_size(cache)
+        if size % 1024 != 0:
+            return detection.impossible
+        if cls.expected_size == 0:
+            return detection.possible
+        if size != cls.expected_size:
+            return detection.impossible
+        return detection.likely
+
     def __str__(self):
         desc = f"{self.ui_name}, size={self.kb}K, {self.platform}, cart_type={self.cart_type}"
         if self.filesystem is not None:
@@ -233,13 +302,20 @@ def find_media_types():
         _media_types = _find_media_types()
     return _media_types
 
+def rank_media_types(container):
+    """Return the list of `detection.Candidate`s for the media types that
+    might match the container, best first.
+    """
+    return detection.rank_candidates(find_media_types(), container.detection)
+
 def guess_media_type(container):
-    signature = guess_signature_from_container(container)
+    signature = container.detection.signature
     if signature:
         log.info(f"found signature {signature}")
     possibilities = []
-    for m in find_media_types():
-        log.debug(f"trying media_type {m.ui_name}")
+    for candidate in rank_media_types(container):
+        m = candidate.cls
+        log.debug(f"trying media_type {candidate}")
         try:
             found = m(container, signature)
         except errors.PossibleCandidateMedia as e:
@@ -1,6 +1,7 @@
 import numpy as np
 
 from .. import errors
+from .. import detection
 from ..media_type import CartImage
 
 import logging
@@ -166,6 +167,22 @@ class Atari8bitCart(CartImage):
     ui_name = "Atari 8bit Cart"
     platform = "atari800"
 
+    @classmethod
+    def calc_confidence(cls, cache):
+        sizes = [cache.size]
+        if cache.has_magic(0, b"CART"):
+            sizes.append(cache.size - 16)
+        confidence = detection.impossible
+        for size in sizes:
+            kb, rem = divmod(size, 1024)
+            if rem > 0:
+                continue
+            if cache.signature is not None:
+                return detection.certain
+            if get_known_carts_of_size(kb):
+                confidence = detection.possible
+        return confidence
+
     def calc_header(self, container):
         header_data = container[0:16]
         try:
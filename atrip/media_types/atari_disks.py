@@ -1,6 +1,7 @@
 import numpy as np
 
 from .. import errors
+from .. import detection
 from ..media_type import DiskImage
 from ..segment import Segment
 from ..container import ContainerHeader
@@ -50,6 +51,20 @@ class AtariSingleDensity(DiskImage):
     sector_size = 128
     expected_size = 92160
 
+    @classmethod
+    def calc_confidence(cls, cache):
+        if cache.size < 16:
+            return detection.impossible
+        if cls.calc_header_length(cache) > 0:
+            sector_size = int.from_bytes(cache.get_bytes(4, 6), "little")
+            if sector_size != cls.sector_size:
+                return detection.impossible
+        return super().calc_confidence(cache)
+
+    @classmethod
+    def calc_header_length(cls, cache):
+        return 16 if cache.has_magic(0, b"\x96\x02") else 0
+
     def check_header(self, header):
         if header.sector_size != self.sector_size:
             raise errors.InvalidMediaSize(f"Sector size {header.sector_size} invalid for {self.ui_name}")
@@ -69,6 +84,17 @@ class AtariSingleDensity(DiskImage):
 class AtariSingleDensityShortImage(AtariSingleDensity):
     ui_name = "Atari SD Non-Standard Image"
 
+    @classmethod
+    def calc_confidence(cls, cache):
+        # requires an ATR header and can't look like an executable
+        if cls.calc_header_length(cache) == 0 or cache.has_magic(16, b"\xff\xff"):
+            return detection.impossible
+        return super().calc_confidence(cache)
+
+    @classmethod
+    def is_disk_size_possible(cls, size):
+        return size < cls.expected_size
+
     def check_disk_size(self):
         size = len(self)
         if size >= self.expected_size:
@@ -114,17 +140,29 @@ class AtariDoubleDensityShortBootSectors(AtariDoubleDensity):
         if not self.is_sector_valid(sector):
             raise errors.ByteNotInFile166("Sector %d out of range" % sector)
         if sector <= self.num_initial_sectors:
-            pos = self.num_initial_sectors * (sector - 1)
+            pos = self.initial_sector_size * (sector - 1)
             size = self.initial_sector_size
         else:
             pos = self.num_initial_sectors * self.initial_sector_size + (sector - 1 - self.num_initial_sectors) * self.sector_size
             size = self.sector_size
         return pos, size
 
+    def calc_sector_positions(self):
+        positions, sizes = DiskImage.calc_sector_positions(self)
+        n = self.num_initial_sectors
+        sizes[:n] = self.initial_sector_size
+        positions[:n] = np.arange(n) * self.initial_sector_size
+        positions[n:] -= n * (self.sector_size - self.initial_sector_size)
+        return positions, sizes
+
 
 class AtariDoubleDensityHardDriveImage(AtariDoubleDensity):
     ui_name = "Atari DD Hard Drive Image"
 
+    @classmethod
+    def is_disk_size_possible(cls, size):
+        return size > cls.expected_size
+
     def check_disk_size(self):
         size = len(self)
         if size <= self.expected_size:
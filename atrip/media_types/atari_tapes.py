@@ -1,6 +1,7 @@
 import numpy as np
 
 from .. import errors
+from .. import detection
 from ..media_type import DiskImage
 from ..segment import Segment
 from ..container import ContainerHeader
@@ -42,6 +43,12 @@ class CassetteChunk:
 class AtariCassetteImage(DiskImage):
     ui_name = "Atari Cassette Image (.cas)"
 
+    @classmethod
+    def calc_confidence(cls, cache):
+        if cache.size >= 8 and cache.has_magic(0, b"FUJI"):
+            return detection.certain
+        return detection.impossible
+
     def check_media_size(self):
         size = len(self)
         if size < 8:
@@ -0,0 +1,283 @@
+import numpy as np
+
+from . import utils
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class RunLengthArray:
+    """Run-length encoded storage for per-byte metadata like style and
+    disassembly type.
+
+    Almost every byte in a container shares its metadata value with its
+    neighbors, so the values are stored as a sorted list of run start
+    positions and the value of each run. Range operations (setting or
+    clearing bits, finding ranges that match some bits) operate on the runs
+    and are proportional to the number of runs instead of the number of bytes.
+
+    Most of the code (and all the viewers) still expect numpy arrays, so a
+    dense copy is created on demand through the `dense` property. Reading the
+    dense array doesn't affect the runs; code that changes it directly must
+    say which range it changed, either by getting the array through
+    `writable` or by calling `mark_modified`. The runs covering the modified
+    range are rebuilt from the dense array the next time a run-based
+    operation is performed. Run-based operations update the dense array in
+    place if it exists, so the two stay consistent.
+    """
+
+    def __init__(self, size, value=0):
+        self.size = int(size)
+        if self.size > 0:
+            self.starts = np.zeros(1, dtype=np.int64)
+            self.values = np.asarray([value], dtype=np.uint8)
+        else:
+            self.starts = np.zeros(0, dtype=np.int64)
+            self.values = np.zeros(0, dtype=np.uint8)
+        self._dense = None
+        self._modified = None
+
+    def __len__(self):
+        return self.size
+
+    def __str__(self):
+        return f"RunLengthArray size={self.size} runs={self.num_runs}"
+
+    #### creation
+
+    @classmethod
+    def from_array(cls, array):
+        """Create the runs from a numpy array. The array becomes the dense
+        representation and is not copied.
+        """
+        r = cls(0)
+        r.size = len(array)
+        r._dense = array
+        r._set_runs_from_dense()
+        return r
+
+    @classmethod
+    def from_collapsed(cls, size, ranges, value=0):
+        """Create the runs from a list of [value, start, end] entries as
+        produced by `collapsed` or `utils.collapse_values`. Any byte not
+        covered by an entry is set to `value`.
+        """
+        r = cls(size, value)
+        if not ranges:
+            return r
+        a = np.asarray(ranges, dtype=np.int64).reshape(-1, 3)
+        a = a[np.argsort(a[:, 1], kind='stable')]
+        if a[0, 1] == 0 and a[-1, 2] == size and np.array_equal(a[1:, 1], a[:-1, 2]):
+            # a complete tiling (i.e. the saved state), so use it directly
+            r.starts = a[:, 1].copy()
+            r.values = a[:, 0].astype(np.uint8)
+            r._merge()
+        else:
+            for v, start, end in a:
+                r.set_ranges([(start, end)], v)
+        return r
+
+    #### dense representation
+
+    @property
+    def is_materialized(self):
+        return self._dense is not None
+
+    @property
+    def dense(self):
+        """Dense numpy array of values, created if necessary.
+
+        This is for reading; see `writable` to change values through it.
+        """
+        if self._dense is None:
+            self._dense = self.calc_array()
+        return self._dense
+
+    def writable(self, start=0, end=None):
+        """Return the dense numpy array for a caller that is going to change
+        values in the range start:end
+        """
+        dense = self.dense
+        self.mark_modified(start, end)
+        return dense
+
+    def mark_modified(self, start=0, end=None):
+        """Note that values in the range start:end of the dense array have
+        been (or are about to be) changed outside of this object, so the runs
+        for that range must be rebuilt before they are used.
+        """
+        if self._dense is None:
+            return
+        start, end = self.clip(start, end)
+        if start >= end:
+            return
+        if self._modified is not None:
+            start = min(start, self._modified[0])
+            end = max(end, self._modified[1])
+        self._modified = (start, end)
+
+    def calc_array(self, start=0, end=None):
+        """Return a new numpy array of the values in the range start:end
+        """
+        start, end = self.clip(start, end)
+        if self.num_runs == 1 and self.values[0] == 0:
+            return utils.lazy_zeros(end - start)
+        run_starts, run_ends, values = self.get_runs(start, end)
+        return np.repeat(values, run_ends - run_starts)
+
+    def sync(self):
+        """Rebuild the runs of the range of the dense array that has been
+        marked as modified, if any.
+        """
+        if self._modified is not None:
+            self._set_runs_from_dense(*self._modified)
+
+    def _set_runs_from_dense(self, start=0, end=None):
+        a = self._dense
+        self._modified = None
+        start, end = self.clip(start, end)
+        if len(a) == 0:
+            self.starts = np.zeros(0, dtype=np.int64)
+            self.values = np.zeros(0, dtype=np.uint8)
+        elif start == 0 and end == self.size:
+            changes = np.flatnonzero(a[1:] != a[:-1]) + 1
+            self.starts = np.concatenate(([0], changes)).astype(np.int64)
+            self.values = np.asarray(a[self.starts], dtype=np.uint8)
+        else:
+            # the dense array is correct everywhere, so only the run
+            # boundaries inside the range have to be found again
+            changes = np.flatnonzero(a[start + 1:end] != a[start:end - 1]) + start + 1
+            self.starts = np.concatenate((
+                self.starts[self.starts < start], [start], changes,
+                [end] if end < self.size else [],
+                self.starts[self.starts > end])).astype(np.int64)
+            self.values = np.asarray(a[self.starts], dtype=np.uint8)
+            self._merge()
+
+    #### queries
+
+    @property
+    def num_runs(self):
+        self.sync()
+        return len(self.starts)
+
+    @property
+    def ends(self):
+        return np.append(self.starts[1:], self.size)
+
+    def clip(self, start, end):
+        if end is None or end > self.size:
+            end = self.size
+        start = max(0, min(start, end))
+        return start, end
+
+    def get_runs(self, start=0, end=None):
+        """Return arrays of run starts, run ends and values for all runs
+        overlapping the range start:end, clipped to that range.
+        """
+        self.sync()
+        start, end = self.clip(start, end)
+        if start >= end:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros(0, dtype=np.uint8)
+        i = np.searchsorted(self.starts, start, 'right') - 1
+        j = np.searchsorted(self.starts, end, 'left')
+        run_starts = self.starts[i:j].copy()
+        run_ends = self.ends[i:j]
+        run_starts[0] = start
+        run_ends[-1] = end
+        return run_starts, run_ends, self.values[i:j]
+
+    def value_at(self, index):
+        self.sync()
+        if index < 0 or index >= self.size:
+            raise IndexError(f"index {index} out of range for size {self.size}")
+        return int(self.values[np.searchsorted(self.starts, index, 'right') - 1])
+
+    def find_ranges(self, bits, start=0, end=None):
+        """Return a list of start, end pairs where all of the specified bits
+        are set.
+        """
+        run_starts, run_ends, values = self.get_runs(start, end)
+        return self._merge_selected(run_starts, run_ends, (values & bits) == bits)
+
+    def find_value_ranges(self, table, start=0, end=None):
+        """Return a list of start, end pairs where the values are flagged in
+        `table`, a 256 element boolean array indexed by value.
+        """
+        run_starts, run_ends, values = self.get_runs(start, end)
+        return self._merge_selected(run_starts, run_ends, np.asarray(table)[values])
+
+    def _merge_selected(self, run_starts, run_ends, selected):
+        selected = np.asarray(selected, dtype=bool)
+        if not np.any(selected):
+            return []
+        # runs are contiguous, so adjacent selected runs can be joined
+        edges = np.diff(np.concatenate(([False], selected, [False])).astype(np.int8))
+        first = np.flatnonzero(edges == 1)
+        last = np.flatnonzero(edges == -1) - 1
+        return list(zip(run_starts[first].tolist(), run_ends[last].tolist()))
+
+    def collapsed(self):
+        """Return the list of [value, start, end] entries in the same format
+        as `utils.collapse_values`, suitable for serialization.
+        """
+        self.sync()
+        return [list(r) for r in zip(self.values.tolist(), self.starts.tolist(), self.ends.tolist())]
+
+    #### modification
+
+    def set_ranges(self, ranges, value):
+        self._apply(ranges, lambda v: np.full_like(v, value), lambda d: d.fill(value))
+
+    def or_ranges(self, ranges, bits):
+        bits = np.uint8(bits)
+        self._apply(ranges, lambda v: v | bits, lambda d: np.bitwise_or(d, bits, out=d))
+
+    def and_ranges(self, ranges, mask):
+        mask = np.uint8(mask)
+        self._apply(ranges, lambda v: v & mask, lambda d: np.bitwise_and(d, mask, out=d))
+
+    def _apply(self, ranges, func, dense_func):
+        self.sync()
+        r = np.asarray(ranges, dtype=np.int64).reshape(-1, 2)
+        r = np.clip(np.sort(r, axis=1), 0, self.size)
+        r = r[r[:, 0] < r[:, 1]]
+        if len(r) == 0:
+            return
+        self._split(r.ravel())
+        i = np.searchsorted(self.starts, r[:, 0])
+        j = np.searchsorted(self.starts, r[:, 1])
+        count = np.zeros(len(self.starts) + 1, dtype=np.int64)
+        np.add.at(count, i, 1)
+        np.add.at(count, j, -1)
+        inside = np.cumsum(count[:-1]) > 0
+        self.values[inside] = func(self.values[inside])
+        self._merge()
+        if self._dense is not None:
+            if len(r) == 1:
+                dense_func(self._dense[r[0, 0]:r[0, 1]])
+            else:
+                lo = int(r[:, 0].min())
+                hi = int(r[:, 1].max())
+                self._dense[lo:hi] = self.calc_array(lo, hi)
+
+    def _split(self, positions):
+        """Make sure there is a run boundary at each of the positions
+        """
+        positions = positions[(positions > 0) & (positions < self.size)]
+        new_starts = np.union1d(self.starts, positions)
+        if len(new_starts) != len(self.starts):
+            self.values = self.values[np.searchsorted(self.starts, new_starts, 'right') - 1]
+            self.starts = new_starts
+
+    def _merge(self):
+        """Join adjacent runs that have the same value
+        """
+        if len(self.values) > 1:
+            keep = np.empty(len(self.values), dtype=bool)
+            keep[0] = True
+            np.not_equal(self.values[1:], self.values[:-1], out=keep[1:])
+            if not np.all(keep):
+                self.starts = self.starts[keep]
+                self.values = self.values[keep]
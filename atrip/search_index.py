@@ -0,0 +1,346 @@
+"""Persistent n-gram index for searching many disk images
+
+Scanning every byte of a large library of disk images and ROMs for each
+search is slow, so a `SearchIndex` records the set of distinct n-grams (runs
+of `gram_size` bytes, 3 or 4) in every container of every file added to it.
+A search looks up the n-grams of the exact bytes in the pattern to find the
+containers that could match, and only those are loaded and scanned to find
+the match offsets.
+
+Containers are identified by the SHA1 of their data, so identical images
+in different files (or different versions of a file) are only indexed once.
+Files are only read again when their size or modification time changes,
+and each update adds a new set of postings rather than rewriting the index.
+Changes are found by `update`; a search only checks the files that hold
+candidate containers, so its cost doesn't grow with the number of indexed
+files.
+
+The index directory contains:
+
+    index.json          the files and containers, see `SearchIndex.save`
+    keys-NNNNNN.npy     sorted n-gram keys of a set of postings
+    ids-NNNNNN.npy      container id of each key in the keys file
+
+Postings of containers that are no longer referenced by any file are
+ignored when searching and discarded by `compact`.
+"""
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from . import errors
+from .byte_pattern import compile_pattern, load_collection, search_files
+
+import logging
+log = logging.getLogger(__name__)
+
+
+index_version = 1
+
+
+def calc_gram_keys(data, gram_size):
+    """Return the sorted array of the distinct n-grams in the data, each packed
+    big-endian into a uint32
+    """
+    data = np.asarray(data, dtype=np.uint8)
+    count = len(data) - gram_size + 1
+    if count <= 0:
+        return np.zeros(0, dtype=np.uint32)
+    keys = data[0:count].astype(np.uint32)
+    for i in range(1, gram_size):
+        keys <<= 8
+        keys |= data[i:i + count]
+    return np.unique(keys)
+
+
+def iter_pathnames(paths):
+    """Generate the pathnames of all files in the list of paths, searching
+    directories recursively in sorted order
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def calc_file_stat(pathname):
+    st = os.stat(pathname)
+    return [st.st_size, st.st_mtime_ns]
+
+
+class SearchIndex:
+    """On-disk inverted index of the n-grams in a set of files.
+
+    `max_grams` limits the number of n-gram lookups used to find the
+    candidates of a search; the remaining n-grams of a long pattern add
+    little selectivity, and the scan verifies the matches anyway.
+    """
+    max_grams = 16
+
+    def __init__(self, path, gram_size=4):
+        if gram_size not in (3, 4):
+            raise ValueError("gram size must be 3 or 4")
+        self.path = path
+        self.index_path = os.path.join(path, "index.json")
+        self.gram_size = gram_size
+        self.files = {}
+        self.containers = []
+        self.postings = []
+        self.container_ids = {}
+        self._container_files = None
+        self.load()
+
+    def __str__(self):
+        return f"SearchIndex {self.path}: {len(self.files)} files, {len(self.live_ids)} containers, {len(self.postings)} postings files"
+
+    #### files
+
+    def load(self):
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path) as fh:
+            info = json.load(fh)
+        if info.get("version") != index_version:
+            raise ValueError(f"{self.index_path}: unsupported search index version")
+        self.gram_size = info["gram_size"]
+        self.files = info["files"]
+        self.containers = info["containers"]
+        self.container_ids = {sha1: i for i, (sha1, size) in enumerate(self.containers)}
+        self.postings = [self.map_postings(name) for name in info["postings"]]
+        self._container_files = None
+
+    def save(self):
+        """Write the index catalog.
+
+        `files` maps each pathname to its "stat" of [size, mtime_ns] and its
+        "containers", the list of [container name, container id];
+        `containers` is the list of [sha1, size] indexed by container id.
+
+        The catalog is written to a temporary file and renamed, so an
+        interrupted update leaves the previous catalog in place.
+        """
+        info = {
+            "version": index_version,
+            "gram_size": self.gram_size,
+            "postings": [name for name, keys, ids in self.postings],
+            "containers": self.containers,
+            "files": self.files,
+        }
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as fh:
+            json.dump(info, fh)
+        os.replace(tmp_path, self.index_path)
+
+    def map_postings(self, name):
+        keys = np.load(os.path.join(self.path, f"keys-{name}.npy"), mmap_mode="r")
+        ids = np.load(os.path.join(self.path, f"ids-{name}.npy"), mmap_mode="r")
+        return name, keys, ids
+
+    def write_postings(self, keys, ids):
+        order = np.lexsort((ids, keys))
+        number = int(self.postings[-1][0]) + 1 if self.postings else 1
+        name = "%06d" % number
+        np.save(os.path.join(self.path, f"keys-{name}.npy"), keys[order])
+        np.save(os.path.join(self.path, f"ids-{name}.npy"), ids[order])
+        self.postings.append(self.map_postings(name))
+
+    @property
+    def live_ids(self):
+        """Set of ids of the containers referenced by the indexed files"""
+        return {i for entry in self.files.values() for name, i in entry["containers"]}
+
+    @property
+    def container_files(self):
+        """Dict of container id to the list of (pathname, container name) of
+        every indexed file containing it, built on first use
+        """
+        if self._container_files is None:
+            container_files = {}
+            for pathname, entry in self.files.items():
+                for name, i in entry["containers"]:
+                    container_files.setdefault(i, []).append((pathname, name))
+            self._container_files = container_files
+        return self._container_files
+
+    #### updating
+
+    def scan_file(self, pathname):
+        """Return the list of (container name, sha1, size, n-gram keys) for
+        each container in the file, where the keys are None if the container
+        is already in the index
+        """
+        collection = load_collection(pathname)
+        found = []
+        for container in collection.containers:
+            sha1 = container.sha1.hex()
+            if sha1 in self.container_ids:
+                keys = None
+            else:
+                keys = calc_gram_keys(container._data, self.gram_size)
+            found.append((container.name, sha1, len(container), keys))
+        return found
+
+    def update(self, paths, max_workers=None):
+        """Add new and changed files in the paths to the index, and remove the
+        indexed files that no longer exist.
+
+        Returns the number of files that were read.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        for pathname in [p for p in self.files if not os.path.exists(p)]:
+            del self.files[pathname]
+        changed = []
+        for pathname in iter_pathnames(paths):
+            pathname = os.path.abspath(pathname)
+            try:
+                stat = calc_file_stat(pathname)
+            except OSError as e:
+                log.warning(f"{pathname}: {e}")
+                continue
+            entry = self.files.get(pathname)
+            if entry is None or entry["stat"] != stat:
+                changed.append((pathname, stat))
+
+        def scan(item):
+            pathname, stat = item
+            try:
+                return self.scan_file(pathname)
+            except (IOError, errors.AtrError) as e:
+                log.info(f"{pathname}: not indexed: {e}")
+                return []
+
+        if max_workers == 1 or len(changed) < 2:
+            results = [scan(item) for item in changed]
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                results = list(pool.map(scan, changed))
+
+        new_keys = []
+        new_ids = []
+        for (pathname, stat), found in zip(changed, results):
+            entry = []
+            for name, sha1, size, keys in found:
+                try:
+                    i = self.container_ids[sha1]
+                except KeyError:
+                    i = len(self.containers)
+                    self.containers.append([sha1, size])
+                    self.container_ids[sha1] = i
+                    new_keys.append(keys)
+                    new_ids.append(np.full(len(keys), i, dtype=np.uint32))
+                entry.append([name, i])
+            self.files[pathname] = {"stat": stat, "containers": entry}
+        self._container_files = None
+        if new_keys:
+            self.write_postings(np.concatenate(new_keys), np.concatenate(new_ids))
+        self.save()
+        log.debug(f"update: read {len(changed)} files; {self}")
+        return len(changed)
+
+    def compact(self):
+        """Merge all the postings into one file, dropping the containers that
+        are no longer referenced by any file
+        """
+        old = list(self.postings)
+        if not old:
+            return
+        live = np.zeros(len(self.containers), dtype=bool)
+        live[list(self.live_ids)] = True
+        keys = np.concatenate([k for name, k, i in old])
+        ids = np.concatenate([i for name, k, i in old])
+        mask = live[ids]
+        self.write_postings(keys[mask], ids[mask])
+        self.postings = self.postings[-1:]
+        self.save()
+        for name, k, i in old:
+            os.remove(os.path.join(self.path, f"keys-{name}.npy"))
+            os.remove(os.path.join(self.path, f"ids-{name}.npy"))
+
+    #### searching
+
+    def calc_pattern_keys(self, pattern):
+        """Return the n-gram keys of the exact parts of the pattern, longest
+        runs first
+        """
+        runs = sorted((data for start, data in pattern.iter_exact_runs()), key=len, reverse=True)
+        keys = []
+        for data in runs:
+            keys.extend(k for k in calc_gram_keys(np.frombuffer(data, dtype=np.uint8), self.gram_size).tolist() if k not in keys)
+        return keys[:self.max_grams]
+
+    def find_container_ids(self, key):
+        found = []
+        for name, keys, ids in self.postings:
+            lo = np.searchsorted(keys, key, side="left")
+            hi = np.searchsorted(keys, key, side="right")
+            found.append(ids[lo:hi])
+        if not found:
+            return np.zeros(0, dtype=np.uint32)
+        return np.concatenate(found)
+
+    def find_candidates(self, pattern):
+        """Return the set of ids of the containers that may contain the
+        pattern, or None if the pattern doesn't have enough exact bytes to
+        use the index
+        """
+        keys = self.calc_pattern_keys(compile_pattern(pattern))
+        if not keys:
+            return None
+        candidates = None
+        for key in keys:
+            ids = self.find_container_ids(key)
+            if candidates is None:
+                candidates = ids
+            else:
+                candidates = np.intersect1d(candidates, ids)
+            if len(candidates) == 0:
+                break
+        return set(candidates.tolist())
+
+    def find_candidate_files(self, pattern, check_changes=False):
+        """Return the dict of pathname to the set of names of the containers in
+        that file that need to be scanned for the pattern.
+
+        Only the files holding candidate containers are looked at. If any of
+        them have changed since they were indexed, they are included with None
+        in place of the set of names, so all their containers are scanned.
+        Changes to other files are found by `update`, or if `check_changes` is
+        True, by checking every indexed file.
+        """
+        candidates = self.find_candidates(pattern)
+        files = {}
+        if candidates is None:
+            for pathname, entry in self.files.items():
+                files[pathname] = {name for name, i in entry["containers"]}
+        else:
+            container_files = self.container_files
+            for i in candidates:
+                for pathname, name in container_files.get(i, []):
+                    files.setdefault(pathname, set()).add(name)
+        for pathname in list(self.files if check_changes else files):
+            try:
+                stat = calc_file_stat(pathname)
+            except OSError:
+                files.pop(pathname, None)
+                continue
+            if stat != self.files[pathname]["stat"]:
+                log.warning(f"{pathname}: changed since indexed; scanning the whole file")
+                files[pathname] = None
+        return files
+
+    def search(self, pattern, max_workers=None, check_changes=False):
+        """Find the pattern in the indexed files.
+
+        The candidate containers are loaded and scanned to find the matches,
+        so the results are exact. Returns the list of (pathname, container,
+        ranges) for each container with at least one match. See
+        `find_candidate_files` for `check_changes`.
+        """
+        files = self.find_candidate_files(pattern, check_changes)
+        return search_files(pattern, sorted(files), max_workers, files)
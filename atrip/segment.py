@@ -74,7 +74,7 @@ class Segment:
         if hasattr(container_or_segment, 'container_offset'):
             log.debug(f"creating {name},  {len(offset_list)} bytes from {container_or_segment}")
             # log.debug(f"  offset_list = {offset_list}")
-            offset_list = container_or_segment.container_offset[offset_list]
+            offset_list = container_or_segment.calc_container_offsets(offset_list)
             container_or_segment = container_or_segment.container
 
         self.container = container_or_segment
@@ -95,21 +95,95 @@ class Segment:
         self.verbose_name = ""
         self.uuid = utils.uuid()
         self._reverse_offset = None
+        self._offset_range = None
+        self._container_offset = None
         self.segments = []
 
     #### properties
 
+    @property
+    def container_offset(self):
+        """Array of indexes into the container, one for each byte in the
+        segment.
+
+        Segments whose offsets are contiguous or have a constant stride only
+        store the (start, stop, step) range, so for those this array is only
+        created on demand.
+        """
+        if self._container_offset is None:
+            self._container_offset = utils.range_to_array(self._offset_range)
+        return self._container_offset
+
+    @container_offset.setter
+    def container_offset(self, offsets):
+        r = utils.offsets_to_range(offsets)
+        self._offset_range = r
+        if r is None:
+            self._container_offset = utils.to_numpy_list(offsets)
+        else:
+            self._container_offset = None
+        self._reverse_offset = None
+
+    @property
+    def is_strided(self):
+        """True if the offsets into the container can be represented as a
+        slice, meaning data, style and disasm_type are numpy views.
+        """
+        return self._offset_range is not None
+
+    @property
+    def container_indexer(self):
+        """Object that can be used directly to index the container's arrays:
+        a slice for strided segments or the index array otherwise.
+        """
+        r = self._offset_range
+        if r is None:
+            return self._container_offset
+        return slice(r.start, r.stop, r.step)
+
+    def wrap_array(self, np_data):
+        r = self._offset_range
+        if r is None:
+            return ArrayWrapper(np_data, self._container_offset)
+        return np_data[r.start:r.stop:r.step]
+
     @property
     def data(self):
-        return ArrayWrapper(self.container._data, self.container_offset)
+        return self.wrap_array(self.container._data)
 
     @property
     def style(self):
-        return ArrayWrapper(self.container._style, self.container_offset)
+        return self.wrap_array(self.container.style)
 
     @property
     def disasm_type(self):
-        return ArrayWrapper(self.container._disasm_type, self.container_offset)
+        return self.wrap_array(self.container.disasm_type)
+
+    @property
+    def container_extent(self):
+        """Start and end of the range of the container that holds all the
+        bytes of the segment
+        """
+        r = self._offset_range
+        if r is None:
+            offsets = self._container_offset
+            if len(offsets) == 0:
+                return 0, 0
+            return int(offsets.min()), int(offsets.max()) + 1
+        if len(r) == 0:
+            return 0, 0
+        return min(r[0], r[-1]), max(r[0], r[-1]) + 1
+
+    @property
+    def writable_style(self):
+        """Style array for code that changes it directly; see
+        `RunLengthArray.writable`
+        """
+        return self.wrap_array(self.container.style_runs.writable(*self.container_extent))
+
+    @property
+    def writable_disasm_type(self):
+        return self.wrap_array(self.container.disasm_type_runs.writable(*self.container_extent))
 
     @property
     def reverse_offset(self):
@@ -118,7 +192,9 @@ class Segment:
         return self._reverse_offset
 
     def __len__(self):
-        return len(self.container_offset)
+        if self._offset_range is not None:
+            return len(self._offset_range)
+        return len(self._container_offset)
 
     #### dunder methods and convenience functions to operate on data (not style)
 
@@ -133,17 +209,24 @@ class Segment:
         return s
 
     def __and__(self, other):
-        return self.container._data[self.container_offset] & other
+        return self.container._data[self.container_indexer] & other
 
     def __iand__(self, other):
-        self.container._data[self.container_offset] &= other
+        self.container._data[self.container_indexer] &= other
         return self
 
     def __getitem__(self, index):
-        return self.container._data[self.container_offset[index]]
+        r = self._offset_range
+        if r is None:
+            return self.container._data[self._container_offset[index]]
+        return self.container._data[r.start:r.stop:r.step][index]
 
     def __setitem__(self, index, value):
-        self.container._data[self.container_offset[index]] = value
+        r = self._offset_range
+        if r is None:
+            self.container._data[self._container_offset[index]] = value
+        else:
+            self.container._data[r.start:r.stop:r.step][index] = value
 
     #### iterator utilities
 
@@ -230,28 +313,80 @@ class Segment:
         try:
             start_offset = int(offset_or_offset_list)
         except TypeError:
-            offset_list = utils.to_numpy_list(offset_or_offset_list)
+            if isinstance(offset_or_offset_list, range):
+                offset_list = offset_or_offset_list
+            else:
+                offset_list = utils.to_numpy_list(offset_or_offset_list)
         else:
             if length is None:
                 length = len(container_or_segment)
-            offset_list = np.arange(offset_or_offset_list, offset_or_offset_list + length, dtype=np.uint32)
+            offset_list = range(start_offset, start_offset + length)
         return offset_list
 
     def enforce_offset_bounds(self, offset_list):
-        return offset_list[offset_list < len(self.container)]
+        size = len(self.container)
+        if isinstance(offset_list, range):
+            return range(offset_list.start, min(offset_list.stop, size), offset_list.step)
+        return offset_list[offset_list < size]
+
+    def calc_container_offsets(self, indexes):
+        """Convert segment indexes into offsets into the container.
+
+        `indexes` may be an integer, a slice, a `range` or an index array.
+        Slices and ranges in a strided segment produce a `range` so that
+        sub-segments can remain strided without ever creating an index array.
+        """
+        r = self._offset_range
+        if r is None:
+            if isinstance(indexes, range):
+                indexes = utils.range_to_array(indexes)
+            return self._container_offset[indexes]
+        if isinstance(indexes, range):
+            if indexes.step < 0:
+                return utils.range_to_array(r)[utils.range_to_array(indexes)]
+            return r[indexes.start:indexes.stop:indexes.step]
+        if isinstance(indexes, slice):
+            return r[indexes]
+        if isinstance(indexes, (list, tuple, np.ndarray)):
+            indexes = np.asarray(indexes, dtype=np.int64)
+            num = len(r)
+            if indexes.size > 0 and (indexes.max() >= num or indexes.min() < -num):
+                raise IndexError(f"index out of bounds for segment of length {num}")
+            indexes = np.where(indexes < 0, indexes + num, indexes)
+            return (r.start + indexes * r.step).astype(np.uint32)
+        return r[int(indexes)]
 
     def calc_reverse_offsets(self):
         # Initialize array to out of range
         r = np.zeros(len(self.container), dtype=np.int32) - 1
-        r[self.container_offset] = np.arange(len(self), dtype=np.int32)
+        r[self.container_indexer] = np.arange(len(self), dtype=np.int32)
         valid = np.where(r >= 0)[0]
         if len(valid) != len(self):
             raise errors.InvalidSegmentOrder
         return r
 
+    def calc_reverse_index(self, container_indexes):
+        """Convert container indexes into indexes in this segment; -1 is
+        returned for any container index not included in the segment.
+        """
+        r = self._offset_range
+        if r is None:
+            return self.reverse_offset[container_indexes]
+        c = np.asarray(container_indexes, dtype=np.int64)
+        delta = c - r.start
+        index = delta // r.step
+        valid = (delta >= 0) & (delta % r.step == 0) & (index < len(r))
+        index = np.where(valid, index, -1).astype(np.int32)
+        if index.ndim == 0:
+            return int(index)
+        return index
+
     def calc_offsets_of_range(self, start, end):
-        in_here = np.arange(start, end, dtype=np.int32)
-        in_container = self.container_offset[in_here]
+        in_container = self.calc_container_offsets(range(start, end))
+        if isinstance(in_container, range):
+            if len(in_container) < end - start:
+                raise IndexError(f"range {start}-{end} out of bounds for segment of length {len(self)}")
+            in_container = utils.range_to_array(in_container)
         return in_container
 
     def calc_index_from_other_segment(self, other_segment_index, other_segment):
@@ -259,8 +394,8 @@ class Segment:
         and then looking up the index that corresponds to that container index
         in this segment.
         """
-        container_index = other_segment.container_offset[other_segment_index]
-        index = self.reverse_offset[container_index]
+        container_index = other_segment.calc_container_offsets(other_segment_index)
+        index = self.calc_reverse_index(container_index)
         return index
 
     def calc_indexes_from_other_segment(self, other_segment_indexes, other_segment):
@@ -268,8 +403,10 @@ class Segment:
         container and then looking up each index that corresponds to that
         container index in this segment.
         """
-        container_indexes = other_segment.container_offset[other_segment_indexes]
-        indexes = self.reverse_offset[container_indexes]
+        container_indexes = other_segment.calc_container_offsets(other_segment_indexes)
+        if isinstance(container_indexes, range):
+            container_indexes = utils.range_to_array(container_indexes)
+        indexes = self.calc_reverse_index(container_indexes)
         return indexes
 
     #### creation
@@ -312,7 +449,16 @@ class Segment:
         for key in self.base_serializable_attributes + self.extra_serializable_attributes + self.dependent_file_attributes:
             key, value = get_value(key)
             state[key] = value
-        state['container_offset'] = utils.collapse_to_ranges(self.container_offset, compact=True)
+        r = self._offset_range
+        if r is not None and r.step == 1:
+            if len(r) == 1:
+                state['container_offset'] = [r.start]
+            elif len(r) > 1:
+                state['container_offset'] = [[r.start, r.stop]]
+            else:
+                state['container_offset'] = []
+        else:
+            state['container_offset'] = utils.collapse_to_ranges(self.container_offset, compact=True)
         state['segments'] = self.segments
         return state
 
@@ -327,8 +473,8 @@ class Segment:
         self.init_empty()
         size = state.pop('__size__')
         raw = np.arange(size, dtype=np.uint32)
+        utils.restore_from_ranges(raw, state.pop('container_offset', []))
         self.container_offset = raw
-        utils.restore_from_ranges(self.container_offset, state.pop('container_offset', []))
         self.segments = state.pop('segments')
 
         # Can't restore here because it would result in many unrelated copies
@@ -389,9 +535,20 @@ class Segment:
         return i >= 0 and i < len(self)
 
     def tobytes(self):
-        return self.container._data[self.container_offset].tobytes()
+        return self.container._data[self.container_indexer].tobytes()
 
     def calc_source_indexes_from_ranges(self, ranges):
+        if self._offset_range is not None:
+            # strided segments map ranges directly without having to scan a
+            # mask the size of the whole container
+            pieces = []
+            for start, end in ranges:
+                if end < start:
+                    start, end = end, start
+                pieces.append(utils.range_to_array(self.calc_container_offsets(slice(start, end))))
+            if not pieces:
+                return np.zeros(0, dtype=np.uint32)
+            return np.unique(np.concatenate(pieces))
         source_indexes = np.zeros(len(self.container), dtype=np.uint8)
         offsets = self.container_offset
         for start, end in ranges:
@@ -401,20 +558,47 @@ class Segment:
         affected_source_indexes = np.where(source_indexes > 0)[0]
         return affected_source_indexes
 
+    def calc_container_ranges(self, ranges):
+        """Convert start, end pairs in this segment to start, end pairs in the
+        container.
+
+        Only possible for segments that map to a single contiguous block of the
+        container; returns None for all others.
+        """
+        r = self._offset_range
+        if r is None or r.step != 1:
+            return None
+        size = len(r)
+        container_ranges = np.asarray(ranges, dtype=np.int64).reshape(-1, 2)
+        container_ranges = np.clip(np.sort(container_ranges, axis=1), 0, size)
+        return container_ranges + r.start
+
     def set_style_ranges(self, ranges, **kwargs):
-        indexes = self.calc_source_indexes_from_ranges(ranges)
-        self.container.set_style_at_indexes(indexes, **kwargs)
+        container_ranges = self.calc_container_ranges(ranges)
+        if container_ranges is not None:
+            self.container.set_style_at_ranges(container_ranges, **kwargs)
+        else:
+            indexes = self.calc_source_indexes_from_ranges(ranges)
+            self.container.set_style_at_indexes(indexes, **kwargs)
 
     def clear_style_ranges(self, ranges, **kwargs):
-        indexes = self.calc_source_indexes_from_ranges(ranges)
-        self.container.clear_style_at_indexes(indexes, **kwargs)
+        container_ranges = self.calc_container_ranges(ranges)
+        if container_ranges is not None:
+            self.container.clear_style_at_ranges(container_ranges, **kwargs)
+        else:
+            indexes = self.calc_source_indexes_from_ranges(ranges)
+            self.container.clear_style_at_indexes(indexes, **kwargs)
 
     def clear_style_bits(self, **kwargs):
-        self.container.clear_style_at_indexes(self.container_offset, **kwargs)
+        self.container.clear_style_at_indexes(self.container_indexer, **kwargs)
 
     def get_style_ranges(self, **kwargs):
         """Return a list of start, end pairs that match the specified style
         """
+        r = self._offset_range
+        if r is not None and r.step == 1:
+            ranges = self.container.get_style_ranges(r.start, r.stop, **kwargs)
+            return [(start - r.start, end - r.start) for start, end in ranges]
         bits = style_bits.get_style_bits(**kwargs)
         matches = (self.style & bits) == bits
         return utils.bool_to_ranges(matches)
@@ -429,7 +613,7 @@ class Segment:
 
     def convert_style(self, from_style, to_style):
         indexes = self.get_style_indexes(**from_style)
-        indexes = self.container_offset[indexes]
+        indexes = self.calc_container_offsets(indexes)
         c = self.container
         c.clear_style_at_indexes(indexes, **from_style)
 
@@ -444,8 +628,65 @@ class Segment:
         self.container.update_data_style_from_disasm_type()
 
     def set_disasm_ranges(self, ranges, value):
-        indexes = self.calc_source_indexes_from_ranges(ranges)
-        self.container.disasm_type[indexes] = value
+        container_ranges = self.calc_container_ranges(ranges)
+        if container_ranges is None:
+            indexes = self.calc_source_indexes_from_ranges(ranges)
+            container_ranges = utils.indexes_to_ranges(indexes)
+        self.container.set_disasm_type_at_ranges(container_ranges, value)
+
+    def calc_disasm_chunks(self, default_disasm_type, split_comments):
+        """Find the blocks of bytes that should be disassembled with the same
+        disassembler type.
+
+        A new block starts wherever the disassembler type changes, and also at
+        each commented byte if the disassembler type is listed in
+        `split_comments`. Disassembler types above 127 are replaced by
+        `default_disasm_type`.
+
+        Returns a tuple of numpy arrays: the starting index of each block in
+        this segment and its disassembler type.
+
+        For contiguous segments this is computed from the run-length encoded
+        metadata in the container, so it is proportional to the number of runs
+        and comments rather than the size of the segment.
+        """
+        size = len(self)
+        if size == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint8)
+        split = np.zeros(256, dtype=bool)
+        split[list(split_comments)] = True
+        type_map = np.arange(256, dtype=np.uint8)
+        type_map[128:] = default_disasm_type
+
+        r = self._offset_range
+        if r is not None and r.step == 1:
+            c = self.container
+            run_starts, _, values = c.disasm_type_runs.get_runs(r.start, r.stop)
+            run_starts = run_starts - r.start
+            values = type_map[values]
+            comment_ranges = c.style_runs.find_ranges(style_bits.comment_bit_mask, r.start, r.stop)
+            if comment_ranges:
+                comments = np.concatenate([np.arange(start, end) for start, end in comment_ranges]) - r.start
+            else:
+                comments = np.zeros(0, dtype=np.int64)
+        else:
+            values = type_map[np.asarray(self.disasm_type[:], dtype=np.uint8)]
+            comments = np.flatnonzero(self.style[:] & style_bits.comment_bit_mask)
+            run_starts = np.flatnonzero(np.concatenate(([True], values[1:] != values[:-1])))
+            values = values[run_starts]
+
+        # disassembler type of the run that contains each comment
+        comment_types = values[np.searchsorted(run_starts, comments, 'right') - 1]
+        comments = comments[split[comment_types]]
+        starts = np.union1d(run_starts, comments)
+        types = values[np.searchsorted(run_starts, starts, 'right') - 1]
+
+        # join neighboring runs that had different raw values but map to the
+        # same disassembler type, unless split by a comment
+        keep = np.ones(len(starts), dtype=bool)
+        keep[1:] = types[1:] != types[:-1]
+        keep[np.isin(starts, comments)] = True
+        return starts[keep], types[keep]
 
     #### comment convenience functions
 
@@ -488,7 +729,7 @@ class Segment:
     def set_comments_at_indexes(self, ranges, indexes, comments):
         c = self.container
         for where_index, comment in zip(indexes, comments):
-            rawindex = self.container_offset[where_index]
+            rawindex = self.calc_container_offsets(where_index)
             if comment:
                 log.debug("  restoring comment: rawindex=%d, '%s'" % (rawindex, comment))
                 c.comments[rawindex] = comment
@@ -507,7 +748,7 @@ class Segment:
         has_comments = np.where(s & style_bits.comment_bit_mask > 0)[0]
         comments = []
         for where_index in has_comments:
-            raw = self.container_offset[indexes[where_index]]
+            raw = self.calc_container_offsets(indexes[where_index])
             try:
                 comment = self.container.comments[raw]
             except KeyError:
@@ -525,7 +766,7 @@ class Segment:
             styles = self.style[start:end].copy()
             items = {}
             for i in range(start, end):
-                rawindex = self.container_offset[i]
+                rawindex = self.calc_container_offsets(i)
                 try:
                     comment = self.container.comments[rawindex]
                     log.debug("  index: %d rawindex=%d '%s'" % (i, rawindex, comment))
@@ -542,7 +783,7 @@ class Segment:
         """
         for start, end, styles, items in restore_data:
             log.debug("range: %d-%d" % (start, end))
-            self.style[start:end] = styles
+            self.writable_style[start:end] = styles
             for i in range(start, end):
                 rawindex, comment = items[i]
                 if comment:
@@ -573,26 +814,26 @@ class Segment:
         return comments
 
     def set_comment_at(self, index, text):
-        rawindex = self.container_offset[index]
+        rawindex = self.calc_container_offsets(index)
         c = self.container
         c.comments[rawindex] = text
-        c.style[rawindex] |= style_bits.comment_bit_mask
+        c.set_style_at_ranges([(rawindex, rawindex + 1)], comment=True)
 
     def set_comment_ranges(self, ranges, text):
         for start, end in ranges:
             self.set_comment_at(start, text)
 
     def get_comment_at(self, index):
-        rawindex = self.container_offset[index]
+        rawindex = self.calc_container_offsets(index)
         return self.container.comments.get(rawindex, "")
 
     def remove_comment_at(self, index):
-        rawindex = self.container_offset[index]
+        rawindex = self.calc_container_offsets(index)
         self.container.clear_comments([rawindex])
 
     def get_first_comment(self, ranges):
         start = reduce(min, [r[0] for r in ranges])
-        rawindex = self.container_offset[start]
+        rawindex = self.calc_container_offsets(start)
         return self.container.comments.get(rawindex, "")
 
     def clear_comment_ranges(self, ranges):
@@ -605,7 +846,7 @@ class Segment:
         s = self.style[:]
         has_comments = np.where(s & style_bits.comment_bit_mask > 0)[0]
         for index in has_comments:
-            rawindex = self.container_offset[index]
+            rawindex = self.calc_container_offsets(index)
             yield index, self.container.comments.get(rawindex, "")
 
     def get_ui_name_at_index(self, index, lower_case=True):
@@ -618,7 +859,8 @@ class Segment:
         self.clear_style_bits(diff=True)
         diff = self.rawdata.data != other_segment.rawdata.data
         d = diff * np.uint8(style_bits.diff_bit_mask)
-        self.style |= (diff * np.uint8(style_bits.diff_bit_mask))
+        style = self.writable_style
+        style |= d
         log.debug("compare_segment: # entries %d, # diffs: %d" % (len(diff), len(np.where(diff == True)[0])))
 
     def calc_selected_index_metadata(self, indexes):
@@ -1,3 +1,39 @@
+"""SHA1 signature database
+
+Known ROM images are identified by the SHA1 hash of their contents. The
+signatures are maintained as python dicts in the modules registered under the
+'atrip.signatures' entry point, but importing those (very large) literals
+just to look up a single hash is slow, so at build time they are compiled
+into a binary index file, `atrip/signatures/sha1_index.bin`. The index is
+memory mapped and a lookup is a probe into a hash bucket table followed by
+a comparison of the (usually one) record in that bucket; no python
+signature modules are imported.
+
+Index file layout, all integers little endian:
+
+    header: magic (8 bytes), version, count, bucket_bits, num_mimes,
+            strings_size (uint32 each)
+    buckets: (2**bucket_bits + 1) uint32 record indexes; the records for
+             bucket b are in buckets[b]:buckets[b + 1]
+    mimes: num_mimes records of (offset, length) into the string table
+    records: count records of (sha1, mime index, name length, name offset),
+             sorted by sha1
+    strings: utf-8 encoded names and mime types
+
+The bucket is the high bits of the sha1, which are uniformly distributed, so
+the number of buckets is chosen to be at least the number of records.
+
+External databases (DAT files in clrmamepro or Logiqx XML format, as used by
+No-Intro and others, or index files created with `write_index`) can be added
+at runtime with `add_signature_database`. They are only parsed the first time
+a lookup isn't found in the built-in index.
+"""
+import os
+import re
+import pkgutil
+import importlib
+import xml.etree.ElementTree as ET
+
 import pkg_resources
 
 import numpy as np
@@ -6,11 +42,76 @@ import logging
 log = logging.getLogger(__name__)
 
 
+index_magic = b"ATRIPSIG"
+
+index_version = 1
+
+index_header_dtype = np.dtype([
+    ("magic", "S8"),
+    ("version", "<u4"),
+    ("count", "<u4"),
+    ("bucket_bits", "<u4"),
+    ("num_mimes", "<u4"),
+    ("strings_size", "<u4"),
+])
+
+index_mime_dtype = np.dtype([
+    ("offset", "<u4"),
+    ("length", "<u4"),
+])
+
+index_record_dtype = np.dtype([
+    ("sha1", "V20"),
+    ("mime", "<u2"),
+    ("name_length", "<u2"),
+    ("name_offset", "<u4"),
+])
+
+builtin_index_pathname = os.path.join(os.path.dirname(__file__), "signatures", "sha1_index.bin")
+
+
+class Signature:
+    def __init__(self, mime, name):
+        self.mime = mime
+        self.name = name
+
+    def __str__(self):
+        return f"{self.mime}: {self.name}"
+
+
+#### signature modules
+
+def iter_module_signatures(modules):
+    """Generate (sha1, mime, name) tuples from all the `sha1_signatures`
+    dicts in the list of modules
+    """
+    for mod in modules:
+        for mime, sigs in mod.sha1_signatures.items():
+            for sha_hash, name in sigs.items():
+                yield sha_hash, mime, name
+
+
+def builtin_module_names():
+    from . import signatures
+    return sorted(f"{signatures.__name__}.{m.name}" for m in pkgutil.iter_modules(signatures.__path__))
+
+
+def builtin_signature_modules():
+    mods = [importlib.import_module(name) for name in builtin_module_names()]
+    return [mod for mod in mods if hasattr(mod, "sha1_signatures")]
+
+
 _signatures = None
 
 def _find_signatures():
+    """Import signature modules from entry points, skipping the ones built in
+    to atrip because those are in the compiled index.
+    """
+    builtin = set(builtin_module_names())
     signatures = []
     for entry_point in pkg_resources.iter_entry_points('atrip.signatures'):
+        if entry_point.module_name in builtin:
+            continue
         mod = entry_point.load()
         log.debug(f"find_signatures: Found module {entry_point.name}={mod.__name__}")
         if hasattr(mod, "sha1_signatures"):
@@ -25,31 +126,281 @@ def find_signatures():
     return _signatures
 
 
-class Signature:
-    def __init__(self, mime, name):
-        self.mime = mime
-        self.name = name
+#### binary index
+
+def calc_index_bytes(entries):
+    """Create the binary index from an iterable of (sha1, mime, name) tuples.
+
+    If a hash appears more than once, the first entry is used.
+    """
+    unique = {}
+    mimes = {}
+    for sha_hash, mime, name in entries:
+        if len(sha_hash) != 20:
+            raise ValueError(f"invalid sha1 hash {sha_hash!r} for {name}")
+        if sha_hash not in unique:
+            unique[sha_hash] = (mimes.setdefault(mime, len(mimes)), name)
+    count = len(unique)
+    bucket_bits = max(4, int(count - 1).bit_length()) if count > 0 else 4
+    strings = bytearray()
+
+    mime_table = np.zeros(len(mimes), dtype=index_mime_dtype)
+    for mime, i in mimes.items():
+        encoded = mime.encode("utf-8")
+        mime_table[i] = (len(strings), len(encoded))
+        strings.extend(encoded)
+
+    records = np.zeros(count, dtype=index_record_dtype)
+    keys = sorted(unique.keys())
+    for i, sha_hash in enumerate(keys):
+        mime_index, name = unique[sha_hash]
+        encoded = name.encode("utf-8")[:0xffff]
+        records[i] = (sha_hash, mime_index, len(encoded), len(strings))
+        strings.extend(encoded)
+
+    # bucket boundaries from the high bits of the sorted hashes
+    high = np.asarray([int.from_bytes(h[0:4], "big") >> (32 - bucket_bits) for h in keys], dtype=np.int64)
+    buckets = np.searchsorted(high, np.arange((1 << bucket_bits) + 1)).astype("<u4")
+
+    header = np.zeros(1, dtype=index_header_dtype)
+    header[0] = (index_magic, index_version, count, bucket_bits, len(mimes), len(strings))
+    return b"".join([header.tobytes(), buckets.tobytes(), mime_table.tobytes(), records.tobytes(), bytes(strings)])
+
+
+def write_index(entries, pathname):
+    """Write a binary index file for the (sha1, mime, name) tuples
+    """
+    data = calc_index_bytes(entries)
+    with open(pathname, "wb") as fh:
+        fh.write(data)
+    log.debug(f"write_index: wrote {len(data)} bytes to {pathname}")
+
+
+def write_builtin_index(pathname=None):
+    """Compile the signature modules in atrip.signatures into the index file
+    that is shipped with atrip. Called from setup.py.
+    """
+    if pathname is None:
+        pathname = builtin_index_pathname
+    write_index(iter_module_signatures(builtin_signature_modules()), pathname)
+
+
+def is_index_file(pathname):
+    with open(pathname, "rb") as fh:
+        return fh.read(len(index_magic)) == index_magic
+
+
+class SignatureIndex:
+    """Lookup table backed by a binary index, either memory mapped from a
+    file or from a bytes object.
+    """
+    def __init__(self, source):
+        if isinstance(source, str):
+            raw = np.memmap(source, dtype=np.uint8, mode="r")
+            self.pathname = source
+        else:
+            raw = np.frombuffer(source, dtype=np.uint8)
+            self.pathname = None
+        if len(raw) < index_header_dtype.itemsize:
+            raise ValueError("signature index too small")
+        header = raw[0:index_header_dtype.itemsize].view(index_header_dtype)[0]
+        if header["magic"] != index_magic or header["version"] != index_version:
+            raise ValueError("not a signature index or unsupported version")
+        self.count = int(header["count"])
+        self.bucket_bits = int(header["bucket_bits"])
+        offset = index_header_dtype.itemsize
+        num_buckets = (1 << self.bucket_bits) + 1
+        self.buckets = raw[offset:offset + 4 * num_buckets].view("<u4")
+        offset += 4 * num_buckets
+        num_mimes = int(header["num_mimes"])
+        mime_table = raw[offset:offset + num_mimes * index_mime_dtype.itemsize].view(index_mime_dtype)
+        offset += num_mimes * index_mime_dtype.itemsize
+        self.records = raw[offset:offset + self.count * index_record_dtype.itemsize].view(index_record_dtype)
+        offset += self.count * index_record_dtype.itemsize
+        self.strings = raw[offset:offset + int(header["strings_size"])]
+        self.mimes = [self.get_string(m["offset"], m["length"]) for m in mime_table]
+
+    def __len__(self):
+        return self.count
 
     def __str__(self):
-        return f"{self.mime}: {self.name}"
+        return f"SignatureIndex {self.pathname or '(memory)'}: {self.count} signatures"
+
+    def get_string(self, offset, length):
+        offset = int(offset)
+        return self.strings[offset:offset + int(length)].tobytes().decode("utf-8")
+
+    def lookup(self, sha_hash):
+        """Return the Signature matching the 20 byte sha1 digest, or None
+        """
+        bucket = int.from_bytes(sha_hash[0:4], "big") >> (32 - self.bucket_bits)
+        for i in range(self.buckets[bucket], self.buckets[bucket + 1]):
+            r = self.records[i]
+            if r["sha1"].tobytes() == sha_hash:
+                return Signature(self.mimes[r["mime"]], self.get_string(r["name_offset"], r["name_length"]))
+        return None
+
+
+#### external databases
+
+# DAT files identify the system by name in the header; map those to mime types
+dat_system_mime = [
+    ("atari - 2600", "application/x.atari2600.cart"),
+    ("atari - 5200", "application/x.atari5200.cart"),
+    ("atari - 8-bit", "application/x.atari8bit.cart"),
+    ("gce - vectrex", "application/x.vectrex"),
+]
+
+def guess_dat_mime(system_name, default="application/x.rom"):
+    system_name = system_name.lower()
+    for prefix, mime in dat_system_mime:
+        if system_name.startswith(prefix):
+            return mime
+    return default
+
+
+def iter_logiqx_entries(pathname):
+    """Generate (sha1, system name, name) tuples from a Logiqx XML DAT file
+    """
+    system_name = ""
+    for event, elem in ET.iterparse(pathname):
+        if elem.tag == "header":
+            system_name = elem.findtext("name", "")
+        elif elem.tag in ("game", "machine"):
+            name = elem.get("name", "")
+            for rom in elem.iter("rom"):
+                sha1 = rom.get("sha1")
+                if sha1:
+                    yield bytes.fromhex(sha1), system_name, name
+            elem.clear()
+
+
+clrmamepro_name_re = re.compile(r'^\s*name\s+"([^"]*)"')
+clrmamepro_sha1_re = re.compile(r'\bsha1\s+([0-9a-fA-F]{40})\b')
+
+def iter_clrmamepro_entries(pathname):
+    """Generate (sha1, system name, name) tuples from a clrmamepro DAT file
+    """
+    system_name = ""
+    block = None
+    name = None
+    with open(pathname, encoding="utf-8", errors="replace") as fh:
+        for line in fh:
+            stripped = line.strip()
+            if stripped.endswith("(") and not stripped.startswith("rom"):
+                block = stripped[:-1].strip()
+                name = None
+            elif block is not None and name is None:
+                match = clrmamepro_name_re.match(line)
+                if match:
+                    name = match.group(1)
+                    if block == "clrmamepro":
+                        system_name = name
+            for match in clrmamepro_sha1_re.finditer(line):
+                yield bytes.fromhex(match.group(1)), system_name, name or ""
+
+
+def iter_dat_entries(pathname, mime=None):
+    """Generate (sha1, mime, name) tuples from a DAT file. If `mime` is not
+    specified it is determined from the system name in the DAT header.
+    """
+    with open(pathname, "rb") as fh:
+        is_xml = fh.read(256).lstrip().startswith(b"<")
+    entries = iter_logiqx_entries(pathname) if is_xml else iter_clrmamepro_entries(pathname)
+    for sha_hash, system_name, name in entries:
+        yield sha_hash, mime or guess_dat_mime(system_name), name
+
+
+class ExternalDatabase:
+    """Signature database that isn't loaded until it's needed
+    """
+    def __init__(self, pathname, mime=None):
+        self.pathname = pathname
+        self.mime = mime
+        self._index = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            if is_index_file(self.pathname):
+                self._index = SignatureIndex(self.pathname)
+            else:
+                self._index = SignatureIndex(calc_index_bytes(iter_dat_entries(self.pathname, self.mime)))
+            log.debug(f"loaded {self._index}")
+        return self._index
+
+    def lookup(self, sha_hash):
+        return self.index.lookup(sha_hash)
+
+
+_external_databases = []
+
+def add_signature_database(pathname, mime=None):
+    """Add an external signature database to be searched after the built-in
+    signatures.
+
+    The file may be a DAT file (clrmamepro or Logiqx XML format) or a binary
+    index created by `write_index`. It isn't read until a lookup fails to
+    find a match in the built-in signatures, so adding databases doesn't
+    slow down startup. If `mime` is not specified, DAT files use the mime
+    type corresponding to the system name in their header.
+    """
+    if not os.path.exists(pathname):
+        raise FileNotFoundError(f"signature database {pathname} not found")
+    _external_databases.append(ExternalDatabase(pathname, mime))
+
+
+def clear_signature_databases():
+    _external_databases[:] = []
+
+
+#### lookup
+
+_builtin_index = None
+
+def get_builtin_index():
+    global _builtin_index
+
+    if _builtin_index is None:
+        if os.path.exists(builtin_index_pathname):
+            _builtin_index = SignatureIndex(builtin_index_pathname)
+        else:
+            # running from a source tree that hasn't been built
+            log.warning(f"{builtin_index_pathname} not found; creating signature index from modules")
+            _builtin_index = SignatureIndex(calc_index_bytes(iter_module_signatures(builtin_signature_modules())))
+    return _builtin_index
 
 
 def guess_signature_from_container(container, verbose=False):
-    found = None
     sha_hash = container.sha1
     log.debug(f"container: {container}; sha1={sha_hash}")
-    for mod in find_signatures():
-        for mime, sigs in mod.sha1_signatures.items():
-            try:
-                name = sigs[sha_hash]
-            except KeyError:
-                continue
-            else:
-                log.debug(f"found match: {name}")
-                return Signature(mime, name)
+    return guess_signature_from_sha1(sha_hash)
+
+
+def guess_signature_from_sha1(sha_hash):
+    found = get_builtin_index().lookup(sha_hash)
+    if found is None:
+        for db in _external_databases:
+            found = db.lookup(sha_hash)
+            if found is not None:
+                break
+    if found is None:
+        for mod in find_signatures():
+            for mime, sigs in mod.sha1_signatures.items():
+                try:
+                    name = sigs[sha_hash]
+                except KeyError:
+                    continue
+                else:
+                    found = Signature(mime, name)
+                    break
+            if found is not None:
+                break
+    if found is not None:
+        log.debug(f"found match: {found.name}")
     else:
         log.debug(f"no match found in sha1 signature database")
-    return None
+    return found
 
 
 # different than the above mime_parse_order, this list is the order in which
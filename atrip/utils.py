@@ -1,3 +1,5 @@
+import mmap
+import tempfile
 import types
 import uuid as stdlib_uuid
 
@@ -32,12 +34,69 @@ def to_numpy(value):
     raise TypeError("Can't convert to numpy data")
 
 
+def lazy_zeros(size):
+    """Return a writable uint8 array of zeros backed by an anonymous memory
+    map, so the operating system only commits pages as they are touched.
+    """
+    if size == 0:
+        return np.zeros(0, dtype=np.uint8)
+    return np.frombuffer(mmap.mmap(-1, size), dtype=np.uint8)
+
+
+def to_memmap(value):
+    """Copy byte data into an unnamed temporary file and return a numpy memmap
+    of that file.
+
+    The temporary file is removed by the operating system as soon as the
+    memory map is released, and only pages that are actually accessed are
+    resident in memory.
+    """
+    with tempfile.TemporaryFile() as fh:
+        if type(value) is bytes:
+            fh.write(value)
+        else:
+            fh.write(memoryview(np.ascontiguousarray(value, dtype=np.uint8)))
+        fh.flush()
+        return np.memmap(fh, dtype=np.uint8, mode='r+')
+
+
 def to_numpy_list(value):
     if type(value) is np.ndarray:
         return value
     return np.asarray(value, dtype=np.uint32)
 
 
+def offsets_to_range(offsets):
+    """Return a python `range` equivalent to the list of offsets if the
+    offsets are evenly spaced and increasing, otherwise None.
+
+    Contiguous (or constant stride) offset lists can then be stored as
+    (start, stop, step) rather than as an index array and used to produce
+    numpy slice views instead of fancy-indexed copies.
+    """
+    if isinstance(offsets, range):
+        return offsets if offsets.step > 0 else None
+    count = len(offsets)
+    if count == 0:
+        return range(0, 0)
+    start = int(offsets[0])
+    if count == 1:
+        return range(start, start + 1)
+    step = int(offsets[1]) - start
+    if step <= 0 or start < 0:
+        return None
+    d = np.diff(np.asarray(offsets, dtype=np.int64))
+    if np.any(d != step):
+        return None
+    return range(start, start + count * step, step)
+
+
+def range_to_array(r):
+    """Build the uint32 index array corresponding to a python `range`
+    """
+    return np.arange(r.start, r.stop, r.step, dtype=np.uint32)
+
+
 def text_to_int(text, default_base="hex"):
     """ Convert text to int, raising exeception on invalid input
     """
@@ -68,6 +127,27 @@ def bool_to_ranges(matches):
     return ranges
 
 
+def indexes_to_ranges(indexes, size=None):
+    """Convert an index specifier into an Nx2 array of start, end pairs of
+    contiguous indexes.
+
+    `indexes` may be a slice (in which case `size` is required), a single
+    integer, or a list of indexes in any order.
+    """
+    if isinstance(indexes, slice):
+        start, stop, step = indexes.indices(size)
+        if step == 1:
+            return np.asarray([[start, max(start, stop)]], dtype=np.int64)
+        indexes = np.arange(start, stop, step)
+    u = np.unique(np.asarray(indexes, dtype=np.int64).ravel())
+    if len(u) == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    breaks = np.flatnonzero(np.diff(u) != 1) + 1
+    starts = u[np.concatenate(([0], breaks))]
+    ends = u[np.concatenate((breaks - 1, [len(u) - 1]))] + 1
+    return np.stack((starts, ends), axis=1)
+
+
 def collapse_values(src):
     """Given a list of integers, return a list of lists, where each entry
     contains a value and the start/end location of that value.
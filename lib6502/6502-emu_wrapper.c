@@ -201,7 +201,7 @@ int lib6502_step_cpu(output_t *output, history_6502_t *entry, breakpoints_t *bre
 	if (inst.cycles == 7) extra_cycles = 0;
 	cycles = inst.cycles + extra_cycles;
 
-	if (apple2_mode) liba2_copy_video((a2_output_t *)output, cycles);
+	if (apple2_mode && !status->skip_output) liba2_copy_video((a2_output_t *)output, cycles);
 
 	entry->cycles = cycles;
 	if (result_flag == BRANCH_TAKEN) {
@@ -276,6 +276,19 @@ int lib6502_step_cpu(output_t *output, history_6502_t *entry, breakpoints_t *bre
 		entry->after3 = SR.byte;
 	}
 
+	if (read_addr != NULL) {
+		index = (intptr_t)read_addr - (intptr_t)(&memory[0]);
+		if (index >= 0 && index < MAIN_MEMORY_SIZE) {
+			LIBDEBUGGER_CHECK_WATCHPOINT(breakpoints, status, (uint16_t)index, ACCESS_TYPE_READ, memory[index], memory[index]);
+		}
+	}
+	if (write_addr != NULL) {
+		index = (intptr_t)write_addr - (intptr_t)(&memory[0]);
+		if (index >= 0 && index < MAIN_MEMORY_SIZE) {
+			LIBDEBUGGER_CHECK_WATCHPOINT(breakpoints, status, (uint16_t)index, ACCESS_TYPE_WRITE, before_value_index > 0 ? before_value[0] : memory[index], memory[index]);
+		}
+	}
+
 	if (status->use_memory_access) {
 		if (read_addr != NULL) {
 			index = (intptr_t)read_addr - (intptr_t)(&memory[0]);
@@ -450,7 +463,9 @@ int lib6502_next_frame(history_input_t *input, output_t *output, breakpoints_t *
 		tv_line = 0;
 	}
 	bpid = libdebugger_calc_frame(&lib6502_calc_frame, memory, status, breakpoints, history);
-	lib6502_get_current_state(output);
+	if (!status->skip_output || status->frame_status != FRAME_FINISHED) {
+		lib6502_get_current_state(output);
+	}
 	return bpid;
 }
 
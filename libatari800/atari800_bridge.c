@@ -402,8 +402,11 @@ int a8bridge_next_frame(input_template_t *input, output_template_t *output, brea
 
 	bpid = libdebugger_calc_frame(&a8bridge_calc_frame, MEMORY_mem, &output->status, breakpoints, history);
 
-	LIBATARI800_StateSave(output->current.state, &output->current.tags);
-	if (output->status.frame_status == FRAME_FINISHED) {
+	/* in turbo mode, the state is still needed if stopped at a breakpoint */
+	if (!output->status.skip_output || output->status.frame_status != FRAME_FINISHED) {
+		LIBATARI800_StateSave(output->current.state, &output->current.tags);
+	}
+	if (output->status.frame_status == FRAME_FINISHED && !output->status.skip_output) {
 		copy_screen(output->video);
 	}
 	return bpid;
@@ -90,31 +90,43 @@ extern int ANTIC_in_overscan;
 #undef MEMORY_dGetByte
 #undef MEMORY_dPutByte
 
+#define CHECK_WATCHPOINT(addr, access, old_value, new_value) \
+	if (LIBATARI800_Breakpoints) LIBDEBUGGER_CHECK_WATCHPOINT(LIBATARI800_Breakpoints, LIBATARI800_Status, addr, access, old_value, new_value)
+
 UBYTE MEMORY_dGetByte(UWORD x) {
 	memory_access[x]=255;
 	access_type[x]|=ACCESS_TYPE_READ;
+	CHECK_WATCHPOINT(x, ACCESS_TYPE_READ, MEMORY_mem[x], MEMORY_mem[x]);
 	return MEMORY_mem[x];
 }
 
 UBYTE MEMORY_dHwGetByte(UWORD x) {
+	UBYTE value;
 	memory_access[x]=255;
 	access_type[x]|=ACCESS_TYPE_READ | ACCESS_TYPE_HARDWARE;
-	return MEMORY_HwGetByte(x, FALSE);
+	value = MEMORY_HwGetByte(x, FALSE);
+	CHECK_WATCHPOINT(x, ACCESS_TYPE_READ, value, value);
+	return value;
 }
 
 UBYTE MEMORY_dSafeHwGetByte(UWORD x) {
+	UBYTE value;
 	memory_access[x]=255;
 	access_type[x]|=ACCESS_TYPE_READ | ACCESS_TYPE_HARDWARE;
-	return MEMORY_HwGetByte(x, TRUE);
+	value = MEMORY_HwGetByte(x, TRUE);
+	CHECK_WATCHPOINT(x, ACCESS_TYPE_READ, value, value);
+	return value;
 }
 
 void MEMORY_dPutByte(UWORD x, UBYTE y) {
+	CHECK_WATCHPOINT(x, ACCESS_TYPE_WRITE, MEMORY_mem[x], y);
 	MEMORY_mem[x]=y;
 	memory_access[x]=255;
 	access_type[x]|=ACCESS_TYPE_WRITE;
 }
 
 void MEMORY_dHwPutByte(UWORD x, UBYTE y) {
+	CHECK_WATCHPOINT(x, ACCESS_TYPE_WRITE, MEMORY_mem[x], y);
 	MEMORY_HwPutByte(x, y);
 	memory_access[x]=255;
 	access_type[x]|=ACCESS_TYPE_WRITE | ACCESS_TYPE_HARDWARE;
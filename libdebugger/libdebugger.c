@@ -12,92 +12,89 @@ void libdebugger_init_array(breakpoints_t *breakpoints) {
 	breakpoints->last_pc = -1;
 }
 
-typedef struct {
+/* Evaluate the compiled condition, storing the result in *value. Returns zero
+ or an error status. The compiler guarantees that the stack can't underflow
+ or overflow. An empty condition is true. Operators must match the
+ definitions in omnivore/debugger/compiler.py */
+int evaluate_bytecode(uint16_t *code, cpu_state_callback_ptr get_emulator_value, uint16_t *value) {
 	uint16_t stack[TOKENS_PER_BREAKPOINT];
-	int index;
-	int error;
-} postfix_stack_t;
-
-void clear(postfix_stack_t *s) {
-	s->index = 0;
-	s->error = 0;
-}
-
-void push(postfix_stack_t *s, uint16_t value) {
-	if (s->index >= TOKENS_PER_BREAKPOINT) {
-		s->error = STACK_OVERFLOW;
-	}
-	else {
-		s->stack[s->index++] = value;
-	}
-#ifdef DEBUG_POSTFIX_STACK
-	printf("push; (err=%d) stack is now: ", s->error);
-	for (int i=0; i<s->index; i++) {
-		printf("%x,", s->stack[i]);
-	}
-	printf("\n");
-#endif
-}
+	uint16_t *sp = stack; /* next free slot */
+	uint16_t word, a, b;
+	uint32_t base, result;
+
+	for (;;) {
+		word = *code++;
+		switch (word & BYTECODE_OP_MASK) {
+			case BYTECODE_END:
+			*value = (sp > stack) ? sp[-1] : 1;
+			return 0;
+
+			case BYTECODE_NUMBER:
+			*sp++ = *code++;
+			break;
 
-uint16_t pop(postfix_stack_t *s) {
-	uint16_t value;
+			case BYTECODE_EMU:
+			*sp++ = (uint16_t)get_emulator_value(word >> BYTECODE_OPERAND_SHIFT, 0);
+			break;
 
-	if (s->index > 0) {
-		value = (uint16_t)(s->stack[--s->index]);
-	}
-	else {
-		s->error = STACK_UNDERFLOW;
-		value = 0;
-	}
-#ifdef DEBUG_POSTFIX_STACK
-	printf("pop; (err=%d) stack is now: ", s->error);
-	for (int i=0; i<s->index; i++) {
-		printf("%x,", s->stack[i]);
-	}
-	printf("\n");
-#endif
-	return value;
-}
+			case BYTECODE_EMU_ARG:
+			*sp++ = (uint16_t)get_emulator_value((word >> BYTECODE_OPERAND_SHIFT) | VALUE_ARGUMENT, *code++);
+			break;
 
-void process_binary(uint16_t token, postfix_stack_t *s) {
-	uint16_t first, second, value;
+#define BINARY(expr) b = *--sp; a = sp[-1]; sp[-1] = (uint16_t)(expr); break
+			case BYTECODE_PLUS: BINARY(a + b);
+			case BYTECODE_MINUS: BINARY(a - b);
+			case BYTECODE_MULT: BINARY((uint32_t)a * b);
+			case BYTECODE_LSHIFT: BINARY(b < 16 ? (uint32_t)a << b : 0);
+			case BYTECODE_RSHIFT: BINARY(b < 16 ? a >> b : 0);
+			case BYTECODE_BITWISE_AND: BINARY(a & b);
+			case BYTECODE_BITWISE_OR: BINARY(a | b);
+			case BYTECODE_LOGICAL_AND: BINARY(a && b);
+			case BYTECODE_LOGICAL_OR: BINARY(a || b);
+			case BYTECODE_EQ: BINARY(a == b);
+			case BYTECODE_NE: BINARY(a != b);
+			case BYTECODE_LT: BINARY(a < b);
+			case BYTECODE_LE: BINARY(a <= b);
+			case BYTECODE_GT: BINARY(a > b);
+			case BYTECODE_GE: BINARY(a >= b);
+#undef BINARY
+
+			case BYTECODE_DIV:
+			b = *--sp;
+			if (b == 0) return EVALUATION_ERROR;
+			sp[-1] = sp[-1] / b;
+			break;
 
-	first = pop(s);
-	second = pop(s);
-	value = 0;
-	if (!s->error) {
-		switch(token) {
-			case OP_PLUS:
-			value = first + second;
+			case BYTECODE_EXP:
+			b = *--sp;
+			base = sp[-1];
+			result = 1;
+			while (b) {
+				if (b & 1) result = (result * base) & 0xffff;
+				base = (base * base) & 0xffff;
+				b >>= 1;
+			}
+			sp[-1] = (uint16_t)result;
 			break;
 
-			case OP_MINUS:
-			value = first - second;
+			case BYTECODE_UMINUS:
+			sp[-1] = (uint16_t)(-sp[-1]);
 			break;
 
-			case OP_EQ:
-			value = first == second;
+			case BYTECODE_BITWISE_NOT:
+			sp[-1] = (uint16_t)(~sp[-1]);
 			break;
 
-			case OP_LOGICAL_AND:
-			value = first && second;
+			case BYTECODE_LOGICAL_NOT:
+			sp[-1] = !sp[-1];
 			break;
 
 			default:
-			printf("unimplemented binary operation: token=%d\n", token);
-			break;
+			return EVALUATION_ERROR;
 		}
-#ifdef DEBUG_POSTFIX_STACK
-		printf("process_binary: op=%d first=%d second=%d value=%d\n", token, first, second, value);
-#endif
-		push(s, value);
 	}
 }
 
-int process_unary(uint16_t token, cpu_state_callback_ptr get_emulator_value, postfix_stack_t *s) {
-	return 0;
-}
-
 /* returns: index number of breakpoint or -1 if no breakpoint condition met. */
 int libdebugger_brk_instruction(breakpoints_t *breakpoints) {
 	breakpoints->breakpoint_status[0] = BREAKPOINT_ENABLED;
@@ -105,12 +102,38 @@ int libdebugger_brk_instruction(breakpoints_t *breakpoints) {
 	return 0;
 }
 
+/* Record the first access to a watched address during an instruction. The
+ watchpoint fires when the breakpoints are checked before the next
+ instruction, so last_pc is the instruction that made the access. */
+void libdebugger_watchpoint_access(breakpoints_t *breakpoints, frame_status_t *run, uint16_t addr, uint8_t access, uint8_t old_value, uint8_t new_value) {
+	int id;
+
+	if (breakpoints->watchpoint_hit) return;
+	id = breakpoints->watch_id[addr];
+	if (breakpoints->breakpoint_status[id] != BREAKPOINT_ENABLED || breakpoints->breakpoint_type[id] != BREAKPOINT_WATCHPOINT) return;
+#ifdef DEBUG_WATCHPOINT
+	printf("watchpoint %d: pc=%04x addr=%04x access=%d old=%02x new=%02x\n", id, breakpoints->last_pc, addr, access, old_value, new_value);
+#endif
+	breakpoints->watchpoint_hit = id + 1;
+	run->watchpoint_pc = breakpoints->last_pc;
+	run->watchpoint_address = addr;
+	run->watchpoint_access_type = access;
+	run->watchpoint_old_value = old_value;
+	run->watchpoint_new_value = new_value;
+}
+
 /* returns: index number of breakpoint or -1 if no breakpoint condition met. */
 int libdebugger_check_breakpoints(breakpoints_t *breakpoints, frame_status_t *run, cpu_state_callback_ptr get_emulator_value, int is_unconditional_jmp) {
-	uint16_t token, op, addr, value;
+	uint16_t value, *code;
+	uint8_t *ids;
 	int64_t ref_val;
-	int i, num_entries, index, status, btype, final_value, count, current_pc, current_scan_line, start_checking_breakpoints_at;
-	postfix_stack_t stack;
+	int i, j, num_entries, status, btype, count, current_pc, current_scan_line, start_checking_breakpoints_at;
+
+	if (breakpoints->watchpoint_hit) {
+		i = breakpoints->watchpoint_hit - 1;
+		breakpoints->watchpoint_hit = 0;
+		return i;
+	}
 
 	current_pc = get_emulator_value(REG_PC, 0);
 	// printf("in libdebugger_check_breakpoints: PC=%04x breakpoint->last_pc=%04x\n", current_pc, breakpoints->last_pc);
@@ -132,7 +155,6 @@ int libdebugger_check_breakpoints(breakpoints_t *breakpoints, frame_status_t *ru
 		run->scan_lines_since_power_on++;
 	}
 
-	num_entries = breakpoints->num_breakpoints;
 	start_checking_breakpoints_at = 1;
 
 	/* Special case for zeroth breakpoint: step conditions & user control */
@@ -162,75 +184,36 @@ int libdebugger_check_breakpoints(breakpoints_t *breakpoints, frame_status_t *ru
 		}
 	}
 
-	/* process normal breakpoints */
-	for (i=start_checking_breakpoints_at; i < num_entries; i++) {
-		status = breakpoints->breakpoint_status[i];
-		if (status == BREAKPOINT_ENABLED) {
-			btype = breakpoints->breakpoint_type[i];
-#ifdef DEBUG_BREAKPOINT
-			printf("Breakpoint %d enabled: type=%d\n", i, btype);
-#endif
-			index = i * TOKENS_PER_BREAKPOINT;
-			clear(&stack);
-			for (count=0; count < TOKENS_PER_BREAKPOINT - 1; count++) {
-				token = breakpoints->tokens[index++];
-				op = token & OP_MASK;
-#ifdef DEBUG_BREAKPOINT
-				printf("  index=%d, count=%d token=%x\n", index-1, count, token);
-#endif
-				if (token == END_OF_LIST) goto compute;
-
-				if (op == OP_BINARY) {
-#ifdef DEBUG_BREAKPOINT
-					printf("  binary: op=%d\n", op);
-#endif
-					process_binary(token, &stack);
-				}
-				else if (op == OP_UNARY) {
-#ifdef DEBUG_BREAKPOINT
-					printf("  unary: op=%d\n", op);
-#endif
-					process_unary(token, get_emulator_value, &stack);
-				}
-				else {
-					if (op == VALUE_ARGUMENT) {
-						addr = breakpoints->tokens[index++];
-					}
-					else {
-						addr = 0;
-					}
-					if (token == NUMBER) {
-						value = addr;
-#ifdef DEBUG_BREAKPOINT
-						printf("  number: op=%d value=%04x\n", op, addr);
-#endif
-
-					}
-					else {
-						value = get_emulator_value(token, addr);
+	/* process normal breakpoints. Only the compiled conditions are used; the
+	 breakpoints with a PC guard are only looked at if the bit for the current
+	 PC is set, otherwise only the unguarded breakpoints need checking. */
+	if (!breakpoints->compiled) return -1;
+	if (PC_BITMAP_TEST(breakpoints->pc_bitmap, current_pc)) {
+		ids = breakpoints->compiled_ids;
+		num_entries = breakpoints->num_compiled;
+	}
+	else {
+		ids = breakpoints->unguarded_ids;
+		num_entries = breakpoints->num_unguarded;
+	}
+	for (j=0; j < num_entries; j++) {
+		i = ids[j];
+		if (i < start_checking_breakpoints_at) continue;
+		if (breakpoints->breakpoint_status[i] != BREAKPOINT_ENABLED) continue;
+		if (breakpoints->guard_type[i] == BREAKPOINT_GUARD_PC && breakpoints->guard_pc[i] != current_pc) continue;
+		code = &breakpoints->bytecode[i * TOKENS_PER_BREAKPOINT];
+		if (*code == BYTECODE_END) return i;
 #ifdef DEBUG_BREAKPOINT
-						printf("  emu value: op=%d value=%04x\n", op, value);
+		printf("Breakpoint %d enabled: evaluating bytecode\n", i);
 #endif
-					}
-					push(&stack, value);
-				}
-				if (stack.error) {
-					breakpoints->breakpoint_status[i] = stack.error;
-					goto next;
-				}
-			}
-compute:
-			final_value = pop(&stack);
-			if (stack.error) {
-				breakpoints->breakpoint_status[i] = stack.error;
-				goto next;
-			}
-			if (final_value != 0) {
-				/* condition true, so the breakpoint should be triggered! */
-				return i;
-			}
+		status = evaluate_bytecode(code, get_emulator_value, &value);
+		if (status) {
+			breakpoints->breakpoint_status[i] = status;
+		}
+		else if (value != 0) {
+			/* condition true, so the breakpoint should be triggered! */
+			return i;
 		}
-next: ;
 	}
 	return -1;
 }
@@ -286,7 +269,7 @@ int libdebugger_calc_frame(emu_frame_callback_ptr calc, uint8_t *memory, frame_s
 		output->frame_number += 1;
 		output->current_instruction_in_frame = 0;
 		output->current_scan_line_in_frame = -1;
-		libdebugger_memory_access_start_frame(memory, output);
+		if (!output->skip_output) libdebugger_memory_access_start_frame(memory, output);
 	}
 	output->frame_status = FRAME_INCOMPLETE;
 	bpid = calc(output, breakpoints, history);
@@ -29,7 +29,16 @@ typedef struct {
         uint8_t brk_into_debugger; /* enter debugger on BRK */
         uint8_t unused2[5];
 
-        int64_t unused3[6]; /* 16 x uint64 in header (16*8 bytes) */
+        /* location of the memory access that triggered a watchpoint */
+        int32_t watchpoint_pc;
+        int32_t watchpoint_address;
+        uint8_t watchpoint_old_value;
+        uint8_t watchpoint_new_value;
+        uint8_t watchpoint_access_type;
+        uint8_t skip_output; /* turbo mode: don't produce video, state or memory access output for finished frames */
+        uint8_t unused4[4];
+
+        int64_t unused3[4]; /* 16 x uint64 in header (16*8 bytes) */
 
         uint8_t memory_access[MAIN_MEMORY_SIZE];
         uint8_t access_type[MAIN_MEMORY_SIZE];
@@ -76,21 +85,57 @@ typedef struct {
 #define BREAKPOINT_BRK_INSTRUCTION 0x6
 #define BREAKPOINT_PAUSE_AT_FRAME_START 0x7
 #define BREAKPOINT_COUNT_LINES 0x8
+#define BREAKPOINT_WATCHPOINT 0x9
 
 /* status values returned */
 #define NO_BREAKPOINT_FOUND -1
 
+/* guard types for compiled breakpoints */
+#define BREAKPOINT_GUARD_NONE 0  /* evaluate after every instruction */
+#define BREAKPOINT_GUARD_PC 1  /* evaluate only when the PC is guard_pc */
+#define BREAKPOINT_GUARD_NEVER 2  /* condition can never be true */
+
 /* NOTE: breakpoint #0 is reserved for stepping the cpu */
 typedef struct {
         int32_t num_breakpoints;
         int32_t last_pc; /* allow -1 to signify invalid PC */
-        int32_t unused[14];
+        int32_t compiled; /* compiled tables below are valid */
+        int32_t num_compiled;
+        int32_t num_unguarded;
+        int32_t watchpoint_hit; /* watchpoint id + 1 if triggered during the last instruction */
+        int32_t unused[10];
         int64_t reference_value[NUM_BREAKPOINT_ENTRIES];
         uint8_t breakpoint_type[NUM_BREAKPOINT_ENTRIES];
         uint8_t breakpoint_status[NUM_BREAKPOINT_ENTRIES];
         uint16_t tokens[TOKEN_LIST_SIZE];  /* indexed by breakpoint number * TOKENS_PER_BREAKPOINT */
+
+        /* compiled conditions, created by omnivore/debugger/compiler.py */
+        uint8_t guard_type[NUM_BREAKPOINT_ENTRIES];
+        uint8_t compiled_ids[NUM_BREAKPOINT_ENTRIES]; /* all compiled breakpoints */
+        uint8_t unguarded_ids[NUM_BREAKPOINT_ENTRIES]; /* breakpoints without a guard */
+        uint16_t guard_pc[NUM_BREAKPOINT_ENTRIES];
+        uint8_t pc_bitmap[MAIN_MEMORY_SIZE / 8]; /* bit set for each guard_pc */
+        uint16_t bytecode[TOKEN_LIST_SIZE];  /* indexed like tokens */
+
+        /* watchpoints: the access types (ACCESS_TYPE_READ/WRITE) watched at
+         each address and the id of the watchpoint watching it. watch_pages
+         is nonzero for each page that contains an address of an enabled
+         watchpoint; it is created by omnivore/debugger/compiler.py */
+        uint8_t watch_pages[256];
+        uint8_t watch_mask[MAIN_MEMORY_SIZE];
+        uint8_t watch_id[MAIN_MEMORY_SIZE];
 } breakpoints_t;
 
+#define PC_BITMAP_TEST(bitmap, pc) ((bitmap)[(pc) >> 3] & (1 << ((pc) & 7)))
+
+/* Called from the CPU memory access path for each read or write; the page
+ test is the only cost for addresses on pages without watchpoints. */
+#define LIBDEBUGGER_CHECK_WATCHPOINT(breakpoints, status, addr, access, old_value, new_value) \
+        do { \
+                if ((breakpoints)->watch_pages[(uint16_t)(addr) >> 8] && ((breakpoints)->watch_mask[(uint16_t)(addr)] & (access))) \
+                        libdebugger_watchpoint_access(breakpoints, status, addr, access, old_value, new_value); \
+        } while (0)
+
 
 /* operation flags */
 #define OP_UNARY 0x1000
@@ -150,6 +195,38 @@ typedef struct {
 #define COUNT_INSTRUCTIONS (401 | VALUE_ARGUMENT)
 #define COUNT_CYCLES (402 | VALUE_ARGUMENT)
 
+/* compiled condition bytecode: the operation is in the low bits of each word;
+ for BYTECODE_EMU and BYTECODE_EMU_ARG the upper bits hold the token (without
+ VALUE_ARGUMENT) for the register callback. BYTECODE_NUMBER and
+ BYTECODE_EMU_ARG are followed by a word holding the value or argument. */
+#define BYTECODE_OP_MASK 0x1f
+#define BYTECODE_OPERAND_SHIFT 5
+
+#define BYTECODE_END 0
+#define BYTECODE_NUMBER 1
+#define BYTECODE_EMU 2
+#define BYTECODE_EMU_ARG 3
+#define BYTECODE_PLUS 4
+#define BYTECODE_MINUS 5
+#define BYTECODE_MULT 6
+#define BYTECODE_DIV 7
+#define BYTECODE_EXP 8
+#define BYTECODE_LSHIFT 9
+#define BYTECODE_RSHIFT 10
+#define BYTECODE_BITWISE_AND 11
+#define BYTECODE_BITWISE_OR 12
+#define BYTECODE_LOGICAL_AND 13
+#define BYTECODE_LOGICAL_OR 14
+#define BYTECODE_EQ 15
+#define BYTECODE_NE 16
+#define BYTECODE_LT 17
+#define BYTECODE_LE 18
+#define BYTECODE_GT 19
+#define BYTECODE_GE 20
+#define BYTECODE_UMINUS 21
+#define BYTECODE_BITWISE_NOT 22
+#define BYTECODE_LOGICAL_NOT 23
+
 #define OPCODE_READ 1
 #define OPCODE_WRITE 2
 #define OPCODE_RETURN 4
@@ -170,6 +247,8 @@ typedef int (*emu_frame_callback_ptr)(frame_status_t *output, breakpoints_t *bre
 
 int libdebugger_brk_instruction(breakpoints_t *breakpoints);
 
+void libdebugger_watchpoint_access(breakpoints_t *breakpoints, frame_status_t *run, uint16_t addr, uint8_t access, uint8_t old_value, uint8_t new_value);
+
 int libdebugger_check_breakpoints(breakpoints_t *, frame_status_t *, cpu_state_callback_ptr, int);
 
 int libdebugger_calc_frame(emu_frame_callback_ptr calc, uint8_t *memory, frame_status_t *output, breakpoints_t *breakpoints, emulator_history_t *history);
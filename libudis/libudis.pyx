@@ -1,6 +1,6 @@
 # cython: language_level=3
 from libc.stdio cimport printf
-from libc.string cimport strstr, strcasestr
+from libc.string cimport strstr, strcasestr, memcpy, memmove
 import cython
 import numpy as np
 cimport numpy as np
@@ -9,6 +9,9 @@ from libudis.libudis cimport history_entry_t, emulator_history_t, parse_func_t,
 
 from atrip.disassemblers.dtypes import HISTORY_ENTRY_DTYPE
 
+cdef extern from "libudis_flags.h":
+    int FLAG_TARGET_ADDR
+
 cdef extern:
     parse_func_t parser_map[]
     string_func_t stringifier_map[]
@@ -308,6 +311,76 @@ cdef class ParsedDisassembly:
                 #    print "  disasm_info: added label at %04x" % (pc + i)
                 jmp_target[(pc + i) & 0xffff] = old_label
 
+    cdef int find_line_start(self, int index):
+        # index of the first byte of the line containing the byte at index
+        cdef np.uint32_t *index_to_row = self.index_to_row_data
+        cdef np.uint32_t row = index_to_row[index]
+        while index > 0 and index_to_row[index - 1] == row:
+            index -= 1
+        return index
+
+    cdef int splice(self, history_entry_t *new_entries, int num_new, int start_index, int end_index):
+        # Replace the lines covering the bytes start_index:end_index (which
+        # must both be at line boundaries) with the new entries, shifting the
+        # rows of everything after. Returns 0 if the new entries won't fit.
+        cdef np.uint32_t *index_to_row = self.index_to_row_data
+        cdef int first_row = index_to_row[start_index]
+        cdef int last_row = index_to_row[end_index] if end_index < self.num_bytes else self.num_entries
+        cdef int delta = num_new - (last_row - first_row)
+        cdef np.uint8_t *jmp_target = <np.uint8_t *>self.jmp_targets_data
+        cdef history_entry_t *h
+        cdef int i, row, count
+
+        if self.num_entries + delta > self.max_entries:
+            return 0
+
+        # Labels created by the old lines may be stale. Any line could
+        # reference the same address, so remember them here and only clear
+        # the ones that aren't referenced by anything after the splice.
+        cdef np.ndarray[np.uint16_t, ndim=1] old_labels = np.empty((last_row - first_row) * 2, dtype=np.uint16)
+        h = &self.history_entries[first_row]
+        for i in range(last_row - first_row):
+            old_labels[2 * i] = h.pc
+            old_labels[2 * i + 1] = h.target_addr
+            h += 1
+
+        memmove(&self.history_entries[first_row + num_new], &self.history_entries[last_row], (self.num_entries - last_row) * sizeof(history_entry_t))
+        memcpy(&self.history_entries[first_row], new_entries, num_new * sizeof(history_entry_t))
+        self.num_entries += delta
+
+        if delta != 0:
+            for i in range(end_index, self.num_bytes):
+                index_to_row[i] += delta
+        i = start_index
+        h = &self.history_entries[first_row]
+        for row in range(first_row, first_row + num_new):
+            for count in range(h.num_bytes):
+                index_to_row[i] = row
+                i += 1
+            h += 1
+
+        cdef np.ndarray[np.uint8_t, ndim=1] referenced = np.zeros(256*256, dtype=np.uint8)
+        h = &self.history_entries[0]
+        for i in range(self.num_entries):
+            if h.target_addr or h.flag & FLAG_TARGET_ADDR:
+                referenced[h.target_addr] = 1
+            h += 1
+        cdef np.uint16_t addr
+        for i in range(len(old_labels)):
+            addr = old_labels[i]
+            if not referenced[addr]:
+                jmp_target[addr] = 0
+
+                # fix_offset_labels may have copied the label to the start of
+                # the line containing it; it will be recreated there if still
+                # needed.
+                i = (addr - self.origin) & 0xffff
+                if i < self.num_bytes:
+                    addr = (self.origin + self.find_line_start(i)) & 0xffff
+                    if not referenced[addr]:
+                        jmp_target[addr] = 0
+        return 1
+
     def parse_test(self, np.uint8_t disasm_type, np.ndarray[np.uint8_t, ndim=1] src):
         cdef parse_func_t processor
 
@@ -329,15 +402,22 @@ cdef class ParsedDisassembly:
 
 cdef int data_style = 0
 
+# Number of bytes before a change that are parsed again in an incremental
+# update, because some parsers (e.g. the data parser looking for runs of
+# repeated bytes) look at bytes past the end of the line they create.
+cdef int resync_lookbehind = 32
+
 cdef class DisassemblyConfig:
     cdef np.uint8_t c_split_comments[256]
     cdef parse_func_t segment_parsers[256]
     cdef np.uint8_t default_disasm_type
+    cdef public object split_comments
 
     def __init__(self, def_disasm_type=0, split_comments=[data_style]):
         cdef int i
         for i in range(256):
             self.c_split_comments[i] = 1 if i in split_comments else 0
+        self.split_comments = list(split_comments)
         self.default_disasm_type = def_disasm_type
 
     def get_parser(self, num_entries, origin, num_bytes):
@@ -348,69 +428,98 @@ cdef class DisassemblyConfig:
     @cython.boundscheck(False)
     @cython.wraparound(False)
     def parse(self, segment, num_entries):
-        cdef np.uint8_t s, t
-        cdef int comment_bit_mask = 0x40
-
-        src_copy = segment.data.tobytes()
-        cdef np.uint8_t *src = <np.uint8_t *>src_copy
-        style_copy = segment.style.tobytes()
-        cdef np.uint8_t *c_style = <np.uint8_t *>style_copy
-        disasm_type_copy = segment.disasm_type.tobytes()
-        cdef np.uint8_t *c_disasm_type = <np.uint8_t *>disasm_type_copy
-        cdef int num_bytes = len(src_copy)
+        cdef np.ndarray[np.uint8_t, ndim=1] src_array = np.ascontiguousarray(segment.data[:], dtype=np.uint8)
+        cdef np.uint8_t *src = <np.uint8_t *>src_array.data
+        cdef int num_bytes = len(src_array)
 
         cdef int origin = segment.origin
-        cdef int end_addr = origin + len(segment)
-        cdef int pc = origin
 
         if num_bytes < 1:
             return self.get_parser(0, origin, 0)
         cdef ParsedDisassembly parsed = self.get_parser(num_entries, origin, num_bytes)
 
-        cdef int first_index = 0
-        cdef np.uint8_t current_disasm_type = c_disasm_type[0]
-        if current_disasm_type > 127:
-            current_disasm_type = self.default_disasm_type
-        cdef int start_index
-        cdef int end_index = 0
-        cdef int count
-        # print "CYTHON FAST_GET_ENTIRE", style_copy
-        for end_index in range(1, num_bytes):
-            s = c_style[end_index]
-            t = c_disasm_type[end_index]
-            if t > 127:
-                t = self.default_disasm_type
-            # print "%04x" % i, s, s2,
-            if s & comment_bit_mask:
-                if t == current_disasm_type and not self.c_split_comments[t]:
-                    # print("same w/skippable comment")
-                    continue
-            elif t == current_disasm_type:
-                # print "same"
-                continue
-
-            # process chuck here:
-            start_index = first_index
-            count = end_index - start_index
-            # print("break here -> %x:%x = %s" % (start_index, end_index, current_disasm_type))
-            processor = parser_map[current_disasm_type]
+        # The blocks of bytes using the same disassembler are computed from
+        # the run-length encoded style and disasm_type data, so only the
+        # boundaries need to be processed here rather than every byte.
+        starts, types = segment.calc_disasm_chunks(self.default_disasm_type, self.split_comments)
+        cdef np.ndarray[np.int64_t, ndim=1] chunk_starts = np.append(starts, num_bytes).astype(np.int64)
+        cdef np.ndarray[np.uint8_t, ndim=1] chunk_types = np.asarray(types, dtype=np.uint8)
+        cdef int num_chunks = len(chunk_types)
+        cdef int i, count
+        cdef parse_func_t processor
+        for i in range(num_chunks):
+            count = chunk_starts[i + 1] - chunk_starts[i]
+            # print("break here -> %x:%x = %s" % (chunk_starts[i], chunk_starts[i + 1], chunk_types[i]))
+            processor = parser_map[chunk_types[i]]
             parsed.parse_next(processor, src, count)
             src += count
-            first_index = end_index
-            current_disasm_type = t
-
-        # process last chunk
-        start_index = first_index
-        end_index += 1  # i is last byte tested, need +1 to include it in the range
-        count = end_index - start_index
-        # print("final break here -> %x:%x = %s, count=%x" % (start_index, end_index, current_disasm_type, num_bytes))
-        processor = parser_map[current_disasm_type]
-        parsed.parse_next(processor, src, count)
 
         parsed.fix_offset_labels()
         # print("finished offset label generation")
         return parsed
 
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def reparse(self, segment, ParsedDisassembly parsed not None, ranges):
+        """Update a previous disassembly of the segment after the bytes or
+        disassembly types in the list of (start, end) ranges have changed.
+
+        Parsing restarts at the beginning of the line a little before the
+        first change and stops at the first line start after the last change
+        that matches a line start in the previous disassembly, because from
+        that point on the instruction stream is the same. The new lines are
+        spliced into `parsed` in place. If the previous disassembly can't be
+        reused a complete new one is returned, so always use the return value.
+        """
+        cdef np.ndarray[np.uint8_t, ndim=1] src_array = np.ascontiguousarray(segment.data[:], dtype=np.uint8)
+        cdef np.uint8_t *src = <np.uint8_t *>src_array.data
+        cdef int num_bytes = len(src_array)
+        cdef int origin = segment.origin
+
+        if num_bytes < 1 or num_bytes != parsed.num_bytes or origin != parsed.origin or parsed.index_index < num_bytes:
+            # segment has changed size or the previous disassembly was
+            # truncated, so there's nothing to line up with
+            return self.parse(segment, parsed.max_entries)
+
+        r = np.asarray(ranges, dtype=np.int64).reshape(-1, 2)
+        if len(r) == 0:
+            return parsed
+        cdef int start = max(r[:, 0].min(), 0)
+        cdef int end = min(r[:, 1].max(), num_bytes)
+        if start >= end:
+            return parsed
+        cdef int start_index = parsed.find_line_start(max(start - resync_lookbehind, 0))
+
+        starts, types = segment.calc_disasm_chunks(self.default_disasm_type, self.split_comments)
+        cdef np.ndarray[np.int64_t, ndim=1] chunk_starts = np.append(starts, num_bytes).astype(np.int64)
+        cdef np.ndarray[np.uint8_t, ndim=1] chunk_types = np.asarray(types, dtype=np.uint8)
+        cdef int chunk = np.searchsorted(chunk_starts, start_index, 'right') - 1
+
+        # each line is at least one byte, so this is the most that can be needed
+        cdef np.ndarray new_entries = np.zeros((num_bytes - start_index) * sizeof(history_entry_t), dtype=np.uint8)
+        cdef history_entry_t *first_h = <history_entry_t *>new_entries.data
+        cdef history_entry_t *h = first_h
+        cdef np.uint32_t *old_rows = parsed.index_to_row_data
+        cdef int index = start_index
+        cdef int chunk_end, count
+        cdef parse_func_t processor
+        while index < num_bytes:
+            if index >= end and old_rows[index] != old_rows[index - 1]:
+                # back in sync with the previous disassembly
+                break
+            chunk_end = chunk_starts[chunk + 1]
+            processor = parser_map[chunk_types[chunk]]
+            count = processor(h, src + index, origin + index, origin + chunk_end, parsed.jmp_targets_data)
+            index += count
+            h += 1
+            if index >= chunk_end:
+                chunk += 1
+
+        if not parsed.splice(first_h, h - first_h, start_index, index):
+            return self.parse(segment, parsed.max_entries)
+        parsed.fix_offset_labels()
+        return parsed
+
 
 cdef class StringifiedHistory:
     cdef public int origin
@@ -599,3 +708,15 @@ cdef class HistoryStorage:
         index = (self.history.first_entry_index + index) % self.history.num_allocated_entries
         output.parse_history_entries(self.history, index, num_lines_requested)
         return output
+
+    def load_entries(self, np.ndarray entries):
+        """Replace the contents of the ring with the given entries so that
+        history stored elsewhere (e.g. a trace on disk) can be stringified
+        """
+        cdef int count = len(entries)
+        if count > self.history.num_allocated_entries:
+            raise IndexError(f"{count} entries won't fit in history of {self.history.num_allocated_entries}")
+        self.entries[:count] = entries
+        self.history.first_entry_index = 0
+        self.history.latest_entry_index = count - 1
+        self.history.num_entries = count
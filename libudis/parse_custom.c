@@ -70,7 +70,7 @@ int parse_entry_data(history_entry_t *entry, unsigned char *src, unsigned int pc
     return entry->num_bytes;
 }
 
-int parse_entry_antic_dl(history_entry_t *entry, unsigned char *src, unsigned int pc, unsigned int last_pc, unsigned short *labels) {
+int parse_entry_antic_dl(history_entry_t *entry, unsigned char *src, unsigned int pc, unsigned int last_pc, jmp_targets_t *jmp_targets) {
     unsigned char *first_instruction_ptr;
     unsigned short addr;
 
@@ -90,7 +90,7 @@ int parse_entry_antic_dl(history_entry_t *entry, unsigned char *src, unsigned in
         }
         else {
             addr = (256 * src[2]) + src[1];
-            labels[addr] = DISASM_ANTIC_DL;
+            jmp_targets->discovered[addr] = DISASM_ANTIC_DL;
             entry->target_addr = addr;
             entry->flag = FLAG_TARGET_ADDR;
         }
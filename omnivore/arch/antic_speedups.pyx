@@ -55,56 +55,6 @@ def get_numpy_memory_map_image(segment_viewer, np.ndarray[np.uint8_t, ndim=2] by
     return array
 
 
-# Fast font rendering. As an optimization, only renders complete rectangles.
-# The first and last row may be partial depending on the start offset of the
-# segment, but these now have to be rendered separately in their own (single
-# row) rectangle
-@cython.boundscheck(False)
-@cython.wraparound(False)
-def get_numpy_font_map_image(segment_viewer, antic_font, np.ndarray[np.uint8_t, ndim=2] bytes, np.ndarray[np.uint8_t, ndim=2] style, int start_byte, int end_byte, int bytes_per_row, int num_rows, int start_col, int num_cols):
-    cdef int char_w = antic_font.char_w
-    cdef int char_h = antic_font.char_h
-    cdef int end_col = min(bytes_per_row, start_col + num_cols)
-    cdef int width = char_w * num_cols
-    cdef int height = num_rows * char_h
-    cdef np.ndarray[np.uint8_t, ndim=3] array = np.empty([height, width, 3], dtype=np.uint8)
-    cdef np.uint8_t[:,:,:] fast_array = array
-
-    cdef int y = 0
-    cdef int x, i, j
-    cdef np.ndarray[np.uint8_t, ndim=4] f = antic_font.normal_font
-    cdef np.uint8_t[:,:,:,:] fast_f = f
-    cdef np.ndarray[np.uint8_t, ndim=4] fh = antic_font.highlight_font
-    cdef np.uint8_t[:,:,:,:] fast_fh = fh
-    cdef np.ndarray[np.uint8_t, ndim=4] fd = antic_font.data_font
-    cdef np.uint8_t[:,:,:,:] fast_fd = fd
-    cdef np.ndarray[np.uint8_t, ndim=4] fm = antic_font.match_font
-    cdef np.uint8_t[:,:,:,:] fast_fm = fm
-    cdef np.ndarray[np.uint8_t, ndim=4] fc = antic_font.comment_font
-    cdef np.uint8_t[:,:,:,:] fast_fc = fc
-    cdef np.uint8_t s, c
-    cdef np.ndarray[np.uint8_t] mapping = segment_viewer.font_mapping.font_mapping
-    for j in range(num_rows):
-        x = 0
-        for i in range(start_col, start_col + num_cols):
-            c = mapping[bytes[j, i]]
-            s = style[j, i]
-            if s & 0x80:
-                fast_array[y:y+char_h,x:x+char_w,:] = fast_fh[c]
-            elif s & 0x20:
-                fast_array[y:y+char_h,x:x+char_w,:] = fast_fm[c]
-            elif s & 0x40:
-                fast_array[y:y+char_h,x:x+char_w,:] = fast_fc[c]
-            elif s & 0x08:
-                fast_array[y:y+char_h,x:x+char_w,:] = fast_fd[c]
-            else:
-                fast_array[y:y+char_h,x:x+char_w,:] = fast_f[c]
-            x += char_w
-        y += char_h
-
-    return array
-
-
 @cython.boundscheck(False)
 @cython.wraparound(False)
 def get_numpy_memory_access_image(segment_viewer, int bytes_per_row, int num_rows, int count, np.ndarray[np.uint8_t, ndim=2] access_value, np.ndarray[np.uint8_t, ndim=2] access_type, int start_col, int num_cols):
@@ -9,15 +9,36 @@ from sawx.utils.nputil import intscale, intwscale, intwscale_font
 
 from atrip.machines import atari8bit
 from .bitmap_renderers import BaseRenderer
-try:
-    from . import antic_speedups as speedups
-except ImportError:
-    speedups = None
 
 import logging
 log = logging.getLogger(__name__)
 
 
+# Order of the style fonts in the glyph atlas. Each plane holds all 256
+# characters in one style, and a single background tile follows the last
+# plane.
+atlas_planes = ["normal", "data", "comment", "match", "highlight"]
+
+chars_per_plane = 256
+
+background_tile = len(atlas_planes) * chars_per_plane
+
+
+def calc_style_planes():
+    """Lookup table from style byte to atlas plane, using the same priority
+    as the per-cell renderer: selected, then match, then comment, then data.
+    """
+    s = np.arange(256, dtype=np.uint8)
+    planes = np.zeros(256, dtype=np.intp)
+    planes[s & style_bits.data_bit_mask > 0] = atlas_planes.index("data")
+    planes[s & style_bits.comment_bit_mask > 0] = atlas_planes.index("comment")
+    planes[s & style_bits.match_bit_mask > 0] = atlas_planes.index("match")
+    planes[s & style_bits.selected_bit_mask > 0] = atlas_planes.index("highlight")
+    return planes
+
+style_planes = calc_style_planes()
+
+
 class Mode2(BaseRenderer):
     name = "Antic 2 (Gr 0)"
     char_bit_width = 8
@@ -28,11 +49,7 @@ class Mode2(BaseRenderer):
 
     @classmethod
     def get_image(cls, machine, antic_font, byte_values, style, start_byte, end_byte, bytes_per_row, nr, start_col, visible_cols):
-        if speedups is not None:
-            array = speedups.get_numpy_font_map_image(machine, antic_font, byte_values, style, start_byte, end_byte, bytes_per_row, nr, start_col, visible_cols)
-        else:
-            array = get_numpy_font_map_image(machine, antic_font, byte_values, style, start_byte, end_byte, bytes_per_row, nr, start_col, visible_cols)
-        return array
+        return get_numpy_font_map_image(machine, antic_font, byte_values, style, start_byte, end_byte, bytes_per_row, nr, start_col, visible_cols)
 
     @property
     def bytes_per_char(self):
@@ -43,6 +60,24 @@ class Mode2(BaseRenderer):
         font = self.bits_to_font(bits, colors, gr0_colors, reverse)
         return font
 
+    def get_atlas(self, data, plane_colors, background_color, reverse=False):
+        """Create the glyph atlas: an array of character tiles holding the
+        font rendered in each style in `atlas_planes` order, followed by a
+        tile filled with the background color.
+
+        `plane_colors` is a list of (colors, gr0_colors) for each plane. The
+        font data is only converted to bits once for all the planes.
+        """
+        bits = self.data_to_bits(data)
+        fonts = [self.bits_to_font(bits, colors, gr0_colors, reverse) for colors, gr0_colors in plane_colors]
+        _, h, w, depth = fonts[0].shape
+        atlas = np.empty((background_tile + 1, h, w, depth), dtype=np.uint8)
+        for i, font in enumerate(fonts):
+            start = i * chars_per_plane
+            atlas[start:start + chars_per_plane] = font
+        atlas[background_tile] = background_color
+        return atlas
+
     def data_to_bits(self, data):
         """Convert byte data into bits, returning only a subset if
         required
@@ -289,48 +324,38 @@ class Apple2TextMode(Mode2):
 
 
 def get_numpy_font_map_image(segment_viewer, antic_font, byte_values, style, start_byte, end_byte, bytes_per_row, num_rows, start_col, num_cols):
-    width = int(antic_font.char_w * num_cols)
-    height = int(num_rows * antic_font.char_h)
-    log.debug("pixel width: %dx%d" % (width, height))
-    array = np.empty((height, width, 3), dtype=np.uint8)
-
-    log.debug("start byte: %s, end_byte: %s, bytes_per_row=%d num_rows=%d start_col=%d num_cols=%d" % (start_byte, end_byte, bytes_per_row, num_rows, start_col, num_cols))
-    end_col = min(bytes_per_row, start_col + num_cols)
-    y = 0
-    e = start_byte
-    f = antic_font.normal_font
-    fh = antic_font.highlight_font
-    fd = antic_font.data_font
-    fm = antic_font.match_font
-    fc = antic_font.comment_font
+    """Render a grid of characters as an RGB image.
+
+    Each cell is an index into the glyph atlas computed from the font mapping
+    of the byte value and the style plane, so the whole image is produced by
+    a single gather from the atlas instead of a copy per character cell.
+    Cells past `end_byte` or the end of the row are drawn in the background
+    color.
+    """
     char_w = antic_font.char_w
     char_h = antic_font.char_h
+    log.debug("start byte: %s, end_byte: %s, bytes_per_row=%d num_rows=%d start_col=%d num_cols=%d" % (start_byte, end_byte, bytes_per_row, num_rows, start_col, num_cols))
+    end_col = min(bytes_per_row, start_col + num_cols)
+    cols = np.arange(start_col, start_col + num_cols)
+    rows = np.arange(num_rows)
+    byte_index = start_byte + rows[:, np.newaxis] * bytes_per_row + cols
+    valid = (byte_index < end_byte) & (cols < end_col)
+
+    # clip so the invalid cells can be looked up; they are replaced below
+    clipped = np.minimum(cols, byte_values.shape[1] - 1)
     mapping = segment_viewer.font_mapping.font_mapping
-    for j in range(num_rows):
-        x = 0
-        for i in range(start_col, start_col + num_cols):
-            if e + i >= end_byte or i >= end_col:
-                array[y:y+char_h,x:x+char_w,:] = segment_viewer.preferences.background_color
-            else:
-                c = mapping[byte_values[j, i]]
-                s = style[j, i]
-                if s & style_bits.selected_bit_mask:
-                    array[y:y+char_h,x:x+char_w,:] = fh[c]
-                elif s & style_bits.match_bit_mask:
-                    array[y:y+char_h,x:x+char_w,:] = fm[c]
-                elif s & style_bits.comment_bit_mask:
-                    array[y:y+char_h,x:x+char_w,:] = fc[c]
-                elif s & style_bits.user_bit_mask:
-                    array[y:y+char_h,x:x+char_w,:] = fd[c]
-                else:
-                    array[y:y+char_h,x:x+char_w,:] = f[c]
-            x += char_w
-        y += char_h
-        e += bytes_per_row
+    chars = mapping[byte_values[:num_rows, clipped]]
+    planes = style_planes[style[:num_rows, clipped]]
+    tiles = planes * chars_per_plane + chars
+    tiles[~valid] = background_tile
+
+    cells = np.take(antic_font.atlas, tiles, axis=0)
+    # (rows, cols, char_h, char_w, 3) -> (rows, char_h, cols, char_w, 3)
+    array = cells.transpose(0, 2, 1, 3, 4).reshape((num_rows * char_h, num_cols * char_w, -1))
+    log.debug("pixel width: %dx%d" % (array.shape[1], array.shape[0]))
     return array
 
 
-
 font_renderer_list = [
     Mode2(),
     Mode4(),
@@ -1,6 +1,6 @@
 import hashlib
 import uuid
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 
 import numpy as np
 import wx
@@ -10,6 +10,7 @@ from sawx.persistence import iter_templates
 from atrip.machines import atari8bit
 
 from . import colors
+from . import font_renderers
 
 import logging
 log = logging.getLogger(__name__)
@@ -30,6 +31,43 @@ log = logging.getLogger(__name__)
 #    }
 
 
+class GlyphAtlasCache(object):
+    """Least-recently-used cache of glyph atlases, keyed by the font data, the
+    font renderer, and all the colors used to render the atlas, so switching
+    between fonts or color schemes that have been used recently doesn't
+    regenerate every style font.
+    """
+    def __init__(self, max_atlases=16):
+        self.max_atlases = max_atlases
+        self.atlases = OrderedDict()
+
+    def __len__(self):
+        return len(self.atlases)
+
+    def clear(self):
+        self.atlases.clear()
+
+    def calc_key(self, data, font_renderer, plane_colors, background_color, reverse):
+        colors = [(np.asarray(c, dtype=np.float64).tobytes(), np.asarray(g, dtype=np.float64).tobytes()) for c, g in plane_colors]
+        return (hashlib.sha1(data.tobytes()).digest(), font_renderer.name, bool(reverse), tuple(colors), tuple(background_color))
+
+    def get_atlas(self, data, font_renderer, plane_colors, background_color, reverse=False):
+        key = self.calc_key(data, font_renderer, plane_colors, background_color, reverse)
+        try:
+            atlas = self.atlases[key]
+        except KeyError:
+            log.debug(f"creating glyph atlas for {font_renderer.name}")
+            atlas = font_renderer.get_atlas(data, plane_colors, background_color, reverse)
+            self.atlases[key] = atlas
+            while len(self.atlases) > self.max_atlases:
+                self.atlases.popitem(last=False)
+        else:
+            self.atlases.move_to_end(key)
+        return atlas
+
+glyph_atlas_cache = GlyphAtlasCache()
+
+
 class AnticFont(object):
     def __init__(self, segment_viewer, font_data, font_renderer, playfield_colors, reverse=False):
         self.char_w = font_renderer.char_bit_width
@@ -61,20 +99,25 @@ class AnticFont(object):
         self.font_data = font_data
 
         m = segment_viewer
-        self.normal_font = font_renderer.get_font(data, m.color_registers, self.normal_gr0_colors, reverse)
-
         prefs = segment_viewer.preferences
         h_colors = colors.get_blended_color_registers(m.color_registers, prefs.highlight_background_color)
-        self.highlight_font = font_renderer.get_font(data, h_colors, self.highlight_gr0_colors, reverse)
-
         d_colors = colors.get_dimmed_color_registers(m.color_registers, prefs.background_color, prefs.data_background_color)
-        self.data_font = font_renderer.get_font(data, d_colors, self.data_gr0_colors, reverse)
-
         m_colors = colors.get_blended_color_registers(m.color_registers, prefs.match_background_color)
-        self.match_font = font_renderer.get_font(data, m_colors, self.match_gr0_colors, reverse)
-
         c_colors = colors.get_blended_color_registers(m.color_registers, prefs.comment_background_color)
-        self.comment_font = font_renderer.get_font(data, c_colors, self.comment_gr0_colors, reverse)
+        plane_colors = {
+            "normal": (m.color_registers, self.normal_gr0_colors),
+            "highlight": (h_colors, self.highlight_gr0_colors),
+            "data": (d_colors, self.data_gr0_colors),
+            "match": (m_colors, self.match_gr0_colors),
+            "comment": (c_colors, self.comment_gr0_colors),
+        }
+        plane_colors = [plane_colors[name] for name in font_renderers.atlas_planes]
+        self.atlas = glyph_atlas_cache.get_atlas(data, font_renderer, plane_colors, prefs.background_color, reverse)
+
+        # each style font is a view into the atlas
+        for i, name in enumerate(font_renderers.atlas_planes):
+            start = i * font_renderers.chars_per_plane
+            setattr(self, name + "_font", self.atlas[start:start + font_renderers.chars_per_plane])
 
     def get_height(self, zoom):
         return self.char_h * self.scale_h * zoom
@@ -36,6 +36,7 @@ class ChangeByteValuesCommand(SegmentCommand):
 
     def set_undo_flags(self, flags):
         flags.byte_values_changed = True
+        flags.index_range_source = self.segment
 
 
 class ChangeMetadataCommand(SegmentCommand):
@@ -76,13 +77,15 @@ class SetSelectionCommand(ChangeByteValuesCommand):
 
     def do_change(self, editor, undo):
         indexes = self.get_indexes()
+        log.debug(f"{self.short_name}: do_change: indexes={indexes}")
+        old_data, indexes = self.change_data_at_indexes(indexes)
+        # subclasses may change more (or fewer) bytes than were requested
         i1 = min(indexes)
         i2 = max(indexes)
-        log.debug(f"{self.short_name}: do_change: indexes={indexes}")
         undo.flags.index_range = i1, i2
         if self.advance:
             undo.flags.advance_caret_position_in_control = editor.focused_viewer.control
-        return self.change_data_at_indexes(indexes)
+        return (old_data, indexes)
 
     def undo_change(self, editor, old_data):
         old_data, indexes = old_data
@@ -210,7 +213,7 @@ class SetRangeCommand(ChangeByteValuesCommand):
     def do_change(self, editor, undo):
         indexes = self.range_to_index_function(self.ranges)
         # print(f"{self.short_name}: ranges={self.ranges}, indexes={indexes}")
-        undo.flags.index_range = indexes[0], indexes[-1]
+        undo.flags.index_range = int(min(indexes)), int(max(indexes))
         old_data = self.segment[indexes].copy()
         self.segment[indexes] = self.get_data(old_data)
         if self.advance:
@@ -258,8 +261,8 @@ class SetRangeValueModifyIndexesCommand(SetRangeCommand):
     def do_change(self, editor, undo):
         indexes = self.range_to_index_function(self.ranges)
         print(f"{self.short_name}: ranges={self.ranges}, indexes={indexes}")
-        undo.flags.index_range = indexes[0], indexes[-1]
         data, new_indexes = self.get_data_and_indexes(indexes)
+        undo.flags.index_range = min(new_indexes), max(new_indexes)
         old_data = self.segment[new_indexes].copy()
         self.segment[new_indexes] = data
         if self.advance:
@@ -296,12 +299,12 @@ class ChangeStyleCommand(SetContiguousDataCommand):
         new_style = self.get_style(editor)
         self.clip(new_style)
         old_style = self.segment.style[self.start_index:self.end_index].copy()
-        self.segment.style[self.start_index:self.end_index] = new_style
+        self.segment.writable_style[self.start_index:self.end_index] = new_style
         self.update_is_tracing(viewer)
         editor.document.change_count += 1
         return (old_style, old_is_tracing)
 
     def undo_change(self, editor, old_data):
         old_style, old_is_tracing = old_data
-        self.segment.style[self.start_index:self.end_index] = old_style
+        self.segment.writable_style[self.start_index:self.end_index] = old_style
         viewer.is_tracing = old_is_tracing
@@ -97,7 +97,7 @@ class ClipboardCommand(SegmentCommand):
         style = self.get_style(data)
         if style is not None:
             old_style = self.segment.style[indexes].copy()
-            self.segment.style[indexes] = style
+            self.segment.writable_style[indexes] = style
         else:
             old_style = None
         if old_comment_info is not None:
@@ -109,7 +109,7 @@ class ClipboardCommand(SegmentCommand):
         old_data, old_indexes, old_style, old_comment_info = old_data
         self.segment[old_indexes] = old_data
         if old_style is not None:
-            self.segment.style[old_indexes] = old_style
+            self.segment.writable_style[old_indexes] = old_style
         if old_comment_info is not None:
             self.segment.restore_comments(old_comment_info)
 
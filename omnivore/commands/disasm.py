@@ -27,9 +27,11 @@ class SetDisasmCommand(SetRangeCommand):
     def do_change(self, editor, undo):
         indexes = self.range_to_index_function(self.ranges)
         # print(f"{self.short_name}: ranges={self.ranges}, indexes={indexes}")
-        undo.flags.index_range = indexes[0], indexes[-1]
+        # the selected ranges may be in any order; the disassembly viewer
+        # reparses everything between the first and last changed index
+        undo.flags.index_range = int(min(indexes)), int(max(indexes))
         old_data = self.segment.disasm_type[indexes].copy()
-        self.segment.disasm_type[indexes] = self.get_data(old_data)
+        self.segment.writable_disasm_type[indexes] = self.get_data(old_data)
         self.segment.update_data_style_from_disasm_type()
         if self.advance:
             undo.flags.advance_caret_position_in_control = editor.focused_viewer.control
@@ -37,7 +39,7 @@ class SetDisasmCommand(SetRangeCommand):
 
     def undo_change(self, editor, old_data):
         indexes = self.range_to_index_function(self.ranges)
-        self.segment.disasm_type[indexes] = old_data
+        self.segment.writable_disasm_type[indexes] = old_data
         self.segment.update_data_style_from_disasm_type()
 
 
@@ -0,0 +1,390 @@
+"""Compile breakpoint conditions into bytecode for libdebugger
+
+Breakpoint conditions are stored as postfix token lists (see `dtypes`). To
+avoid interpreting every token list after every instruction, each enabled
+conditional breakpoint is compiled:
+
+* the postfix tokens are parsed into an expression tree, and subexpressions
+  that only use numbers are folded into constants
+* a top-level `PC == number` term (either the whole condition or one term of
+  a chain of logical ANDs) is removed from the condition and becomes a PC
+  guard. The address is set in a 64K bit map, and the remaining condition is
+  only evaluated when the bit for the current PC is set
+* the remaining condition is emitted as bytecode in which the operators are
+  numbered consecutively (so the evaluator's switch is a jump table) and the
+  maximum stack depth is known ahead of time.
+
+As in the original token lists, all values are 16 bit unsigned integers and
+the condition is true if the result is nonzero. An empty bytecode list (just
+`BYTECODE_END`) is always true, so a breakpoint that only tests the PC costs
+nothing unless the PC matches.
+"""
+import functools
+
+import numpy as np
+
+from . import dtypes as dd
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class BreakpointCompileError(ValueError):
+    def __init__(self, status, message):
+        ValueError.__init__(self, message)
+        self.status = status
+
+
+binary_bytecode = {
+    dd.OP_PLUS: dd.BYTECODE_PLUS,
+    dd.OP_MINUS: dd.BYTECODE_MINUS,
+    dd.OP_MULT: dd.BYTECODE_MULT,
+    dd.OP_DIV: dd.BYTECODE_DIV,
+    dd.OP_EXP: dd.BYTECODE_EXP,
+    dd.OP_LSHIFT: dd.BYTECODE_LSHIFT,
+    dd.OP_RSHIFT: dd.BYTECODE_RSHIFT,
+    dd.OP_BITWISE_AND: dd.BYTECODE_BITWISE_AND,
+    dd.OP_BITWISE_OR: dd.BYTECODE_BITWISE_OR,
+    dd.OP_LOGICAL_AND: dd.BYTECODE_LOGICAL_AND,
+    dd.OP_LOGICAL_OR: dd.BYTECODE_LOGICAL_OR,
+    dd.OP_EQ: dd.BYTECODE_EQ,
+    dd.OP_NE: dd.BYTECODE_NE,
+    dd.OP_LT: dd.BYTECODE_LT,
+    dd.OP_LE: dd.BYTECODE_LE,
+    dd.OP_GT: dd.BYTECODE_GT,
+    dd.OP_GE: dd.BYTECODE_GE,
+}
+
+unary_bytecode = {
+    dd.OP_UMINUS: dd.BYTECODE_UMINUS,
+    dd.OP_BITWISE_NOT: dd.BYTECODE_BITWISE_NOT,
+    dd.OP_LOGICAL_NOT: dd.BYTECODE_LOGICAL_NOT,
+    dd.OP_UPLUS: None,
+}
+
+
+def calc_exp(a, b):
+    result = 1
+    while b:
+        if b & 1:
+            result = (result * a) & 0xffff
+        a = (a * a) & 0xffff
+        b >>= 1
+    return result
+
+
+# These must match the operators in libdebugger.c. Division by zero is
+# handled by the caller.
+binary_functions = {
+    dd.BYTECODE_PLUS: lambda a, b: (a + b) & 0xffff,
+    dd.BYTECODE_MINUS: lambda a, b: (a - b) & 0xffff,
+    dd.BYTECODE_MULT: lambda a, b: (a * b) & 0xffff,
+    dd.BYTECODE_DIV: lambda a, b: a // b,
+    dd.BYTECODE_EXP: calc_exp,
+    dd.BYTECODE_LSHIFT: lambda a, b: (a << b) & 0xffff if b < 16 else 0,
+    dd.BYTECODE_RSHIFT: lambda a, b: a >> b if b < 16 else 0,
+    dd.BYTECODE_BITWISE_AND: lambda a, b: a & b,
+    dd.BYTECODE_BITWISE_OR: lambda a, b: a | b,
+    dd.BYTECODE_LOGICAL_AND: lambda a, b: int(bool(a) and bool(b)),
+    dd.BYTECODE_LOGICAL_OR: lambda a, b: int(bool(a) or bool(b)),
+    dd.BYTECODE_EQ: lambda a, b: int(a == b),
+    dd.BYTECODE_NE: lambda a, b: int(a != b),
+    dd.BYTECODE_LT: lambda a, b: int(a < b),
+    dd.BYTECODE_LE: lambda a, b: int(a <= b),
+    dd.BYTECODE_GT: lambda a, b: int(a > b),
+    dd.BYTECODE_GE: lambda a, b: int(a >= b),
+}
+
+unary_functions = {
+    dd.BYTECODE_UMINUS: lambda a: -a & 0xffff,
+    dd.BYTECODE_BITWISE_NOT: lambda a: ~a & 0xffff,
+    dd.BYTECODE_LOGICAL_NOT: lambda a: int(not a),
+}
+
+
+#### expression tree
+#
+# Nodes are tuples:
+#
+#   (BYTECODE_NUMBER, value)
+#   (BYTECODE_EMU, token, 0) or (BYTECODE_EMU_ARG, token, arg)
+#   (unary bytecode, operand)
+#   (binary bytecode, left, right)
+
+def parse_tokens(tokens):
+    """Return the expression tree for the postfix token list, which is
+    terminated by END_OF_LIST.
+
+    Operands of binary operators are in the usual postfix order: `a b OP`
+    computes `a OP b`.
+    """
+    stack = []
+    tokens = [int(t) for t in tokens]
+    num_tokens = len(tokens)
+    i = 0
+    while True:
+        if i >= num_tokens:
+            raise BreakpointCompileError(dd.EVALUATION_ERROR, "missing end of list")
+        token = tokens[i]
+        i += 1
+        if token == dd.END_OF_LIST:
+            break
+        op = token & dd.OP_MASK
+        if op == dd.OP_BINARY:
+            if len(stack) < 2:
+                raise BreakpointCompileError(dd.STACK_UNDERFLOW, "not enough values for binary operator")
+            try:
+                code = binary_bytecode[token]
+            except KeyError:
+                raise BreakpointCompileError(dd.EVALUATION_ERROR, f"unknown binary operator {token}")
+            right = stack.pop()
+            left = stack.pop()
+            stack.append(fold((code, left, right)))
+        elif op == dd.OP_UNARY:
+            if len(stack) < 1:
+                raise BreakpointCompileError(dd.STACK_UNDERFLOW, "not enough values for unary operator")
+            try:
+                code = unary_bytecode[token]
+            except KeyError:
+                raise BreakpointCompileError(dd.EVALUATION_ERROR, f"unknown unary operator {token}")
+            if code is not None:
+                stack.append(fold((code, stack.pop())))
+        elif op == dd.VALUE_ARGUMENT:
+            if i >= num_tokens:
+                raise BreakpointCompileError(dd.EVALUATION_ERROR, "missing argument")
+            arg = tokens[i]
+            i += 1
+            if token == dd.NUMBER:
+                stack.append((dd.BYTECODE_NUMBER, arg))
+            else:
+                stack.append((dd.BYTECODE_EMU_ARG, token, arg))
+        else:
+            stack.append((dd.BYTECODE_EMU, token, 0))
+        if op != dd.OP_BINARY and op != dd.OP_UNARY and token != dd.NUMBER and (token & dd.TOKEN_MASK) > dd.BYTECODE_MAX_OPERAND:
+            raise BreakpointCompileError(dd.EVALUATION_ERROR, f"unknown token {token}")
+        if len(stack) > dd.TOKENS_PER_BREAKPOINT:
+            raise BreakpointCompileError(dd.STACK_OVERFLOW, "too many values")
+    if not stack:
+        raise BreakpointCompileError(dd.STACK_UNDERFLOW, "no value")
+    # like the original interpreter, any values below the top are ignored
+    return stack[-1]
+
+
+def is_number(node):
+    return node[0] == dd.BYTECODE_NUMBER
+
+
+def fold(node):
+    """Replace an operator node whose operands are all numbers with a
+    number node
+    """
+    code = node[0]
+    if code in unary_functions:
+        if is_number(node[1]):
+            return (dd.BYTECODE_NUMBER, unary_functions[code](node[1][1]))
+    elif code in binary_functions:
+        left, right = node[1], node[2]
+        if is_number(left) and is_number(right):
+            if code == dd.BYTECODE_DIV and right[1] == 0:
+                raise BreakpointCompileError(dd.EVALUATION_ERROR, "division by zero")
+            return (dd.BYTECODE_NUMBER, binary_functions[code](left[1], right[1]))
+    return node
+
+
+def split_and_terms(node):
+    if node[0] == dd.BYTECODE_LOGICAL_AND:
+        return split_and_terms(node[1]) + split_and_terms(node[2])
+    return [node]
+
+
+def join_and_terms(terms):
+    node = terms[0]
+    for term in terms[1:]:
+        node = (dd.BYTECODE_LOGICAL_AND, node, term)
+    return node
+
+
+def calc_pc_guard(node):
+    """Return the address if the node is a test of the program counter
+    against a number, otherwise None
+    """
+    if node[0] == dd.BYTECODE_EQ:
+        left, right = node[1], node[2]
+        if is_number(left):
+            left, right = right, left
+        if left[0] == dd.BYTECODE_EMU and left[1] == dd.REG_PC and is_number(right):
+            return right[1]
+    return None
+
+
+def emit(node, bytecode):
+    """Append the bytecode for the node, returning the maximum stack depth
+    it needs
+    """
+    code = node[0]
+    if code == dd.BYTECODE_NUMBER:
+        bytecode.extend((code, node[1]))
+        return 1
+    elif code == dd.BYTECODE_EMU:
+        bytecode.append(code | (node[1] << dd.BYTECODE_OPERAND_SHIFT))
+        return 1
+    elif code == dd.BYTECODE_EMU_ARG:
+        bytecode.extend((code | ((node[1] & dd.TOKEN_MASK) << dd.BYTECODE_OPERAND_SHIFT), node[2]))
+        return 1
+    elif code in unary_functions:
+        depth = emit(node[1], bytecode)
+        bytecode.append(code)
+        return depth
+    else:
+        left = emit(node[1], bytecode)
+        right = emit(node[2], bytecode)
+        bytecode.append(code)
+        return max(left, right + 1)
+
+
+class CompiledCondition:
+    """The result of compiling a breakpoint's token list.
+
+    `guard_type` is one of the BREAKPOINT_GUARD_* values; for
+    BREAKPOINT_GUARD_PC the `bytecode` is only evaluated when the program
+    counter is `guard_pc`. A condition that is always false compiles to
+    BREAKPOINT_GUARD_NEVER and is left out of the tables entirely.
+    """
+    def __init__(self, guard_type, guard_pc, bytecode, stack_depth):
+        self.guard_type = guard_type
+        self.guard_pc = guard_pc
+        self.bytecode = bytecode
+        self.stack_depth = stack_depth
+
+    def __str__(self):
+        return f"CompiledCondition guard={self.guard_type} pc={self.guard_pc} bytecode={self.bytecode}"
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_condition(tokens):
+    """Compile a tuple of postfix tokens (terminated by END_OF_LIST) into a
+    `CompiledCondition`, or raise a `BreakpointCompileError` whose `status`
+    is the breakpoint error status.
+    """
+    node = parse_tokens(tokens)
+    guard_type = dd.BREAKPOINT_GUARD_NONE
+    guard_pc = 0
+    if is_number(node):
+        if node[1] == 0:
+            return CompiledCondition(dd.BREAKPOINT_GUARD_NEVER, 0, [dd.BYTECODE_END], 0)
+        node = None
+    else:
+        terms = split_and_terms(node)
+        for i, term in enumerate(terms):
+            addr = calc_pc_guard(term)
+            if addr is not None:
+                guard_type = dd.BREAKPOINT_GUARD_PC
+                guard_pc = addr
+                terms[i:i + 1] = []
+                break
+        # the remaining terms only matter if they can be false
+        terms = [t for t in terms if not is_number(t) or t[1] == 0]
+        if any(is_number(t) for t in terms):
+            return CompiledCondition(dd.BREAKPOINT_GUARD_NEVER, 0, [dd.BYTECODE_END], 0)
+        node = join_and_terms(terms) if terms else None
+    bytecode = []
+    depth = 0
+    if node is not None:
+        depth = emit(node, bytecode)
+    bytecode.append(dd.BYTECODE_END)
+    if len(bytecode) > dd.TOKENS_PER_BREAKPOINT:
+        raise BreakpointCompileError(dd.EVALUATION_ERROR, "condition too long")
+    return CompiledCondition(guard_type, guard_pc, bytecode, depth)
+
+
+def evaluate_bytecode(bytecode, get_emulator_value):
+    """Python version of the bytecode evaluator in libdebugger.c, returning
+    the value of the condition. An empty condition is true.
+
+    `get_emulator_value` is called with the token and argument in the same
+    way as the emulator's register callback.
+    """
+    stack = []
+    i = 0
+    while True:
+        word = int(bytecode[i])
+        i += 1
+        code = word & dd.BYTECODE_OP_MASK
+        if code == dd.BYTECODE_END:
+            return stack[-1] if stack else 1
+        elif code == dd.BYTECODE_NUMBER:
+            stack.append(int(bytecode[i]))
+            i += 1
+        elif code == dd.BYTECODE_EMU:
+            stack.append(get_emulator_value(word >> dd.BYTECODE_OPERAND_SHIFT, 0) & 0xffff)
+        elif code == dd.BYTECODE_EMU_ARG:
+            token = (word >> dd.BYTECODE_OPERAND_SHIFT) | dd.VALUE_ARGUMENT
+            stack.append(get_emulator_value(token, int(bytecode[i])) & 0xffff)
+            i += 1
+        elif code in unary_functions:
+            stack.append(unary_functions[code](stack.pop()))
+        else:
+            right = stack.pop()
+            left = stack.pop()
+            if code == dd.BYTECODE_DIV and right == 0:
+                raise ZeroDivisionError("division by zero in breakpoint condition")
+            stack.append(binary_functions[code](left, right))
+
+
+def compile_breakpoints(debug_cmd):
+    """Fill the compiled breakpoint tables in the debugger command structure
+    (a record of `DEBUGGER_COMMANDS_DTYPE`) from the token lists of its
+    enabled conditional breakpoints, and mark the pages containing addresses
+    of enabled watchpoints.
+
+    Breakpoints that fail to compile have their status set to the error.
+    Breakpoint 0 is included only when it is a conditional breakpoint;
+    the other breakpoint 0 types are handled directly by libdebugger.
+    """
+    c = debug_cmd
+    c['compiled'] = 0
+    c['guard_type'][:] = dd.BREAKPOINT_GUARD_NEVER
+    c['guard_pc'][:] = 0
+    c['pc_bitmap'][:] = 0
+    compiled_ids = []
+    unguarded_ids = []
+    pcs = []
+    tokens = c['tokens']
+    for i in range(int(c['num_breakpoints'])):
+        if c['breakpoint_status'][i] != dd.BREAKPOINT_ENABLED or c['breakpoint_type'][i] != dd.BREAKPOINT_CONDITIONAL:
+            continue
+        index = i * dd.TOKENS_PER_BREAKPOINT
+        try:
+            compiled = compile_condition(tuple(tokens[index:index + dd.TOKENS_PER_BREAKPOINT].tolist()))
+        except BreakpointCompileError as e:
+            log.warning(f"breakpoint {i}: {e}")
+            c['breakpoint_status'][i] = e.status
+            continue
+        if compiled.guard_type == dd.BREAKPOINT_GUARD_NEVER:
+            continue
+        c['guard_type'][i] = compiled.guard_type
+        c['guard_pc'][i] = compiled.guard_pc
+        c['bytecode'][index:index + len(compiled.bytecode)] = compiled.bytecode
+        compiled_ids.append(i)
+        if compiled.guard_type == dd.BREAKPOINT_GUARD_PC:
+            pcs.append(compiled.guard_pc)
+        else:
+            unguarded_ids.append(i)
+    if pcs:
+        bits = np.zeros(dd.MAIN_MEMORY_SIZE, dtype=np.uint8)
+        bits[pcs] = 1
+        c['pc_bitmap'][:] = np.packbits(bits, bitorder='little')
+    # pages containing an address watched by an enabled watchpoint
+    num = int(c['num_breakpoints'])
+    enabled = np.zeros(dd.NUM_BREAKPOINT_ENTRIES, dtype=bool)
+    enabled[:num] = (c['breakpoint_status'][:num] == dd.BREAKPOINT_ENABLED) & (c['breakpoint_type'][:num] == dd.BREAKPOINT_WATCHPOINT)
+    if enabled.any():
+        active = (c['watch_mask'] != 0) & enabled[c['watch_id']]
+        c['watch_pages'][:] = active.reshape(256, 256).any(axis=1)
+    else:
+        c['watch_pages'][:] = 0
+    c['compiled_ids'][:len(compiled_ids)] = compiled_ids
+    c['num_compiled'] = len(compiled_ids)
+    c['unguarded_ids'][:len(unguarded_ids)] = unguarded_ids
+    c['num_unguarded'] = len(unguarded_ids)
+    c['compiled'] = 1
@@ -87,12 +87,26 @@ ccontinue|cc NUMBER
 import numpy as np
 
 from . import dtypes as dd
+from .compiler import compile_breakpoints
 from ..utils.persistence import Serializable
 
 import logging
 log = logging.getLogger(__name__)
 
 
+def calc_watched_addresses(ranges):
+    """Return a boolean array marking each address in the list of (start,
+    end) ranges, end not inclusive. Ranges may overlap.
+    """
+    ranges = np.asarray(ranges, dtype=np.int64).reshape(-1, 2)
+    ranges = np.clip(ranges, 0, dd.MAIN_MEMORY_SIZE)
+    ranges = ranges[ranges[:,0] < ranges[:,1]]
+    counts = np.zeros(dd.MAIN_MEMORY_SIZE + 1, dtype=np.int32)
+    np.add.at(counts, ranges[:,0], 1)
+    np.add.at(counts, ranges[:,1], -1)
+    return np.cumsum(counts[:-1]) > 0
+
+
 class Breakpoint:
     def __init__(self, debugger, id, addr=None):
         self.debugger = debugger
@@ -251,8 +265,32 @@ class Breakpoint:
         self.terms = (dd.OPCODE_TYPE, dd.OPCODE_RETURN, dd.REG_SP, dd.NUMBER, sp, dd.OP_EQ, dd.OP_LOGICAL_AND, dd.END_OF_LIST)
         self.enable()
 
+    def watch(self, ranges, access=dd.ACCESS_TYPE_WRITE):
+        # make this a watchpoint on the list of (start, end) address ranges,
+        # end not inclusive. Addresses already watched by another watchpoint
+        # are taken over by this one.
+        c = self.debugger.debug_cmd[0]
+        self.clear_watched()
+        watched = calc_watched_addresses(ranges)
+        c['watch_mask'][watched] = access & (dd.ACCESS_TYPE_READ | dd.ACCESS_TYPE_WRITE)
+        c['watch_id'][watched] = self.id
+        c['breakpoint_type'][self.id] = dd.BREAKPOINT_WATCHPOINT
+        c['tokens'][self.index] = dd.END_OF_LIST
+        self.enable()
+
+    @property
+    def watched_addresses(self):
+        c = self.debugger.debug_cmd[0]
+        return np.where((c['watch_id'] == self.id) & (c['watch_mask'] != 0))[0]
+
+    def clear_watched(self):
+        c = self.debugger.debug_cmd[0]
+        c['watch_mask'][c['watch_id'] == self.id] = 0
+
     def clear(self):
         c = self.debugger.debug_cmd[0]
+        if c['breakpoint_type'][self.id] == dd.BREAKPOINT_WATCHPOINT:
+            self.clear_watched()
         status = dd.BREAKPOINT_DISABLED if self.id == 0 else dd.BREAKPOINT_EMPTY
         c['breakpoint_type'][self.id] = dd.BREAKPOINT_CONDITIONAL
         c['breakpoint_status'][self.id] = status
@@ -278,12 +316,35 @@ class Debugger(Serializable):
     def __init__(self):
         self.debug_cmd_raw = np.zeros([dd.DEBUGGER_COMMANDS_DTYPE.itemsize], dtype=np.uint8)
         self.debug_cmd = self.debug_cmd_raw.view(dtype=dd.DEBUGGER_COMMANDS_DTYPE)
+        self.compiled_breakpoint_source = None
         self.clear_all_breakpoints()
 
     ##### Serialization
 
     def restore_computed_attributes(self, state):
         self.debug_cmd_raw[:] = state['debug_cmd_raw']
+        self.compiled_breakpoint_source = None
+
+    ##### Breakpoint compilation
+
+    def calc_breakpoint_source(self):
+        c = self.debug_cmd[0]
+        return b"".join([c['num_breakpoints'].tobytes(), c['breakpoint_type'].tobytes(), c['breakpoint_status'].tobytes(), c['tokens'].tobytes(), c['watch_mask'].tobytes(), c['watch_id'].tobytes()])
+
+    def compile_breakpoints(self):
+        """Compile the breakpoint conditions for libdebugger if they have
+        changed since the last time they were compiled.
+
+        Must be called before running the emulator; the breakpoints are
+        changed in many places (including by the emulator itself when a
+        breakpoint fires or has an error) so changes are detected by
+        comparing the breakpoint definitions.
+        """
+        source = self.calc_breakpoint_source()
+        if source != self.compiled_breakpoint_source or not self.debug_cmd[0]['compiled']:
+            compile_breakpoints(self.debug_cmd[0])
+            # compiling may set error statuses, so save the source afterwards
+            self.compiled_breakpoint_source = self.calc_breakpoint_source()
 
     def clear_all_breakpoints(self):
         c = self.debug_cmd[0]
@@ -292,6 +353,8 @@ class Debugger(Serializable):
         c['breakpoint_status'][0] = dd.BREAKPOINT_DISABLED
         c['num_breakpoints'] = 0
         c['last_pc'] = -1
+        c['watchpoint_hit'] = 0
+        c['watch_mask'][:] = 0
 
     def create_breakpoint(self, addr=None):
         c = self.debug_cmd[0]
@@ -300,6 +363,18 @@ class Debugger(Serializable):
         c['num_breakpoints'] = max(c['num_breakpoints'], bpid + 1)
         return Breakpoint(self, bpid, addr)
 
+    def create_watchpoint(self, ranges, access=dd.ACCESS_TYPE_WRITE):
+        """Create a watchpoint on a list of (start, end) address ranges (end
+        not inclusive), triggered by the `access` types (ACCESS_TYPE_READ
+        and/or ACCESS_TYPE_WRITE).
+
+        The breakpoint fires before the instruction after the one that made
+        the access; the emulator's `watchpoint_hit` describes the access.
+        """
+        b = self.create_breakpoint()
+        b.watch(ranges, access)
+        return b
+
     def get_breakpoint(self, bpid):
         if bpid < 0:
             return None
@@ -24,7 +24,16 @@ FRAME_STATUS_DTYPE = np.dtype([
     ("brk_into_debugger", np.uint8),
     ("unused2", np.uint8, 5),
 
-    ("unused3", np.uint64, 6), # fill header to 128 bytes
+    # location of the memory access that triggered a watchpoint
+    ("watchpoint_pc", np.int32),
+    ("watchpoint_address", np.int32),
+    ("watchpoint_old_value", np.uint8),
+    ("watchpoint_new_value", np.uint8),
+    ("watchpoint_access_type", np.uint8),
+    ("skip_output", np.uint8),
+    ("unused4", np.uint8, 4),
+
+    ("unused3", np.uint64, 4), # fill header to 128 bytes
 
     ("memory_access", np.uint8, MAIN_MEMORY_SIZE),
     ("access_type", np.uint8, MAIN_MEMORY_SIZE),
@@ -54,11 +63,28 @@ TOKEN_LIST_SIZE = (NUM_BREAKPOINT_ENTRIES * TOKENS_PER_BREAKPOINT)
 DEBUGGER_COMMANDS_DTYPE = np.dtype([
     ("num_breakpoints", np.uint32),
     ("last_pc", np.int32),
-    ("unused", np.uint32, 14),
+    ("compiled", np.int32),
+    ("num_compiled", np.int32),
+    ("num_unguarded", np.int32),
+    ("watchpoint_hit", np.int32),
+    ("unused", np.uint32, 10),
     ("reference_value", np.int64, NUM_BREAKPOINT_ENTRIES),
     ("breakpoint_type", np.uint8, NUM_BREAKPOINT_ENTRIES),
     ("breakpoint_status", np.uint8, NUM_BREAKPOINT_ENTRIES),
     ("tokens", np.uint16, TOKEN_LIST_SIZE),
+
+    # compiled conditions, filled by compiler.compile_breakpoints
+    ("guard_type", np.uint8, NUM_BREAKPOINT_ENTRIES),
+    ("compiled_ids", np.uint8, NUM_BREAKPOINT_ENTRIES),
+    ("unguarded_ids", np.uint8, NUM_BREAKPOINT_ENTRIES),
+    ("guard_pc", np.uint16, NUM_BREAKPOINT_ENTRIES),
+    ("pc_bitmap", np.uint8, MAIN_MEMORY_SIZE // 8),
+    ("bytecode", np.uint16, TOKEN_LIST_SIZE),
+
+    # watchpoints
+    ("watch_pages", np.uint8, 256),
+    ("watch_mask", np.uint8, MAIN_MEMORY_SIZE),
+    ("watch_id", np.uint8, MAIN_MEMORY_SIZE),
 ])
 
 # Breakpoints are address of PC to break at before executing code at that
@@ -77,6 +103,25 @@ DEBUGGER_COMMANDS_DTYPE = np.dtype([
 # condition whether the watchpoint should be triggered. True is a non-zero
 # value and false is zero.
 
+# The token lists are not evaluated directly. Before running the emulator, the
+# enabled conditional breakpoints are compiled (see `compiler.py`) into
+# bytecode stored in the `bytecode` list at the same index as their tokens,
+# and `compiled` is set. Breakpoints whose condition includes a test of the PC
+# against a constant are guarded by that address: the bit for the address is
+# set in `pc_bitmap` and the bytecode is only evaluated when the PC matches
+# `guard_pc`. `unguarded_ids` lists the breakpoints that must be evaluated
+# after every instruction, and `compiled_ids` lists all of the compiled
+# breakpoints, for when the PC bit is set.
+
+# Memory watchpoints are breakpoints of type BREAKPOINT_WATCHPOINT. Each
+# address can be watched by one watchpoint: `watch_id` holds its id and
+# `watch_mask` the access types (ACCESS_TYPE_READ and/or ACCESS_TYPE_WRITE)
+# that trigger it. The CPU memory access functions only look at those arrays
+# if the address's page is marked in `watch_pages`, which is created when the
+# breakpoints are compiled. A triggering access is recorded in the frame
+# status (`watchpoint_pc`, `watchpoint_address`, etc.) and the watchpoint
+# fires as a breakpoint before the next instruction.
+
 # Breakpoint/watchpoint status values. For watchpoints, the status value can be
 # changed by the watchpoint processor if it finds a problem in a rule. Note
 # that watchpoints are only processed when their status is BREAKPOINT_ENABLED,
@@ -101,6 +146,13 @@ BREAKPOINT_INFINITE_LOOP = 0x5
 BREAKPOINT_BRK_INSTRUCTION = 0x6
 BREAKPOINT_PAUSE_AT_FRAME_START = 0x7
 BREAKPOINT_COUNT_LINES = 0x8
+BREAKPOINT_WATCHPOINT = 0x9
+
+
+# guard types for compiled breakpoints
+BREAKPOINT_GUARD_NONE = 0  # evaluate after every instruction
+BREAKPOINT_GUARD_PC = 1  # evaluate only when the PC is guard_pc
+BREAKPOINT_GUARD_NEVER = 2  # condition can never be true
 
 
 # contitional breakpoint definitions
@@ -166,3 +218,38 @@ OPCODE_READ = 1
 OPCODE_WRITE = 2
 OPCODE_RETURN = 4
 OPCODE_INTERRUPT = 8
+
+
+# compiled condition bytecode: the operation is in the low bits of each word;
+# for BYTECODE_EMU and BYTECODE_EMU_ARG the upper bits hold the token (without
+# VALUE_ARGUMENT) to pass to the emulator's register callback. BYTECODE_NUMBER
+# and BYTECODE_EMU_ARG are followed by a word holding the value or argument.
+
+BYTECODE_OP_MASK = 0x1f
+BYTECODE_OPERAND_SHIFT = 5
+BYTECODE_MAX_OPERAND = 0xffff >> BYTECODE_OPERAND_SHIFT
+
+BYTECODE_END = 0
+BYTECODE_NUMBER = 1
+BYTECODE_EMU = 2
+BYTECODE_EMU_ARG = 3
+BYTECODE_PLUS = 4
+BYTECODE_MINUS = 5
+BYTECODE_MULT = 6
+BYTECODE_DIV = 7
+BYTECODE_EXP = 8
+BYTECODE_LSHIFT = 9
+BYTECODE_RSHIFT = 10
+BYTECODE_BITWISE_AND = 11
+BYTECODE_BITWISE_OR = 12
+BYTECODE_LOGICAL_AND = 13
+BYTECODE_LOGICAL_OR = 14
+BYTECODE_EQ = 15
+BYTECODE_NE = 16
+BYTECODE_LT = 17
+BYTECODE_LE = 18
+BYTECODE_GT = 19
+BYTECODE_GE = 20
+BYTECODE_UMINUS = 21
+BYTECODE_BITWISE_NOT = 22
+BYTECODE_LOGICAL_NOT = 23
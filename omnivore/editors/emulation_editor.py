@@ -278,17 +278,10 @@ class EmulationEditor(ByteEditor):
             start, end = end, start
         doc = self.document
         emu = doc.emulator
-        frames = []
-        save = (emu.current_frame_number, emu.current_restart.restart_number)
-        restart_number = end.restart_number
-        frame_number = end.frame_number
-        while frame_number >= start.frame_number:
-            emu.restore_restart(restart_number, frame_number)
-            frame = emu.get_frame_rgb(frame_number)
-            frame = frame.copy()  # need copy rather than reference to same data storage space
-            frames.append(frame)
-            frame_number -= 1
-        frames.reverse()
+        save = (emu.current_restart.restart_number, emu.current_frame_number)
+        # frames are looked up in the current restart
+        emu.restore_restart(end.restart_number, end.frame_number)
+        frames = emu.get_frames_rgb(range(start.frame_number, end.frame_number + 1))
         emu.restore_restart(*save)
         return (self.document.framerate, frames)
 
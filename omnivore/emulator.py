@@ -8,8 +8,11 @@ import numpy as np
 from atrip import find_container
 
 from .debugger import Debugger
-from .debugger.dtypes import FRAME_STATUS_DTYPE
+from .debugger.dtypes import FRAME_STATUS_DTYPE, DEBUGGER_COMMANDS_DTYPE
 from .utils.historyutil import RestartTree
+from .utils.framestore import FrameStore
+from .utils.cpuhistory import HistoryQuery, FrameCheckpoints
+from .utils.cputrace import CpuTrace
 from atrip import disassembler as disasm
 from .utils.templateutil import load_memory_map
 from . import errors
@@ -33,9 +36,6 @@ INPUT_DTYPE = np.dtype([
 import logging
 log = logging.getLogger(__name__)
 
-KFEST_HACK = False
-
-
 # Values must correspond to values in libdebugger.h
 FRAME_START = 0
 FRAME_FINISHED = 1
@@ -62,13 +62,17 @@ class Emulator(Debugger):
 
     history_entry_dtype = disasm.dd.HISTORY_ENTRY_DTYPE
 
+    # save snapshots in the restart tree
+    frame_history_enabled = True
+
+    # frames between snapshots; the input of every frame is recorded, so the
+    # frames in between are rebuilt by replaying from the previous snapshot
+    snapshot_interval = 10
+
     def __init__(self):
         Debugger.__init__(self)
-        self.input_raw = np.zeros([self.input_array_dtype.itemsize], dtype=np.uint8)
-        self.input = self.input_raw.view(dtype=self.input_array_dtype)
-        self.output_raw = np.zeros([FRAME_STATUS_DTYPE.itemsize + self.output_array_dtype.itemsize], dtype=np.uint8)
-        self.status = self.output_raw[0:FRAME_STATUS_DTYPE.itemsize].view(dtype=FRAME_STATUS_DTYPE)
-        self.output = self.output_raw[FRAME_STATUS_DTYPE.itemsize:].view(dtype=self.output_array_dtype)
+        input_size, output_size = self.calc_io_array_sizes()
+        self.set_io_arrays(np.zeros([input_size], dtype=np.uint8), np.zeros([output_size], dtype=np.uint8))
         self.num_stringified_lines = 500
         self.stringified_lines = disasm.StringifiedHistory(self.num_stringified_lines)
         self.bootfile = None
@@ -82,10 +86,42 @@ class Emulator(Debugger):
         self.forced_modifier = None
         self.emulator_started = False
         self.cpu_history = None
+        self.cpu_trace = None
         self.labels = None
 
         self.compute_color_map()
+        self.palette_rgb, self.palette_rgba = self.calc_palettes()
         self.screen_rgb, self.screen_rgba = self.calc_screens()
+        self.screen_index = np.empty((self.height, self.width), dtype=np.intp)
+
+    @classmethod
+    def calc_io_array_sizes(cls):
+        """Return the number of bytes needed for the input and output arrays
+        """
+        return cls.input_array_dtype.itemsize, FRAME_STATUS_DTYPE.itemsize + cls.output_array_dtype.itemsize
+
+    @classmethod
+    def get_headless_class(cls):
+        """Return a version of this emulator class without any user
+        interface mixins, for use where there is no GUI (e.g. in worker
+        processes)
+        """
+        bases = tuple(b for b in cls.__bases__ if not getattr(b, 'is_ui_mixin', False))
+        if bases == cls.__bases__:
+            return cls
+        namespace = {k: v for k, v in cls.__dict__.items() if k not in ('__dict__', '__weakref__')}
+        return type(cls.__name__ + "Headless", bases, namespace)
+
+    def set_io_arrays(self, input_raw, output_raw):
+        """Use the given uint8 arrays (which may be backed by shared memory)
+        as the input and output arrays. Must be called before
+        `configure_emulator`.
+        """
+        self.input_raw = input_raw
+        self.input = self.input_raw.view(dtype=self.input_array_dtype)
+        self.output_raw = output_raw
+        self.status = self.output_raw[0:FRAME_STATUS_DTYPE.itemsize].view(dtype=FRAME_STATUS_DTYPE)
+        self.output = self.output_raw[FRAME_STATUS_DTYPE.itemsize:].view(dtype=self.output_array_dtype)
 
     @property
     def raw_array(self):
@@ -147,6 +183,14 @@ class Emulator(Debugger):
     def current_scan_line_in_frame(self):
         return self.status['current_scan_line_in_frame'][0]
 
+    @property
+    def watchpoint_hit(self):
+        """The memory access that triggered the most recent watchpoint, as a
+        tuple of (pc, address, access type, old value, new value)
+        """
+        s = self.status[0]
+        return (int(s['watchpoint_pc']), int(s['watchpoint_address']), int(s['watchpoint_access_type']), int(s['watchpoint_old_value']), int(s['watchpoint_new_value']))
+
     @property
     def stack_pointer(self):
         raise NotImplementedError("define stack_pointer property in subclass")
@@ -188,11 +232,55 @@ class Emulator(Debugger):
     def compute_color_map(self):
         pass
 
+    def calc_palettes(self):
+        """Return the 256 entry palettes used to convert color indexed
+        screens: RGB as uint8 [256, 3], and RGBA as uint32 with the bytes in
+        RGBA order. Uses the rmap, gmap & bmap set by `compute_color_map`,
+        or grayscale if there aren't any.
+        """
+        palette = np.empty((256, 4), dtype=np.uint8)
+        try:
+            palette[:,0] = self.rmap
+            palette[:,1] = self.gmap
+            palette[:,2] = self.bmap
+        except AttributeError:
+            palette[:,0:3] = np.arange(256, dtype=np.uint8)[:,np.newaxis]
+        palette[:,3] = 255
+        return palette[:,0:3].copy(), palette.view(np.uint32).reshape(256)
+
     def calc_screens(self):
         rgb = np.empty((self.height, self.width, 3), np.uint8)
-        rgba = np.empty((self.height, self.width, 4), np.uint8)
+        # backed by uint32 so the RGBA palette can be used directly
+        rgba = np.empty((self.height, self.width), np.uint32).view(np.uint8).reshape((self.height, self.width, 4))
         return rgb, rgba
 
+    def convert_to_rgb(self, raw, out=None):
+        """Convert a color indexed screen to RGB, into `out` if specified or
+        the reusable `screen_rgb` array otherwise.
+        """
+        if out is None:
+            out = self.screen_rgb
+        index = self.screen_index
+        index[...] = raw
+        np.take(self.palette_rgb, index, axis=0, out=out, mode='clip')
+        return out
+
+    def convert_to_rgba(self, raw, out=None):
+        """Convert a color indexed screen to RGBA, into `out` if specified
+        or the reusable `screen_rgba` array otherwise. `out` may be a
+        [height, width, 4] uint8 array or a [height, width] uint32 array.
+        """
+        if out is None:
+            out = self.screen_rgba
+        if out.dtype == np.uint32:
+            dest = out
+        else:
+            dest = out.view(np.uint32).reshape(out.shape[0:2])
+        index = self.screen_index
+        index[...] = raw
+        np.take(self.palette_rgba, index, out=dest, mode='clip')
+        return out
+
     ##### Serialization
 
     def restore_computed_attributes(self, state):
@@ -321,20 +409,52 @@ class Emulator(Debugger):
     def generate_save_state_memory_blocks(self):
         pass
 
-    def next_frame(self):
+    def next_frame(self, skip_output=False):
+        """Emulate until the end of the frame or a breakpoint, returning the
+        breakpoint or None.
+
+        If `skip_output` is true, the frame is run in turbo mode: the video
+        and the save state aren't copied to the output array, the memory
+        access array isn't faded, no CPU history is recorded and no snapshot
+        is saved in the restart tree. Breakpoints and frame events still
+        work as usual.
+        """
         self.process_key_state()
         if not self.is_frame_finished:
             print(f"next_frame: continuing frame from cycle {self.current_cycle_in_frame} of frame {self.current_frame_number}")
-        if KFEST_HACK:
-            self.kfest_before_history_count = len(self.cpu_history)
-        bpid = self.low_level_interface.next_frame(self.input, self.output_raw, self.debug_cmd, self.cpu_history)
+        else:
+            if self.frame_history_enabled:
+                self.current_restart.save_input(self.current_frame_number + 1, self.input_raw)
+            if not skip_output:
+                self.cpu_history_checkpoints.add(self.current_frame_number + 1, self.cpu_history.cumulative_count)
+        self.compile_breakpoints()
+        self.status['skip_output'] = 1 if skip_output else 0
+        history = None if skip_output else self.cpu_history
+        bpid = self.low_level_interface.next_frame(self.input, self.output_raw, self.debug_cmd, history)
+        self.status['skip_output'] = 0
+        self.record_cpu_trace()
         if self.is_frame_finished:
             self.frame_count += 1
             self.process_frame_events()
-            self.save_history()
+            if not skip_output:
+                self.save_history()
         self.forced_modifier = None
         return self.get_breakpoint(bpid)
 
+    def fast_forward(self, num_frames):
+        """Emulate up to `num_frames` frames in turbo mode, producing output
+        only for the last one.
+
+        Stops early at a breakpoint, which is returned (the output of that
+        frame is incomplete, as it is for any frame stopped at a
+        breakpoint). Returns None if all frames were emulated.
+        """
+        for i in range(num_frames - 1):
+            bp = self.next_frame(skip_output=True)
+            if bp is not None:
+                return bp
+        return self.next_frame()
+
     def process_frame_events(self):
         still_waiting = []
         for count, callback in self.frame_event:
@@ -439,11 +559,29 @@ class Emulator(Debugger):
 
     #### history/checkpoints
 
-    def init_restart_tree(self):
+    def init_restart_tree(self, frame_store_path=None):
+        """Start a new restart tree. If `frame_store_path` is given, frames
+        are saved to a frame store in that directory instead of memory. Any
+        frames already stored there are discarded; use `open_restart_tree` to
+        continue a previous session.
+        """
         self.frame_count = 0
-        self.restart_tree = RestartTree()
+        if frame_store_path is not None:
+            self.restart_tree = RestartTree(frame_store=FrameStore(frame_store_path, new=True), snapshot_interval=self.snapshot_interval)
+        else:
+            self.restart_tree = RestartTree(snapshot_interval=self.snapshot_interval)
         self.current_restart = self.restart_tree.emulator_start
 
+    def open_restart_tree(self, frame_store_path):
+        """Reopen the restart tree saved in a frame store by a previous
+        session, and restore the last frame of the most recent restart.
+        """
+        self.restart_tree = RestartTree.from_frame_store(frame_store_path)
+        self.current_restart = self.restart_tree[-1]
+        self.frame_count = self.current_restart.end_frame
+        if len(self.current_restart.frame_history) > 0:
+            self.restore_history(self.current_restart.end_frame)
+
     def get_restart_summary(self):
         return self.restart_tree.get_summary()
 
@@ -463,22 +601,18 @@ class Emulator(Debugger):
         # entries but makes things extremely easy to manage. Simply delete
         # a history entry by setting it to NONE.
         frame_number = int(self.status['frame_number'][0])
-        if force or self.current_restart.is_memorable(frame_number):
+        if force or (self.frame_history_enabled and self.current_restart.is_memorable(frame_number)):
             log.debug(f"Saving history at {frame_number}")
             d = self.calc_current_state()
             self.current_restart.save_frame(frame_number, d)
-            if KFEST_HACK:
-                try:
-                    for i in range(self.kfest_before_history_count, len(self.cpu_history)):
-                        self.kfest_history_to_frame_number[i] = frame_number
-                    self.kfest_frame_number_to_history[frame_number] = (self.kfest_before_history_count, len(self.cpu_history))
-                except IndexError:
-                    raise
             # self.print_history(frame_number)
 
     def get_history(self, frame_number):
         frame_number = int(frame_number)
-        raw = self.current_restart[frame_number]
+        try:
+            raw = self.current_restart[frame_number]
+        except KeyError:
+            raw = self.calc_rebuilt_state(self.current_restart.restart_number, frame_number)
         status = raw[0:FRAME_STATUS_DTYPE.itemsize].view(dtype=FRAME_STATUS_DTYPE)
         output = raw[FRAME_STATUS_DTYPE.itemsize:].view(dtype=self.output_array_dtype)
         return status, output
@@ -490,17 +624,59 @@ class Emulator(Debugger):
     def restore_restart(self, restart_number, frame_number):
         print(f"restoring restart {restart_number} from frame number {frame_number}")
         try:
-            restart = self.restart_tree[restart_number]
+            self.rebuild_frame(restart_number, frame_number)
         except IndexError:
             log.error(f"{restart_number} not in history")
-        else:
-            try:
-                d = self.current_restart[frame_number]
-            except KeyError:
-                log.error(f"{frame_number} not in restart {restart_number}")
-            else:
-                self.current_restart = restart
-                self.restore_state(d)
+        except KeyError:
+            log.error(f"{frame_number} not in restart {restart_number}")
+
+    def rebuild_frame(self, restart_number, frame_number):
+        """Restore the state at the end of the frame. If the frame isn't a
+        snapshot, the most recent snapshot before it is restored and the
+        frames after it are replayed in turbo mode using the recorded
+        inputs. Breakpoints are ignored and no CPU history is recorded
+        during the replay.
+
+        Raises IndexError if the restart doesn't exist or KeyError if the
+        frame can't be rebuilt.
+        """
+        restart = self.restart_tree[restart_number]
+        frame_number = int(frame_number)
+        snapshot_restart, snapshot_frame = restart.find_snapshot(frame_number)
+        inputs = [restart.get_input(f) for f in range(snapshot_frame + 1, frame_number + 1)]
+        if any(input_raw is None for input_raw in inputs):
+            raise KeyError(f"missing input to replay from frame {snapshot_frame} to {frame_number}")
+        self.restore_state(snapshot_restart.frame_history[snapshot_frame])
+        self.current_restart = restart
+        if inputs:
+            saved_input = self.input_raw.copy()
+            for i, input_raw in enumerate(inputs):
+                self.input_raw[:] = input_raw
+                self.replay_frame(i < len(inputs) - 1)
+            self.input_raw[:] = saved_input
+
+    def replay_frame(self, skip_output):
+        try:
+            replay_cmd = self.replay_debug_cmd
+        except AttributeError:
+            # no breakpoints
+            replay_cmd = self.replay_debug_cmd = np.zeros(1, dtype=DEBUGGER_COMMANDS_DTYPE)
+        self.status['skip_output'] = 1 if skip_output else 0
+        self.low_level_interface.next_frame(self.input, self.output_raw, replay_cmd, None)
+        self.status['skip_output'] = 0
+
+    def calc_rebuilt_state(self, restart_number, frame_number):
+        """Return a copy of the state at the end of the frame, rebuilding it
+        if necessary, without changing the current state of the emulator
+        """
+        saved_state = self.calc_current_state()
+        saved_restart = self.current_restart
+        try:
+            self.rebuild_frame(restart_number, frame_number)
+            return self.calc_current_state()
+        finally:
+            self.restore_state(saved_state)
+            self.current_restart = saved_restart
 
     def kfest_step_history(self, frame_number, step_to):
         from atrip.disassembler import flags, dd
@@ -516,10 +692,10 @@ class Emulator(Debugger):
                 mem_to_screen_xy[addr:addr+40] = np.arange(x, x+40, dtype=np.uint16)
                 print(mem_to_screen_xy[addr:addr+40])
             self.mem_to_screen_xy = mem_to_screen_xy
-        low, high = self.kfest_frame_number_to_history[frame_number]
+        low, high = self.get_cpu_history_frame_range(frame_number)
         print(f"kfest_step_history: {low}->{high}: {step_to}")
         for row in range(low, step_to):
-            h = self.cpu_history[row].view(dtype=dd.HISTORY_6502_DTYPE)
+            h = self.visible_cpu_history[row].view(dtype=dd.HISTORY_6502_DTYPE)
             # print(f"{row}: {h}")
             t = h['disassembler_type']
             if t == flags.DISASM_6502_HISTORY:
@@ -563,7 +739,10 @@ class Emulator(Debugger):
     def restore_restart_plus(self, restart_number, frame_number, num_instructions):
         self.restore_restart(restart_number, frame_number)
         self.step_into(num_instructions)
+        self.cpu_history_checkpoints.add(self.current_frame_number + 1, self.cpu_history.cumulative_count)
+        self.compile_breakpoints()
         bpid = self.low_level_interface.next_frame(self.input, self.output_raw, self.debug_cmd, self.cpu_history)
+        self.record_cpu_trace()
         if self.is_frame_finished:
             self.frame_count += 1
             self.process_frame_events()
@@ -577,15 +756,9 @@ class Emulator(Debugger):
         if frame_number < 0:
             return
         try:
-            d = self.current_restart[frame_number]
+            self.rebuild_frame(self.current_restart.restart_number, frame_number)
         except KeyError:
             log.error(f"{frame_number} not in history")
-            pass
-        else:
-            self.restore_state(d)
-            # self.current_restart[(frame_number + 1):] = []  # remove frames newer than this
-            # print(("  %d items remain in history" % len(self.current_restart)))
-            # self.frame_event = []
 
     def print_history(self, frame_number):
         d = self.current_restart[frame_number]
@@ -607,26 +780,50 @@ class Emulator(Debugger):
         """
         pass
 
-    def get_frame_rgb(self, frame_number=-1):
+    def get_frame_rgb(self, frame_number=-1, out=None):
         """Return RGB image of the current screen
         """
+        return self.convert_to_rgb(self.get_color_indexed_screen(frame_number), out)
 
-    def get_frame_rgba(self, frame_number=-1):
+    def get_frame_rgba(self, frame_number=-1, out=None):
         """Return RGBA image of the current screen
         """
+        return self.convert_to_rgba(self.get_color_indexed_screen(frame_number), out)
 
-    def get_frame_rgba_opengl(self, frame_number=-1):
+    def get_frame_rgba_opengl(self, frame_number=-1, out=None):
         """Return RGBA image of the current screen, suitable for use with
         OpenGL (flipped vertically)
         """
+        return self.convert_to_rgba(self.get_color_indexed_screen(frame_number)[::-1], out)
+
+    def get_frames_rgb(self, frame_numbers, out=None):
+        """Return RGB images of the frames in the current restart as a
+        single [num frames, height, width, 3] array, e.g. for exporting video
+        """
+        if out is None:
+            out = np.empty((len(frame_numbers), self.height, self.width, 3), dtype=np.uint8)
+        for i, frame_number in enumerate(frame_numbers):
+            self.convert_to_rgb(self.get_color_indexed_screen(frame_number), out[i])
+        return out
+
+    def get_frames_rgba(self, frame_numbers, out=None):
+        """Return RGBA images of the frames in the current restart as a
+        single [num frames, height, width, 4] array
+        """
+        if out is None:
+            out = np.empty((len(frame_numbers), self.height, self.width), dtype=np.uint32).view(np.uint8).reshape((len(frame_numbers), self.height, self.width, 4))
+        for i, frame_number in enumerate(frame_numbers):
+            self.convert_to_rgba(self.get_color_indexed_screen(frame_number), out[i])
+        return out
 
     # CPU history
 
     def init_cpu_history(self, num_entries):
         self.cpu_history = disasm.HistoryStorage(num_entries)
-        if KFEST_HACK:
-            self.kfest_history_to_frame_number = [0]*num_entries
-            self.kfest_frame_number_to_history = {}
+        self.cpu_history_checkpoints = FrameCheckpoints()
+        self.cpu_history_query = HistoryQuery(self.cpu_history, self.cpu_history_checkpoints)
+        if self.cpu_trace is not None:
+            self.cpu_trace.sync(self.cpu_history)
 
     def cpu_history_show_range(self, from_index, details=False):
         self.cpu_history.debug_range(from_index)
@@ -634,6 +831,33 @@ class Emulator(Debugger):
     def cpu_history_show_next_instruction(self):
         self.low_level_interface.show_next_instruction(self.cpu_history)
 
+    def start_cpu_trace(self, path):
+        """Record all CPU history from now on to the trace in the directory
+        `path`, appending to it if it already exists
+        """
+        self.stop_cpu_trace()
+        self.cpu_trace = CpuTrace(path, self.history_entry_dtype)
+        self.cpu_trace.sync(self.cpu_history)
+
+    def stop_cpu_trace(self):
+        if self.cpu_trace is not None:
+            self.cpu_trace.close()
+            self.cpu_trace = None
+
+    def record_cpu_trace(self):
+        if self.cpu_trace is not None:
+            frame_number = self.current_frame_number if self.is_frame_finished else None
+            self.cpu_trace.record(self.cpu_history, frame_number)
+
+    @property
+    def visible_cpu_history(self):
+        """The CPU history shown to the user: the trace if one is being
+        recorded, otherwise the history ring
+        """
+        if self.cpu_trace is not None:
+            return self.cpu_trace
+        return self.cpu_history
+
     def calc_stringified_history(self, start_index, count):
         """Returns an list of indexes into the entries array for the
         range of history requested.
@@ -643,11 +867,49 @@ class Emulator(Debugger):
         display window (which ranges from 0 -> count) to the history entry
         starting at first_entry_index + start_index for count entries.
         """
-        return self.cpu_history.stringify_to(self.stringified_lines, start_index, count)
+        return self.visible_cpu_history.stringify_to(self.stringified_lines, start_index, count)
 
     @property
     def num_cpu_history_entries(self):
-        return len(self.cpu_history)
+        return len(self.visible_cpu_history)
+
+    def find_cpu_history(self, first_frame=None, last_frame=None, **kwargs):
+        """Return the rows of the CPU history matching the criteria; see
+        `cpuhistory.calc_mask` for the keyword arguments.
+        """
+        if self.cpu_trace is not None:
+            return self.cpu_trace.find(first_frame, last_frame, **kwargs)
+        return self.cpu_history_query.find(first_frame, last_frame, **kwargs)
+
+    def find_previous_cpu_history(self, row, **kwargs):
+        if self.cpu_trace is not None:
+            return self.cpu_trace.find_previous(row, **kwargs)
+        return self.cpu_history_query.find_previous(row, **kwargs)
+
+    def find_next_cpu_history(self, row, **kwargs):
+        if self.cpu_trace is not None:
+            return self.cpu_trace.find_next(row, **kwargs)
+        return self.cpu_history_query.find_next(row, **kwargs)
+
+    def find_cpu_history_frame_number(self, row):
+        """Return the frame number of the CPU history row, or None if it
+        can't be determined
+        """
+        if self.cpu_trace is not None:
+            return self.cpu_trace.find_frame_number(row)
+        q = self.cpu_history_query
+        frame_numbers = q.calc_frame_numbers(q.get_entries(row))
+        if len(frame_numbers) == 0 or frame_numbers[0] < 0:
+            return None
+        return int(frame_numbers[0])
+
+    def get_cpu_history_frame_range(self, frame_number):
+        """Return the (start, end) rows of the frame in the CPU history, or
+        None if it isn't available
+        """
+        if self.cpu_trace is not None:
+            return self.cpu_trace.get_frame_range(frame_number)
+        return self.cpu_history_query.calc_checkpoint_rows(frame_number, frame_number)
 
 
 _emulators = None
@@ -0,0 +1,331 @@
+"""Headless emulators running in worker processes
+
+The low-level emulators keep their state in C globals, so only one instance
+can run in a process. An `EmulatorPool` runs one headless emulator (the
+emulator class without its GUI mixins) in each of a number of worker
+processes, so batch jobs like regression playback of many files can use all
+the cores.
+
+Each worker's emulator uses input and output arrays in shared memory, so the
+current frame can be read by the parent without copying or pickling it.
+Commands and small results (breakpoint ids, frame numbers) go over a pipe.
+A `PlaybackJob` is sent to a worker once and runs to completion there, and
+only the frames and CPU history requested by the job are sent back.
+"""
+import os
+import inspect
+import multiprocessing
+import multiprocessing.connection
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .emulator import find_emulator
+from .debugger.dtypes import FRAME_STATUS_DTYPE
+from . import errors
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class PlaybackJob:
+    """A file to boot and run for a number of frames.
+
+    `inputs`, if given, is an array of input records (using the emulator's
+    `input_array_dtype`), one per frame; frames past the end of the array
+    get no input. `breakpoints` is a list of addresses at which to record
+    the frame and program counter. `capture_frames` is a list of frame
+    indexes (counting from zero at the start of the job) whose video is
+    returned; by default only the last frame is captured. If
+    `capture_history` is true, the CPU history recorded during the job (up
+    to the size of the history buffer) is returned.
+    """
+    # stop a job that keeps hitting breakpoints without finishing frames
+    max_breakpoints = 10000
+
+    def __init__(self, pathname, num_frames, inputs=None, breakpoints=None, capture_frames=None, capture_history=False):
+        self.pathname = pathname
+        self.num_frames = num_frames
+        self.inputs = inputs
+        self.breakpoints = list(breakpoints) if breakpoints is not None else []
+        if capture_frames is None:
+            capture_frames = [num_frames - 1]
+        self.capture_frames = set(capture_frames)
+        self.capture_history = capture_history
+
+    def __str__(self):
+        return f"PlaybackJob {self.pathname}: {self.num_frames} frames"
+
+
+class PlaybackResult:
+    def __init__(self, job):
+        self.job = job
+        self.frame_number = 0
+        self.video = {}  # frame index -> video array
+        self.breakpoints = []  # (frame index, breakpoint id, program counter)
+        self.history = None
+        self.error = None
+
+    def __str__(self):
+        if self.error:
+            return f"PlaybackResult {self.job.pathname}: {self.error}"
+        return f"PlaybackResult {self.job.pathname}: frame {self.frame_number}, {len(self.video)} captured frames, {len(self.breakpoints)} breakpoints"
+
+
+def get_emulator_class(emulator):
+    """Return the emulator class given its name or the class itself, which
+    doesn't have to be one of the installed emulators
+    """
+    if inspect.isclass(emulator):
+        return emulator
+    return find_emulator(emulator)
+
+
+#### worker process
+
+def run_playback_job(emu, job):
+    result = PlaybackResult(job)
+    emu.boot_from_file(job.pathname)
+    emu.clear_all_breakpoints()
+    for addr in job.breakpoints:
+        emu.create_breakpoint(addr)
+    history = emu.cpu_history
+    start_count = history.cumulative_count
+    inputs = job.inputs
+    frame_index = 0
+    while frame_index < job.num_frames:
+        if inputs is not None and frame_index < len(inputs):
+            emu.input[0] = inputs[frame_index]
+        else:
+            emu.clear_keys()
+        # frames that aren't captured are emulated in turbo mode
+        skip_output = not job.capture_history and frame_index not in job.capture_frames
+        bp = emu.next_frame(skip_output)
+        if bp is not None:
+            result.breakpoints.append((frame_index, int(bp.id), int(emu.program_counter)))
+            if len(result.breakpoints) >= job.max_breakpoints:
+                result.error = f"stopped after {job.max_breakpoints} breakpoints"
+                break
+            continue
+        if frame_index in job.capture_frames:
+            result.video[frame_index] = emu.video_array.copy()
+        frame_index += 1
+    result.frame_number = int(emu.current_frame_number)
+    if job.capture_history:
+        count = min(history.cumulative_count - start_count, len(history))
+        allocated = len(history.entries)
+        index = (history.first_entry_index + np.arange(len(history) - count, len(history))) % allocated
+        result.history = history.entries[index]
+    return result
+
+
+def run_worker(conn, emulator_cls, input_name, output_name, emu_args, instruction_history_count):
+    input_shm = shared_memory.SharedMemory(name=input_name)
+    output_shm = shared_memory.SharedMemory(name=output_name)
+    try:
+        emu = emulator_cls.get_headless_class()()
+        input_size, output_size = emu.calc_io_array_sizes()
+        emu.set_io_arrays(np.ndarray(input_size, dtype=np.uint8, buffer=input_shm.buf), np.ndarray(output_size, dtype=np.uint8, buffer=output_shm.buf))
+        emu.frame_history_enabled = False
+        emu.configure_emulator(emu_args, instruction_history_count)
+    except Exception as e:
+        conn.send(("error", f"{e.__class__.__name__}: {e}"))
+        return
+    conn.send(("ok", os.getpid()))
+    while True:
+        try:
+            cmd, arg = conn.recv()
+        except EOFError:
+            break
+        if cmd == "quit":
+            break
+        try:
+            if cmd == "boot":
+                emu.boot_from_file(arg)
+                value = int(emu.current_frame_number)
+            elif cmd == "frame":
+                bp = emu.next_frame()
+                value = -1 if bp is None else int(bp.id)
+            elif cmd == "job":
+                value = run_playback_job(emu, arg)
+            else:
+                raise ValueError(f"unknown command {cmd}")
+        except Exception as e:
+            log.error(f"worker {os.getpid()}: {cmd}: {e}")
+            conn.send(("error", f"{e.__class__.__name__}: {e}"))
+        else:
+            conn.send(("ok", value))
+
+    # the arrays must be released before the shared memory can be closed
+    del emu
+    input_shm.close()
+    output_shm.close()
+
+
+#### parent process
+
+class EmulatorWorker:
+    """Handle to a headless emulator running in a worker process.
+
+    `input` and `output_raw` (and the `status` and `output` views) are shared
+    with the emulator, so input can be set and the current frame read
+    directly between calls to `next_frame`.
+
+    `emulator_name` is the name of an installed emulator or an emulator
+    class.
+    """
+    def __init__(self, emulator_name, emu_args=None, instruction_history_count=100000, context=None):
+        if context is None:
+            context = multiprocessing.get_context()
+        emulator_cls = get_emulator_class(emulator_name)
+        self.emulator_name = emulator_cls.name
+        input_size, output_size = emulator_cls.calc_io_array_sizes()
+        self.input_shm = shared_memory.SharedMemory(create=True, size=input_size)
+        self.output_shm = shared_memory.SharedMemory(create=True, size=output_size)
+        self.input_raw = np.ndarray(input_size, dtype=np.uint8, buffer=self.input_shm.buf)
+        self.input_raw[:] = 0
+        self.input = self.input_raw.view(dtype=emulator_cls.input_array_dtype)
+        self.output_raw = np.ndarray(output_size, dtype=np.uint8, buffer=self.output_shm.buf)
+        self.output_raw[:] = 0
+        self.status = self.output_raw[0:FRAME_STATUS_DTYPE.itemsize].view(dtype=FRAME_STATUS_DTYPE)
+        self.output = self.output_raw[FRAME_STATUS_DTYPE.itemsize:].view(dtype=emulator_cls.output_array_dtype)
+
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=run_worker, args=(child_conn, emulator_cls, self.input_shm.name, self.output_shm.name, emu_args, instruction_history_count), daemon=True)
+        self.process.start()
+        child_conn.close()
+        try:
+            self.pid = self.receive()
+        except errors.EmulatorWorkerError:
+            self.close()
+            raise
+
+    def __str__(self):
+        return f"EmulatorWorker {self.emulator_name} pid={self.pid}"
+
+    def send(self, cmd, arg=None):
+        self.conn.send((cmd, arg))
+
+    def receive(self):
+        try:
+            status, value = self.conn.recv()
+        except EOFError:
+            raise errors.EmulatorWorkerError(f"{self.emulator_name} worker process exited")
+        if status == "error":
+            raise errors.EmulatorWorkerError(value)
+        return value
+
+    def call(self, cmd, arg=None):
+        self.send(cmd, arg)
+        return self.receive()
+
+    def boot(self, pathname):
+        return self.call("boot", pathname)
+
+    def next_frame(self):
+        """Run the emulator until the end of the frame or a breakpoint,
+        returning the breakpoint id or -1 if the frame finished
+        """
+        return self.call("frame")
+
+    def run_job(self, job):
+        return self.call("job", job)
+
+    @property
+    def current_frame_number(self):
+        return self.status['frame_number'][0]
+
+    @property
+    def video_array(self):
+        return self.output['video'][0]
+
+    def close(self):
+        if self.process is not None:
+            try:
+                self.send("quit")
+            except (BrokenPipeError, OSError):
+                pass
+            self.process.join(5)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process = None
+            self.conn.close()
+        # the arrays must be released before the shared memory can be closed
+        self.input_raw = self.input = None
+        self.output_raw = self.status = self.output = None
+        for shm in (self.input_shm, self.output_shm):
+            shm.close()
+            shm.unlink()
+
+
+class EmulatorPool:
+    """A number of headless emulators, one per worker process, for running
+    batches of `PlaybackJob`s in parallel.
+    """
+    def __init__(self, emulator_name="atari800", num_workers=None, emu_args=None, instruction_history_count=100000, context=None):
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+        self.workers = []
+        try:
+            for i in range(num_workers):
+                self.workers.append(EmulatorWorker(emulator_name, emu_args, instruction_history_count, context))
+        except:
+            self.close()
+            raise
+
+    def __len__(self):
+        return len(self.workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+        self.workers = []
+
+    def iter_results(self, jobs):
+        """Run the jobs on the workers, generating (job index, result) tuples
+        in the order the jobs finish.
+
+        Errors in a job are reported in the result's `error` attribute
+        rather than raised.
+        """
+        jobs = enumerate(jobs)
+        idle = list(self.workers)
+        running = {}  # connection -> (worker, job index, job)
+        while True:
+            while idle:
+                try:
+                    index, job = next(jobs)
+                except StopIteration:
+                    break
+                worker = idle.pop()
+                worker.send("job", job)
+                running[worker.conn] = (worker, index, job)
+            if not running:
+                break
+            for conn in multiprocessing.connection.wait(list(running.keys())):
+                worker, index, job = running.pop(conn)
+                try:
+                    result = worker.receive()
+                except errors.EmulatorWorkerError as e:
+                    if not worker.process.is_alive():
+                        raise
+                    result = PlaybackResult(job)
+                    result.error = str(e)
+                idle.append(worker)
+                yield index, result
+
+    def run(self, jobs):
+        """Run the jobs on the workers, returning the list of results in the
+        same order as the jobs
+        """
+        jobs = list(jobs)
+        results = [None] * len(jobs)
+        for index, result in self.iter_results(jobs):
+            results[index] = result
+        return results
@@ -242,29 +242,6 @@ class Atari800Mixin:
         #print "get_raw_screen", frame_number, raw
         return raw
 
-    def get_frame_rgb(self, frame_number=-1):
-        raw = self.get_color_indexed_screen(frame_number)
-        self.screen_rgb[:,:,0] = self.rmap[raw]
-        self.screen_rgb[:,:,1] = self.gmap[raw]
-        self.screen_rgb[:,:,2] = self.bmap[raw]
-        return self.screen_rgb
-
-    def get_frame_rgba(self, frame_number=-1):
-        raw = self.get_color_indexed_screen(frame_number)
-        self.screen_rgba[:,:,0] = self.rmap[raw]
-        self.screen_rgba[:,:,1] = self.gmap[raw]
-        self.screen_rgba[:,:,2] = self.bmap[raw]
-        self.screen_rgba[:,:,3] = 255
-        return self.screen_rgba
-
-    def get_frame_rgba_opengl(self, frame_number=-1):
-        raw = np.flipud(self.get_color_indexed_screen(frame_number))
-        self.screen_rgba[:,:,0] = self.rmap[raw]
-        self.screen_rgba[:,:,1] = self.gmap[raw]
-        self.screen_rgba[:,:,2] = self.bmap[raw]
-        self.screen_rgba[:,:,3] = 255
-        return self.screen_rgba
-
     ##### Input routines
 
     def get_special_key_actions(self):
@@ -321,6 +298,8 @@ try:
     import wx
 
     class wxMixin:
+        is_ui_mixin = True
+
         wx_to_akey = {
             wx.WXK_BACK: akey.AKEY_BACKSPACE,
             wx.WXK_DELETE: akey.AKEY_DELETE_CHAR,
@@ -494,7 +473,7 @@ try:
 
 except ImportError:
     class wxMixin:
-        pass
+        is_ui_mixin = True
 
 
 class Atari800(wxMixin, Atari800Mixin, Emulator):
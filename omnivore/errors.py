@@ -24,6 +24,13 @@ class EmulatorInUseError(EmulatorError):
     pass
 
 
+class EmulatorWorkerError(EmulatorError):
+    """Raised when an emulator running in a worker process reports an error
+    or the worker process dies.
+    """
+    pass
+
+
 class FrameNotFinishedError(EmulatorError):
     """Raised when an operation that must occur between frames is
     attempted while in the middle of a frame.
@@ -97,7 +97,7 @@ class JumpmanSelectMode(NormalSelectMode):
         # have it generate true/false values for each coordinate input pair.
         y, x = np.mgrid[:h,:w]
         allergic = np.logical_or((2 * y + 0x20 + hy) & 0x1f < 7, (x + 0x30 + hx) & 0x1f <= 7).astype(np.uint8) * style_bits.comment_bit_mask
-        style = screen.style
+        style = screen.writable_style
         style |= allergic.flat
 
 
@@ -472,7 +472,7 @@ class DrawCoinMode(DrawMode):
 
     def cleanup(self):
         v = self.control.segment_viewer
-        v.current_level.playfield.style[:] &= (0xff ^ style_bits.comment_bit_mask)
+        v.current_level.playfield.writable_style[:] &= (0xff ^ style_bits.comment_bit_mask)
 
     def get_caret(self):
         if self.is_bad_location:
@@ -40,6 +40,12 @@ class SegmentTable(cg.HexTable):
     def style(self):
         return self.linked_base.segment.style
 
+    def clear_selected_style(self):
+        self.segment.clear_style_bits(selected=True)
+
+    def set_selected_index_range(self, index1, index2):
+        self.segment.set_style_ranges([(index1, index2)], selected=True)
+
     def get_label_at_index(self, index):
         # Can't just return hex value of index because some segments (like the
         # raw sector segment) use different labels
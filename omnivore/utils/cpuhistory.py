@@ -0,0 +1,273 @@
+"""Vectorized searches of the CPU instruction history
+
+The CPU history (`HistoryStorage` from libudis) is a ring buffer of
+`HISTORY_ENTRY_DTYPE` records. Searches are done on the whole ring at once
+using numpy: the ring is viewed in chronological order (at most two
+contiguous slices, so the wraparound costs one copy) and the fields are used
+as columns to build boolean masks.
+
+Results are row numbers, counting from zero at the oldest entry in the ring,
+which is the same indexing used by `HistoryStorage.__getitem__` and the
+instruction history viewer.
+
+Entries can also be limited to a range of frames. The emulator records a
+`FrameCheckpoints` entry at the start of each frame giving the cumulative
+instruction count at that point, so finding the rows in a frame is a binary
+search. Without checkpoints (or for frames older than the first
+checkpoint), the frame of each entry is found from the DISASM_FRAME_END
+entries in the ring.
+"""
+import numpy as np
+
+from atrip.disassembler import flags, dd
+
+import logging
+log = logging.getLogger(__name__)
+
+
+# disassembler types of entries that describe an instruction using
+# HISTORY_6502_DTYPE or HISTORY_ATARI800_DTYPE
+instruction_types = [
+    flags.DISASM_6502_HISTORY,
+    flags.DISASM_ATARI800_HISTORY,
+    flags.DISASM_ATARI800_VBI_START,
+    flags.DISASM_ATARI800_VBI_END,
+    flags.DISASM_ATARI800_DLI_START,
+    flags.DISASM_ATARI800_DLI_END,
+]
+
+# result flags (flag & FLAG_RESULT_MASK) of instructions that access memory
+memory_write_flags = [
+    flags.FLAG_STORE_A_IN_MEMORY,
+    flags.FLAG_STORE_X_IN_MEMORY,
+    flags.FLAG_STORE_Y_IN_MEMORY,
+    flags.FLAG_MEMORY_ALTER,
+    flags.FLAG_MEMORY_READ_ALTER_A,
+]
+
+memory_read_flags = [
+    flags.FLAG_LOAD_A_FROM_MEMORY,
+    flags.FLAG_LOAD_X_FROM_MEMORY,
+    flags.FLAG_LOAD_Y_FROM_MEMORY,
+    flags.FLAG_PEEK_MEMORY,
+    flags.FLAG_MEMORY_READ_ALTER_A,
+]
+
+
+def unwrap_count(previous, count):
+    """Return the 64 bit value of the 32 bit counter `count`, given the
+    previous 64 bit value
+    """
+    delta = (int(count) - previous) & 0xffffffff
+    return previous + delta
+
+
+def calc_mask(entries, pc=None, pc_range=None, target_addr=None, opcode=None, operand=None, flag=None, disassembler_type=None):
+    """Return the boolean mask of the entries matching all of the given
+    criteria.
+
+    `pc_range` is (start, end), end not inclusive. `target_addr`,
+    `opcode`, `flag` and `disassembler_type` may be a single value or a
+    list of values. `flag` is compared to the result part of the flag
+    (the FLAG_* values below FLAG_TARGET_ADDR). `operand` is the address
+    or value in the instruction bytes. Criteria other than
+    `disassembler_type` only match instruction entries.
+    """
+    mask = np.ones(len(entries), dtype=bool)
+    if disassembler_type is not None:
+        mask &= np.isin(entries['disassembler_type'], disassembler_type)
+    if pc is not None or pc_range is not None or target_addr is not None or opcode is not None or operand is not None or flag is not None:
+        mask &= np.isin(entries['disassembler_type'], instruction_types)
+    if pc is not None:
+        mask &= np.isin(entries['pc'], pc)
+    if pc_range is not None:
+        pcs = entries['pc']
+        mask &= (pcs >= pc_range[0]) & (pcs < pc_range[1])
+    if target_addr is not None:
+        mask &= np.isin(entries['target_addr'], target_addr)
+    if flag is not None:
+        mask &= np.isin(entries['flag'] & flags.FLAG_RESULT_MASK, flag)
+    instruction = entries['instruction']
+    if opcode is not None:
+        mask &= np.isin(instruction[:,0], opcode)
+    if operand is not None:
+        num_bytes = entries['num_bytes']
+        values = np.where(num_bytes == 3, instruction[:,1].astype(np.uint16) | (instruction[:,2].astype(np.uint16) << 8), instruction[:,1])
+        mask &= (num_bytes > 1) & (values == operand)
+    return mask
+
+
+class FrameCheckpoints:
+    """The cumulative history entry count at the start of each frame.
+
+    Counts are 64 bit (the history's cumulative count is only 32 bits), so
+    `add` must be called at least once every 2**32 instructions. If the frame
+    number goes backwards (e.g. a restart is restored), the checkpoints for
+    the abandoned frames are discarded.
+    """
+    def __init__(self, max_checkpoints=100000):
+        self.max_checkpoints = max_checkpoints
+        self.frame_numbers = np.zeros(1024, dtype=np.int64)
+        self.counts = np.zeros(1024, dtype=np.int64)
+        self.num_checkpoints = 0
+        self.total_count = 0
+
+    def __len__(self):
+        return self.num_checkpoints
+
+    def unwrap(self, count):
+        self.total_count = unwrap_count(self.total_count, count)
+        return self.total_count
+
+    def add(self, frame_number, cumulative_count):
+        count = self.unwrap(cumulative_count)
+        n = self.num_checkpoints
+        if n > 0 and frame_number <= self.frame_numbers[n - 1]:
+            n = int(np.searchsorted(self.frame_numbers[:n], frame_number))
+        if n == self.max_checkpoints:
+            # drop the oldest half
+            keep = n // 2
+            self.frame_numbers[:keep] = self.frame_numbers[n - keep:n]
+            self.counts[:keep] = self.counts[n - keep:n]
+            n = keep
+        elif n == len(self.frame_numbers):
+            self.frame_numbers = np.concatenate([self.frame_numbers, np.zeros_like(self.frame_numbers)])
+            self.counts = np.concatenate([self.counts, np.zeros_like(self.counts)])
+        self.frame_numbers[n] = frame_number
+        self.counts[n] = count
+        self.num_checkpoints = n + 1
+
+    def find_count(self, frame_number):
+        """Return the total count at the start of the frame, or None if the
+        frame isn't covered by the checkpoints
+        """
+        n = self.num_checkpoints
+        i = int(np.searchsorted(self.frame_numbers[:n], frame_number))
+        if i < n and self.frame_numbers[i] == frame_number:
+            return int(self.counts[i])
+        return None
+
+    def find_first_count_after(self, frame_number):
+        """Return the total count at the start of the first frame after
+        `frame_number`, or None if there are no checkpoints after it
+        """
+        n = self.num_checkpoints
+        i = int(np.searchsorted(self.frame_numbers[:n], frame_number, side='right'))
+        if i < n:
+            return int(self.counts[i])
+        return None
+
+
+class HistoryQuery:
+    """Vectorized searches of a `HistoryStorage` ring buffer.
+
+    `history` can be any object with the `entries` array, `first_entry_index`,
+    `cumulative_count` and length of a `HistoryStorage`.
+    """
+    def __init__(self, history, checkpoints=None):
+        self.history = history
+        self.checkpoints = checkpoints
+
+    def __len__(self):
+        return len(self.history)
+
+    def get_entries(self, start=0, end=None):
+        """Return a copy of the entries for rows start to end in chronological
+        order
+        """
+        h = self.history
+        num_rows = len(h)
+        if end is None or end > num_rows:
+            end = num_rows
+        if start >= end:
+            return h.entries[0:0].copy()
+        allocated = len(h.entries)
+        first = (h.first_entry_index + start) % allocated
+        last = first + (end - start)
+        if last <= allocated:
+            return h.entries[first:last].copy()
+        return np.concatenate([h.entries[first:], h.entries[:last - allocated]])
+
+    #### frames
+
+    def calc_oldest_count(self):
+        """Total count of the entry in row zero"""
+        h = self.history
+        if self.checkpoints is not None:
+            total = self.checkpoints.unwrap(h.cumulative_count)
+        else:
+            total = int(h.cumulative_count)
+        return total - len(h)
+
+    def calc_frame_numbers(self, entries):
+        """Return the frame number of each entry, from the DISASM_FRAME_END
+        entries that follow them. Entries after the last frame end are in the
+        frame after it; -1 is used if there are no frame end entries.
+        """
+        ends = np.nonzero(entries['disassembler_type'] == flags.DISASM_FRAME_END)[0]
+        if len(ends) == 0:
+            return np.full(len(entries), -1, dtype=np.int64)
+        frame_numbers = entries[ends].view(dd.HISTORY_FRAME_DTYPE)['frame_number'].astype(np.int64)
+        frame_numbers = np.append(frame_numbers, frame_numbers[-1] + 1)
+        return frame_numbers[np.searchsorted(ends, np.arange(len(entries)))]
+
+    def calc_checkpoint_rows(self, first_frame=None, last_frame=None):
+        """Return the (start, end) rows covering the frames from first_frame
+        to last_frame (inclusive) using the checkpoints, or None if the
+        checkpoints don't include the frames. Either frame may be None to
+        leave that end of the range open.
+        """
+        c = self.checkpoints
+        if c is None or len(c) == 0:
+            return None
+        num_rows = len(self.history)
+        oldest = self.calc_oldest_count()
+        start, end = 0, num_rows
+        if first_frame is not None:
+            count = c.find_count(first_frame)
+            if count is None:
+                return None
+            start = max(0, count - oldest)
+        if last_frame is not None:
+            count = c.find_first_count_after(last_frame)
+            if count is not None:
+                end = max(0, count - oldest)
+        return min(start, num_rows), min(end, num_rows)
+
+    #### searches
+
+    def find(self, first_frame=None, last_frame=None, **kwargs):
+        """Return an array of the rows matching the criteria (see `calc_mask`)
+        in the frames from first_frame to last_frame inclusive
+        """
+        start, end = 0, None
+        use_frame_numbers = False
+        if first_frame is not None or last_frame is not None:
+            rows = self.calc_checkpoint_rows(first_frame, last_frame)
+            if rows is None:
+                use_frame_numbers = True
+            else:
+                start, end = rows
+        entries = self.get_entries(start, end)
+        mask = calc_mask(entries, **kwargs)
+        if use_frame_numbers:
+            frame_numbers = self.calc_frame_numbers(entries)
+            if first_frame is not None:
+                mask &= frame_numbers >= first_frame
+            if last_frame is not None:
+                mask &= frame_numbers <= last_frame
+        return np.nonzero(mask)[0] + start
+
+    def find_previous(self, row, **kwargs):
+        """Return the last row before `row` matching the criteria, or None"""
+        rows = np.nonzero(calc_mask(self.get_entries(0, row), **kwargs))[0]
+        if len(rows) == 0:
+            return None
+        return int(rows[-1])
+
+    def find_next(self, row, **kwargs):
+        """Return the first row after `row` matching the criteria, or None"""
+        rows = np.nonzero(calc_mask(self.get_entries(row + 1), **kwargs))[0]
+        if len(rows) == 0:
+            return None
+        return int(rows[0]) + row + 1
@@ -0,0 +1,359 @@
+"""Recording of the CPU history to disk
+
+The CPU history (`HistoryStorage` from libudis) is a ring buffer, so only
+the most recent instructions are available. A `CpuTrace` is drained from
+the ring after every call to the emulator's `next_frame` and keeps
+everything: new entries are buffered in memory and written out every
+`frames_per_chunk` frames as a chunk file holding one compressed array per
+field of HISTORY_ENTRY_DTYPE.
+
+The trace directory contains:
+
+    chunks.bin         chunk records (see `chunk_dtype`), in row order
+    frames.bin         frame records (see `frame_dtype`), in row order
+    chunk-NNNNNN.npz   the columns of each chunk
+
+Rows count from zero at the first entry recorded. Reading any row loads its
+whole chunk, and only the `max_cached_chunks` most recently used chunks are
+kept in memory, so the trace can be paged through without holding it in
+memory.
+"""
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from atrip import disassembler as disasm
+from atrip.disassembler import dd
+
+from .cpuhistory import HistoryQuery, calc_mask, unwrap_count
+
+import logging
+log = logging.getLogger(__name__)
+
+
+chunk_dtype = np.dtype([
+    ('start', '<u8'),
+    ('count', '<u8'),
+])
+
+frame_dtype = np.dtype([
+    ('frame', '<u4'),
+    ('unused', '<u4'),
+    ('start', '<u8'),
+    ('end', '<u8'),
+])
+
+
+def load_records(path, dtype):
+    """Memory map the file of records, discarding any partial record at the
+    end left from an interrupted write
+    """
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        size = 0
+    count = size // dtype.itemsize
+    if size > count * dtype.itemsize:
+        log.warning(f"{path}: ignoring partial record")
+        with open(path, "r+b") as fh:
+            fh.truncate(count * dtype.itemsize)
+    if count > 0:
+        return np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+    return np.zeros(0, dtype=dtype)
+
+
+class CpuTrace:
+    """Append-only record of every CPU history entry, stored in chunks on
+    disk with an index of the rows in each frame.
+
+    If the emulator goes back to an earlier frame (e.g. a restart is
+    restored), the frames are recorded again as they are emulated, so a
+    frame number may appear more than once; lookups by frame number use the
+    most recent recording.
+    """
+    frames_per_chunk = 60
+
+    # a chunk is also written when this many entries are pending, in case
+    # the emulator stays in one frame for a long time (e.g. when stepping)
+    max_chunk_entries = 1024 * 1024
+
+    max_cached_chunks = 8
+
+    def __init__(self, path, entry_dtype=dd.HISTORY_ENTRY_DTYPE):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.entry_dtype = entry_dtype
+        self.chunks_path = os.path.join(path, "chunks.bin")
+        self.frames_path = os.path.join(path, "frames.bin")
+        self.map_index()
+        self.pending = np.zeros(1024, dtype=entry_dtype)
+        self.num_pending = 0
+        self.pending_frames = []
+        self.cache = OrderedDict()
+        self.history_count = 0
+        self.num_lost = 0
+        self.page = None
+
+    def __str__(self):
+        return f"CpuTrace {self.path}: {self.num_rows} entries in {self.num_frames} frames"
+
+    def __len__(self):
+        return self.num_rows
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += self.num_rows
+        if row < 0 or row >= self.num_rows:
+            raise IndexError(f"row {row} not in trace of {self.num_rows} entries")
+        return self.get_entries(row, row + 1)[0]
+
+    #### files
+
+    def get_chunk_path(self, chunk):
+        return os.path.join(self.path, "chunk-%06d.npz" % chunk)
+
+    def map_index(self):
+        self.chunks = load_records(self.chunks_path, chunk_dtype)
+        self.frames = load_records(self.frames_path, frame_dtype)
+        self.chunk_starts = self.chunks['start'].astype(np.int64)
+        if len(self.chunks) > 0:
+            last = self.chunks[-1]
+            self.num_saved_rows = int(last['start'] + last['count'])
+        else:
+            self.num_saved_rows = 0
+        if len(self.frames) > 0:
+            self.frame_start = int(self.frames[-1]['end'])
+        else:
+            self.frame_start = 0
+
+    @property
+    def num_rows(self):
+        return self.num_saved_rows + self.num_pending
+
+    @property
+    def num_frames(self):
+        return len(self.frames) + len(self.pending_frames)
+
+    def close(self):
+        self.flush()
+        self.cache = OrderedDict()
+
+    #### recording
+
+    def sync(self, history):
+        """Start recording from the current end of the history, skipping
+        the entries already in it
+        """
+        self.history_count = int(history.cumulative_count)
+
+    def record(self, history, frame_number=None):
+        """Append the entries added to the history since the last call.
+
+        If `frame_number` is not None, the frame has finished and the rows
+        since the end of the previous frame are recorded as that frame.
+        """
+        count = unwrap_count(self.history_count, history.cumulative_count)
+        num_new = count - self.history_count
+        self.history_count = count
+        num_entries = len(history)
+        if num_new > num_entries:
+            lost = num_new - num_entries
+            log.warning(f"{self}: history overflowed; {lost} entries lost")
+            self.num_lost += lost
+            num_new = num_entries
+        if num_new > 0:
+            self.append_entries(HistoryQuery(history).get_entries(num_entries - num_new, num_entries))
+        if frame_number is not None:
+            self.pending_frames.append((frame_number, 0, self.frame_start, self.num_rows))
+            self.frame_start = self.num_rows
+            if len(self.pending_frames) >= self.frames_per_chunk:
+                self.flush()
+        if self.num_pending >= self.max_chunk_entries:
+            self.flush()
+
+    def append_entries(self, entries):
+        count = len(entries)
+        needed = self.num_pending + count
+        if needed > len(self.pending):
+            size = len(self.pending)
+            while size < needed:
+                size *= 2
+            pending = np.zeros(size, dtype=self.entry_dtype)
+            pending[:self.num_pending] = self.pending[:self.num_pending]
+            self.pending = pending
+        self.pending[self.num_pending:needed] = entries
+        self.num_pending = needed
+
+    def flush(self):
+        """Write the pending entries as a new chunk, and the index records of
+        the pending frames
+        """
+        if self.num_pending > 0:
+            entries = self.pending[:self.num_pending].copy()
+            chunk = len(self.chunks)
+            path = self.get_chunk_path(chunk)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as fh:
+                np.savez_compressed(fh, **{name: entries[name] for name in entries.dtype.names})
+            os.replace(tmp_path, path)
+
+            # the index record is written after the chunk so the index never
+            # refers to a chunk that isn't on disk
+            record = np.zeros(1, dtype=chunk_dtype)
+            record[0] = (self.num_saved_rows, self.num_pending)
+            with open(self.chunks_path, "ab") as fh:
+                fh.write(record.tobytes())
+            self.cache_chunk(chunk, entries)
+            self.num_pending = 0
+        if self.pending_frames:
+            records = np.array(self.pending_frames, dtype=frame_dtype)
+            with open(self.frames_path, "ab") as fh:
+                fh.write(records.tobytes())
+            self.pending_frames = []
+        self.map_index()
+
+    #### reading
+
+    def cache_chunk(self, chunk, entries):
+        self.cache[chunk] = entries
+        self.cache.move_to_end(chunk)
+        while len(self.cache) > self.max_cached_chunks:
+            self.cache.popitem(last=False)
+
+    def get_chunk(self, chunk):
+        try:
+            entries = self.cache[chunk]
+        except KeyError:
+            entries = np.zeros(int(self.chunks[chunk]['count']), dtype=self.entry_dtype)
+            with np.load(self.get_chunk_path(chunk)) as columns:
+                for name in self.entry_dtype.names:
+                    entries[name] = columns[name]
+            self.cache_chunk(chunk, entries)
+        else:
+            self.cache.move_to_end(chunk)
+        return entries
+
+    def iter_blocks(self, start, end, reverse=False):
+        """Yield (first row, entries) for each chunk (or part of a chunk)
+        in the rows from start to end
+        """
+        start = max(0, start)
+        end = min(self.num_rows, end)
+        if start >= end:
+            return
+        blocks = []
+        chunk = max(0, int(np.searchsorted(self.chunk_starts, start, side='right')) - 1)
+        first = start
+        while first < end:
+            if first >= self.num_saved_rows:
+                last = end
+                blocks.append((first, last, None))
+            else:
+                chunk_end = int(self.chunk_starts[chunk] + self.chunks[chunk]['count'])
+                last = min(end, chunk_end)
+                blocks.append((first, last, chunk))
+                chunk += 1
+            first = last
+        if reverse:
+            blocks.reverse()
+        for first, last, chunk in blocks:
+            if chunk is None:
+                offset = self.num_saved_rows
+                yield first, self.pending[first - offset:last - offset]
+            else:
+                offset = int(self.chunk_starts[chunk])
+                yield first, self.get_chunk(chunk)[first - offset:last - offset]
+
+    def get_entries(self, start=0, end=None):
+        """Return a new array of the entries in rows start to end"""
+        if end is None or end > self.num_rows:
+            end = self.num_rows
+        start = max(0, start)
+        entries = np.zeros(max(0, end - start), dtype=self.entry_dtype)
+        for first, block in self.iter_blocks(start, end):
+            entries[first - start:first - start + len(block)] = block
+        return entries
+
+    @property
+    def entries(self):
+        """The entries most recently stringified"""
+        if self.page is None:
+            return np.zeros(0, dtype=self.entry_dtype)
+        return self.page.entries
+
+    def stringify_to(self, output, index, num_lines_requested):
+        count = max(0, min(num_lines_requested, self.num_rows - index))
+        if self.page is None or len(self.page.entries) < count:
+            self.page = disasm.HistoryStorage(max(count, 1000))
+        self.page.load_entries(self.get_entries(index, index + count))
+        return self.page.stringify_to(output, 0, count)
+
+    #### frames
+
+    def get_frame_records(self):
+        if self.pending_frames:
+            return np.concatenate([self.frames, np.array(self.pending_frames, dtype=frame_dtype)])
+        return self.frames
+
+    def get_frame_range(self, frame_number):
+        """Return the (start, end) rows of the most recent recording of the
+        frame, or None if the frame isn't in the trace
+        """
+        for record in reversed(self.pending_frames):
+            if record[0] == frame_number:
+                return record[2], record[3]
+        found = np.nonzero(self.frames['frame'] == frame_number)[0]
+        if len(found) == 0:
+            return None
+        record = self.frames[found[-1]]
+        return int(record['start']), int(record['end'])
+
+    def find_frame_number(self, row):
+        """Return the frame number of the row, or None if the row is in a
+        frame that hasn't finished
+        """
+        records = self.get_frame_records()
+        i = int(np.searchsorted(records['end'], row, side='right'))
+        if i < len(records):
+            return int(records[i]['frame'])
+        return None
+
+    #### searches
+
+    def find(self, first_frame=None, last_frame=None, **kwargs):
+        """Return an array of the rows matching the criteria (see
+        `cpuhistory.calc_mask`) in the frames from first_frame to last_frame
+        inclusive
+        """
+        start, end = 0, self.num_rows
+        if first_frame is not None:
+            frame_range = self.get_frame_range(first_frame)
+            if frame_range is None:
+                return np.zeros(0, dtype=np.int64)
+            start = frame_range[0]
+        if last_frame is not None:
+            frame_range = self.get_frame_range(last_frame)
+            if frame_range is None:
+                return np.zeros(0, dtype=np.int64)
+            end = frame_range[1]
+        found = [np.nonzero(calc_mask(block, **kwargs))[0] + first for first, block in self.iter_blocks(start, end)]
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(found)
+
+    def find_previous(self, row, **kwargs):
+        """Return the last row before `row` matching the criteria, or None"""
+        for first, block in self.iter_blocks(0, row, reverse=True):
+            rows = np.nonzero(calc_mask(block, **kwargs))[0]
+            if len(rows) > 0:
+                return int(rows[-1]) + first
+        return None
+
+    def find_next(self, row, **kwargs):
+        """Return the first row after `row` matching the criteria, or None"""
+        for first, block in self.iter_blocks(row + 1, self.num_rows):
+            rows = np.nonzero(calc_mask(block, **kwargs))[0]
+            if len(rows) > 0:
+                return int(rows[0]) + first
+        return None
@@ -0,0 +1,305 @@
+"""Disk-backed storage for emulator frame history
+
+Frames are compressed and appended to a log made up of segment files, and
+each frame gets a fixed-size record in an index file that gives the segment
+and offset of its data. Nothing in the log is ever rewritten, so a session
+can be reopened by memory-mapping the index rather than parsing the frames.
+
+The store directory contains:
+
+    index.bin          index records (see `index_dtype`), in the order saved
+    frames-NNNN.log    segment files holding the compressed frame data
+    metadata.json      frame dtype and shape, and the restart tree structure
+
+Lookups use an array of (restart_number << 32 | frame_number) keys kept in
+sorted order, so finding a frame, or the frame before or after a given frame
+number, is a binary search.
+"""
+import os
+import json
+import zlib
+
+import numpy as np
+
+import logging
+log = logging.getLogger(__name__)
+
+
+index_dtype = np.dtype([
+    ('restart', '<u4'),
+    ('frame', '<u4'),
+    ('segment', '<u4'),
+    ('length', '<u4'),
+    ('offset', '<u8'),
+])
+
+
+def calc_key(restart_number, frame_number):
+    return (int(restart_number) << 32) | int(frame_number)
+
+
+class FrameStore:
+    """Append-only store of frames indexed by restart number and frame
+    number.
+
+    If a frame is saved more than once, the most recent data is used.
+    """
+    segment_size = 256 * 1024 * 1024
+
+    compression_level = 1
+
+    # number of index records appended before the index is mapped again
+    remap_count = 4096
+
+    def __init__(self, path, new=False):
+        """Open the store in the directory, creating it if necessary.
+
+        Frames saved in the directory by a previous session are kept unless
+        `new` is true, in which case the files of the old store are removed
+        first.
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.index_path = os.path.join(path, "index.bin")
+        self.metadata_path = os.path.join(path, "metadata.json")
+        if new:
+            self.remove_files()
+        self.read_handles = {}
+        self.write_handle = None
+        self.load_metadata()
+        self.map_index()
+        self.calc_sorted_keys()
+        self.index_handle = open(self.index_path, "ab")
+
+    def __str__(self):
+        return f"FrameStore {self.path}: {self.num_records} frames in {self.num_segments} segments"
+
+    def __len__(self):
+        return self.num_keys
+
+    #### files
+
+    def get_segment_path(self, segment):
+        return os.path.join(self.path, "frames-%04d.log" % segment)
+
+    def remove_files(self):
+        names = os.listdir(self.path)
+        for name in names:
+            if name in ("index.bin", "metadata.json") or (name.startswith("frames-") and name.endswith(".log")):
+                os.remove(os.path.join(self.path, name))
+
+    def load_metadata(self):
+        try:
+            with open(self.metadata_path) as fh:
+                self.metadata = json.load(fh)
+        except FileNotFoundError:
+            self.metadata = {}
+        self.num_segments = 0
+        while os.path.exists(self.get_segment_path(self.num_segments)):
+            self.num_segments += 1
+
+    def save_metadata(self):
+        tmp_path = self.metadata_path + ".tmp"
+        with open(tmp_path, "w") as fh:
+            json.dump(self.metadata, fh)
+        os.replace(tmp_path, self.metadata_path)
+
+    def map_index(self):
+        try:
+            size = os.path.getsize(self.index_path)
+        except FileNotFoundError:
+            size = 0
+        # a partial record at the end is from an interrupted write; ignore it
+        count = size // index_dtype.itemsize
+        if size > count * index_dtype.itemsize:
+            log.warning(f"{self.index_path}: ignoring partial index record")
+            with open(self.index_path, "r+b") as fh:
+                fh.truncate(count * index_dtype.itemsize)
+        if count > 0:
+            self.index = np.memmap(self.index_path, dtype=index_dtype, mode="r", shape=(count,))
+        else:
+            self.index = np.zeros(0, dtype=index_dtype)
+        self.num_mapped = count
+        self.pending = []
+
+    @property
+    def num_records(self):
+        return self.num_mapped + len(self.pending)
+
+    def get_record(self, row):
+        if row < self.num_mapped:
+            return self.index[row]
+        return self.pending[row - self.num_mapped]
+
+    def close(self):
+        for fh in self.read_handles.values():
+            fh.close()
+        self.read_handles = {}
+        if self.write_handle is not None:
+            self.write_handle.close()
+            self.write_handle = None
+        self.index_handle.close()
+
+    #### sorted keys
+
+    def calc_sorted_keys(self):
+        keys = (self.index['restart'].astype(np.uint64) << np.uint64(32)) | self.index['frame'].astype(np.uint64)
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        # keep only the last record saved for each frame
+        if len(keys) > 0:
+            last = np.ones(len(keys), dtype=bool)
+            last[:-1] = keys[:-1] != keys[1:]
+            keys = keys[last]
+            order = order[last]
+        self.num_keys = len(keys)
+        self.sorted_keys = np.empty(max(1024, 2 * self.num_keys), dtype=np.uint64)
+        self.sorted_rows = np.empty(len(self.sorted_keys), dtype=np.int64)
+        self.sorted_keys[:self.num_keys] = keys
+        self.sorted_rows[:self.num_keys] = order
+
+    def insert_key(self, key, row):
+        n = self.num_keys
+        keys = self.sorted_keys
+        if n == 0 or key > keys[n - 1]:
+            pos = n
+        else:
+            pos = int(np.searchsorted(keys[:n], key))
+            if keys[pos] == key:
+                self.sorted_rows[pos] = row
+                return
+        if n == len(keys):
+            self.sorted_keys = np.empty(2 * n, dtype=np.uint64)
+            self.sorted_keys[:n] = keys
+            rows = self.sorted_rows
+            self.sorted_rows = np.empty(2 * n, dtype=np.int64)
+            self.sorted_rows[:n] = rows
+            keys = self.sorted_keys
+        if pos < n:
+            keys[pos + 1:n + 1] = keys[pos:n]
+            self.sorted_rows[pos + 1:n + 1] = self.sorted_rows[pos:n]
+        keys[pos] = key
+        self.sorted_rows[pos] = row
+        self.num_keys += 1
+
+    def find_key(self, restart_number, frame_number):
+        """Return the position in the sorted keys of the frame, or -1 if it
+        isn't in the store
+        """
+        key = np.uint64(calc_key(restart_number, frame_number))
+        n = self.num_keys
+        pos = int(np.searchsorted(self.sorted_keys[:n], key))
+        if pos < n and self.sorted_keys[pos] == key:
+            return pos
+        return -1
+
+    def calc_restart_range(self, restart_number):
+        n = self.num_keys
+        keys = self.sorted_keys[:n]
+        first = int(np.searchsorted(keys, np.uint64(calc_key(restart_number, 0))))
+        last = int(np.searchsorted(keys, np.uint64(calc_key(restart_number + 1, 0))))
+        return first, last
+
+    #### frame numbers
+
+    def __contains__(self, restart_frame):
+        return self.find_key(*restart_frame) >= 0
+
+    def count_frames(self, restart_number):
+        first, last = self.calc_restart_range(restart_number)
+        return last - first
+
+    def get_frame_numbers(self, restart_number):
+        first, last = self.calc_restart_range(restart_number)
+        return (self.sorted_keys[first:last] & np.uint64(0xffffffff)).astype(np.int64)
+
+    def get_previous_frame_number(self, restart_number, frame_number, lowest=0):
+        """Return the largest frame number less than `frame_number` (and not
+        less than `lowest`) in the restart, or raise IndexError
+        """
+        n = self.num_keys
+        pos = int(np.searchsorted(self.sorted_keys[:n], np.uint64(calc_key(restart_number, frame_number)))) - 1
+        if pos >= 0:
+            key = int(self.sorted_keys[pos])
+            if key >= calc_key(restart_number, lowest):
+                return key & 0xffffffff
+        raise IndexError("No previous frame")
+
+    def get_next_frame_number(self, restart_number, frame_number):
+        """Return the smallest frame number greater than `frame_number` in the
+        restart, or raise IndexError
+        """
+        n = self.num_keys
+        pos = int(np.searchsorted(self.sorted_keys[:n], np.uint64(calc_key(restart_number, frame_number)), side='right'))
+        if pos < n:
+            key = int(self.sorted_keys[pos])
+            if key >> 32 == restart_number:
+                return key & 0xffffffff
+        raise IndexError("No next frame")
+
+    #### data
+
+    def save_frame(self, restart_number, frame_number, data):
+        data = np.ascontiguousarray(data)
+        if 'dtype' not in self.metadata:
+            self.metadata['dtype'] = data.dtype.str
+            self.metadata['shape'] = list(data.shape)
+            self.save_metadata()
+        compressed = zlib.compress(data.tobytes(), self.compression_level)
+
+        fh = self.write_handle
+        if fh is None:
+            # append to the last segment of a reopened store
+            self.num_segments = max(1, self.num_segments)
+            fh = open(self.get_segment_path(self.num_segments - 1), "ab")
+        if fh.tell() > 0 and fh.tell() + len(compressed) > self.segment_size:
+            fh.close()
+            self.num_segments += 1
+            fh = open(self.get_segment_path(self.num_segments - 1), "ab")
+        self.write_handle = fh
+        segment = self.num_segments - 1
+        offset = fh.tell()
+        fh.write(compressed)
+        fh.flush()
+
+        # the index record is written after the data so the index never
+        # refers to data that isn't in the log
+        record = np.zeros(1, dtype=index_dtype)
+        record[0] = (restart_number, frame_number, segment, len(compressed), offset)
+        self.index_handle.write(record.tobytes())
+        self.index_handle.flush()
+        row = self.num_records
+        self.pending.append(record[0])
+        self.insert_key(np.uint64(calc_key(restart_number, frame_number)), row)
+        if len(self.pending) >= self.remap_count:
+            self.map_index()
+
+    def read_data(self, segment, offset, length):
+        try:
+            fh = self.read_handles[segment]
+        except KeyError:
+            fh = open(self.get_segment_path(segment), "rb")
+            self.read_handles[segment] = fh
+        return os.pread(fh.fileno(), length, offset)
+
+    def get_frame(self, restart_number, frame_number):
+        """Return a new array containing the frame, or raise KeyError if it
+        isn't in the store
+        """
+        pos = self.find_key(restart_number, frame_number)
+        if pos < 0:
+            raise KeyError((restart_number, frame_number))
+        r = self.get_record(self.sorted_rows[pos])
+        raw = zlib.decompress(self.read_data(int(r['segment']), int(r['offset']), int(r['length'])))
+        data = np.frombuffer(bytearray(raw), dtype=np.dtype(self.metadata['dtype']))
+        return data.reshape(self.metadata['shape'])
+
+    #### restart tree structure
+
+    def get_restarts(self):
+        """List of (parent restart number, start frame) for each restart"""
+        return [tuple(r) for r in self.metadata.get('restarts', [])]
+
+    def set_restarts(self, restarts):
+        self.metadata['restarts'] = [list(r) for r in restarts]
+        self.save_metadata()
@@ -1,22 +1,366 @@
 import os
+import math
+import zlib
+import bisect
 import tempfile
 
 import numpy as np
 
 from .persistence import Serializable
+from .framestore import FrameStore
 
 import logging
 log = logging.getLogger(__name__)
 
 
+class FrameHistory:
+    """Compressed storage for emulator frames, indexed by frame number.
+
+    Frames are stored as keyframes, compressed on their own, and deltas: the
+    XOR of the frame with the most recent keyframe, compressed. Consecutive
+    frames differ in only a small part of memory, so the XOR is mostly zeros
+    and compresses very well. Because deltas are always relative to a
+    keyframe, never to another delta, reconstructing any frame takes at most
+    one keyframe and one delta decompression.
+
+    When the compressed size exceeds `max_bytes`, older frames are thinned
+    out (see `decimate`) so the history fits in the budget: the most recent
+    `full_resolution_frames` are always kept, and farther back the spacing
+    between kept frames doubles each time the age doubles.
+    """
+    keyframe_interval = 60
+
+    max_bytes = 256 * 1024 * 1024
+
+    full_resolution_frames = 600
+
+    max_thinning_level = 16
+
+    compression_level = 1
+
+    def __init__(self, max_bytes=None, keyframe_interval=None):
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        if keyframe_interval is not None:
+            self.keyframe_interval = keyframe_interval
+        self.clear()
+
+    def clear(self):
+        # frame number -> (keyframe number, compressed data); keyframes refer
+        # to themselves
+        self.frames = {}
+        self.sorted_keys = []
+        self.keyframe_info = {}  # keyframe number -> (dtype, shape)
+        self.keyframe_refs = {}  # keyframe number -> number of deltas using it
+        self.hidden_keyframes = set()  # removed, but still needed by deltas
+        self.nbytes = 0
+        self.thinning_level = 0
+        self.current_keyframe = None
+        self.cached_keyframe = (None, None)
+
+    #### dict-like interface
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __contains__(self, frame_number):
+        return frame_number in self.frames and frame_number not in self.hidden_keyframes
+
+    def __iter__(self):
+        return iter(self.sorted_keys)
+
+    def __getitem__(self, frame_number):
+        return self.get_frame(frame_number)
+
+    def __setitem__(self, frame_number, data):
+        self.save_frame(frame_number, data)
+
+    def __delitem__(self, frame_number):
+        self.remove_frame(frame_number)
+
+    def keys(self):
+        return list(self.sorted_keys)
+
+    def items(self):
+        for frame_number in self.sorted_keys:
+            yield frame_number, self.get_frame(frame_number)
+
+    def get_previous_key(self, frame_number, lowest=0):
+        index = bisect.bisect_left(self.sorted_keys, frame_number) - 1
+        if index >= 0 and self.sorted_keys[index] >= lowest:
+            return self.sorted_keys[index]
+        raise IndexError("No previous frame")
+
+    def get_next_key(self, frame_number):
+        index = bisect.bisect_right(self.sorted_keys, frame_number)
+        if index < len(self.sorted_keys):
+            return self.sorted_keys[index]
+        raise IndexError("No next frame")
+
+    #### storage
+
+    def is_keyframe(self, frame_number):
+        return self.frames[frame_number][0] == frame_number
+
+    def needs_keyframe(self, frame_number, data):
+        key = self.current_keyframe
+        if key is None or key not in self.frames:
+            return True
+        if frame_number < key or frame_number - key >= self.keyframe_interval:
+            return True
+        dtype, shape = self.keyframe_info[key]
+        return data.dtype != dtype or data.shape != shape
+
+    def save_frame(self, frame_number, data):
+        frame_number = int(frame_number)
+        if frame_number in self:
+            self.remove_frame(frame_number)
+        data = np.ascontiguousarray(data)
+        if self.needs_keyframe(frame_number, data):
+            self.keyframe_info[frame_number] = (data.dtype, data.shape)
+            self.keyframe_refs[frame_number] = 0
+            self.current_keyframe = frame_number
+            self.cached_keyframe = (frame_number, data.copy())
+            key = frame_number
+            raw = data.view(np.uint8)
+        else:
+            key = self.current_keyframe
+            raw = data.view(np.uint8) ^ self.get_keyframe(key).view(np.uint8)
+            self.keyframe_refs[key] += 1
+        compressed = zlib.compress(raw.tobytes(), self.compression_level)
+        self.frames[frame_number] = (key, compressed)
+        self.nbytes += len(compressed)
+        if not self.sorted_keys or frame_number > self.sorted_keys[-1]:
+            self.sorted_keys.append(frame_number)
+        else:
+            bisect.insort(self.sorted_keys, frame_number)
+        if self.nbytes > self.max_bytes:
+            self.decimate()
+
+    def remove_frame(self, frame_number):
+        """Remove a frame. A keyframe that is still needed by deltas stays in
+        storage (but not in the list of keys) until its last delta is
+        removed.
+        """
+        if frame_number not in self:
+            raise KeyError(frame_number)
+        key, compressed = self.frames[frame_number]
+        del self.sorted_keys[bisect.bisect_left(self.sorted_keys, frame_number)]
+        if key != frame_number:
+            del self.frames[frame_number]
+            self.nbytes -= len(compressed)
+            self.keyframe_refs[key] -= 1
+            if key in self.hidden_keyframes:
+                self.remove_unused_keyframe(key)
+        else:
+            self.hidden_keyframes.add(key)
+            self.remove_unused_keyframe(key)
+
+    def remove_unused_keyframe(self, key):
+        if self.keyframe_refs[key] > 0:
+            return
+        key, compressed = self.frames.pop(key)
+        self.nbytes -= len(compressed)
+        self.hidden_keyframes.discard(key)
+        del self.keyframe_refs[key]
+        del self.keyframe_info[key]
+        if self.cached_keyframe[0] == key:
+            self.cached_keyframe = (None, None)
+        if self.current_keyframe == key:
+            self.current_keyframe = None
+
+    #### retrieval
+
+    def get_keyframe(self, key):
+        cached_key, data = self.cached_keyframe
+        if cached_key != key:
+            dtype, shape = self.keyframe_info[key]
+            data = np.frombuffer(zlib.decompress(self.frames[key][1]), dtype=dtype).reshape(shape)
+            self.cached_keyframe = (key, data)
+        return data
+
+    def get_frame(self, frame_number):
+        """Reconstruct the frame, returning a new array. Raises KeyError if the
+        frame isn't in the history.
+        """
+        if frame_number not in self:
+            raise KeyError(frame_number)
+        key, compressed = self.frames[frame_number]
+        data = self.get_keyframe(key)
+        if key == frame_number:
+            return data.copy()
+        delta = np.frombuffer(zlib.decompress(compressed), dtype=np.uint8)
+        return (data.view(np.uint8).reshape(-1) ^ delta).view(data.dtype).reshape(data.shape)
+
+    #### decimation
+
+    def calc_keep_interval(self, age):
+        """Spacing between the frames kept at `age` frames before the newest
+        frame.
+        """
+        if age < self.full_resolution_frames:
+            return 1
+        tier = int(math.log2(age / self.full_resolution_frames)) + 1
+        return 1 << (tier + self.thinning_level)
+
+    def decimate(self):
+        """Thin out the older frames until the history fits in the memory
+        budget, increasing the thinning level each pass that doesn't free
+        enough space. The first and most recent frames are always kept.
+        """
+        while self.nbytes > self.max_bytes and len(self.sorted_keys) > 2:
+            newest = self.sorted_keys[-1]
+            oldest = self.sorted_keys[0]
+            for frame_number in self.sorted_keys[1:-1]:
+                interval = self.calc_keep_interval(newest - frame_number)
+                if (frame_number - oldest) % interval != 0:
+                    self.remove_frame(frame_number)
+            log.debug(f"decimate: thinning level {self.thinning_level}: {len(self.sorted_keys)} frames, {self.nbytes} bytes")
+            if self.nbytes > self.max_bytes:
+                if self.thinning_level >= self.max_thinning_level:
+                    break
+                self.thinning_level += 1
+
+
+class StoredFrameHistory:
+    """The frames of one restart in a `FrameStore`, with the same interface
+    as `FrameHistory`. Frames are never discarded, so there is no
+    decimation.
+    """
+    def __init__(self, store, restart_number):
+        self.store = store
+        self.restart_number = restart_number
+
+    def __len__(self):
+        return self.store.count_frames(self.restart_number)
+
+    def __contains__(self, frame_number):
+        return (self.restart_number, frame_number) in self.store
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __getitem__(self, frame_number):
+        return self.get_frame(frame_number)
+
+    def __setitem__(self, frame_number, data):
+        self.save_frame(frame_number, data)
+
+    def keys(self):
+        return [int(f) for f in self.store.get_frame_numbers(self.restart_number)]
+
+    def items(self):
+        for frame_number in self.keys():
+            yield frame_number, self.get_frame(frame_number)
+
+    def get_previous_key(self, frame_number, lowest=0):
+        return self.store.get_previous_frame_number(self.restart_number, frame_number, lowest)
+
+    def get_next_key(self, frame_number):
+        return self.store.get_next_frame_number(self.restart_number, frame_number)
+
+    def save_frame(self, frame_number, data):
+        self.store.save_frame(self.restart_number, frame_number, data)
+
+    def get_frame(self, frame_number):
+        return self.store.get_frame(self.restart_number, frame_number)
+
+    def decimate(self):
+        pass
+
+
+class InputLog:
+    """The input array used for each frame, so any frame can be rebuilt by
+    replaying the inputs from an earlier snapshot.
+
+    Frames must be added in increasing order; adding a frame number that
+    isn't after the last one discards the log from that frame onwards.
+    """
+    def __init__(self):
+        self.frame_numbers = np.zeros(1024, dtype=np.int64)
+        self.inputs = None
+        self.num_frames = 0
+
+    def __len__(self):
+        return self.num_frames
+
+    def __contains__(self, frame_number):
+        return self.find(frame_number) >= 0
+
+    def find(self, frame_number):
+        n = self.num_frames
+        i = int(np.searchsorted(self.frame_numbers[:n], frame_number))
+        if i < n and self.frame_numbers[i] == frame_number:
+            return i
+        return -1
+
+    def add(self, frame_number, input_raw):
+        n = self.num_frames
+        if self.inputs is None:
+            self.inputs = np.zeros((len(self.frame_numbers), len(input_raw)), dtype=np.uint8)
+        if n > 0 and frame_number <= self.frame_numbers[n - 1]:
+            n = int(np.searchsorted(self.frame_numbers[:n], frame_number))
+        if n == len(self.frame_numbers):
+            self.frame_numbers = np.concatenate([self.frame_numbers, np.zeros_like(self.frame_numbers)])
+            self.inputs = np.concatenate([self.inputs, np.zeros_like(self.inputs)])
+        self.frame_numbers[n] = frame_number
+        self.inputs[n] = input_raw
+        self.num_frames = n + 1
+
+    def get(self, frame_number):
+        """Return the input of the frame, or None if it isn't in the log"""
+        i = self.find(frame_number)
+        if i < 0:
+            return None
+        return self.inputs[i]
+
+    def items(self):
+        n = self.num_frames
+        if n == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.uint8)
+        return self.frame_numbers[:n].copy(), self.inputs[:n].copy()
+
+
 class RestartTree(Serializable):
     name = None
 
     serializable_attributes = ['restarts']
 
-    def __init__(self):
-        self.emulator_start = Restart(0, None)
+    def __init__(self, max_history_bytes=None, frame_store=None, snapshot_interval=1):
+        self.max_history_bytes = max_history_bytes
+        self.frame_store = frame_store
+        self.snapshot_interval = snapshot_interval
+        self.emulator_start = Restart(0, None, 0, max_history_bytes, frame_store, snapshot_interval)
         self.restarts = [self.emulator_start]
+        self.save_structure()
+
+    @classmethod
+    def from_frame_store(cls, path):
+        """Reopen the restart tree of a previous session from its frame store
+        directory. Only the index is read; frame data is loaded on demand.
+        """
+        store = FrameStore(path)
+        tree = cls.__new__(cls)
+        tree.max_history_bytes = None
+        tree.frame_store = store
+        tree.restarts = []
+        for restart_number, (parent_number, start_frame) in enumerate(store.get_restarts()):
+            parent = tree.restarts[parent_number] if parent_number >= 0 else None
+            restart = Restart(restart_number, parent, start_frame, frame_store=store)
+            try:
+                restart.end_frame = restart.frame_history.get_previous_key(2**32 - 1)
+            except IndexError:
+                pass
+            tree.restarts.append(restart)
+        if not tree.restarts:
+            tree.restarts.append(Restart(0, None, frame_store=store))
+            tree.save_structure()
+        tree.emulator_start = tree.restarts[0]
+        return tree
+
+    def save_structure(self):
+        if self.frame_store is not None:
+            self.frame_store.set_restarts([(r.parent.restart_number if r.parent is not None else -1, r.start_frame) for r in self.restarts])
 
     #### dunder methods
 
@@ -44,8 +388,9 @@ class RestartTree(Serializable):
         restart = self.restarts[restart_number]
         parent = restart.get_restart(frame_number)
         index = len(self.restarts)
-        new_restart = Restart(index, parent, frame_number)
+        new_restart = Restart(index, parent, frame_number, self.max_history_bytes, self.frame_store, getattr(self, 'snapshot_interval', 1))
         self.restarts.append(new_restart)
+        self.save_structure()
         return new_restart
 
     def get_summary(self):
@@ -59,29 +404,49 @@ class RestartTree(Serializable):
 class Restart(Serializable):
     name = None
 
-    serializable_attributes = ['frame_history']
-    serializable_computed = {'frame_history'}
+    serializable_attributes = ['frame_history', 'input_log']
+    serializable_computed = {'frame_history', 'input_log'}
 
-    def __init__(self, restart_number, parent, start_frame=0):
+    def __init__(self, restart_number, parent, start_frame=0, max_history_bytes=None, frame_store=None, snapshot_interval=1):
         self.restart_number = restart_number
         self.parent = parent
         self.start_frame = start_frame
         self.end_frame = start_frame
+        self.max_history_bytes = max_history_bytes
+        self.frame_store = frame_store
+        self.snapshot_interval = snapshot_interval
         self.frame_history = self.calc_history_iterable()
+        self.input_log = InputLog()
 
     def calc_history_iterable(self):
-        return dict()
+        store = getattr(self, 'frame_store', None)
+        if store is not None:
+            return StoredFrameHistory(store, self.restart_number)
+        return FrameHistory(getattr(self, 'max_history_bytes', None))
 
     ##### Serialization
 
     def calc_computed_attribute(self, key):
+        if key == 'input_log':
+            return [list(a) for a in self.input_log.items()]
         if key == 'frame_history':
+            if self.frame_store is not None:
+                # frames are already on disk; only save where they are
+                return {'frame_store': self.frame_store.path}
             return [list(a) for a in self.frame_history.items()]
         return getattr(self, key).copy()
 
     def restore_computed_attributes(self, state):
+        self.input_log = InputLog()
+        for frame_number, input_raw in zip(*state.get('input_log', ([], []))):
+            self.input_log.add(frame_number, input_raw)
+        history = state['frame_history']
+        if isinstance(history, dict):
+            self.frame_store = FrameStore(history['frame_store'])
+            self.frame_history = self.calc_history_iterable()
+            return
         self.frame_history = self.calc_history_iterable()
-        for frame_number, data in state['frame_history']:
+        for frame_number, data in history:
             self.frame_history[frame_number] = data
 
     ##### Storage indexes
@@ -95,39 +460,48 @@ class Restart(Serializable):
     #         yield self.frame_history[k]
 
     def keys(self):
-        return sorted(self.frame_history.keys())
+        return self.frame_history.keys()
 
     def is_memorable(self, frame_number):
-        # return frame_number % 10 == 0
-        return True
+        # the first frame is always saved so there is somewhere to replay
+        # from
+        return frame_number % getattr(self, 'snapshot_interval', 1) == 0 or len(self.frame_history) == 0
+
+    def can_rebuild(self, frame_number):
+        """True if the frame is a snapshot or can be replayed from one"""
+        try:
+            restart, snapshot_frame = self.find_snapshot(frame_number)
+        except KeyError:
+            return False
+        return snapshot_frame == frame_number or self.get_input(frame_number) is not None
 
     def get_previous_frame(self, frame_cursor):
-        n = frame_cursor - 1
-        while n > 0:
-            if n in self.frame_history:
-                return n
-            n -= 1
-        raise IndexError("No previous frame")
+        lowest = 1 if self.parent is None else self.start_frame + 1
+        if frame_cursor - 1 >= lowest and self.can_rebuild(frame_cursor - 1):
+            return frame_cursor - 1
+        return self.frame_history.get_previous_key(frame_cursor, 1)
 
     def get_next_frame(self, frame_cursor):
-        n = frame_cursor + 1
-        largest = max(self.frame_history.keys())
-        while n < largest:
-            if n in self.frame_history:
-                return n
-            n += 1
-        raise IndexError("No next frame")
+        if frame_cursor < self.end_frame and self.can_rebuild(frame_cursor + 1):
+            return frame_cursor + 1
+        return self.frame_history.get_next_key(frame_cursor)
 
     ##### Storage
 
     def save_frame(self, frame_number, data):
-        # History is saved in a big list, which will waste space for empty
-        # entries but makes things extremely easy to manage. Simply delete
-        # a history entry by setting it to NONE.
+        # Frames are delta compressed as they are stored, and older frames
+        # are thinned out automatically when the history exceeds its memory
+        # budget.
         frame_number = int(frame_number)
-        self.frame_history[frame_number] = data
+        self.frame_history.save_frame(frame_number, data)
         self.end_frame = frame_number
 
+    def save_input(self, frame_number, input_raw):
+        """Record the input used to emulate the frame"""
+        frame_number = int(frame_number)
+        self.input_log.add(frame_number, input_raw)
+        self.end_frame = max(self.end_frame, frame_number)
+
     ##### Retrieval
 
     def __getitem__(self, index):
@@ -158,7 +532,36 @@ class Restart(Serializable):
     def get_frame(self, frame_number):
         parent = self.get_restart(frame_number)  # could raise IndexError
         frame_number = int(frame_number)
-        return self.frame_history[frame_number]
+        return parent.frame_history[frame_number]
+
+    def get_input(self, frame_number):
+        """Return the input used to emulate the frame, or None if it wasn't
+        recorded. Frames up to the start of this restart were emulated in
+        the parent.
+        """
+        frame_number = int(frame_number)
+        restart = self
+        while restart.parent is not None and frame_number <= restart.start_frame:
+            restart = restart.parent
+        return restart.input_log.get(frame_number)
+
+    def find_snapshot(self, frame_number):
+        """Return the (restart, frame number) of the most recent snapshot at
+        or before the frame, or raise KeyError if there isn't one
+        """
+        frame_number = int(frame_number)
+        restart = self
+        while restart is not None:
+            if frame_number > restart.start_frame or restart.parent is None:
+                history = restart.frame_history
+                if frame_number in history:
+                    return restart, frame_number
+                try:
+                    return restart, history.get_previous_key(frame_number, restart.start_frame)
+                except IndexError:
+                    frame_number = restart.start_frame
+            restart = restart.parent
+        raise KeyError(f"no snapshot before frame {frame_number}")
 
     ##### Compact
 
@@ -166,4 +569,4 @@ class Restart(Serializable):
         """Remove old history items according to an algorithm that discards
         some portion of the older history as time goes on
         """
-        pass
+        self.frame_history.decimate()
@@ -2,6 +2,8 @@ import re
 
 import numpy as np
 
+from atrip.byte_pattern import BytePattern, search_containers, search_collection, search_files
+
 from sawx.utils.parseutil import NumpyIntExpression, ParseException
 
 import logging
@@ -19,6 +21,18 @@ class BaseSearcher(object):
         else:
             self.matches = []
 
+    @classmethod
+    def calc_byte_pattern(cls, text):
+        return BytePattern.from_bytes(bytes(text, "utf-8"))
+
+    @classmethod
+    def search_index(cls, index, text, max_workers=None):
+        """Find the search text in all the files of an
+        `atrip.search_index.SearchIndex`, returning the list of (pathname,
+        container, ranges) of the matches
+        """
+        return index.search(cls.calc_byte_pattern(text), max_workers)
+
     def get_search_text(self, text):
         return bytes(text, "utf-8")
 
@@ -35,13 +49,20 @@ class HexSearcher(BaseSearcher):
     def __str__(self):
         return "hex matches: %s" % str(self.matches)
 
+    @classmethod
+    def calc_byte_pattern(cls, text):
+        return BytePattern(text)
+
     def get_search_text(self, text):
         try:
-            return bytes.fromhex(text)
-        except ValueError:
-            log.debug("%s: fromhex failed on: %s")
+            return self.calc_byte_pattern(text)
+        except ValueError as e:
+            log.debug("%s: hex pattern failed on %s: %s" % (self.ui_name, text, e))
             return ""
 
+    def get_matches(self, editor):
+        return self.search_text.find_ranges(self.search_copy)
+
 
 class CharSearcher(BaseSearcher):
     ui_name = "text"
@@ -29,6 +29,7 @@ class DisassemblyTable(SegmentTable):
         SegmentTable.__init__(self, linked_base, len(self.column_labels), False)
 
         self.max_num_entries = 80000
+        self.current_segment = None
         self.rebuild()
 
     def calc_num_rows(self):
@@ -111,6 +112,20 @@ class DisassemblyTable(SegmentTable):
     def rebuild(self):
         segment = self.linked_base.segment
         self.current = self.linked_base.document.disassembler.parse(segment, self.max_num_entries)
+        self.current_segment = segment
+        self.parsed = None
+        self.init_boundaries()
+
+    def rebuild_range(self, index_range):
+        """Update the disassembly after the bytes or disassembly types in the
+        (inclusive) range of indexes have changed, reparsing only the affected
+        lines.
+        """
+        i1, i2 = index_range
+        if i1 > i2:
+            i1, i2 = i2, i1
+        segment = self.current_segment
+        self.current = self.linked_base.document.disassembler.reparse(segment, self.current, [(i1, i2 + 1)])
         self.parsed = None
         self.init_boundaries()
 
@@ -233,7 +248,11 @@ class DisassemblyViewer(SegmentViewer):
         self.refresh_view(True)
 
     def on_update_table_for_value_change(self, evt):
-        self.table.rebuild()
+        flags = evt.flags
+        if flags.index_range is not None and flags.index_range_source is not None and flags.index_range_source is self.table.current_segment:
+            self.table.rebuild_range(flags.index_range)
+        else:
+            self.table.rebuild()
 
     def on_update_table_for_style_change(self, evt):
         self.table.rebuild()
@@ -54,15 +54,15 @@ class InstructionHistoryTable(cg.VirtualTable):
             return "----"
         try:
             emu = self.emulator
-            return "%04x" % (emu.cpu_history[row][0])
+            return "%04x" % (emu.visible_cpu_history[row][0])
         except IndexError:
             return "----"
 
     def get_row_label_text(self, start_line, num_lines, step=1):
         last_line = min(start_line + num_lines, self.num_rows)
-        emu = self.emulator
+        history = self.emulator.visible_cpu_history
         for line in range(start_line, last_line, step):
-            h = emu.cpu_history[line]
+            h = history[line]
             t = h['disassembler_type']
             if t == flags.DISASM_NEXT_INSTRUCTION:
                 h = h.view(dtype=dd.HISTORY_BREAKPOINT_DTYPE)
@@ -80,29 +80,15 @@ class InstructionHistoryTable(cg.VirtualTable):
                 f = h['frame_number']
                 yield "f%d" % (f)
             else:
-                yield "%d" % (emu.cpu_history[line][0])
+                yield "%d" % (history[line][0])
 
     def find_previous_line(self, start, flag_type):
-        emu = self.emulator
-        line = start
-        while line > 0:
-            line -= 1
-            h = emu.cpu_history[line]
-            t = h['disassembler_type']
-            if flag_type == t:
-                break
-        return line
+        line = self.emulator.find_previous_cpu_history(start, disassembler_type=flag_type)
+        return 0 if line is None else line
 
     def find_next_line(self, start, flag_type):
-        emu = self.emulator
-        line = start
-        while line < self.num_rows - 1:
-            line += 1
-            h = emu.cpu_history[line]
-            t = h['disassembler_type']
-            if flag_type == t:
-                break
-        return line
+        line = self.emulator.find_next_cpu_history(start, disassembler_type=flag_type)
+        return self.num_rows - 1 if line is None else min(line, self.num_rows - 1)
 
     def find_frame_instruction(self, line):
         line = self.find_previous_line(line, flags.DISASM_FRAME_END)
@@ -151,8 +137,9 @@ class InstructionHistoryTable(cg.VirtualTable):
     def rebuild(self):
         v = self.virtual_linked_base
         emu = v.emulator
-        self.current_num_rows = len(emu.cpu_history)
-        c = Container(emu.cpu_history.entries.view(np.uint8), force_numpy_data=True)
+        history = emu.visible_cpu_history
+        self.current_num_rows = len(history)
+        c = Container(history.entries.view(np.uint8), force_numpy_data=True)
         v.segment = Segment(c, 0)
         # print("CPU HISTORY ENTRIES", self.current_num_rows)
         self.init_boundaries()
@@ -230,15 +217,13 @@ class InstructionHistoryGridControl(SegmentGridControl):
                 try:
                     self.kfest_detach_update = True
                     emu = self.table.emulator
-                    h = emu.cpu_history[row]
-                    t = h['disassembler_type']
-                    frame_number = emu.kfest_history_to_frame_number[row]
-                    print(f"history: {row}: {frame_number}, {emu.kfest_frame_number_to_history[frame_number]}")
-                    print(f"history: {row}: {h}")
-                    emu.restore_restart(0, frame_number - 1)
-                    emu.kfest_step_history(frame_number, row)
-                    doc.emulator_update_screen_event(True)
-                    doc.priority_level_refresh_event(100)
+                    frame_number = emu.find_cpu_history_frame_number(row)
+                    frame_range = None if frame_number is None else emu.get_cpu_history_frame_range(frame_number)
+                    if frame_range is not None:
+                        print(f"history: {row}: {frame_number}, {frame_range}")
+                        emu.restore_restart_plus(0, frame_number - 1, row - frame_range[0])
+                        doc.emulator_update_screen_event(True)
+                        doc.priority_level_refresh_event(100)
                 except IndexError:
                     pass
                 except KeyError:
@@ -52,7 +52,7 @@ class SampleVirtualTable(cg.VirtualTable):
         old_segment = v.segment
         container = Container(np.arange(size, dtype=np.uint8))
         segment = Segment(container)
-        segment.style[0:old_size] = old_segment.style[0:old_size]
+        segment.writable_style[0:old_size] = old_segment.style[0:old_size]
         v.segment = segment
         self.init_boundaries()
         print(f"new size: {len(v.segment)}")
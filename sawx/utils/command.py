@@ -198,6 +198,11 @@ class DisplayFlags:
         # ensure the specified index range is visible
         self.index_range = None
 
+        # the object (e.g. segment) in which index_range was changed, if
+        # known. Views of the same object can use index_range to update only
+        # the part that changed instead of being rebuilt.
+        self.index_range_source = None
+
         # set to True if the index_range should be selected
         self.select_range = False
 
@@ -294,14 +299,18 @@ class DisplayFlags:
         if flags.index_range is not None:
             if self.index_range is None:
                 self.index_range = flags.index_range
+                self.index_range_source = flags.index_range_source
             else:
                 s1, s2 = self.index_range
                 f1, f2 = flags.index_range
                 if f1 < s1:
                     s1 = f1
                 if f2 > s2:
-                    s2 = f1
+                    s2 = f2
                 self.index_range = (s1, s2)
+                if self.index_range_source is not flags.index_range_source:
+                    # indexes in different objects can't be combined
+                    self.index_range_source = None
 
         if flags.caret_index is not None:
             self.caret_index = flags.caret_index
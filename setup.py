@@ -72,6 +72,7 @@ class clean_py(clean):
             "libudis/parse_udis_cpu.c",
             "libudis/stringify_udis_cpu.c",
             "libudis/stringify_udis_cpu.h",
+            "atrip/signatures/sha1_index.bin",
         ]
         for pathspec in files:
             for path in glob.glob(pathspec):
@@ -114,6 +115,14 @@ else:
             if os.path.exists(parse_gen_path):
                 os.remove(parse_gen_path)
             sys.exit("libudis/parse_gen.py failed, stopping the build.")
+    sha1_index_path = "atrip/signatures/sha1_index.bin"
+    if not os.path.exists(sha1_index_path):
+        completed_process = subprocess.run([sys.executable, '-c', 'from atrip.signature import write_builtin_index; write_builtin_index()'])
+        if completed_process.returncode != 0:
+            if os.path.exists(sha1_index_path):
+                os.remove(sha1_index_path)
+            sys.exit("atrip signature index generation failed, stopping the build.")
+
     extensions = [
         Extension("omnivore.arch.antic_speedups",
                   sources=["omnivore/arch/antic_speedups.pyx"],
@@ -0,0 +1,80 @@
+import json
+import multiprocessing
+
+from mock import *
+
+from atrip import batch
+from atrip.batch import iter_batch_items, catalog_item, run_batch
+
+
+samples = os.path.join(os.path.dirname(__file__), "../samples")
+
+
+def catalog_in_worker(item, parent_zip_id):
+    records = catalog_item(item)
+    return records[0].get("sha1"), id(batch._open_zip[-1]) == parent_zip_id
+
+
+class TestBatch:
+    def setup(self):
+        self.paths = [
+            os.path.join(samples, "dos_sd_test1.atr"),
+            os.path.join(samples, "dos_sd_test_collection.zip"),
+            os.path.join(samples, "does_not_exist.atr"),
+        ]
+
+    def test_items(self):
+        items = list(iter_batch_items(self.paths))
+        assert len(items) == 1 + 5 + 1
+        assert items[1][1] == "dos_sd_test1.atr"
+
+        records = catalog_item(items[0])
+        assert len(records) == 1
+        r = records[0]
+        assert r["filesystem"] == "Atari DOS 2"
+        assert r["dirents"][0]["filename"] == "A128.DAT"
+        assert r["dirents"][0]["size"] == 128
+
+        # same disk image inside the zip file
+        assert catalog_item(items[1])[0]["sha1"] == r["sha1"]
+
+        records = catalog_item(items[-1])
+        assert "error" in records[0]
+
+    def test_forked_zip(self):
+        zip_items = [i for i in iter_batch_items(self.paths) if i[1] is not None]
+        expected = [catalog_item(item)[0]["sha1"] for item in zip_items]
+
+        # the parent now has the zip open; workers forked from it must not
+        # read through the inherited handle
+        parent_zip_id = id(batch._open_zip[-1])
+        args = [(item, parent_zip_id) for item in zip_items * 20]
+        with multiprocessing.get_context("fork").Pool(4) as pool:
+            results = pool.starmap(catalog_in_worker, args)
+        assert [sha1 for sha1, inherited in results] == expected * 20
+        assert not any(inherited for sha1, inherited in results)
+
+    @pytest.mark.parametrize("processes", [1, 2])
+    def test_resume(self, processes):
+        output = "tmp.batch.ndjson"
+        run_batch(self.paths, output, processes)
+        with open(output) as fh:
+            lines = fh.readlines()
+        assert len(lines) == 7
+
+        # simulate being interrupted part way through a record
+        with open(output, "w") as fh:
+            fh.writelines(lines[0:3])
+            fh.write(lines[3][0:20])
+        run_batch(self.paths, output, processes, resume=True)
+        with open(output) as fh:
+            resumed = fh.readlines()
+        assert [json.loads(line) for line in resumed] == [json.loads(line) for line in lines]
+
+    def test_stdout(self, capsys):
+        # parsers print debugging info; only records can appear on stdout
+        count = run_batch([samples], None, 1)
+        lines = capsys.readouterr().out.splitlines()
+        records = [json.loads(line) for line in lines]
+        assert len(records) >= count
+        assert all("path" in r for r in records)
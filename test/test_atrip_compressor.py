@@ -1,10 +1,12 @@
 import os
+import glob
 
 import pytest
 
 import numpy as np
 
 from atrip.compressors import bzip, dcm, gzip, lz4, lzma, unix_compress, zlib
+from atrip.compressor import sniff_compressors, guess_compressor_list, guess_compressor_list_by_magic, guess_compressor_list_by_trial
 
 compressors_and_decompressors = [
     bzip.BZipCompressor,
@@ -37,6 +39,39 @@ class TestCompressor:
         print(len(self.byte_data), len(packed), len(unpacked))
         assert unpacked == self.byte_data
 
+    @pytest.mark.parametrize("compressor_cls", compressors_and_decompressors)
+    def test_sniff(self, compressor_cls):
+        packed = compressor_cls().calc_packed_data(self.byte_data)
+        assert compressor_cls in sniff_compressors(packed)
+        assert compressor_cls not in sniff_compressors(self.byte_data)
+
+    def test_nested(self):
+        packed = self.byte_data
+        order = [bzip.BZipCompressor, zlib.ZLibCompressor, gzip.GZipCompressor, lzma.LZMACompressor]
+        for compressor_cls in reversed(order):
+            packed = compressor_cls().calc_packed_data(packed)
+        unpacked, compressors = guess_compressor_list(np.frombuffer(packed, dtype=np.uint8))
+        assert compressors == order
+        assert unpacked.tobytes() == self.byte_data
+
+    def test_false_positive(self):
+        # looks like a zlib header, but isn't compressed
+        raw = np.frombuffer(b"\x78\x9c" + self.byte_data, dtype=np.uint8)
+        assert zlib.ZLibCompressor in sniff_compressors(raw)
+        unpacked, compressors = guess_compressor_list(raw)
+        assert unpacked is raw
+        assert compressors[0].compression_algorithm == "none"
+
+    @pytest.mark.parametrize("pathname", sorted(glob.glob(os.path.join(os.path.dirname(__file__), "../samples/*.dcm*"))))
+    def test_nested_dcm(self, pathname):
+        # the streamed unpacking must handle the dcm layer itself rather than
+        # relying on the fallback
+        raw = np.fromfile(pathname, dtype=np.uint8)
+        unpacked, compressors = guess_compressor_list_by_magic(raw)
+        assert compressors[-1] is dcm.DCMCompressor
+        expected, _ = guess_compressor_list_by_trial(raw)
+        assert unpacked.tobytes() == bytes(expected)
+
 if __name__ == "__main__":
     t = TestCompressor()
     t.setup()
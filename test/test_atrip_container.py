@@ -4,7 +4,7 @@ import numpy as np
 
 from mock import *
 
-from atrip.container import guess_container
+from atrip.container import guess_container, guess_container_memmap
 from atrip import errors
 
 
@@ -85,6 +85,31 @@ class TestMultipleCompression:
             assert np.array_equal(container._data, container2._data)
 
 
+class TestMemoryMappedContainer:
+    @pytest.mark.parametrize(("ext"), ['', '.gz', '.lz4.gz.bz2.xz'])
+    def test_memmap(self, ext):
+        pathname = os.path.abspath(os.path.join(os.path.dirname(__file__), "../samples/dos_sd_test1.atr" + ext))
+        sample_data = np.fromfile(pathname, dtype=np.uint8)
+        container = guess_container(sample_data)
+        mapped = guess_container_memmap(pathname)
+        assert mapped.is_memory_mapped
+        assert np.array_equal(container._data, mapped._data)
+
+        # metadata arrays aren't created until needed
+        assert not mapped.style_runs.is_materialized
+        assert not mapped.disasm_type_runs.is_materialized
+        assert np.all(mapped.disasm_type == mapped.default_disasm_type)
+
+        # changes to an uncompressed image must not be written to the source
+        mapped[1000:1004] = 0xaa
+        assert np.array_equal(np.fromfile(pathname, dtype=np.uint8), sample_data)
+        mapped[1000:1004] = container[1000:1004]
+
+        mapped.guess_media_type()
+        container.guess_media_type()
+        assert mapped.media.__class__ == container.media.__class__
+
+
 if __name__ == "__main__":
     import logging
     logging.basicConfig(level=logging.DEBUG)
@@ -1,4 +1,5 @@
 import os
+import glob
 
 import pytest
 
@@ -7,6 +8,7 @@ np.set_printoptions(formatter={'int': lambda x: f"{x:02x}"})
 
 from mock import globbed_sample_atari_files
 
+from atrip import errors
 from atrip.container import Container, guess_container
 from atrip.compressors import dcm
 from atrip.media_type import Media, guess_media_type
@@ -247,6 +249,68 @@ class TestFileCompression:
         else:
             assert np.array_equal(m.data, out)
 
+
+class TestVectorized:
+    def setup(self):
+        data = np.empty(92160, dtype=np.uint8)
+        data[:] = np.repeat(np.arange(720, dtype=np.uint8), 128)
+        data[::100] = 0xff
+        data[128*10:128*20] = 0
+        data[128*30:128*31] = 7
+        self.media = AtariSingleDensity(Container(data))
+
+    @pytest.mark.parametrize("allowed_blocks", [
+        None,
+        [0x41],
+        [0x42],
+        [0x43],
+        [0x44],
+        [],
+    ])
+    def test_same_as_by_sector(self, allowed_blocks):
+        m = self.media
+        packed = compressor.calc_packed_data(m.data, m, allowed_blocks)
+        assert packed == compressor.calc_packed_data_by_sector(m.data, m, allowed_blocks)
+
+    @pytest.mark.parametrize(("pathname"), sorted(glob.glob("../samples/*")))
+    def test_glob(self, pathname):
+        sample_data = np.fromfile(pathname, dtype=np.uint8)
+        container = guess_container(sample_data)
+        container.guess_media_type()
+        m = container.media
+        try:
+            packed = compressor.calc_packed_data(m.data, m)
+        except errors.InvalidMediaSize:
+            pytest.skip("not a standard size Atari disk image")
+        assert packed == compressor.calc_packed_data_by_sector(m.data, m)
+
+    def test_benchmark(self):
+        import timeit
+        sample_data = np.fromfile("../samples/mydos_dd_bm301318.dcm", dtype=np.uint8)
+        container = guess_container(sample_data)
+        container.guess_media_type()
+        m = container.media
+
+        def call_vectorized():
+            compressor.calc_packed_data(m.data, m)
+        vectorized = timeit.timeit(call_vectorized, number=5)
+
+        def call_by_sector():
+            compressor.calc_packed_data_by_sector(m.data, m)
+        by_sector = timeit.timeit(call_by_sector, number=5)
+        print(f"vectorized: {vectorized / 5 * 1000:.1f}ms, by sector: {by_sector / 5 * 1000:.1f}ms")
+
+        packed = compressor.calc_packed_data(m.data, m)
+        def call_unpack():
+            compressor.calc_unpacked_data(packed)
+        unpack = timeit.timeit(call_unpack, number=5)
+        print(f"unpack: {unpack / 5 * 1000:.1f}ms")
+
+        # timings are only reported; they depend too much on the machine's
+        # load to compare
+        assert compressor.calc_unpacked_data(packed) == m.data.tobytes()
+
+
 if __name__ == "__main__":
     t = TestDCMBlocks()
     t.setup()
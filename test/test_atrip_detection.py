@@ -0,0 +1,47 @@
+import numpy as np
+
+from mock import *
+
+from atrip.container import guess_container
+from atrip.media_type import rank_media_types
+from atrip.filesystem import rank_filesystems
+from atrip import detection
+
+
+samples = os.path.join(os.path.dirname(__file__), "../samples")
+
+
+class TestDetection:
+    def setup(self):
+        sample_data = np.fromfile(os.path.join(samples, "dos_sd_test1.atr"), dtype=np.uint8)
+        self.container = guess_container(sample_data)
+
+    def test_rank_media(self):
+        candidates = rank_media_types(self.container)
+        names = [c.cls.__name__ for c in candidates]
+        assert names[0] == "AtariSingleDensity"
+        assert candidates[0].confidence == detection.certain
+        assert "AtariDoubleDensity" not in names
+        assert "AtariCassetteImage" not in names
+        assert names == [c.cls.__name__ for c in rank_media_types(self.container)]
+
+    def test_rank_filesystems(self):
+        self.container.guess_media_type()
+        candidates = rank_filesystems(self.container.media)
+        names = [c.cls.__name__ for c in candidates]
+        assert names[0] == "AtariDos2"
+        assert "AtariCassetteFilesystem" not in names
+        assert "AppleDos33" not in names
+        assert len(set(names)) == len(names)
+
+    def test_cache(self):
+        self.container.guess_media_type()
+        cache = self.container.detection
+        assert cache.sha1 == self.container.sha1
+        assert cache.get_bytes(0, 2) == b"\x96\x02"
+        assert cache.check_signature([(slice(0, 2), [0x96, 0x02]), (2, 0x80)])
+        assert not cache.check_signature([(slice(0, 2), [0x96, 0x03])])
+        self.container.guess_filesystem()
+        assert self.container.detection is cache
+        self.container.guess_media_type()
+        assert self.container.detection is not cache
@@ -24,8 +24,8 @@ class TestNOP:
         c = Container(self.data)
         segment = Segment(c, origin=0x6000)
         driver = DisassemblyConfig()
-        segment.style[:] = 0
-        segment.disasm_type[:] = self.cpu_id
+        segment.writable_style[:] = 0
+        segment.writable_disasm_type[:] = self.cpu_id
         self.parsed = driver.parse(segment, 8000)
         self.entries = self.parsed.entries
         if self.__class__.labels is not None:
@@ -73,6 +73,39 @@ class TestLabels(TestORA):
     labels = [(0x80, "ADDR80"), (0xff, "ADDRFF")]
 
 
+class TestReparse:
+    def setup(self):
+        data = np.arange(0x1000, dtype=np.uint32).astype(np.uint8)
+        c = Container(data)
+        self.segment = Segment(c, origin=0x6000)
+        self.segment.writable_disasm_type[:] = 10
+        self.segment.writable_disasm_type[0x800:0x900] = 0
+        self.driver = DisassemblyConfig()
+        self.parsed = self.driver.parse(self.segment, 8000)
+
+    def check(self, ranges):
+        parsed = self.driver.reparse(self.segment, self.parsed, ranges)
+        assert parsed is self.parsed
+        full = self.driver.parse(self.segment, 8000)
+        assert len(parsed) == len(full)
+        assert np.array_equal(parsed.entries[:len(full)], full.entries[:len(full)])
+        assert np.array_equal(parsed.index_to_row, full.index_to_row)
+        assert np.array_equal(parsed.jmp_targets != 0, full.jmp_targets != 0)
+
+    @pytest.mark.parametrize("index", [0, 0x100, 0x7ff, 0x850, 0xfff])
+    def test_change_byte(self, index):
+        self.segment[index] = 0x20  # jsr, changes instruction length
+        self.check([(index, index + 1)])
+        self.segment[index] = 0xea  # nop
+        self.check([(index, index + 1)])
+
+    def test_change_disasm_type(self):
+        self.segment.writable_disasm_type[0x400:0x410] = 0
+        self.check([(0x400, 0x410)])
+        self.segment.writable_disasm_type[0x800:0x900] = 10
+        self.check([(0x800, 0x900)])
+
+
 def sample():
     if len(sys.argv) > 1:
         with open(sys.argv[1], 'rb') as fh:
@@ -113,8 +146,8 @@ def sample():
             print(f"text[{start}:{start + count}] = {text}, {e[i]}")
 
     driver = DisassemblyConfig()
-    segment.style[:] = 0
-    segment.disasm_type[:] = 10
+    segment.writable_style[:] = 0
+    segment.writable_disasm_type[:] = 10
     p = driver.parse(segment, 8000)
     e = p.entries
     print(p)
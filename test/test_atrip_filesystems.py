@@ -6,7 +6,7 @@ from mock import *
 
 from atrip.container import guess_container
 from atrip.media_type import Media, guess_media_type
-from atrip import errors
+from atrip import errors, find_container
 
 from atrip.media_types.atari_disks import *
 from atrip.media_types.apple_disks import *
@@ -40,6 +40,171 @@ class TestAtariDos2:
         is_expected_media(container, pathname)
 
 
+class TestAtariDosSectorLinks:
+    def setup(self):
+        pathname = os.path.join(os.path.dirname(__file__), "../samples", "dos_sd_test2.atr")
+        self.container = find_container(pathname)
+        self.fs = self.container.filesystem
+
+    @pytest.mark.parametrize("filename", ["dos_sd_test1.atr", "dos_dd_test1.atr", "dos_ed_test1.atr"])
+    def test_positions(self, filename):
+        container = find_container(os.path.join(os.path.dirname(__file__), "../samples", filename))
+        media = container.media
+        positions, sizes = media.calc_sector_positions()
+        expected = np.array([media.get_index_of_sector(i) for i, _, _ in media.iter_sectors()])
+        assert np.array_equal(positions, expected[:,0])
+        assert np.array_equal(sizes, expected[:,1])
+
+    def test_files(self):
+        links = self.fs.calc_sector_links()
+        for dirent in self.fs.iter_dirents():
+            sectors, error = links.follow(dirent.starting_sector, dirent.num_sectors, dirent.file_num)
+            assert error is None
+            assert len(sectors) == dirent.num_sectors
+            assert np.all(links.file_num[sectors] == dirent.file_num)
+        assert self.fs.check_integrity() == []
+
+    def test_problems(self):
+        dirents = list(self.fs.iter_dirents())
+        media = self.container.media
+        links = self.fs.calc_sector_links()
+        first, _ = links.follow(dirents[0].starting_sector, dirents[0].num_sectors)
+        second, _ = links.follow(dirents[1].starting_sector, dirents[1].num_sectors)
+
+        # link the last sector of the first file to the second file
+        index = links.index[first[-1]] + links.size[first[-1]] - 3
+        media[index] = (media[index] & 0xfc) | (second[0] >> 8)
+        media[index + 1] = second[0] & 0xff
+        problems = self.fs.check_integrity()
+        assert problems == [f"{dirents[0].filename}: Expecting file {dirents[0].file_num}, found {dirents[1].file_num}"]
+
+        # free a sector in the VTOC without removing it from the file
+        self.fs.vtoc.sector_map[second[-1]] = 1
+        assert f"marked free in VTOC: {second[-1]}" in self.fs.check_integrity()[-1]
+
+    def count_link_tables(self):
+        calls = []
+        calc_sector_links = self.fs.calc_sector_links
+        def counting_calc_sector_links():
+            calls.append(1)
+            return calc_sector_links()
+        self.fs.calc_sector_links = counting_calc_sector_links
+        return calls
+
+    def test_cache(self):
+        calls = self.count_link_tables()
+        self.fs.invalidate_sector_links()
+        for dirent in self.fs.iter_dirents():
+            dirent.invalidate_file()
+        for dirent in self.fs.iter_dirents():
+            assert dirent.get_file_segment() is not None
+        assert len(calls) == 1
+        assert self.fs.sector_links is self.fs.sector_links
+
+    def test_cache_media_edit(self):
+        dirents = list(self.fs.iter_dirents())
+        media = self.container.media
+        links = self.fs.sector_links
+        sizes = [len(d.get_file_segment()) for d in dirents[0:2]]
+        first, _ = links.follow(dirents[0].starting_sector, dirents[0].num_sectors)
+        second, _ = links.follow(dirents[1].starting_sector, dirents[1].num_sectors)
+        assert len(first) > 1 and len(second) > 1
+        dirents[1].invalidate_file()
+
+        # end both files after their first sector: the first file has
+        # already been built from the cached table, the second hasn't
+        for sector in (first[0], second[0]):
+            index = links.index[sector] + links.size[sector] - 3
+            media[index] = media[index] & 0xfc
+            media[index + 1] = 0
+        calls = self.count_link_tables()
+        assert len(dirents[0].get_file_segment()) == links.num_bytes[first[0]] < sizes[0]
+        assert len(calls) == 1
+        assert len(dirents[1].get_file_segment()) == links.num_bytes[second[0]] < sizes[1]
+        assert len(calls) == 1
+        assert self.fs.sector_links.next_sector[second[0]] == 0
+
+
+class TestAtariDosTransaction:
+    def setup(self):
+        pathname = os.path.join(os.path.dirname(__file__), "../samples", "dos_sd_test1.atr")
+        self.container = find_container(pathname)
+        self.fs = self.container.filesystem
+
+    def test_add_remove(self):
+        data = {f"F{i}.DAT": np.arange(i * 100, dtype=np.uint8) for i in range(20)}
+        free = self.fs.vtoc.unused_sectors
+        with self.fs.transaction() as t:
+            t.remove("A128.DAT")
+            for filename, d in data.items():
+                t.add(filename, d)
+        names = [d.filename for d in self.fs.iter_dirents()]
+        assert "A128.DAT" not in names
+        assert len(names) == 24
+        for dirent in self.fs.iter_dirents():
+            if dirent.filename in data:
+                segment = dirent.get_file_segment()
+                found = segment[:] if segment is not None else []
+                assert np.array_equal(found, data[dirent.filename])
+        assert self.fs.check_integrity() == []
+        used = sum(max(1, (i * 100 + 124) // 125) for i in range(20))
+        assert self.fs.vtoc.unused_sectors == free + 2 - used
+
+        # replace a file
+        with self.fs.transaction() as t:
+            t.add("F3.DAT", b"replaced")
+        assert self.container.find_dirent("F3.DAT").get_file_segment().tobytes() == b"replaced"
+        links = self.fs.sector_links
+        with self.fs.transaction() as t:
+            t.add("F3.DAT", b"replaced again")
+        assert self.fs.sector_links is not links
+        assert self.container.find_dirent("F3.DAT").get_file_segment().tobytes() == b"replaced again"
+        assert len(list(self.fs.iter_dirents())) == 24
+
+    def test_atomic(self):
+        before = self.container._data.copy()
+        t = self.fs.transaction()
+        t.add("SMALL.DAT", b"small")
+        t.add("BIG.DAT", np.zeros(100000, dtype=np.uint8))
+        with pytest.raises(errors.NotEnoughSpaceOnDisk):
+            t.commit()
+        t = self.fs.transaction()
+        t.add("SMALL.DAT", b"small")
+        t.remove("MISSING.DAT")
+        with pytest.raises(errors.FileNotFound):
+            t.commit()
+        assert np.array_equal(before, self.container._data)
+
+    def test_hard_drive(self):
+        # a double density image extended past 1040 sectors, where the link
+        # bytes hold a full sector number instead of the file number
+        pathname = os.path.join(os.path.dirname(__file__), "../samples", "dos_dd_test1.atr")
+        sample = np.fromfile(pathname, dtype=np.uint8)
+        header = sample[0:16].copy()
+        boot = np.zeros((3, 256), dtype=np.uint8)
+        boot[:,0:128] = sample[16:16 + 384].reshape((3, 128))
+        extra = np.zeros((2000 - 720) * 256, dtype=np.uint8)
+        body = np.concatenate([boot.ravel(), sample[16 + 384:], extra])
+        paragraphs = len(body) // 16
+        header[2:4] = np.array([paragraphs & 0xffff], dtype='<u2').view(np.uint8)
+        header[6] = paragraphs >> 16
+        container = guess_container(np.concatenate([header, body]))
+        container.guess_media_type()
+        container.guess_filesystem()
+        fs = container.filesystem
+        assert container.media.num_sectors == 2000
+        assert not fs.sector_links.has_file_numbers
+
+        data = {"NEW1.DAT": np.arange(1000, dtype=np.uint8), "NEW2.DAT": np.arange(300, dtype=np.uint8)}
+        with fs.transaction() as t:
+            for filename, d in data.items():
+                t.add(filename, d)
+        for filename, d in data.items():
+            dirent = container.find_dirent(filename)
+            assert dirent.file_num > 0
+            assert np.array_equal(dirent.get_file_segment()[:], d)
+
+
 if __name__ == "__main__":
     import logging
     logging.basicConfig(level=logging.WARNING)
@@ -31,6 +31,31 @@ class TestContainer:
         print(dirent)
         assert dirent is None
 
+    def test_lazy_file(self):
+        c = find_container(os.path.join(os.path.dirname(__file__), "../samples", "dos_sd_test1.atr"))
+        dirents = list(c.iter_dirents())
+        assert dirents
+        for dirent in dirents:
+            assert dirent._segments is None
+
+        dirent = c.find_dirent("A128.DAT", True)
+        segment = dirent.get_file_segment()
+        assert len(segment) == 128
+        assert dirent.segments == [segment]
+        assert dirent.get_file_segment() is segment
+
+        # changing file data doesn't affect the structure
+        segment[0] = segment[0] ^ 0xff
+        assert dirent.get_file_segment() is segment
+
+        # but a bad sector link does
+        offset = dirent.file_structure_offsets[0]
+        c._data[offset] ^= 0xfc
+        with pytest.raises(errors.FileError):
+            dirent.get_file_segment()
+        c._data[offset] ^= 0xfc
+        assert len(dirent.get_file_segment()) == 128
+
     def test_uuid(self):
         c = self.container
         segments = list(c.iter_segments())
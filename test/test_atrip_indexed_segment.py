@@ -102,6 +102,33 @@ class TestIndexed:
             self.container[index_in_source] = 9
             assert s2[i] == self.container[index_in_source]
 
+    def test_strided(self):
+        assert self.segment.is_strided
+        assert self.segment._container_offset is None
+
+        # constant stride sub-segments are numpy views into the container
+        s, indexes = get_indexed(self.segment, 256, 3)
+        assert s.is_strided
+        assert np.shares_memory(s.data, self.container._data)
+        s.data[4] = 77
+        assert self.container[12] == 77
+        assert np.array_equal(s.style, self.container.style[0:768:3])
+
+        # scattered offsets fall back to an index array
+        s2 = Segment(self.segment, [0, 5, 6, 100])
+        assert not s2.is_strided
+        assert np.array_equal(s2.container_offset, [0, 5, 6, 100])
+        assert s2.calc_index_from_other_segment(100, self.segment) == 3
+
+        # slices of a strided segment remain strided
+        s3 = Segment(s, 10, length=20)
+        assert s3.is_strided
+        assert s3.calc_container_offsets(0) == 30
+        assert s.calc_index_from_other_segment(3, s3) == 13
+        assert s.calc_index_from_other_segment(31, self.segment) == -1
+        assert np.array_equal(s3.calc_offsets_of_range(0, 4), [30, 33, 36, 39])
+        assert s3.reverse_offset[36] == 2
+
     # def test_indexed_sub(self):
     #     base = self.segment
     #     assert not base.rawdata.is_indexed
@@ -0,0 +1,127 @@
+import numpy as np
+
+from atrip.container import Container
+from atrip.segment import Segment
+from atrip.run_length import RunLengthArray
+from atrip.utils import collapse_values
+
+
+class TestRunLengthArray:
+    def setup(self):
+        self.runs = RunLengthArray(1000, 0)
+        self.expected = np.zeros(1000, dtype=np.uint8)
+
+    def check(self):
+        assert np.array_equal(self.runs.calc_array(), self.expected)
+        assert self.runs.collapsed() == collapse_values(self.expected)
+
+    def test_ranges(self):
+        self.runs.set_ranges([(100, 200), (150, 300)], 5)
+        self.expected[100:300] = 5
+        self.check()
+        assert self.runs.num_runs == 3
+
+        self.runs.or_ranges([(250, 400)], 0x80)
+        self.expected[250:400] |= 0x80
+        self.check()
+
+        self.runs.and_ranges([(0, 1000)], 0x7f)
+        self.expected &= 0x7f
+        self.check()
+        assert self.runs.find_ranges(4) == [(100, 300)]
+        assert self.runs.find_ranges(4, 120, 130) == [(120, 130)]
+
+    def test_dense(self):
+        d = self.runs.writable(10, 20)
+        d[10:20] = 3
+        self.expected[10:20] = 3
+        self.check()
+
+        # run operations update the existing dense array in place
+        self.runs.or_ranges([(15, 30), (900, 2000)], 8)
+        self.expected[15:30] |= 8
+        self.expected[900:] |= 8
+        assert np.array_equal(d, self.expected)
+        self.check()
+
+    def test_read_dense(self):
+        self.runs.set_ranges([(100, 200)], 5)
+        d = self.runs.dense
+        assert d[150] == 5
+        assert self.runs._modified is None
+        starts = self.runs.starts
+        assert self.runs.num_runs == 3
+        assert self.runs.starts is starts
+
+    def test_mark_modified(self):
+        self.runs.set_ranges([(100, 200), (500, 600)], 5)
+        self.expected[100:200] = 5
+        self.expected[500:600] = 5
+        d = self.runs.dense
+        d[150:550] = 5
+        d[700:710] = 2
+        self.runs.mark_modified(150, 550)
+        self.runs.mark_modified(700, 710)
+        self.expected[150:550] = 5
+        self.expected[700:710] = 2
+        assert self.runs._modified == (150, 710)
+        self.check()
+        assert self.runs.num_runs == 5
+
+        # values changed back to match the neighboring runs are merged
+        d[700:710] = 0
+        self.runs.mark_modified(700, 710)
+        self.expected[700:710] = 0
+        self.check()
+        assert self.runs.num_runs == 3
+
+    def test_collapsed(self):
+        self.runs.set_ranges([(10, 20)], 1)
+        self.runs.set_ranges([(30, 40)], 2)
+        r = RunLengthArray.from_collapsed(1000, self.runs.collapsed(), 99)
+        assert r.collapsed() == self.runs.collapsed()
+
+        r = RunLengthArray.from_collapsed(1000, [[1, 10, 20]], 99)
+        assert r.collapsed() == [[99, 0, 10], [1, 10, 20], [99, 20, 1000]]
+
+
+class TestContainerStyle:
+    def setup(self):
+        data = np.arange(0x10000, dtype=np.uint8)
+        self.container = Container(data)
+        self.segment = Segment(self.container, 0x1000, length=0x8000)
+
+    def test_style_ranges(self):
+        s = self.segment
+        s.set_style_ranges([[100, 200], [0x7000, 0x9000]], selected=True)
+        assert s.get_style_ranges(selected=True) == [(100, 200), (0x7000, 0x8000)]
+        assert self.container.get_style_ranges(selected=True) == [(0x1064, 0x10c8), (0x8000, 0x9000)]
+        assert self.container.style_runs.num_runs == 5
+
+        s.clear_style_bits(selected=True)
+        assert s.get_style_ranges(selected=True) == []
+        assert self.container.style_runs.num_runs == 1
+
+    def test_writable_style(self):
+        s = self.segment
+        s.set_style_ranges([[0, 0x10]], data=True)
+        assert s.style[0] == self.container.style[0x1000]
+        assert s.get_style_ranges(data=True) == [(0, 0x10)]
+
+        s.writable_style[0x20:0x30] = s.style[0]
+        assert self.container.style_runs._modified == (0x1000, 0x9000)
+        assert s.get_style_ranges(data=True) == [(0, 0x10), (0x20, 0x30)]
+
+    def test_disasm_ranges(self):
+        s = self.segment
+        s.set_disasm_ranges([[0, 0x100]], 0)
+        s.set_comment_at(0x80, "comment")
+        s.update_data_style_from_disasm_type()
+        assert s.get_style_ranges(data=True) == [(0, 0x100)]
+
+        starts, types = s.calc_disasm_chunks(10, [0])
+        assert starts.tolist() == [0, 0x80, 0x100]
+        assert types.tolist() == [0, 0, 10]
+
+        starts, types = s.calc_disasm_chunks(10, [])
+        assert starts.tolist() == [0, 0x100]
@@ -0,0 +1,115 @@
+import shutil
+
+import numpy as np
+
+from mock import *
+
+from atrip import search_index
+from atrip.byte_pattern import BytePattern, search_files
+from atrip.search_index import SearchIndex, calc_gram_keys
+
+
+samples = ["dos_sd_test1.atr", "dos_ed_test1.atr", "dos_dd_test1.atr", "mydos_sd_mydos4534.dcm"]
+
+
+class TestSearchIndex:
+    def setup(self):
+        self.dir = "tmp.search_index"
+        if os.path.exists(self.dir):
+            shutil.rmtree(self.dir)
+        self.images = os.path.join(self.dir, "images")
+        os.makedirs(self.images)
+        for name in samples:
+            shutil.copy(os.path.join(os.path.dirname(__file__), "../samples", name), self.images)
+        self.index = SearchIndex(os.path.join(self.dir, "index"))
+        self.index.update([self.images])
+
+    def teardown(self):
+        shutil.rmtree(self.dir)
+
+    def check_search(self, text):
+        pathnames = [os.path.abspath(os.path.join(self.images, name)) for name in sorted(samples)]
+        expected = [(p, c.name, r) for p, c, r in search_files(text, pathnames)]
+        found = [(p, c.name, r) for p, c, r in self.index.search(text)]
+        assert found == expected
+        return found
+
+    def test_gram_keys(self):
+        keys = calc_gram_keys(np.frombuffer(b"ABCDABCDE", dtype=np.uint8), 4)
+        assert keys.tolist() == [0x41424344, 0x42434441, 0x42434445, 0x43444142, 0x44414243]
+        assert len(calc_gram_keys(np.frombuffer(b"AB", dtype=np.uint8), 3)) == 0
+
+    @pytest.mark.parametrize("text", [
+        "9b",  # too short for the index; every container is scanned
+        "a0 00 b1",
+        "4? 31 32 38",
+        "41 31 ?? ?? 2e 44 41 54",
+        "de ad be ef 00 11",
+    ])
+    def test_search(self, text):
+        self.check_search(text)
+
+    def test_candidates(self):
+        assert self.index.find_candidates("de ad be ef 00 11") == set()
+        assert self.index.find_candidates("?? 9b") is None
+        files = self.index.find_candidate_files(BytePattern.from_bytes(b"DUP     SYS"))
+        assert list(files.keys()) == [os.path.abspath(os.path.join(self.images, "mydos_sd_mydos4534.dcm"))]
+
+    def test_candidates_stat(self, monkeypatch):
+        # only the files holding candidate containers are checked for changes
+        checked = []
+        calc_file_stat = search_index.calc_file_stat
+        def counting_calc_file_stat(pathname):
+            checked.append(pathname)
+            return calc_file_stat(pathname)
+        monkeypatch.setattr(search_index, "calc_file_stat", counting_calc_file_stat)
+        pattern = BytePattern.from_bytes(b"DUP     SYS")
+        files = self.index.find_candidate_files(pattern)
+        assert checked == list(files.keys())
+        assert self.index.find_candidate_files("de ad be ef 00 11") == {}
+        assert checked == list(files.keys())
+
+        del checked[:]
+        assert self.index.find_candidate_files(pattern, True) == files
+        assert sorted(checked) == sorted(self.index.files)
+
+    def test_update(self):
+        assert self.index.update([self.images]) == 0
+        index = SearchIndex(self.index.path)
+        assert len(index.files) == len(samples)
+        assert len(index.postings) == 1
+
+        # a copy of an indexed image doesn't add postings
+        shutil.copy(os.path.join(self.images, "dos_sd_test1.atr"), os.path.join(self.images, "copy.atr"))
+        assert index.update([self.images]) == 1
+        assert len(index.postings) == 1
+        assert len(index.containers) == len(samples)
+
+        # changed files are only scanned before the index is updated if all
+        # the files are checked
+        pathname = os.path.join(self.images, "dos_ed_test1.atr")
+        data = bytearray(open(pathname, "rb").read())
+        data[5000:5006] = b"\xde\xad\xbe\xef\x00\x11"
+        with open(pathname, "wb") as fh:
+            fh.write(data)
+        os.utime(pathname, ns=(0, 0))
+        assert len(index.search("de ad be ef 00 11")) == 0
+        assert len(index.search("de ad be ef 00 11", check_changes=True)) == 1
+
+        # but a changed file holding a candidate is scanned in full
+        files = index.find_candidate_files(BytePattern.from_bytes(b"A128    DAT"))
+        assert files[os.path.abspath(pathname)] is None
+
+        assert index.update([self.images]) == 1
+        assert len(index.postings) == 2
+        found = index.search("de ad be ef 00 11")
+        assert len(found) == 1
+        assert found[0][0] == os.path.abspath(pathname)
+
+        os.remove(os.path.join(self.images, "dos_sd_test1.atr"))
+        index.update([self.images])
+        index.compact()
+        index = SearchIndex(self.index.path)
+        assert len(index.postings) == 1
+        assert len(index.live_ids) == len(samples)
+        assert len(index.search("de ad be ef 00 11")) == 1
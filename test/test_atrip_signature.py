@@ -0,0 +1,85 @@
+import hashlib
+
+import numpy as np
+
+from mock import *
+
+from atrip.container import Container
+from atrip import signature
+
+
+clrmamepro_dat = """\
+clrmamepro (
+	name "Atari - 2600"
+	description "Atari - 2600"
+)
+
+game (
+	name "Test Cart (USA)"
+	description "Test Cart (USA)"
+	rom ( name "Test Cart (USA).a26" size 4096 crc 12345678 md5 00000000000000000000000000000000 sha1 %s )
+)
+"""
+
+logiqx_dat = """\
+<?xml version="1.0"?>
+<datafile>
+	<header>
+		<name>GCE - Vectrex</name>
+	</header>
+	<game name="Test Vectrex (World)">
+		<rom name="Test Vectrex (World).vec" size="4096" sha1="%s"/>
+	</game>
+</datafile>
+"""
+
+
+class TestSignatureIndex:
+    def setup(self):
+        self.entries = [(hashlib.sha1(bytes([i])).digest(), f"application/x.test{i % 3}", f"name {i}") for i in range(100)]
+        self.index = signature.SignatureIndex(signature.calc_index_bytes(self.entries))
+
+    def test_lookup(self):
+        assert len(self.index) == 100
+        for sha_hash, mime, name in self.entries:
+            found = self.index.lookup(sha_hash)
+            assert found.mime == mime
+            assert found.name == name
+        assert self.index.lookup(b"\0" * 20) is None
+
+    def test_file(self):
+        signature.write_index(self.entries, "tmp.sha1_index.bin")
+        assert signature.is_index_file("tmp.sha1_index.bin")
+        index = signature.SignatureIndex("tmp.sha1_index.bin")
+        assert index.lookup(self.entries[50][0]).name == "name 50"
+
+    def test_builtin(self):
+        mods = signature.builtin_signature_modules()
+        index = signature.SignatureIndex(signature.calc_index_bytes(signature.iter_module_signatures(mods)))
+        for mime, sigs in mods[0].sha1_signatures.items():
+            for sha_hash, name in sigs.items():
+                assert index.lookup(sha_hash).name == name
+
+
+class TestExternalDatabase:
+    def setup(self):
+        self.container = Container(np.arange(4096, dtype=np.uint32).view(np.uint8))
+        self.sha1 = hashlib.sha1(self.container.data).hexdigest()
+
+    def teardown(self):
+        signature.clear_signature_databases()
+
+    @pytest.mark.parametrize(("template", "mime", "name"), [
+        (clrmamepro_dat, "application/x.atari2600.cart", "Test Cart (USA)"),
+        (logiqx_dat, "application/x.vectrex", "Test Vectrex (World)"),
+    ])
+    def test_dat(self, template, mime, name):
+        assert signature.guess_signature_from_container(self.container) is None
+        with open("tmp.signatures.dat", "w") as fh:
+            fh.write(template % self.sha1)
+        signature.add_signature_database("tmp.signatures.dat")
+        db = signature._external_databases[0]
+        assert db._index is None
+        found = signature.guess_signature_from_container(self.container)
+        assert found.mime == mime
+        assert found.name == name
@@ -0,0 +1,181 @@
+"""Pure-Python stand-in for a compiled emulator
+
+`StandIn` plugs a Python low-level interface into the `Emulator` base class,
+so the parts of the emulator framework above the C code (turbo frames,
+breakpoints, the restart tree, conversion to RGB, the emulator pool) can be
+tested without building an emulator.
+
+The machine is trivial: each instruction increments the program counter
+and adds the key code (plus one) to the byte of screen memory at the
+instruction's position in the frame, so the screen depends on the input of
+every frame since boot. Only simple PC breakpoints (`Breakpoint.simple_address`)
+are supported.
+"""
+import numpy as np
+
+from omnivore.emulator import Emulator, FRAME_START, FRAME_FINISHED, FRAME_BREAKPOINT
+from omnivore.debugger import dtypes as dd
+from omnivore.debugger.dtypes import FRAME_STATUS_DTYPE
+
+VIDEO_WIDTH = 40
+VIDEO_HEIGHT = 24
+MAIN_MEMORY_SIZE = 1 << 16
+SCREEN_ADDRESS = 0x4000
+
+CPU_DTYPE = np.dtype([
+    ("PC", np.uint16),
+])
+
+OUTPUT_DTYPE = np.dtype([
+    ("video", np.uint8, VIDEO_WIDTH * VIDEO_HEIGHT),
+    ("audio", np.uint8, 64),
+    ("state", np.uint8, CPU_DTYPE.itemsize + MAIN_MEMORY_SIZE),
+])
+
+
+class StandInInterface:
+    """Python version of the functions of an emulator's cython module used
+    by `Emulator`
+    """
+    instructions_per_frame = 2000
+
+    def __init__(self):
+        # frame numbers of the frames emulated with a CPU history
+        self.history_frames = []
+
+    def get_arrays(self, output_raw):
+        status = output_raw[0:FRAME_STATUS_DTYPE.itemsize].view(dtype=FRAME_STATUS_DTYPE)[0]
+        output = output_raw[FRAME_STATUS_DTYPE.itemsize:].view(dtype=OUTPUT_DTYPE)[0]
+        cpu = output['state'][0:CPU_DTYPE.itemsize].view(dtype=CPU_DTYPE)[0]
+        memory = output['state'][CPU_DTYPE.itemsize:]
+        return status, output, cpu, memory
+
+    def clear_state_arrays(self, input, output_raw):
+        output_raw[:] = 0
+        status = output_raw[0:FRAME_STATUS_DTYPE.itemsize].view(dtype=FRAME_STATUS_DTYPE)
+        status['frame_status'] = FRAME_FINISHED
+
+    def init_emulator(self, args):
+        pass
+
+    def configure_state_arrays(self, input, output_raw):
+        pass
+
+    def restore_state(self, state):
+        # all the state is in the output array
+        pass
+
+    def get_current_state(self, state):
+        pass
+
+    def find_breakpoints(self, debug_cmd):
+        """Return the dict of address to breakpoint id of the enabled PC
+        breakpoints
+        """
+        c = debug_cmd[0]
+        breakpoints = {}
+        for bpid in range(c['num_breakpoints']):
+            if c['breakpoint_status'][bpid] != dd.BREAKPOINT_ENABLED or c['breakpoint_type'][bpid] != dd.BREAKPOINT_CONDITIONAL:
+                continue
+            i = bpid * dd.TOKENS_PER_BREAKPOINT
+            tokens = c['tokens'][i:i + 5].tolist()
+            if tokens[0:2] == [dd.REG_PC, dd.NUMBER] and tokens[3:5] == [dd.OP_EQ, dd.END_OF_LIST]:
+                breakpoints.setdefault(tokens[2], bpid)
+        return breakpoints
+
+    def next_frame(self, input, output_raw, debug_cmd, history):
+        status, output, cpu, memory = self.get_arrays(output_raw)
+        breakpoints = self.find_breakpoints(debug_cmd)
+        step = int(input['keycode'][0]) + 1
+        if status['frame_status'] == FRAME_BREAKPOINT:
+            # continue from the breakpoint without stopping at it again
+            resume = True
+        else:
+            resume = False
+            status['current_instruction_in_frame'] = 0
+        status['frame_status'] = FRAME_START
+        pc = int(cpu['PC'])
+        first = int(status['current_instruction_in_frame'])
+        screen_size = VIDEO_WIDTH * VIDEO_HEIGHT
+        for i in range(first, self.instructions_per_frame):
+            if pc in breakpoints and not resume:
+                cpu['PC'] = pc
+                status['instructions_since_power_on'] += i - first
+                status['current_instruction_in_frame'] = i
+                status['frame_status'] = FRAME_BREAKPOINT
+                status['breakpoint_id'] = breakpoints[pc]
+                return breakpoints[pc]
+            resume = False
+            addr = SCREEN_ADDRESS + i % screen_size
+            memory[addr] = (int(memory[addr]) + step) & 0xff
+            pc = (pc + 1) & 0xffff
+        status['instructions_since_power_on'] += self.instructions_per_frame - first
+        cpu['PC'] = pc
+        status['current_instruction_in_frame'] = 0
+        status['frame_number'] += 1
+        status['frame_status'] = FRAME_FINISHED
+        status['breakpoint_id'] = -1
+        if history is not None:
+            self.history_frames.append(int(status['frame_number']))
+        if not status['skip_output']:
+            output['video'][:] = memory[SCREEN_ADDRESS:SCREEN_ADDRESS + screen_size]
+        return -1
+
+
+class StandInUI:
+    """Stand-in for the GUI mixins of the real emulators"""
+    is_ui_mixin = True
+
+
+class StandIn(StandInUI, Emulator):
+    cpu = "none"
+    name = "standin"
+    ui_name = "Stand-in Emulator"
+
+    output_array_dtype = OUTPUT_DTYPE
+    width = VIDEO_WIDTH
+    height = VIDEO_HEIGHT
+
+    low_level_interface = StandInInterface()
+
+    # address at which the contents of a file are loaded and run
+    boot_address = 0x2000
+
+    @property
+    def program_counter(self):
+        return self.cpu_state['PC']
+
+    @program_counter.setter
+    def program_counter(self, value):
+        self.cpu_state['PC'] = value
+
+    def configure_labels(self, labels=None):
+        self.labels = labels
+
+    def compute_color_map(self):
+        self.rmap = np.arange(256, dtype=np.uint8)
+        self.gmap = self.rmap[::-1].copy()
+        self.bmap = (self.rmap * 3) & 0xff
+
+    def calc_cpu_data_array(self):
+        return self.state_array[0:CPU_DTYPE.itemsize].view(dtype=CPU_DTYPE)[0]
+
+    def calc_main_memory_array(self):
+        return self.state_array[CPU_DTYPE.itemsize:]
+
+    def boot_from_file(self, filename):
+        data = np.fromfile(filename, dtype=np.uint8)
+        self.coldstart()
+        end = self.boot_address + len(data)
+        if end > MAIN_MEMORY_SIZE:
+            raise ValueError(f"{filename} doesn't fit in memory")
+        self.main_memory[self.boot_address:end] = data
+        self.program_counter = self.boot_address
+        self.last_boot_state = self.calc_current_state()
+
+    def get_color_indexed_screen(self, frame_number=-1):
+        if frame_number < 0:
+            output = self.output
+        else:
+            _, output = self.get_history(frame_number)
+        return output['video'].reshape((self.height, self.width))
@@ -0,0 +1,123 @@
+import numpy as np
+
+from mock import *
+
+from omnivore.debugger import dtypes as dd
+from omnivore.debugger.compiler import compile_condition, evaluate_bytecode, BreakpointCompileError
+from omnivore.debugger.debugger import Debugger
+
+
+registers = {
+    dd.REG_A: 0x42,
+    dd.REG_X: 3,
+    dd.REG_PC: 0x2000,
+}
+
+
+def get_emulator_value(token, addr):
+    return registers.get(token, 0)
+
+
+def evaluate(*tokens):
+    compiled = compile_condition(tokens + (dd.END_OF_LIST,))
+    return compiled, evaluate_bytecode(compiled.bytecode, get_emulator_value)
+
+
+class TestCompiler(object):
+    def test_operators(self):
+        assert evaluate(dd.NUMBER, 10, dd.REG_X, dd.OP_MINUS)[1] == 7
+        assert evaluate(dd.REG_X, dd.NUMBER, 10, dd.OP_MINUS)[1] == 0xfff9
+        assert evaluate(dd.REG_A, dd.NUMBER, 2, dd.OP_RSHIFT)[1] == 0x10
+        assert evaluate(dd.REG_X, dd.NUMBER, 4, dd.OP_EXP)[1] == 81
+        assert evaluate(dd.REG_A, dd.NUMBER, 0x40, dd.OP_GT)[1] == 1
+        assert evaluate(dd.REG_A, dd.OP_BITWISE_NOT)[1] == 0xffbd
+        assert evaluate(dd.REG_A, dd.OP_LOGICAL_NOT, dd.REG_X, dd.OP_LOGICAL_OR)[1] == 1
+        assert evaluate(dd.REG_A, dd.OP_UMINUS)[1] == 0xffbe
+
+    def test_constant_folding(self):
+        compiled, value = evaluate(dd.REG_A, dd.NUMBER, 0x20, dd.NUMBER, 2, dd.OP_MULT, dd.NUMBER, 2, dd.OP_PLUS, dd.OP_EQ)
+        assert value == 1
+        assert compiled.bytecode == [dd.BYTECODE_EMU | (dd.REG_A << dd.BYTECODE_OPERAND_SHIFT), dd.BYTECODE_NUMBER, 0x42, dd.BYTECODE_EQ, dd.BYTECODE_END]
+        compiled, value = evaluate(dd.REG_A, dd.NUMBER, 1, dd.NUMBER, 1, dd.OP_MINUS, dd.OP_LOGICAL_AND)
+        assert compiled.guard_type == dd.BREAKPOINT_GUARD_NEVER
+
+    def test_pc_guard(self):
+        compiled, value = evaluate(dd.REG_PC, dd.NUMBER, 0x2000, dd.OP_EQ)
+        assert compiled.guard_type == dd.BREAKPOINT_GUARD_PC
+        assert compiled.guard_pc == 0x2000
+        assert compiled.bytecode == [dd.BYTECODE_END]
+        compiled, value = evaluate(dd.REG_A, dd.NUMBER, 0x42, dd.OP_EQ, dd.NUMBER, 0x2000, dd.REG_PC, dd.OP_EQ, dd.OP_LOGICAL_AND)
+        assert compiled.guard_type == dd.BREAKPOINT_GUARD_PC
+        assert compiled.guard_pc == 0x2000
+        assert len(compiled.bytecode) == 5
+        assert value == 1
+
+    def test_errors(self):
+        with pytest.raises(BreakpointCompileError) as e:
+            compile_condition((dd.REG_A, dd.OP_PLUS, dd.END_OF_LIST))
+        assert e.value.status == dd.STACK_UNDERFLOW
+        with pytest.raises(BreakpointCompileError) as e:
+            compile_condition((dd.REG_A, dd.NUMBER, 0, dd.NUMBER, 0, dd.OP_DIV, dd.OP_PLUS, dd.END_OF_LIST))
+        assert e.value.status == dd.EVALUATION_ERROR
+
+
+class TestCompileBreakpoints(object):
+    def setup(self):
+        self.debugger = Debugger()
+        for i in range(100):
+            self.debugger.create_breakpoint(0x2000 + i)
+        b = self.debugger.create_breakpoint()
+        b.terms = (dd.REG_A, dd.NUMBER, 0x42, dd.OP_EQ, dd.END_OF_LIST)
+        b.enable()
+        self.conditional = b
+        self.debugger.compile_breakpoints()
+
+    def test_tables(self):
+        c = self.debugger.debug_cmd[0]
+        assert c['compiled']
+        assert c['num_compiled'] == 101
+        assert c['num_unguarded'] == 1
+        assert c['unguarded_ids'][0] == self.conditional.id
+        bits = np.unpackbits(c['pc_bitmap'], bitorder='little')
+        assert np.array_equal(np.where(bits)[0], np.arange(0x2000, 0x2064))
+        assert c['guard_pc'][1] == 0x2000
+
+    def test_recompile(self):
+        c = self.debugger.debug_cmd[0]
+        self.conditional.disable()
+        self.debugger.compile_breakpoints()
+        assert c['num_unguarded'] == 0
+        b = self.debugger.create_breakpoint()
+        b.terms = (dd.REG_A, dd.OP_MINUS, dd.END_OF_LIST)
+        b.enable()
+        self.debugger.compile_breakpoints()
+        assert b.had_error
+        assert c['num_compiled'] == 100
+
+
+class TestWatchpoints(object):
+    def setup(self):
+        self.debugger = Debugger()
+        self.debugger.create_breakpoint(0x6000)
+        self.writes = self.debugger.create_watchpoint([(0x3000 + i * 4, 0x3002 + i * 4) for i in range(1000)])
+        self.reads = self.debugger.create_watchpoint([(0xd000, 0xd010)], dd.ACCESS_TYPE_READ)
+        self.debugger.compile_breakpoints()
+
+    def test_tables(self):
+        c = self.debugger.debug_cmd[0]
+        assert len(self.writes.watched_addresses) == 2000
+        assert c['watch_id'][0x3f9d] == self.writes.id
+        assert c['watch_mask'][0x3f9d] == dd.ACCESS_TYPE_WRITE
+        assert c['watch_mask'][0x3f9e] == 0
+        assert c['watch_mask'][0xd00f] == dd.ACCESS_TYPE_READ
+        assert list(np.where(c['watch_pages'])[0]) == list(range(0x30, 0x40)) + [0xd0]
+
+    def test_disable(self):
+        c = self.debugger.debug_cmd[0]
+        self.writes.disable()
+        self.debugger.compile_breakpoints()
+        assert list(np.where(c['watch_pages'])[0]) == [0xd0]
+        self.reads.clear()
+        self.debugger.compile_breakpoints()
+        assert not c['watch_pages'].any()
+        assert len(self.reads.watched_addresses) == 0
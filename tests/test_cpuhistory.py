@@ -0,0 +1,141 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from mock import *
+
+from atrip.disassembler import flags, dd
+from omnivore.utils.cpuhistory import HistoryQuery, FrameCheckpoints
+from omnivore.utils.cputrace import CpuTrace
+
+
+class RingHistory(object):
+    # minimal stand-in for HistoryStorage: a ring of entries
+    def __init__(self, num_allocated):
+        self.entries = np.zeros(num_allocated, dtype=dd.HISTORY_ENTRY_DTYPE)
+        self.first_entry_index = 0
+        self.num_entries = 0
+        self.cumulative_count = 0
+
+    def __len__(self):
+        return self.num_entries
+
+    def append(self, **kwargs):
+        allocated = len(self.entries)
+        index = (self.first_entry_index + self.num_entries) % allocated
+        self.entries[index] = 0
+        for k, v in kwargs.items():
+            self.entries[index][k] = v
+        if self.num_entries < allocated:
+            self.num_entries += 1
+        else:
+            self.first_entry_index = (self.first_entry_index + 1) % allocated
+        self.cumulative_count += 1
+
+    def end_frame(self, frame_number):
+        self.append(disassembler_type=flags.DISASM_FRAME_END)
+        allocated = len(self.entries)
+        index = (self.first_entry_index + self.num_entries - 1) % allocated
+        self.entries[index:index + 1].view(dd.HISTORY_FRAME_DTYPE)['frame_number'] = frame_number
+
+
+class TestHistoryQuery(object):
+    def setup(self):
+        self.history = RingHistory(100)
+        self.checkpoints = FrameCheckpoints()
+        # 10 frames of 15 entries each; the first 50 entries are overwritten
+        for frame in range(1, 11):
+            self.checkpoints.add(frame, self.history.cumulative_count)
+            for i in range(14):
+                pc = 0x2000 + frame * 0x10 + i
+                self.history.append(pc=pc, target_addr=0x600 + i, num_bytes=3, disassembler_type=flags.DISASM_6502_HISTORY, flag=flags.FLAG_STORE_A_IN_MEMORY if i == 3 else 0, instruction=[0x8d, 0x00 + i, 0x06] + [0] * 13)
+            self.history.end_frame(frame)
+        self.query = HistoryQuery(self.history, self.checkpoints)
+
+    def test_entries(self):
+        entries = self.query.get_entries()
+        assert len(entries) == 100
+        assert self.history.first_entry_index == 50
+        assert entries[0]['pc'] == self.history.entries[50]['pc']
+        assert entries[99]['disassembler_type'] == flags.DISASM_FRAME_END
+
+    def test_filters(self):
+        rows = self.query.find(pc_range=(0x20a0, 0x20b0))
+        assert list(rows) == list(range(85, 99))
+        rows = self.query.find(flag=flags.FLAG_STORE_A_IN_MEMORY)
+        assert len(rows) == 6
+        assert list(self.query.find(operand=0x0605, pc=0x20a5)) == [90]
+        assert len(self.query.find(disassembler_type=flags.DISASM_FRAME_END)) == 7
+
+    def test_frames(self):
+        rows = self.query.find(9, 9, target_addr=0x603)
+        assert list(rows) == [73]
+        assert self.query.calc_checkpoint_rows(9, 9) == (70, 85)
+        no_checkpoints = HistoryQuery(self.history)
+        assert list(no_checkpoints.find(9, 9, target_addr=0x603)) == [73]
+        assert list(no_checkpoints.find(5, 6, flag=flags.FLAG_STORE_A_IN_MEMORY)) == [13, 28]
+        # the start of frame 4 has been overwritten
+        assert list(self.query.find(4, 4, flag=flags.FLAG_STORE_A_IN_MEMORY)) == []
+
+    def test_previous_next(self):
+        assert self.query.find_previous(50, disassembler_type=flags.DISASM_FRAME_END) == 39
+        assert self.query.find_next(50, disassembler_type=flags.DISASM_FRAME_END) == 54
+        assert self.query.find_next(99, disassembler_type=flags.DISASM_FRAME_END) is None
+        assert self.query.find_previous(9, disassembler_type=flags.DISASM_FRAME_END) is None
+
+    def test_restart(self):
+        self.checkpoints.add(6, self.history.cumulative_count)
+        assert len(self.checkpoints) == 6
+        assert self.checkpoints.find_count(7) is None
+
+
+class TestCpuTrace(object):
+    def setup(self):
+        self.history = RingHistory(40)
+        self.trace = CpuTrace(tempfile.mkdtemp(prefix="tmp.cputrace.", dir=os.path.dirname(__file__)))
+        self.trace.frames_per_chunk = 3
+        self.trace.sync(self.history)
+        # 10 frames of 15 entries each, drained after every frame like the
+        # emulator does after next_frame
+        for frame in range(1, 11):
+            for i in range(14):
+                self.history.append(pc=0x2000 + frame * 0x10 + i, disassembler_type=flags.DISASM_6502_HISTORY, flag=flags.FLAG_STORE_A_IN_MEMORY if i == 3 else 0)
+            self.history.end_frame(frame)
+            self.trace.record(self.history, frame)
+
+    def teardown(self):
+        shutil.rmtree(self.trace.path)
+
+    def test_rows(self):
+        t = self.trace
+        assert len(t) == 150
+        assert len(t.chunks) == 3
+        assert t[0]['pc'] == 0x2010
+        assert t[149]['disassembler_type'] == flags.DISASM_FRAME_END
+        entries = t.get_entries(40, 50)
+        assert list(entries['pc']) == list(range(0x2030 + 10, 0x2030 + 14)) + [3] + list(range(0x2040, 0x2045))
+
+    def test_frames(self):
+        t = self.trace
+        assert t.get_frame_range(4) == (45, 60)
+        assert t.find_frame_number(59) == 4
+        assert t.find_frame_number(60) == 5
+        assert list(t.find(9, 10, flag=flags.FLAG_STORE_A_IN_MEMORY)) == [123, 138]
+        assert len(t.find(pc_range=(0x2000, 0x3000))) == 140
+
+    def test_search(self):
+        t = self.trace
+        assert t.find_previous(100, disassembler_type=flags.DISASM_FRAME_END) == 89
+        assert t.find_next(100, disassembler_type=flags.DISASM_FRAME_END) == 104
+        assert t.find_next(149, disassembler_type=flags.DISASM_FRAME_END) is None
+
+    def test_reopen(self):
+        t = self.trace
+        t.max_cached_chunks = 1
+        t.close()
+        reopened = CpuTrace(t.path)
+        assert len(reopened) == 150
+        assert reopened.get_frame_range(10) == (135, 150)
+        assert reopened.find_previous(140, pc=0x2012) == 2
@@ -0,0 +1,188 @@
+import numpy as np
+
+from mock import *
+
+from standin_emulator import StandIn
+
+
+def get_emulator(tmp_path, data=b"\x00"):
+    pathname = str(tmp_path / "boot.bin")
+    with open(pathname, "wb") as fh:
+        fh.write(data)
+    emu = StandIn.get_headless_class()()
+    emu.configure_emulator([], 1000)
+    emu.boot_from_file(pathname)
+    return emu
+
+
+class TestTurbo(object):
+    @pytest.fixture(autouse=True)
+    def create_emulator(self, tmp_path):
+        self.emu = get_emulator(tmp_path)
+        self.reference = get_emulator(tmp_path)
+        self.history_frames = self.emu.low_level_interface.history_frames
+        del self.history_frames[:]
+        self.saved = []
+        save_history = self.emu.save_history
+        def counting_save_history(*args, **kwargs):
+            self.saved.append(int(self.emu.current_frame_number))
+            save_history(*args, **kwargs)
+        self.emu.save_history = counting_save_history
+
+    def checkpoint_frames(self):
+        c = self.emu.cpu_history_checkpoints
+        return c.frame_numbers[:len(c)].tolist()
+
+    def test_next_frame(self):
+        emu = self.emu
+        assert emu.next_frame() is None
+        video = emu.video_array.copy()
+        for i in range(3):
+            emu.input['keycode'] = i
+            assert emu.next_frame(skip_output=True) is None
+        assert emu.current_frame_number == 4
+        assert emu.status['skip_output'][0] == 0
+        assert np.array_equal(emu.video_array, video)
+
+        # turbo frames aren't saved and record no CPU history
+        assert self.saved == [1]
+        assert self.checkpoint_frames() == [1]
+        assert self.history_frames == [1]
+        assert list(emu.current_restart.frame_history.keys()) == [1]
+
+        # but the input is saved so they can be rebuilt
+        for i in range(3):
+            input_raw = emu.current_restart.get_input(i + 2)
+            assert input_raw.view(dtype=emu.input_array_dtype)['keycode'][0] == i
+
+        emu.input['keycode'] = 0
+        assert emu.next_frame() is None
+        assert self.saved == [1, 5]
+        assert self.checkpoint_frames() == [1, 5]
+        assert self.history_frames == [1, 5]
+
+    def test_fast_forward(self):
+        assert self.emu.fast_forward(25) is None
+        assert self.emu.current_frame_number == 25
+        assert self.saved == [25]
+        assert self.history_frames == [25]
+
+        for i in range(25):
+            self.reference.next_frame()
+        assert np.array_equal(self.emu.video_array, self.reference.video_array)
+        assert np.array_equal(self.emu.output_raw, self.reference.output_raw)
+
+    def test_fast_forward_breakpoint(self):
+        emu = self.emu
+        per_frame = emu.low_level_interface.instructions_per_frame
+        addr = StandIn.boot_address + 4 * per_frame + 5
+        bp = emu.create_breakpoint(addr)
+        stopped = emu.fast_forward(25)
+        assert stopped is not None
+        assert stopped.id == bp.id
+        assert emu.program_counter == addr
+        assert emu.current_frame_number == 4
+        assert not emu.is_frame_finished
+        assert emu.status['skip_output'][0] == 0
+        assert self.saved == []
+        assert self.history_frames == []
+
+        # continuing finishes the frame without stopping at the breakpoint
+        # again
+        assert emu.fast_forward(21) is None
+        assert emu.current_frame_number == 25
+        assert self.saved == [25]
+
+
+class TestScreenConversion(object):
+    @pytest.fixture(autouse=True)
+    def create_emulator(self, tmp_path):
+        self.emu = get_emulator(tmp_path)
+        self.raw = np.arange(self.emu.height * self.emu.width, dtype=np.uint8).reshape((self.emu.height, self.emu.width))
+
+    def get_expected_rgb(self, raw):
+        emu = self.emu
+        return np.stack([emu.rmap[raw], emu.gmap[raw], emu.bmap[raw]], axis=-1)
+
+    def get_expected_rgba(self, raw):
+        rgba = np.empty(raw.shape + (4,), dtype=np.uint8)
+        rgba[...,0:3] = self.get_expected_rgb(raw)
+        rgba[...,3] = 255
+        return rgba
+
+    def test_palettes(self):
+        emu = self.emu
+        assert emu.palette_rgb.shape == (256, 3)
+        assert np.array_equal(emu.palette_rgb, self.get_expected_rgb(np.arange(256)))
+        assert emu.palette_rgba.dtype == np.uint32
+        assert np.array_equal(emu.palette_rgba.view(np.uint8).reshape((256, 4)), self.get_expected_rgba(np.arange(256)))
+
+    def test_grayscale(self):
+        class NoColorMap(StandIn.get_headless_class()):
+            def compute_color_map(self):
+                pass
+
+        emu = NoColorMap()
+        gray = np.arange(256, dtype=np.uint8)
+        assert np.array_equal(emu.palette_rgb, np.stack([gray, gray, gray], axis=-1))
+        assert np.array_equal(emu.palette_rgba.view(np.uint8).reshape((256, 4))[:,3], np.full(256, 255))
+
+    def test_rgb(self):
+        emu = self.emu
+        rgb = emu.convert_to_rgb(self.raw)
+        assert rgb is emu.screen_rgb
+        assert np.array_equal(rgb, self.get_expected_rgb(self.raw))
+
+        # the same buffer is reused
+        raw = self.raw[::-1].copy()
+        assert emu.convert_to_rgb(raw) is rgb
+        assert np.array_equal(rgb, self.get_expected_rgb(raw))
+
+        out = np.zeros_like(rgb)
+        assert emu.convert_to_rgb(self.raw, out) is out
+        assert np.array_equal(out, self.get_expected_rgb(self.raw))
+        assert np.array_equal(rgb, self.get_expected_rgb(raw))
+
+    def test_rgba(self):
+        emu = self.emu
+        rgba = emu.convert_to_rgba(self.raw)
+        assert rgba is emu.screen_rgba
+        assert rgba.shape == (emu.height, emu.width, 4)
+        assert np.array_equal(rgba, self.get_expected_rgba(self.raw))
+
+        raw = self.raw[::-1].copy()
+        assert emu.convert_to_rgba(raw) is rgba
+        assert np.array_equal(rgba, self.get_expected_rgba(raw))
+
+        out = np.zeros_like(rgba)
+        assert emu.convert_to_rgba(self.raw, out) is out
+        assert np.array_equal(out, self.get_expected_rgba(self.raw))
+
+        out32 = np.zeros((emu.height, emu.width), dtype=np.uint32)
+        assert emu.convert_to_rgba(self.raw, out32) is out32
+        assert np.array_equal(out32.view(np.uint8).reshape(rgba.shape), self.get_expected_rgba(self.raw))
+
+    def test_frames(self):
+        emu = self.emu
+        for i in range(12):
+            emu.input['keycode'] = i
+            emu.next_frame()
+        raw = emu.get_color_indexed_screen()
+        assert np.array_equal(emu.get_frame_rgb(), self.get_expected_rgb(raw))
+        assert np.array_equal(emu.get_frame_rgba(), self.get_expected_rgba(raw))
+        assert np.array_equal(emu.get_frame_rgba_opengl(), self.get_expected_rgba(raw[::-1]))
+
+        # snapshots and frames rebuilt from them
+        frame_numbers = [1, 3, 10, 12]
+        expected_rgb = [self.get_expected_rgb(emu.get_color_indexed_screen(f)) for f in frame_numbers]
+        expected_rgba = [self.get_expected_rgba(emu.get_color_indexed_screen(f)) for f in frame_numbers]
+        assert not np.array_equal(expected_rgb[0], expected_rgb[1])
+        frames = emu.get_frames_rgb(frame_numbers)
+        assert frames.shape == (len(frame_numbers), emu.height, emu.width, 3)
+        assert np.array_equal(frames, expected_rgb)
+        frames = emu.get_frames_rgba(frame_numbers)
+        assert np.array_equal(frames, expected_rgba)
+
+        out = np.zeros((len(frame_numbers), emu.height, emu.width, 3), dtype=np.uint8)
+        assert emu.get_frames_rgb(frame_numbers, out) is out
+        assert np.array_equal(out, expected_rgb)
@@ -0,0 +1,120 @@
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from mock import *
+
+from omnivore.emulator import INPUT_DTYPE
+from omnivore.emulator_pool import EmulatorPool, EmulatorWorker, PlaybackJob, run_playback_job
+
+from standin_emulator import StandIn
+
+
+def get_inputs(keycode, num_frames):
+    inputs = np.zeros(num_frames, dtype=INPUT_DTYPE)
+    inputs['keycode'] = keycode
+    return inputs
+
+
+class TestEmulatorPool(object):
+    @pytest.fixture(autouse=True)
+    def create_files(self, tmp_path):
+        self.pathnames = []
+        for i in range(6):
+            pathname = str(tmp_path / f"boot{i}.bin")
+            with open(pathname, "wb") as fh:
+                fh.write(bytes(range(i + 1)))
+            self.pathnames.append(pathname)
+
+    def get_jobs(self):
+        # decreasing lengths, so the jobs finish out of order
+        return [PlaybackJob(p, 12 - i, inputs=get_inputs(i, 12 - i), capture_frames=[0, 11 - i]) for i, p in enumerate(self.pathnames)]
+
+    def get_expected(self, job):
+        emu = StandIn.get_headless_class()()
+        emu.configure_emulator([], 1000)
+        emu.frame_history_enabled = False
+        return run_playback_job(emu, job)
+
+    def test_headless(self):
+        cls = StandIn.get_headless_class()
+        assert cls.name == StandIn.name
+        assert not any(getattr(b, 'is_ui_mixin', False) for b in cls.__mro__)
+
+    def test_run(self):
+        jobs = self.get_jobs()
+        with EmulatorPool(StandIn, 3) as pool:
+            assert len(pool) == 3
+            finished = [index for index, result in pool.iter_results(jobs)]
+            results = pool.run(jobs)
+        assert sorted(finished) == list(range(len(jobs)))
+        assert len(results) == len(jobs)
+        for job, result in zip(jobs, results):
+            expected = self.get_expected(job)
+            assert result.error is None
+            assert result.job.pathname == job.pathname
+            assert result.frame_number == job.num_frames
+            assert sorted(result.video.keys()) == [0, job.num_frames - 1]
+            for frame_index, video in expected.video.items():
+                assert np.array_equal(result.video[frame_index], video)
+
+    def test_breakpoints(self):
+        addr = StandIn.boot_address + StandIn.low_level_interface.instructions_per_frame + 5
+        job = PlaybackJob(self.pathnames[0], 3, breakpoints=[addr])
+        with EmulatorPool(StandIn, 1) as pool:
+            result, = pool.run([job])
+        assert result.error is None
+        assert result.breakpoints == [(1, 1, addr)]
+        assert result.frame_number == 3
+
+    def test_error(self):
+        jobs = self.get_jobs()
+        jobs[2] = PlaybackJob(self.pathnames[2] + ".missing", 5)
+        with EmulatorPool(StandIn, 2) as pool:
+            results = pool.run(jobs)
+            assert "FileNotFoundError" in results[2].error
+            assert results[2].job.pathname == jobs[2].pathname
+            for i, result in enumerate(results):
+                if i != 2:
+                    assert result.error is None
+                    assert result.frame_number == jobs[i].num_frames
+
+            # the workers are still usable
+            results = pool.run(jobs[0:2])
+            assert [r.error for r in results] == [None, None]
+
+    def test_worker(self):
+        worker = EmulatorWorker(StandIn)
+        try:
+            assert worker.boot(self.pathnames[0]) == 0
+            worker.input['keycode'] = 4
+            assert worker.next_frame() == -1
+            assert worker.current_frame_number == 1
+            assert worker.video_array[0] == 15
+        finally:
+            worker.close()
+
+    def test_close(self):
+        pool = EmulatorPool(StandIn, 2)
+        names = [shm.name for w in pool.workers for shm in (w.input_shm, w.output_shm)]
+        processes = [w.process for w in pool.workers]
+        pool.close()
+        assert len(pool) == 0
+        assert not any(p.is_alive() for p in processes)
+        for name in names:
+            with pytest.raises(FileNotFoundError):
+                shared_memory.SharedMemory(name=name)
+
+    @pytest.mark.skipif((os.cpu_count() or 1) < 4, reason="needs at least 4 cores")
+    def test_throughput(self):
+        jobs = [PlaybackJob(self.pathnames[0], 100, capture_frames=[]) for i in range(8)]
+        times = {}
+        for num_workers in [1, 2, 4]:
+            with EmulatorPool(StandIn, num_workers) as pool:
+                start = time.perf_counter()
+                pool.run(jobs)
+                times[num_workers] = time.perf_counter() - start
+        # close to linear scaling
+        assert times[1] / times[2] > 1.6
+        assert times[1] / times[4] > 3.0
@@ -6,7 +6,7 @@ import pytest
 from atrip.container import Container
 from atrip.segment import Segment
 
-from omnivore.utils.searchutil import HexSearcher
+from omnivore.utils.searchutil import HexSearcher, BytePattern, search_containers, search_files
 
 from mock import MockEditor
 
@@ -31,6 +31,57 @@ class TestFind:
         print(searcher.matches)
         assert len(searcher.matches) == 41
 
+    def test_find_wildcard(self):
+        search_copy = self.segment.tobytes()
+        searcher = HexSearcher(self.editor, "7f ??", search_copy)
+        assert len(searcher.matches) == 41
+        assert searcher.matches[1] == (100, 102)
+
+        # nibble wildcards: the odd bytes are all less than 16
+        searcher = HexSearcher(self.editor, "7f 0?", search_copy)
+        assert len(searcher.matches) == 41
+        searcher = HexSearcher(self.editor, "7f 1?", search_copy)
+        assert searcher.matches == []
+
+        searcher = HexSearcher(self.editor, "zz", search_copy)
+        assert searcher.matches == []
+
+    @pytest.mark.parametrize("text,expected", [
+        ("41 42", [0, 8]),
+        ("4142", [0, 8]),
+        ("41 ?? 43", [0, 4, 8]),
+        ("4? 4?", [0, 1, 2, 3, 6, 7, 8, 9]),
+        ("c1/7f", [0, 4, 8]),
+        ("41 42/df", [0, 4, 8]),
+        ("??", list(range(12))),
+        ])
+    def test_pattern(self, text, expected):
+        data = np.frombuffer(b"ABCDAbCDABC.", dtype=np.uint8)
+        pattern = BytePattern(text)
+        found = pattern.find(data)
+        assert found.tolist() == [i for i in expected if i + len(pattern) <= len(data)]
+
+    @pytest.mark.parametrize("text", ["4", "4g", "41/f", "41/??"])
+    def test_bad_pattern(self, text):
+        with pytest.raises(ValueError):
+            BytePattern(text)
+
+    def test_search_containers(self):
+        other = Container(np.zeros(256, dtype=np.uint8))
+        found = search_containers("7f 00", [self.container, other, self.container])
+        assert len(found) == 2
+        assert found[0][0] is self.container
+        assert found[0][1] == [(0, 2), (100, 102), (200, 202)]
+
+    def test_search_files(self):
+        path = os.path.join(os.path.dirname(__file__), "../samples/dos_sd_test_collection.zip")
+        found = search_files("9b", [path, path + ".missing"])
+        assert len(found) > 0
+        for pathname, container, ranges in found:
+            assert pathname == path
+            for start, end in ranges:
+                assert container._data[start] == 0x9b
+
 
 if __name__ == "__main__":
     t = TestFind()
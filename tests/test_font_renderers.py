@@ -0,0 +1,163 @@
+import numpy as np
+import pytest
+
+from mock import *
+
+from atrip import style_bits
+from atrip.machines import atari8bit
+
+from omnivore.arch import colors
+from omnivore.arch import font_renderers as fr
+from omnivore.arch.fonts import AnticFont, glyph_atlas_cache
+
+
+class MockPreferences(object):
+    background_color = (255, 255, 255)
+    highlight_background_color = (100, 200, 255)
+    match_background_color = (255, 255, 180)
+    comment_background_color = (255, 180, 200)
+    data_background_color = (224, 224, 224)
+
+
+class MockFontMapping(object):
+    # not the identity, so the mapping has to be applied to find the glyph
+    font_mapping = np.roll(np.arange(256, dtype=np.uint8), 32)
+
+
+class MockFontViewer(object):
+    def __init__(self):
+        self.preferences = MockPreferences()
+        self.font_mapping = MockFontMapping()
+        self.antic_color_registers = [0x46, 0xd6, 0x74, 0x40, 0x0c, 0x28, 0x94, 0x0e, 0x00]
+        self.color_registers = [self.color_standard(c) for c in self.antic_color_registers]
+
+    def color_standard(self, c):
+        return (c, (c * 3) & 0xff, 255 - c)
+
+
+def get_old_fonts(viewer, data, font_renderer, reverse):
+    # fonts created separately for each style, as AnticFont did before the
+    # glyph atlas
+    m = viewer
+    prefs = m.preferences
+    fg, bg = atari8bit.gr0_colors(m.antic_color_registers)
+    normal = [m.color_standard(fg), m.color_standard(bg)]
+    highlight = colors.get_blended_color_registers(normal, prefs.highlight_background_color)
+    match = colors.get_blended_color_registers(normal, prefs.match_background_color)
+    comment = colors.get_blended_color_registers(normal, prefs.comment_background_color)
+    dimmed = colors.get_dimmed_color_registers(normal, prefs.background_color, prefs.data_background_color)
+    fonts = {}
+    fonts["normal"] = font_renderer.get_font(data, m.color_registers, normal, reverse)
+    h_colors = colors.get_blended_color_registers(m.color_registers, prefs.highlight_background_color)
+    fonts["highlight"] = font_renderer.get_font(data, h_colors, highlight, reverse)
+    d_colors = colors.get_dimmed_color_registers(m.color_registers, prefs.background_color, prefs.data_background_color)
+    fonts["data"] = font_renderer.get_font(data, d_colors, dimmed, reverse)
+    m_colors = colors.get_blended_color_registers(m.color_registers, prefs.match_background_color)
+    fonts["match"] = font_renderer.get_font(data, m_colors, match, reverse)
+    c_colors = colors.get_blended_color_registers(m.color_registers, prefs.comment_background_color)
+    fonts["comment"] = font_renderer.get_font(data, c_colors, comment, reverse)
+    return fonts
+
+
+def get_old_image(viewer, fonts, byte_values, style, start_byte, end_byte, bytes_per_row, num_rows, start_col, num_cols):
+    # the per-cell renderer replaced by the glyph atlas
+    char_h, char_w = fonts["normal"].shape[1:3]
+    array = np.empty((num_rows * char_h, num_cols * char_w, 3), dtype=np.uint8)
+    end_col = min(bytes_per_row, start_col + num_cols)
+    mapping = viewer.font_mapping.font_mapping
+    y = 0
+    e = start_byte
+    for j in range(num_rows):
+        x = 0
+        for i in range(start_col, start_col + num_cols):
+            if e + i >= end_byte or i >= end_col:
+                array[y:y+char_h,x:x+char_w,:] = viewer.preferences.background_color
+            else:
+                c = mapping[byte_values[j, i]]
+                s = style[j, i]
+                if s & style_bits.selected_bit_mask:
+                    array[y:y+char_h,x:x+char_w,:] = fonts["highlight"][c]
+                elif s & style_bits.match_bit_mask:
+                    array[y:y+char_h,x:x+char_w,:] = fonts["match"][c]
+                elif s & style_bits.comment_bit_mask:
+                    array[y:y+char_h,x:x+char_w,:] = fonts["comment"][c]
+                elif s & style_bits.data_bit_mask:
+                    array[y:y+char_h,x:x+char_w,:] = fonts["data"][c]
+                else:
+                    array[y:y+char_h,x:x+char_w,:] = fonts["normal"][c]
+            x += char_w
+        y += char_h
+        e += bytes_per_row
+    return array
+
+
+class TestFontMapImage(object):
+    def setup(self):
+        self.viewer = MockFontViewer()
+        rng = np.random.RandomState(1234)
+        self.font_data = rng.randint(0, 256, 1024).astype(np.uint8)
+        self.bytes_per_row = 16
+        self.num_rows = 8
+        self.byte_values = rng.randint(0, 256, (self.num_rows, self.bytes_per_row)).astype(np.uint8)
+        self.style = np.zeros((self.num_rows, self.bytes_per_row), dtype=np.uint8)
+
+    def check(self, font_renderer, reverse=False, start_byte=0, end_byte=None, start_col=0, num_cols=None):
+        if end_byte is None:
+            end_byte = start_byte + self.num_rows * self.bytes_per_row
+        if num_cols is None:
+            num_cols = self.bytes_per_row - start_col
+        font = AnticFont(self.viewer, {'np_data': self.font_data, 'uuid': "test"}, font_renderer, self.viewer.antic_color_registers, reverse)
+        fonts = get_old_fonts(self.viewer, self.font_data, font_renderer, reverse)
+        for name in fr.atlas_planes:
+            assert np.array_equal(getattr(font, name + "_font"), fonts[name])
+
+        args = (self.byte_values, self.style, start_byte, end_byte, self.bytes_per_row, self.num_rows, start_col, num_cols)
+        expected = get_old_image(self.viewer, fonts, *args)
+        image = font_renderer.get_image(self.viewer, font, *args)
+        assert image.shape == expected.shape
+        assert np.array_equal(image, expected)
+
+    @pytest.mark.parametrize("font_renderer", fr.font_renderer_list, ids=lambda r: r.name)
+    @pytest.mark.parametrize("reverse", [False, True])
+    def test_normal(self, font_renderer, reverse):
+        self.byte_values &= 0x7f
+        self.check(font_renderer, reverse)
+
+    @pytest.mark.parametrize("font_renderer", fr.font_renderer_list, ids=lambda r: r.name)
+    def test_inverse(self, font_renderer):
+        self.byte_values |= 0x80
+        self.check(font_renderer)
+
+    @pytest.mark.parametrize("font_renderer", fr.font_renderer_list, ids=lambda r: r.name)
+    def test_selected(self, font_renderer):
+        self.style[2:5, 3:12] = style_bits.selected_bit_mask
+        self.style[3, :] |= style_bits.comment_bit_mask
+        self.check(font_renderer)
+
+    @pytest.mark.parametrize("font_renderer", fr.font_renderer_list, ids=lambda r: r.name)
+    def test_styles(self, font_renderer):
+        # every combination of style bits, so the priority of the styles
+        # matches the old renderer
+        self.style.flat[:] = np.arange(self.style.size)
+        self.check(font_renderer)
+
+    @pytest.mark.parametrize("font_renderer", [fr.Mode4(), fr.Mode5(), fr.Mode6Upper(), fr.Mode7Lower()], ids=lambda r: r.name)
+    def test_colored(self, font_renderer):
+        self.style[0:4, :] = style_bits.data_bit_mask
+        self.style[4:, 8:] = style_bits.match_bit_mask
+        self.check(font_renderer)
+
+    def test_partial(self):
+        self.style[1, 1:5] = style_bits.selected_bit_mask
+        # last row partly past the end of the data, first columns scrolled
+        # off the left, and more columns than in a row
+        self.check(fr.Mode2(), start_byte=5, end_byte=5 + 7 * self.bytes_per_row + 3, start_col=2, num_cols=self.bytes_per_row)
+
+    def test_atlas_cache(self):
+        glyph_atlas_cache.clear()
+        font1 = AnticFont(self.viewer, {'np_data': self.font_data, 'uuid': "test"}, fr.Mode2(), self.viewer.antic_color_registers)
+        font2 = AnticFont(self.viewer, {'np_data': self.font_data, 'uuid': "test"}, fr.Mode2(), self.viewer.antic_color_registers)
+        assert font2.atlas is font1.atlas
+        font3 = AnticFont(self.viewer, {'np_data': self.font_data, 'uuid': "test"}, fr.Mode4(), self.viewer.antic_color_registers)
+        assert font3.atlas is not font1.atlas
+        assert len(glyph_atlas_cache) == 2
@@ -0,0 +1,170 @@
+import numpy as np
+
+from mock import *
+
+from omnivore.utils.historyutil import FrameHistory, RestartTree
+from omnivore.utils.framestore import FrameStore
+
+
+def make_frame(frame_number):
+    data = np.zeros(4096, dtype=np.uint8)
+    data[0:4] = np.array([frame_number], dtype=np.uint32).view(np.uint8)
+    data[100 + frame_number % 1000] = 0xff
+    return data
+
+
+class TestFrameHistory(object):
+    def setup(self):
+        self.history = FrameHistory(keyframe_interval=10)
+        for i in range(1, 101):
+            self.history[i] = make_frame(i)
+
+    def test_restore(self):
+        h = self.history
+        assert len(h) == 100
+        assert h.keys() == list(range(1, 101))
+        for i in [1, 2, 10, 11, 55, 100]:
+            assert np.array_equal(h[i], make_frame(i))
+        assert h.is_keyframe(1)
+        assert not h.is_keyframe(2)
+        assert h.nbytes < 100 * 4096 // 10
+
+    def test_remove(self):
+        h = self.history
+        del h[1]  # keyframe still needed by frames 2 - 10
+        assert 1 not in h
+        assert 1 in h.frames
+        assert np.array_equal(h[5], make_frame(5))
+        for i in range(2, 11):
+            del h[i]
+        assert 1 not in h.frames
+        assert len(h) == 90
+
+    def test_decimate(self):
+        h = FrameHistory(max_bytes=20000, keyframe_interval=10)
+        h.full_resolution_frames = 50
+        for i in range(1, 2001):
+            h[i] = make_frame(i)
+            assert h.nbytes <= 20000
+        keys = h.keys()
+        assert keys[0] == 1
+        assert keys[-1] == 2000
+        assert len(keys) < 2000
+        for i in keys[::10]:
+            assert np.array_equal(h[i], make_frame(i))
+
+
+class TestRestartTree(object):
+    def setup(self):
+        self.tree = RestartTree()
+        self.restart = self.tree.emulator_start
+        for i in range(1, 51):
+            self.restart.save_frame(i, make_frame(i))
+
+    def test_restart(self):
+        r = self.tree.create_restart(0, 20)
+        r.save_frame(21, make_frame(1000))
+        assert np.array_equal(r[21], make_frame(1000))
+        assert np.array_equal(r[10], make_frame(10))
+        assert np.array_equal(self.restart[21], make_frame(21))
+
+    def test_serialize(self):
+        state = self.restart.calc_computed_attribute('frame_history')
+        assert len(state) == 50
+        self.restart.restore_computed_attributes({'frame_history': state})
+        assert np.array_equal(self.restart[50], make_frame(50))
+
+
+class TestInputLog(object):
+    def setup(self):
+        self.tree = RestartTree(snapshot_interval=10)
+        self.restart = self.tree.emulator_start
+        for i in range(1, 51):
+            self.restart.save_input(i, np.array([i, 0], dtype=np.uint8))
+            if self.restart.is_memorable(i):
+                self.restart.save_frame(i, make_frame(i))
+
+    def test_snapshots(self):
+        r = self.restart
+        assert r.keys() == [1, 10, 20, 30, 40, 50]
+        assert r.find_snapshot(35) == (r, 30)
+        assert r.find_snapshot(40) == (r, 40)
+        assert r.get_input(35)[0] == 35
+        assert r.get_previous_frame(35) == 34
+        assert r.get_next_frame(49) == 50
+        with pytest.raises(IndexError):
+            r.get_next_frame(50)
+
+    def test_restart(self):
+        r = self.tree.create_restart(0, 25)
+        r.save_input(26, np.array([100, 0], dtype=np.uint8))
+        assert r.find_snapshot(26) == (self.restart, 20)
+        assert r.get_input(25)[0] == 25
+        assert r.get_input(26)[0] == 100
+        assert r.is_memorable(26)
+
+    def test_truncate(self):
+        r = self.restart
+        r.save_input(45, np.array([200, 0], dtype=np.uint8))
+        assert len(r.input_log) == 45
+        assert r.get_input(46) is None
+        assert r.get_input(45)[0] == 200
+        state = r.calc_computed_attribute('input_log')
+        r.restore_computed_attributes({'frame_history': [], 'input_log': state})
+        assert r.get_input(45)[0] == 200
+
+
+class TestFrameStore(object):
+    @pytest.fixture(autouse=True)
+    def create_store(self, tmp_path):
+        self.path = str(tmp_path / "framestore")
+        self.tree = RestartTree(frame_store=FrameStore(self.path))
+        for i in range(1, 51):
+            self.tree.emulator_start.save_frame(i, make_frame(i))
+        r = self.tree.create_restart(0, 20)
+        for i in range(21, 31):
+            r.save_frame(i, make_frame(1000 + i))
+
+    def test_lookup(self):
+        r = self.tree[1]
+        assert np.array_equal(r[25], make_frame(1025))
+        assert np.array_equal(r[10], make_frame(10))
+        assert r.get_previous_frame(25) == 24
+        assert self.tree[0].get_next_frame(49) == 50
+        with pytest.raises(IndexError):
+            r.get_previous_frame(21)
+        with pytest.raises(IndexError):
+            self.tree[0].get_next_frame(50)
+        with pytest.raises(KeyError):
+            r[40]
+
+    def test_reopen(self):
+        self.tree.frame_store.close()
+        tree = RestartTree.from_frame_store(self.path)
+        assert len(tree) == 2
+        assert tree[1].parent is tree[0]
+        assert tree[1].start_frame == 20
+        assert tree[1].end_frame == 30
+        assert tree[0].end_frame == 50
+        assert np.array_equal(tree[1][30], make_frame(1030))
+        assert tree[0].keys() == list(range(1, 51))
+
+        tree[1].save_frame(31, make_frame(1031))
+        tree.frame_store.close()
+        tree = RestartTree.from_frame_store(self.path)
+        assert np.array_equal(tree[1][31], make_frame(1031))
+
+    def test_new(self):
+        self.tree.frame_store.close()
+        tree = RestartTree(frame_store=FrameStore(self.path, new=True))
+        assert len(tree.frame_store) == 0
+        assert tree.frame_store.get_restarts() == [(-1, 0)]
+        r = tree.create_restart(0, 20)
+        assert len(r.frame_history.keys()) == 0
+        tree.emulator_start.save_frame(1, make_frame(1))
+        tree.frame_store.close()
+
+        tree = RestartTree.from_frame_store(self.path)
+        assert len(tree) == 2
+        assert tree[0].keys() == [1]
+        assert tree[1].keys() == []